@@ -54,6 +54,12 @@ from modules.models.user_config import UserConfig
 from modules.models.config_share import ConfigShareToken
 from modules.models.option import PurchaseOption
 from modules.models.email_setting import EmailSetting
+from modules.models.analytics import AnalyticsDailyRollup
+from modules.models.job import BackgroundJob, WebhookEvent
+from modules.models.broadcast import BroadcastJob
+
+# Инкрементальное обновление дневных агрегатов аналитики (события SQLAlchemy)
+import modules.analytics
 
 # ============================================================================
 # ИМПОРТ API МАРШРУТОВ
@@ -617,5 +623,17 @@ if __name__ == '__main__':
         # Запускаем планировщик автоматических рассылок
         start_scheduler()
 
+        # Фоновое обновление общего снимка пользователей RemnaWave
+        from modules.remnawave_snapshot import start_snapshot_refresher
+        start_snapshot_refresher()
+
+        # Воркеры фоновой очереди (обработка оплат из вебхуков)
+        from modules.jobs import start_job_workers
+        start_job_workers()
+
+        # Фоновая сверка зависших оплат (если webhook не пришёл)
+        from modules.payment_reconcile import start_payment_reconciler
+        start_payment_reconciler()
+
     # Запускаем приложение
     app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -7,6 +7,7 @@ Telegram Bot для клиентов StealthNET VPN
 import os
 import logging
 import requests
+import httpx  # ставится вместе с python-telegram-bot>=20
 import asyncio
 import base64
 import json
@@ -15,6 +16,10 @@ import re
 import math
 import html
 import hashlib
+import contextlib
+import functools
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 from dotenv import load_dotenv
@@ -32,10 +37,11 @@ from telegram.ext import (
     MessageHandler,
     PreCheckoutQueryHandler,
     InlineQueryHandler,
+    BaseUpdateProcessor,
     ContextTypes,
     filters
 )
-from telegram.error import Conflict
+from telegram.error import Conflict, BadRequest
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -46,6 +52,8 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# httpx пишет INFO на каждый запрос к Flask API
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # Единый разделитель для сообщений (в одну строку)
 SEPARATOR_LINE = "-" * 32
@@ -116,6 +124,12 @@ YOUR_SERVER_IP = os.getenv("YOUR_SERVER_IP", "https://panel.stealthnet.app")  #
 MINIAPP_URL = os.getenv("MINIAPP_URL", YOUR_SERVER_IP)  # URL для miniapp
 SERVICE_NAME = os.getenv("SERVICE_NAME", "StealthNET")  # Название сервиса (можно менять через env)
 
+# Асинхронный клиент Flask API: размер пула соединений и повторы ответов 429/5xx (1, 2, 4 с)
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "20"))
+BOT_API_MAX_RETRIES = 3
+BOT_API_RETRY_BACKOFF = 1
+BOT_API_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 # Webhook (опционально): если BOT_USE_WEBHOOK=true, бот принимает обновления по HTTPS вместо polling
 BOT_USE_WEBHOOK = os.getenv("BOT_USE_WEBHOOK", "").strip().lower() in ("1", "true", "yes")
 BOT_WEBHOOK_BASE_URL = os.getenv("BOT_WEBHOOK_BASE_URL", "").strip().rstrip("/")  # например https://yourdomain.com
@@ -128,10 +142,9 @@ LOGO_PATH = os.path.join(os.path.dirname(__file__), "logo.png")
 
 _logo_path_logged = False
 
-def _get_logo_path(logo_page: str = None) -> str:
-    """Путь к логотипу для страницы бота. logo_page: default, main_menu, subscription_status, tariffs, и т.д."""
+def _find_logo_path(page: str) -> str:
+    """Поиск логотипа страницы по каталогам и bot_page_logos (без кеша, см. _get_logo_path)"""
     global _logo_path_logged
-    page = (logo_page or "default").strip() or "default"
     root = os.path.dirname(os.path.abspath(__file__))
     instance_base = os.environ.get("INSTANCE_PATH") or os.path.join(root, "instance")
     logos_dir = os.path.join(instance_base, "uploads", "bot_logos")
@@ -186,6 +199,204 @@ def _get_logo_path(logo_page: str = None) -> str:
         logger.warning(f"_get_logo_path({page}): {e}")
     return LOGO_PATH
 
+
+# Найденные пути логотипов по страницам. Сбрасываются, когда меняется содержимое каталогов
+# логотипов (mtime каталога) или bot_page_logos в конфигурации бота.
+_logo_path_cache = {'signature': None, 'paths': {}}
+
+def _logo_paths_signature() -> tuple:
+    root = os.path.dirname(os.path.abspath(__file__))
+    instance_base = os.environ.get("INSTANCE_PATH") or os.path.join(root, "instance")
+    signature = []
+    for directory in (os.path.join(instance_base, "uploads", "bot_logos"),
+                      os.path.join(os.getcwd(), "instance", "uploads", "bot_logos")):
+        try:
+            signature.append(os.stat(directory).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    try:
+        logos = get_bot_config().get("bot_page_logos") or {}
+    except Exception:
+        logos = {}
+    signature.append(json.dumps(logos, sort_keys=True, default=str))
+    return tuple(signature)
+
+def _get_logo_path(logo_page: str = None) -> str:
+    """Путь к логотипу для страницы бота. logo_page: default, main_menu, subscription_status, tariffs, и т.д."""
+    page = (logo_page or "default").strip() or "default"
+    signature = _logo_paths_signature()
+    if signature != _logo_path_cache['signature']:
+        _logo_path_cache['signature'] = signature
+        _logo_path_cache['paths'] = {}
+    path = _logo_path_cache['paths'].get(page)
+    if path is None or not os.path.isfile(path):
+        path = _logo_path_cache['paths'][page] = _find_logo_path(page)
+    return path
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# РЕЕСТР МЕДИА (file_id Telegram вместо повторной загрузки файлов)
+# ═══════════════════════════════════════════════════════════════════════════════
+BOT_MEDIA_REGISTRY_PATH = os.getenv(
+    "BOT_MEDIA_REGISTRY_PATH",
+    os.path.join(os.environ.get("INSTANCE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance"),
+                 "cache", "bot_media.json")
+)  # пусто - только память
+BOT_MEDIA_REGISTRY_MAX = int(os.getenv("BOT_MEDIA_REGISTRY_MAX", 2000))
+
+
+class MediaRegistry:
+    """
+    file_id Telegram по sha256 содержимого: логотип или изображение загружается один раз,
+    дальше отправляется по file_id. Сохраняется в JSON (BOT_MEDIA_REGISTRY_PATH) и переживает
+    перезапуск; file_id действительны только для бота, который их получил, поэтому файл
+    привязан к bot_id. Замена файла логотипа (загрузка в админке) меняет его хеш - старая
+    запись удаляется, новый файл загружается заново.
+
+    Чтение/хеширование файлов и запись JSON выполняются в потоке (asyncio.to_thread), словари
+    меняются только в event loop.
+    """
+
+    def __init__(self, path=None, max_items=2000):
+        self.path = path or None
+        self.max_items = max_items
+        self.bot_id = None
+        self._items = OrderedDict()
+        self._digests = {}  # путь -> (mtime_ns, size, sha256), чтобы не читать файл при каждой отправке
+        self._dirty = False
+        self._save_task = None
+        self.stats = {'hits': 0, 'uploads': 0, 'invalidated': 0}
+
+    def load(self, bot_id):
+        """Загрузить сохранённые file_id (вызывается после инициализации бота, в потоке)"""
+        self.bot_id = bot_id
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Media registry: failed to load {self.path}: {e}")
+            return
+        if data.get('bot_id') != bot_id:
+            logger.info("Media registry: saved file_id belong to another bot, starting empty")
+            return
+        self._items = OrderedDict(data.get('items') or {})
+        logger.info(f"Media registry: loaded {len(self._items)} file_id")
+
+    def _write(self, snapshot):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Media registry: failed to save {self.path}: {e}, using memory only")
+            self.path = None
+
+    async def _flush(self):
+        # Записи идут по одной; изменения, пришедшие во время записи, попадут в следующую
+        while self._dirty and self.path:
+            self._dirty = False
+            snapshot = {'bot_id': self.bot_id, 'items': dict(self._items)}
+            await asyncio.to_thread(self._write, snapshot)
+
+    def _save(self):
+        """Сохранить в фоне (не более одной записи одновременно); вне event loop - сразу"""
+        if not self.path:
+            return
+        self._dirty = True
+        if self._save_task is not None and not self._save_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._dirty = False
+            self._write({'bot_id': self.bot_id, 'items': dict(self._items)})
+            return
+        self._save_task = loop.create_task(self._flush())
+
+    @staticmethod
+    def _file_digest(path, cached):
+        """(mtime_ns, size, sha256) файла; читает файл, только если mtime/размер изменились"""
+        st = os.stat(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached
+        with open(path, 'rb') as f:
+            return st.st_mtime_ns, st.st_size, hashlib.sha256(f.read()).hexdigest()
+
+    async def file_key(self, path: str) -> str:
+        """sha256 файла; пересчитывается только при изменении mtime/размера"""
+        cached = self._digests.get(path)
+        entry = await asyncio.to_thread(self._file_digest, path, cached)
+        self._digests[path] = entry
+        if cached and cached[2] != entry[2]:
+            # Файл заменён - file_id старого содержимого больше не понадобится
+            self.forget(cached[2])
+        return entry[2]
+
+    @staticmethod
+    async def bytes_key(data: bytes) -> str:
+        return await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+
+    def get(self, key: str) -> Optional[str]:
+        file_id = self._items.get(key)
+        if file_id:
+            self._items.move_to_end(key)
+        return file_id
+
+    def put(self, key: str, file_id: str):
+        if self._items.get(key) == file_id:
+            return
+        self._items[key] = file_id
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        self._save()
+
+    def forget(self, key: str):
+        if self._items.pop(key, None) is not None:
+            self.stats['invalidated'] += 1
+            self._save()
+
+
+media_registry = MediaRegistry(BOT_MEDIA_REGISTRY_PATH, BOT_MEDIA_REGISTRY_MAX)
+
+
+async def send_photo_cached(send, photo, **kwargs):
+    """
+    Отправить фото по file_id из media_registry, а если его ещё нет - загрузить и запомнить.
+    send: message.reply_photo или context.bot.send_photo (chat_id в kwargs);
+    photo: путь к файлу или bytes (для bytes можно передать filename).
+    """
+    key = await (media_registry.file_key(photo) if isinstance(photo, str) else media_registry.bytes_key(photo))
+    file_id = media_registry.get(key)
+    if file_id:
+        try:
+            sent_message = await send(photo=file_id, **{k: v for k, v in kwargs.items() if k != 'filename'})
+            media_registry.stats['hits'] += 1
+            return sent_message
+        except BadRequest as e:
+            err = str(e).lower()
+            if "parse entities" in err or "can't parse" in err or "cant parse" in err:
+                raise
+            # file_id не принят (другой бот, файл удалён на стороне Telegram) - загружаем заново
+            logger.info(f"Media registry: file_id rejected ({e}), uploading again")
+            media_registry.forget(key)
+    
+    if isinstance(photo, str):
+        with open(photo, 'rb') as f:
+            sent_message = await send(photo=f, **kwargs)
+    else:
+        sent_message = await send(photo=photo, **kwargs)
+    media_registry.stats['uploads'] += 1
+    if sent_message is not None and getattr(sent_message, 'photo', None):
+        media_registry.put(key, sent_message.photo[-1].file_id)
+    return sent_message
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # ДИНАМИЧЕСКАЯ КОНФИГУРАЦИЯ БОТА (из админки)
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -194,7 +405,8 @@ def _get_logo_path(logo_page: str = None) -> str:
 _bot_config_cache = {
     'data': None,
     'last_update': 0,
-    'cache_ttl': 5  # 5 секунд — для быстрого обновления при изменении в админке
+    'cache_ttl': 5,  # 5 секунд — для быстрого обновления при изменении в админке
+    'refresh_task': None
 }
 
 def clear_bot_config_cache():
@@ -202,27 +414,45 @@ def clear_bot_config_cache():
     _bot_config_cache['data'] = None
     _bot_config_cache['last_update'] = 0
 
-def get_bot_config() -> dict:
-    """Получить конфигурацию бота из API с кешированием"""
-    import time
-    
-    current_time = time.time()
-    
-    # Возвращаем из кеша если не истёк
-    if _bot_config_cache['data'] and (current_time - _bot_config_cache['last_update']) < _bot_config_cache['cache_ttl']:
-        return _bot_config_cache['data']
-    
-    # Загружаем из API
+def _schedule_cache_refresh(cache: dict, refresh):
+    """Обновить кеш в фоне (не более одного обновления одновременно); вне event loop ничего не делает"""
+    task = cache.get('refresh_task')
+    if task is not None and not task.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    cache['refresh_task'] = loop.create_task(refresh())
+
+async def refresh_bot_config() -> Optional[dict]:
+    """Загрузить конфигурацию бота из API в кеш"""
     try:
-        response = requests.get(f"{FLASK_API_URL}/api/public/bot-config", timeout=5)
+        response = await api.get("/api/public/bot-config", timeout=5)
         if response.status_code == 200:
             config = response.json()
             _bot_config_cache['data'] = config
-            _bot_config_cache['last_update'] = current_time
+            _bot_config_cache['last_update'] = time.time()
             logger.info("Bot config loaded from API")
             return config
     except Exception as e:
         logger.warning(f"Failed to load bot config from API: {e}")
+    return None
+
+def get_bot_config() -> dict:
+    """
+    Получить конфигурацию бота из кеша.
+
+    Синхронная (её вызывают десятки хелперов меню), поэтому в API не ходит: устаревший кеш
+    отдаётся сразу и обновляется в фоне (refresh_bot_config), первая загрузка - при старте бота.
+    """
+    current_time = time.time()
+    
+    # Возвращаем из кеша если не истёк
+    if _bot_config_cache['data'] and (current_time - _bot_config_cache['last_update']) < _bot_config_cache['cache_ttl']:
+        return _bot_config_cache['data']
+    
+    _schedule_cache_refresh(_bot_config_cache, refresh_bot_config)
     
     # Возвращаем кеш даже если истёк (лучше старые данные чем никаких)
     if _bot_config_cache['data']:
@@ -303,7 +533,8 @@ def get_trial_days() -> int:
 _trial_settings_cache = {
     'data': None,
     'last_update': 0,
-    'cache_ttl': 30  # 30 секунд
+    'cache_ttl': 30,  # 30 секунд
+    'refresh_task': None
 }
 
 def clear_trial_settings_cache():
@@ -311,26 +542,28 @@ def clear_trial_settings_cache():
     _trial_settings_cache['data'] = None
     _trial_settings_cache['last_update'] = 0
 
-def get_trial_settings() -> dict:
-    """Получить настройки триала из API с кешированием"""
-    import time
-    
-    current_time = time.time()
-    
-    # Возвращаем из кеша если не истёк
-    if _trial_settings_cache['data'] and (current_time - _trial_settings_cache['last_update']) < _trial_settings_cache['cache_ttl']:
-        return _trial_settings_cache['data']
-    
-    # Загружаем из API
+async def refresh_trial_settings() -> Optional[dict]:
+    """Загрузить настройки триала из API в кеш"""
     try:
-        response = requests.get(f"{FLASK_API_URL}/api/public/trial-settings", timeout=5)
+        response = await api.get("/api/public/trial-settings", timeout=5)
         if response.status_code == 200:
             settings = response.json()
             _trial_settings_cache['data'] = settings
-            _trial_settings_cache['last_update'] = current_time
+            _trial_settings_cache['last_update'] = time.time()
             return settings
     except Exception as e:
         logger.warning(f"Failed to load trial settings from API: {e}")
+    return None
+
+def get_trial_settings() -> dict:
+    """Получить настройки триала из кеша (устаревший кеш обновляется в фоне, как get_bot_config)"""
+    current_time = time.time()
+    
+    # Возвращаем из кеша если не истёк
+    if _trial_settings_cache['data'] and (current_time - _trial_settings_cache['last_update']) < _trial_settings_cache['cache_ttl']:
+        return _trial_settings_cache['data']
+    
+    _schedule_cache_refresh(_trial_settings_cache, refresh_trial_settings)
     
     # Возвращаем кеш даже если истёк
     if _trial_settings_cache['data']:
@@ -688,22 +921,21 @@ async def reply_with_logo(update: Update, text: str, reply_markup=None, parse_mo
             return
         
         # Всегда отправляем фото с caption в одном сообщении
-        with open(logo_path, 'rb') as logo_file:
-            sent_message = await message.reply_photo(
-                photo=logo_file,
-                caption=text,
-                reply_markup=reply_markup,
-                parse_mode=parse_mode
-            )
-            # Сохраняем message_id для последующего удаления
-            if sent_message and sent_message.message_id and context:
-                user_data = context.user_data if hasattr(context, 'user_data') else {}
-                if 'bot_message_ids' not in user_data:
-                    user_data['bot_message_ids'] = []
-                user_data['bot_message_ids'].append(sent_message.message_id)
-                # Ограничиваем список последними 20 сообщениями
-                if len(user_data['bot_message_ids']) > 20:
-                    user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
+        sent_message = await send_photo_cached(
+            message.reply_photo, logo_path,
+            caption=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+        # Сохраняем message_id для последующего удаления
+        if sent_message and sent_message.message_id and context:
+            user_data = context.user_data if hasattr(context, 'user_data') else {}
+            if 'bot_message_ids' not in user_data:
+                user_data['bot_message_ids'] = []
+            user_data['bot_message_ids'].append(sent_message.message_id)
+            # Ограничиваем список последними 20 сообщениями
+            if len(user_data['bot_message_ids']) > 20:
+                user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщения с логотипом: {e}")
         # Если упали на парсинге Markdown/HTML — пробуем отправить БЕЗ parse_mode
@@ -714,21 +946,20 @@ async def reply_with_logo(update: Update, text: str, reply_markup=None, parse_mo
                 if os.path.exists(logo_path):
                     message = update.message if update.message else (update.callback_query.message if update.callback_query else None)
                     if message:
-                        with open(logo_path, 'rb') as logo_file:
-                            sent_message = await message.reply_photo(
-                                photo=logo_file,
-                                caption=fallback_text,
-                                reply_markup=reply_markup
-                            )
-                            # Сохраняем message_id
-                            if sent_message and sent_message.message_id and context:
-                                user_data = context.user_data if hasattr(context, 'user_data') else {}
-                                if 'bot_message_ids' not in user_data:
-                                    user_data['bot_message_ids'] = []
-                                user_data['bot_message_ids'].append(sent_message.message_id)
-                                if len(user_data['bot_message_ids']) > 20:
-                                    user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
-                            return
+                        sent_message = await send_photo_cached(
+                            message.reply_photo, logo_path,
+                            caption=fallback_text,
+                            reply_markup=reply_markup
+                        )
+                        # Сохраняем message_id
+                        if sent_message and sent_message.message_id and context:
+                            user_data = context.user_data if hasattr(context, 'user_data') else {}
+                            if 'bot_message_ids' not in user_data:
+                                user_data['bot_message_ids'] = []
+                            user_data['bot_message_ids'].append(sent_message.message_id)
+                            if len(user_data['bot_message_ids']) > 20:
+                                user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
+                        return
                 # 2) если фото не вышло — обычный текст без parse_mode
                 sent_message = None
                 if update.message:
@@ -827,13 +1058,29 @@ async def safe_edit_or_send_with_logo(update: Update, context: ContextTypes.DEFA
         except Exception as del_err:
             logger.debug(f"Could not delete old photo message: {del_err}")
         try:
-            with open(logo_path, 'rb') as logo_file:
-                sent_message = await context.bot.send_photo(
+            sent_message = await send_photo_cached(
+                context.bot.send_photo, logo_path,
+                chat_id=message.chat.id,
+                caption=display_text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode
+            )
+            if sent_message and sent_message.message_id:
+                user_data = context.user_data if hasattr(context, 'user_data') else {}
+                if 'bot_message_ids' not in user_data:
+                    user_data['bot_message_ids'] = []
+                user_data['bot_message_ids'].append(sent_message.message_id)
+                if len(user_data['bot_message_ids']) > 20:
+                    user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
+            return sent_message
+        except Exception as e2:
+            logger.warning(f"Error sending photo with logo: {e2}")
+            try:
+                sent_message = await send_photo_cached(
+                    context.bot.send_photo, logo_path,
                     chat_id=message.chat.id,
-                    photo=logo_file,
-                    caption=display_text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode
+                    caption=clean_markdown_for_cards(display_text),
+                    reply_markup=reply_markup
                 )
                 if sent_message and sent_message.message_id:
                     user_data = context.user_data if hasattr(context, 'user_data') else {}
@@ -842,25 +1089,7 @@ async def safe_edit_or_send_with_logo(update: Update, context: ContextTypes.DEFA
                     user_data['bot_message_ids'].append(sent_message.message_id)
                     if len(user_data['bot_message_ids']) > 20:
                         user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
-                return sent_message
-        except Exception as e2:
-            logger.warning(f"Error sending photo with logo: {e2}")
-            try:
-                with open(logo_path, 'rb') as logo_file:
-                    sent_message = await context.bot.send_photo(
-                        chat_id=message.chat.id,
-                        photo=logo_file,
-                        caption=clean_markdown_for_cards(display_text),
-                        reply_markup=reply_markup
-                    )
-                    if sent_message and sent_message.message_id:
-                        user_data = context.user_data if hasattr(context, 'user_data') else {}
-                        if 'bot_message_ids' not in user_data:
-                            user_data['bot_message_ids'] = []
-                        user_data['bot_message_ids'].append(sent_message.message_id)
-                        if len(user_data['bot_message_ids']) > 20:
-                            user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
-                        return sent_message
+                    return sent_message
             except Exception as e3:
                 logger.error(f"Failed to send photo: {e3}")
     
@@ -912,13 +1141,29 @@ async def safe_edit_or_send_with_logo(update: Update, context: ContextTypes.DEFA
             
             # Отправляем новое сообщение с логотипом
             try:
-                with open(logo_path, 'rb') as logo_file:
-                    sent_message = await context.bot.send_photo(
+                sent_message = await send_photo_cached(
+                    context.bot.send_photo, logo_path,
+                    chat_id=message.chat.id,
+                    caption=display_text,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode
+                )
+                if sent_message and sent_message.message_id:
+                    user_data = context.user_data if hasattr(context, 'user_data') else {}
+                    if 'bot_message_ids' not in user_data:
+                        user_data['bot_message_ids'] = []
+                    user_data['bot_message_ids'].append(sent_message.message_id)
+                    if len(user_data['bot_message_ids']) > 20:
+                        user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
+                return sent_message
+            except Exception as e2:
+                logger.warning(f"Error sending photo with logo: {e2}")
+                try:
+                    sent_message = await send_photo_cached(
+                        context.bot.send_photo, logo_path,
                         chat_id=message.chat.id,
-                        photo=logo_file,
-                        caption=display_text,
-                        reply_markup=reply_markup,
-                        parse_mode=parse_mode
+                        caption=clean_markdown_for_cards(display_text),
+                        reply_markup=reply_markup
                     )
                     if sent_message and sent_message.message_id:
                         user_data = context.user_data if hasattr(context, 'user_data') else {}
@@ -927,25 +1172,7 @@ async def safe_edit_or_send_with_logo(update: Update, context: ContextTypes.DEFA
                         user_data['bot_message_ids'].append(sent_message.message_id)
                         if len(user_data['bot_message_ids']) > 20:
                             user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
-                    return sent_message
-            except Exception as e2:
-                logger.warning(f"Error sending photo with logo: {e2}")
-                try:
-                    with open(logo_path, 'rb') as logo_file:
-                        sent_message = await context.bot.send_photo(
-                            chat_id=message.chat.id,
-                            photo=logo_file,
-                            caption=clean_markdown_for_cards(display_text),
-                            reply_markup=reply_markup
-                        )
-                        if sent_message and sent_message.message_id:
-                            user_data = context.user_data if hasattr(context, 'user_data') else {}
-                            if 'bot_message_ids' not in user_data:
-                                user_data['bot_message_ids'] = []
-                            user_data['bot_message_ids'].append(sent_message.message_id)
-                            if len(user_data['bot_message_ids']) > 20:
-                                user_data['bot_message_ids'] = user_data['bot_message_ids'][-20:]
-                            return sent_message
+                        return sent_message
                 except Exception as e3:
                     logger.error(f"Failed to send photo: {e3}")
         
@@ -993,14 +1220,13 @@ async def safe_edit_or_send_with_logo(update: Update, context: ContextTypes.DEFA
     # Отправляем новое сообщение с логотипом
     try:
         if os.path.exists(logo_path):
-            with open(logo_path, 'rb') as logo_file:
-                await context.bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=logo_file,
-                    caption=display_text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode
-                )
+            await send_photo_cached(
+                context.bot.send_photo, logo_path,
+                chat_id=message.chat.id,
+                caption=display_text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode
+            )
         else:
             sent_message = await context.bot.send_message(
                 chat_id=message.chat.id,
@@ -1020,13 +1246,12 @@ async def safe_edit_or_send_with_logo(update: Update, context: ContextTypes.DEFA
         logger.warning(f"Error sending message with logo: {e2}")
         try:
             if os.path.exists(logo_path):
-                with open(logo_path, 'rb') as logo_file:
-                    await context.bot.send_photo(
-                        chat_id=message.chat.id,
-                        photo=logo_file,
-                        caption=clean_markdown_for_cards(display_text),
-                        reply_markup=reply_markup
-                    )
+                await send_photo_cached(
+                    context.bot.send_photo, logo_path,
+                    chat_id=message.chat.id,
+                    caption=clean_markdown_for_cards(display_text),
+                    reply_markup=reply_markup
+                )
             else:
                 await context.bot.send_message(
                     chat_id=message.chat.id,
@@ -1046,44 +1271,78 @@ if MINIAPP_URL and not MINIAPP_URL.startswith("https://"):
 
 
 class ClientBotAPI:
-    """Класс для взаимодействия с Flask API"""
-    
+    """
+    Асинхронный клиент Flask API (httpx).
+
+    Один пул соединений на event loop бота: запросы обработчиков не блокируют loop, и медленный
+    ответ API задерживает только тот обработчик, который его ждёт.
+    """
+
     def __init__(self, api_url: str):
         self.api_url = api_url.rstrip('/')
-        self.session = requests.Session()
-        
-        # Настройка connection pooling для переиспользования соединений
-        from requests.adapters import HTTPAdapter
-        from urllib3.util.retry import Retry
-        
-        # Настройка retry стратегии
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
-            raise_on_status=False
-        )
-        
-        # Настройка HTTP adapter с connection pooling
-        adapter = HTTPAdapter(
-            pool_connections=10,
-            pool_maxsize=20,
-            max_retries=retry_strategy,
-            pool_block=False
-        )
-        
-        # Применяем adapter для HTTP и HTTPS
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
-        
-        # Настройка keep-alive заголовков
-        self.session.headers.update({
-            'Connection': 'keep-alive',
-            'Keep-Alive': 'timeout=60, max=100'
-        })
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # httpx.AsyncClient привязан к event loop, в котором открыт
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_url,
+                # retries - повтор установки соединения; ответы 429/5xx повторяет request()
+                transport=httpx.AsyncHTTPTransport(
+                    retries=BOT_API_MAX_RETRIES,
+                    limits=httpx.Limits(
+                        max_connections=BOT_API_POOL_SIZE,
+                        max_keepalive_connections=10,
+                        keepalive_expiry=60
+                    )
+                ),
+                timeout=httpx.Timeout(10, connect=5)
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        """Закрыть пул соединений (при остановке бота)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Запрос к Flask API: url - путь ('/api/...') или полный адрес.
+
+        Ответы 429/5xx повторяются с задержкой 1, 2, 4 с (asyncio.sleep, loop не блокируется).
+        Таймаут/обрыв повторяется только для GET: POST мог уже дойти до сервера.
+        Ошибки сети пробрасываются как httpx.HTTPError.
+        """
+        method = method.upper()
+        client = self._get_client()
+        for attempt in range(BOT_API_MAX_RETRIES + 1):
+            delay = BOT_API_RETRY_BACKOFF * (2 ** attempt)
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if method != "GET" or attempt == BOT_API_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            if response.status_code not in BOT_API_RETRY_STATUSES or attempt == BOT_API_MAX_RETRIES:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, min(int(retry_after), 30))
+            await asyncio.sleep(delay)
+        return response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
     
-    def get_user_by_telegram_id(self, telegram_id: int) -> Optional[dict]:
+    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[dict]:
         """Получить пользователя по Telegram ID через API бота или создать JWT"""
         # Сначала пытаемся получить JWT токен через telegram-login эндпоинт
         # Но для бота нам нужен другой подход - создадим специальный эндпоинт
@@ -1091,8 +1350,8 @@ class ClientBotAPI:
         
         # Временное решение: используем внутренний эндпоинт для ботов
         try:
-            response = self.session.post(
-                f"{self.api_url}/api/bot/get-token",
+            response = await self.post(
+                "/api/bot/get-token",
                 json={"telegram_id": telegram_id},
                 timeout=10
             )
@@ -1110,7 +1369,7 @@ class ClientBotAPI:
         
         return None
     
-    def register_user(self, telegram_id: int, telegram_username: str = "", ref_code: str = None, preferred_lang: str = None, preferred_currency: str = None) -> Optional[dict]:
+    async def register_user(self, telegram_id: int, telegram_username: str = "", ref_code: str = None, preferred_lang: str = None, preferred_currency: str = None) -> Optional[dict]:
         """Зарегистрировать пользователя через бота"""
         try:
             payload = {
@@ -1123,8 +1382,8 @@ class ClientBotAPI:
             if preferred_currency:
                 payload["preferred_currency"] = preferred_currency
             
-            response = self.session.post(
-                f"{self.api_url}/api/bot/register",
+            response = await self.post(
+                "/api/bot/register",
                 json=payload,
                 timeout=30
             )
@@ -1135,11 +1394,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка регистрации: {e}")
         return None
     
-    def get_credentials(self, telegram_id: int) -> Optional[dict]:
+    async def get_credentials(self, telegram_id: int) -> Optional[dict]:
         """Получить логин (email) и пароль пользователя для входа на сайте"""
         try:
-            response = self.session.post(
-                f"{self.api_url}/api/bot/get-credentials",
+            response = await self.post(
+                "/api/bot/get-credentials",
                 json={"telegram_id": telegram_id},
                 timeout=10
             )
@@ -1149,7 +1408,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения credentials: {e}")
         return None
     
-    def get_user_data(self, token: str, force_refresh: bool = False) -> Optional[dict]:
+    async def get_user_data(self, token: str, force_refresh: bool = False) -> Optional[dict]:
         """Получить данные пользователя с retry логикой"""
         headers = {
             "Authorization": f"Bearer {token}",
@@ -1158,7 +1417,7 @@ class ClientBotAPI:
             "Expires": "0"
         }
         # Добавляем timestamp для предотвращения кэширования
-        url = f"{self.api_url}/api/client/me"
+        url = "/api/client/me"
         if force_refresh:
             url += f"?_t={int(datetime.now().timestamp() * 1000)}"
         
@@ -1166,7 +1425,7 @@ class ClientBotAPI:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                response = self.session.get(
+                response = await self.get(
                     url,
                     headers=headers,
                     timeout=15  # Увеличено до 15 секунд
@@ -1185,44 +1444,19 @@ class ClientBotAPI:
                     return None
                 else:
                     logger.warning(f"HTTP {response.status_code} при получении данных пользователя (попытка {attempt + 1}/{max_retries})")
-            except requests.exceptions.Timeout:
+            except httpx.TimeoutException:
                 logger.warning(f"Timeout при получении данных пользователя (попытка {attempt + 1}/{max_retries})")
                 if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)  # Экспоненциальная задержка: 1s, 2s, 4s
+                    await asyncio.sleep(2 ** attempt)  # Экспоненциальная задержка: 1s, 2s, 4s
                 else:
                     logger.error(f"Превышено максимальное количество попыток при получении данных пользователя")
-            except requests.exceptions.ConnectionError as e:
+            except httpx.TransportError as e:
                 logger.warning(f"Ошибка соединения при получении данных пользователя (попытка {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)
-                    # Пытаемся пересоздать соединение
+                    await asyncio.sleep(2 ** attempt)
+                    # Пересоздаём пул соединений
                     try:
-                        self.session.close()
-                        self.session = requests.Session()
-                        # Повторно применяем adapter
-                        from requests.adapters import HTTPAdapter
-                        from urllib3.util.retry import Retry
-                        retry_strategy = Retry(
-                            total=3,
-                            backoff_factor=1,
-                            status_forcelist=[429, 500, 502, 503, 504],
-                            allowed_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
-                            raise_on_status=False
-                        )
-                        adapter = HTTPAdapter(
-                            pool_connections=10,
-                            pool_maxsize=20,
-                            max_retries=retry_strategy,
-                            pool_block=False
-                        )
-                        self.session.mount("http://", adapter)
-                        self.session.mount("https://", adapter)
-                        self.session.headers.update({
-                            'Connection': 'keep-alive',
-                            'Keep-Alive': 'timeout=60, max=100'
-                        })
+                        await self.aclose()
                     except Exception as reset_error:
                         logger.error(f"Ошибка при пересоздании сессии: {reset_error}")
                 else:
@@ -1234,11 +1468,11 @@ class ClientBotAPI:
         
         return None
     
-    def get_tariffs(self) -> list:
+    async def get_tariffs(self) -> list:
         """Получить список тарифов"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/public/tariffs",
+            response = await self.get(
+                "/api/public/tariffs",
                 timeout=10
             )
             if response.status_code == 200:
@@ -1247,11 +1481,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения тарифов: {e}")
         return []
     
-    def get_tariff_features(self) -> dict:
+    async def get_tariff_features(self) -> dict:
         """Получить функции тарифов по tier"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/public/tariff-features",
+            response = await self.get(
+                "/api/public/tariff-features",
                 timeout=10
             )
             if response.status_code == 200:
@@ -1293,11 +1527,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения функций тарифов: {e}")
         return {}
 
-    def get_tariff_levels(self) -> list:
+    async def get_tariff_levels(self) -> list:
         """Получить публичные уровни тарифов"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/public/tariff-levels",
+            response = await self.get(
+                "/api/public/tariff-levels",
                 timeout=10
             )
             if response.status_code == 200:
@@ -1307,11 +1541,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения уровней тарифов: {e}")
         return []
     
-    def get_branding(self) -> dict:
+    async def get_branding(self) -> dict:
         """Получить настройки брендинга (для названий функций)"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/public/branding",
+            response = await self.get(
+                "/api/public/branding",
                 timeout=10
             )
             if response.status_code == 200:
@@ -1320,7 +1554,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения брендинга: {e}")
         return {}
     
-    def get_system_settings(self) -> dict:
+    async def get_system_settings(self) -> dict:
         """Получить системные настройки (активные языки и валюты) с кэшированием на 1 минуту"""
         # Используем простой кэш в памяти
         if not hasattr(self, '_system_settings_cache') or not hasattr(self, '_system_settings_cache_time'):
@@ -1333,8 +1567,8 @@ class ClientBotAPI:
             return self._system_settings_cache
         
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/public/system-settings",
+            response = await self.get(
+                "/api/public/system-settings",
                 timeout=10
             )
             if response.status_code == 200:
@@ -1353,11 +1587,11 @@ class ClientBotAPI:
         }
         return default_settings
     
-    def get_available_payment_methods(self) -> list:
+    async def get_available_payment_methods(self) -> list:
         """Получить список доступных способов оплаты"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/public/available-payment-methods",
+            response = await self.get(
+                "/api/public/available-payment-methods",
                 timeout=10
             )
             if response.status_code == 200:
@@ -1367,11 +1601,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения способов оплаты: {e}")
         return []
 
-    def get_purchase_options(self) -> dict:
+    async def get_purchase_options(self) -> dict:
         """Получить опции для покупки (сгруппированные по типу)"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/public/purchase-options",
+            response = await self.get(
+                "/api/public/purchase-options",
                 timeout=10
             )
             if response.status_code == 200:
@@ -1381,7 +1615,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения опций: {e}")
         return {"traffic": [], "devices": [], "squad": []}
 
-    def create_option_payment(
+    async def create_option_payment(
         self,
         token: str,
         option_id: int,
@@ -1398,8 +1632,8 @@ class ClientBotAPI:
             if config_id:
                 payload["config_id"] = int(config_id)
 
-            response = self.session.post(
-                f"{self.api_url}/api/client/create-option-payment",
+            response = await self.post(
+                "/api/client/create-option-payment",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json=payload,
                 timeout=10
@@ -1414,11 +1648,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка создания платежа за опцию: {e}")
         return {"success": False, "message": "Ошибка создания платежа"}
     
-    def get_nodes(self, token: str) -> list:
+    async def get_nodes(self, token: str) -> list:
         """Получить список серверов"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/client/nodes",
+            response = await self.get(
+                "/api/client/nodes",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
             )
@@ -1429,11 +1663,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения серверов: {e}")
         return []
     
-    def activate_trial(self, token: str) -> dict:
+    async def activate_trial(self, token: str) -> dict:
         """Активировать триал"""
         try:
-            response = self.session.post(
-                f"{self.api_url}/api/client/activate-trial",
+            response = await self.post(
+                "/api/client/activate-trial",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
             )
@@ -1443,13 +1677,13 @@ class ClientBotAPI:
             logger.error(f"Ошибка активации триала: {e}")
         return {"success": False, "message": "Ошибка активации триала"}
 
-    def get_configs(self, token: str, force_refresh: bool = False) -> dict:
+    async def get_configs(self, token: str, force_refresh: bool = False) -> dict:
         """Получить список конфигов пользователя (primary + дополнительные)"""
         try:
-            url = f"{self.api_url}/api/client/configs"
+            url = "/api/client/configs"
             if force_refresh:
                 url += "?force_refresh=true"
-            response = self.session.get(
+            response = await self.get(
                 url,
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=15
@@ -1460,7 +1694,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения конфигов: {e}")
         return {"configs": []}
     
-    def create_payment(
+    async def create_payment(
         self,
         token: str,
         tariff_id: int,
@@ -1481,8 +1715,8 @@ class ClientBotAPI:
                 payload["config_id"] = int(config_id)
             if create_new_config:
                 payload["create_new_config"] = True
-            response = self.session.post(
-                f"{self.api_url}/api/client/create-payment",
+            response = await self.post(
+                "/api/client/create-payment",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json=payload,
                 timeout=10
@@ -1493,11 +1727,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка создания платежа: {e}")
         return {"success": False, "message": "Ошибка создания платежа"}
     
-    def get_support_tickets(self, token: str) -> list:
+    async def get_support_tickets(self, token: str) -> list:
         """Получить список тикетов поддержки"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/client/support-tickets",
+            response = await self.get(
+                "/api/client/support-tickets",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
             )
@@ -1507,11 +1741,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения тикетов: {e}")
         return []
     
-    def create_support_ticket(self, token: str, subject: str, message: str) -> dict:
+    async def create_support_ticket(self, token: str, subject: str, message: str) -> dict:
         """Создать тикет поддержки"""
         try:
-            response = self.session.post(
-                f"{self.api_url}/api/client/support-tickets",
+            response = await self.post(
+                "/api/client/support-tickets",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json={"subject": subject, "message": message},
                 timeout=10
@@ -1523,11 +1757,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка создания тикета: {e}")
         return {"success": False, "message": "Ошибка создания тикета"}
     
-    def get_ticket_messages(self, token: str, ticket_id: int) -> dict:
+    async def get_ticket_messages(self, token: str, ticket_id: int) -> dict:
         """Получить сообщения тикета"""
         try:
-            response = self.session.get(
-                f"{self.api_url}/api/support-tickets/{ticket_id}",
+            response = await self.get(
+                f"/api/support-tickets/{ticket_id}",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
             )
@@ -1537,7 +1771,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения сообщений тикета: {e}")
         return {}
     
-    def save_settings(self, token: str, lang: Optional[str] = None, currency: Optional[str] = None) -> dict:
+    async def save_settings(self, token: str, lang: Optional[str] = None, currency: Optional[str] = None) -> dict:
         """Сохранить настройки пользователя (язык, валюта)"""
         try:
             payload = {}
@@ -1550,8 +1784,8 @@ class ClientBotAPI:
                 return {"success": False, "message": "Нет данных для сохранения"}
             
             logger.info(f"Saving settings: {payload}")
-            response = self.session.post(
-                f"{self.api_url}/api/client/settings",
+            response = await self.post(
+                "/api/client/settings",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json=payload,
                 timeout=10
@@ -1565,11 +1799,11 @@ class ClientBotAPI:
             logger.error(f"Ошибка сохранения настроек: {e}")
         return {"success": False, "message": "Ошибка сохранения настроек"}
     
-    def reply_to_ticket(self, token: str, ticket_id: int, message: str) -> dict:
+    async def reply_to_ticket(self, token: str, ticket_id: int, message: str) -> dict:
         """Ответить на тикет"""
         try:
-            response = self.session.post(
-                f"{self.api_url}/api/support-tickets/{ticket_id}/reply",
+            response = await self.post(
+                f"/api/support-tickets/{ticket_id}/reply",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json={"message": message},
                 timeout=10
@@ -1771,6 +2005,7 @@ TRANSLATIONS = {
         'login_site': 'Войти на сайте',
         'now_use_bot': 'Теперь вы можете использовать все функции бота!',
         'already_registered': 'Вы уже зарегистрированы!',
+        'account_provisioning': 'Аккаунт создаётся, подписка появится через несколько секунд',
         'registering': 'Регистрируем...',
         'registration_error': 'Ошибка регистрации',
         'registration_failed': 'Не удалось зарегистрироваться. Попробуйте позже или зарегистрируйтесь на сайте:',
@@ -2002,6 +2237,7 @@ TRANSLATIONS = {
         'login_site': 'Увійти на сайті',
         'now_use_bot': 'Тепер ви можете використовувати всі функції бота!',
         'already_registered': 'Ви вже зареєстровані!',
+        'account_provisioning': 'Акаунт створюється, підписка з\'явиться за кілька секунд',
         'registering': 'Реєструємо...',
         'registration_error': 'Помилка реєстрації',
         'registration_failed': 'Не вдалося зареєструватися. Спробуйте пізніше або зареєструйтеся на сайті:',
@@ -2233,6 +2469,7 @@ TRANSLATIONS = {
         'login_site': 'Login to Website',
         'now_use_bot': 'Now you can use all bot features!',
         'already_registered': 'You are already registered!',
+        'account_provisioning': 'Your account is being created, the subscription will appear in a few seconds',
         'registering': 'Registering...',
         'registration_error': 'Registration Error',
         'registration_failed': 'Failed to register. Try again later or register on the website:',
@@ -2464,6 +2701,7 @@ TRANSLATIONS = {
         'login_site': '登录网站',
         'now_use_bot': '现在您可以使用所有机器人功能！',
         'already_registered': '您已经注册！',
+        'account_provisioning': '正在创建账户，订阅将在几秒钟后显示',
         'registering': '注册中...',
         'registration_error': '注册错误',
         'registration_failed': '注册失败。请稍后重试或在网站上注册：',
@@ -2536,7 +2774,7 @@ def get_text(key: str, lang: str = 'ru') -> str:
         text = text.replace('{SERVICE_NAME}', get_service_name())
     return text
 
-def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = None, token: str = None) -> str:
+async def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = None, token: str = None) -> str:
     """Получить язык пользователя из данных, context или по токену"""
     # Сначала проверяем context.user_data (самый быстрый способ, если язык был недавно изменен)
     if context and hasattr(context, 'user_data') and 'user_lang' in context.user_data:
@@ -2555,7 +2793,7 @@ def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = N
     
     # Если есть token, получаем данные из API
     if token:
-        user_data = api.get_user_data(token)
+        user_data = await api.get_user_data(token)
         if user_data:
             lang = user_data.get('preferred_lang') or user_data.get('preferredLang') or 'ru'
             if lang in ['ru', 'ua', 'en', 'cn']:
@@ -2568,7 +2806,7 @@ def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = N
     return 'ru'
 
 
-def get_user_token(telegram_id: int) -> Optional[str]:
+async def get_user_token(telegram_id: int) -> Optional[str]:
     """Получить или создать JWT токен для пользователя"""
     if telegram_id in user_tokens:
         cached = user_tokens.get(telegram_id)
@@ -2590,7 +2828,7 @@ def get_user_token(telegram_id: int) -> Optional[str]:
                 return cached["token"]
     
     # Получаем токен через API
-    token = api.get_user_by_telegram_id(telegram_id)
+    token = await api.get_user_by_telegram_id(telegram_id)
     if token and isinstance(token, str):
         user_tokens[telegram_id] = {"token": token, "exp": _get_jwt_exp(token)}
         return token
@@ -2629,10 +2867,10 @@ def clear_user_token_cache(telegram_id: int):
         pass
 
 
-def get_system_defaults() -> tuple[str, str]:
+async def get_system_defaults() -> tuple[str, str]:
     """Вернуть (default_language, default_currency) из системных настроек."""
     try:
-        settings = api.get_system_settings() or {}
+        settings = await api.get_system_settings() or {}
         lang = str(settings.get("default_language") or "ru").strip().lower() or "ru"
         currency = str(settings.get("default_currency") or "uah").strip().lower() or "uah"
         return lang, currency
@@ -2640,7 +2878,7 @@ def get_system_defaults() -> tuple[str, str]:
         return "ru", "uah"
 
 
-def get_user_data_safe(telegram_id: int, token: Optional[str], force_refresh: bool = False):
+async def get_user_data_safe(telegram_id: int, token: Optional[str], force_refresh: bool = False):
     """
     Получить user_data. Если token протух/стал невалидным — автоматически обновит токен и повторит запрос.
     Возвращает: (token, user_data)
@@ -2648,15 +2886,15 @@ def get_user_data_safe(telegram_id: int, token: Optional[str], force_refresh: bo
     if not token or not isinstance(token, str):
         return token, None
 
-    user_data = api.get_user_data(token, force_refresh=force_refresh)
+    user_data = await api.get_user_data(token, force_refresh=force_refresh)
     if user_data:
         return token, user_data
 
     # Наиболее частая причина: протухший JWT из кеша. Обновляем и пробуем ещё раз.
     clear_user_token_cache(telegram_id)
-    new_token = get_user_token(telegram_id)
+    new_token = await get_user_token(telegram_id)
     if new_token and isinstance(new_token, str):
-        user_data = api.get_user_data(new_token, force_refresh=force_refresh)
+        user_data = await api.get_user_data(new_token, force_refresh=force_refresh)
         if user_data:
             return new_token, user_data
 
@@ -2673,7 +2911,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_recent_bot_messages(context, chat_id, context.user_data, max_messages=20)
     
     # Получаем токен для пользователя
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     
     # Проверяем блокировку аккаунта
     if isinstance(token, dict) and token.get('blocked'):
@@ -2684,7 +2922,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text += "⚠️ Если вы считаете, что вас заблокировали ошибочно, свяжитесь с администрацией.\n\n"
         text += "💬 Для связи с поддержкой используйте кнопку ниже:"
         
-        lang = get_user_lang(None, context, None)
+        lang = await get_user_lang(None, context, None)
         keyboard = [
             [InlineKeyboardButton(get_text('contact_support_button', lang), callback_data="support")]
         ]
@@ -2707,9 +2945,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await show_channel_subscription_required(update, context)
                 return
 
-        default_lang, default_currency = get_system_defaults()
+        default_lang, default_currency = await get_system_defaults()
         telegram_username = user.username or ""
-        result = api.register_user(
+        result = await api.register_user(
             telegram_id,
             telegram_username,
             ref_code=referral_code,
@@ -2723,7 +2961,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_tokens[telegram_id] = {"token": token, "exp": _get_jwt_exp(token)}
         else:
             clear_user_token_cache(telegram_id)
-            token = get_user_token(telegram_id)
+            token = await get_user_token(telegram_id)
 
         if not token or not isinstance(token, str):
             # Если что-то пошло не так — показываем сообщение об ошибке
@@ -2731,15 +2969,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
     # Получаем данные пользователя (с авто-refresh токена)
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await reply_with_logo(update, f"❌ {get_text('failed_to_load_user', lang)}", context=context)
         return
     
     # Получаем язык пользователя
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Получаем данные для клавиатуры
     is_active = user_data.get("activeInternalSquads", [])
@@ -2774,6 +3012,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     preferred_currency = user_data.get("preferred_currency", "uah")
     currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
     welcome_text += f"{get_emoji('BALANCE')} **{get_text('balance', user_lang)}:** {balance:.2f} {currency_symbol}\n"
+    if user_data.get("provisioning"):
+        welcome_text += f"⏳ {get_text('account_provisioning', user_lang)}\n"
 
     # Статус подписки
     if has_active_subscription and expire_date:
@@ -2908,16 +3148,16 @@ async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
     # Попробуем обработать "зависшие" оплаты (если webhook не дошел), затем обновим профиль
     try:
-        api.session.post(
-            f"{FLASK_API_URL}/api/client/payments/reconcile",
+        await api.post(
+            "/api/client/payments/reconcile",
             headers={"Authorization": f"Bearer {token}"},
             json={},
             timeout=15
@@ -2925,14 +3165,14 @@ async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         pass
 
-    token, user_data = get_user_data_safe(telegram_id, token, force_refresh=True)
+    token, user_data = await get_user_data_safe(telegram_id, token, force_refresh=True)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('failed_to_load', lang)}")
         return
     
     # Получаем язык пользователя
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Формируем сообщение со статусом
     is_active = user_data.get("activeInternalSquads", [])
@@ -3044,7 +3284,7 @@ async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Данные для входа
     status_text += f"\n🔐 {get_text('login_data_title', user_lang)}\n"
     
-    credentials = api.get_credentials(telegram_id)
+    credentials = await api.get_credentials(telegram_id)
     if credentials and credentials.get("email"):
         status_text += f"📧 `{credentials['email']}`\n"
         if credentials.get("password"):
@@ -3097,20 +3337,20 @@ async def show_subscription_menu(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
 
     # Обновим профиль, чтобы статус был актуален
-    token, user_data = get_user_data_safe(telegram_id, token, force_refresh=True)
+    token, user_data = await get_user_data_safe(telegram_id, token, force_refresh=True)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('failed_to_load', lang)}", show_alert=True)
         return
 
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
     is_active = user_data.get("activeInternalSquads", [])
     expire_at = user_data.get("expireAt")
@@ -3221,8 +3461,8 @@ async def show_support_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
 
     text = f"💬 **{get_text('support', user_lang)}**\n"
     text += "━━━━━━━━━━━━━━━\n\n"
@@ -3282,7 +3522,7 @@ async def show_support_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     agreement_url = ''
     offer_url = ''
     try:
-        branding = api.get_branding() or {}
+        branding = await api.get_branding() or {}
         agreement_url = (branding.get('user_agreement_url') or '').strip()
         offer_url = (branding.get('offer_url') or '').strip()
     except Exception:
@@ -3334,20 +3574,20 @@ async def show_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await update.callback_query.answer("❌ Ошибка авторизации")
         return
     
-    tariffs = api.get_tariffs()
+    tariffs = await api.get_tariffs()
     
     if not tariffs:
         await update.callback_query.answer("❌ Тарифы не найдены")
         return
     
     # Получаем валюту и язык пользователя
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     
     currency_map = {
@@ -3360,13 +3600,13 @@ async def show_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     symbol = currency_config["symbol"]
     
     # Динамические уровни тарифов (как в V3)
-    levels = api.get_tariff_levels()
+    levels = await api.get_tariff_levels()
     levels_sorted = sorted(
         (lvl for lvl in levels if isinstance(lvl, dict) and lvl.get("code")),
         key=lambda x: (x.get("display_order", 0), x.get("id", 0))
     )
 
-    branding = api.get_branding()
+    branding = await api.get_branding()
     basic_name = branding.get("tariff_tier_basic_name", "Базовый") or "Базовый"
     pro_name = branding.get("tariff_tier_pro_name", "Премиум") or "Премиум"
     elite_name = branding.get("tariff_tier_elite_name", "Элитный") or "Элитный"
@@ -3448,85 +3688,56 @@ async def show_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_edit_or_send_with_logo(update, context, text_clean, reply_markup=reply_markup, logo_page="tariffs")
 
 
-async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE, tier: str):
-    """Показать тарифы конкретного типа (Basic/Pro/Elite) с выбором длительности"""
-    query = update.callback_query
-    if not query:
-        return
-    
-    user = update.effective_user
-    telegram_id = user.id
-    
-    token = get_user_token(telegram_id)
-    if not token:
-        await query.answer("❌ Ошибка авторизации")
-        return
-    
-    tariffs = api.get_tariffs()
-    
-    if not tariffs:
-        await query.answer("❌ Тарифы не найдены")
-        return
-    
-    # Получаем валюту и язык пользователя
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
-    currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
-    
-    currency_map = {
-        "uah": {"field": "price_uah", "symbol": "₴"},
-        "rub": {"field": "price_rub", "symbol": "₽"},
-        "usd": {"field": "price_usd", "symbol": "$"}
-    }
-    
-    currency_config = currency_map.get(currency, currency_map["uah"])
-    price_field = currency_config["field"]
-    symbol = currency_config["symbol"]
-    
-    # Получаем названия уровней тарифов (TariffLevel), fallback на branding
-    branding = api.get_branding()
+TIER_CURRENCIES = {
+    "uah": {"field": "price_uah", "symbol": "₴"},
+    "rub": {"field": "price_rub", "symbol": "₽"},
+    "usd": {"field": "price_usd", "symbol": "$"}
+}
+
+# Рендер изображений тарифов - в отдельных потоках, чтобы не блокировать обработку обновлений
+TARIFF_IMAGE_RENDER_WORKERS = int(os.getenv("TARIFF_IMAGE_RENDER_WORKERS", "2"))
+# Проверка изменений тарифов/брендинга для прогрева кэша изображений, сек (0 - не прогревать)
+TARIFF_IMAGE_WARM_INTERVAL = float(os.getenv("TARIFF_IMAGE_WARM_INTERVAL", "60"))
+_image_executor = ThreadPoolExecutor(max_workers=TARIFF_IMAGE_RENDER_WORKERS, thread_name_prefix="tariff-image")
+_tariff_image_warm_task = None
+
+
+def _tariff_tier(tariff: dict) -> str:
+    """Tier тарифа; если не задан - определяем по длительности"""
+    tariff_tier = tariff.get("tier")
+    if not tariff_tier:
+        duration = tariff.get("duration_days", 0)
+        if duration >= 180:
+            tariff_tier = "elite"
+        elif duration >= 90:
+            tariff_tier = "pro"
+        else:
+            tariff_tier = "basic"
+    return str(tariff_tier).lower()
+
+
+def _tier_card(tier: str, tariffs: list, levels: list, tariff_features: dict, branding: dict) -> dict:
+    """Данные карточки уровня тарифов: тарифы, функции, название, иконка, цвет"""
     basic_name = branding.get("tariff_tier_basic_name", "Базовый") or "Базовый"
     pro_name = branding.get("tariff_tier_pro_name", "Премиум") or "Премиум"
     elite_name = branding.get("tariff_tier_elite_name", "Элитный") or "Элитный"
 
-    levels = api.get_tariff_levels()
     tier_names_plain = {lvl.get("code"): (lvl.get("name") or lvl.get("code")) for lvl in levels if isinstance(lvl, dict) and lvl.get("code")}
     tier_names_plain.setdefault("basic", basic_name)
     tier_names_plain.setdefault("pro", pro_name)
     tier_names_plain.setdefault("elite", elite_name)
 
-    # Фильтруем тарифы по tier
-    tier_tariffs = []
-    
-    for tariff in tariffs:
-        duration = tariff.get("duration_days", 0)
-        tariff_tier = tariff.get("tier")
-        
-        if not tariff_tier:
-            # Определяем tier по длительности
-            if duration >= 180:
-                tariff_tier = "elite"
-            elif duration >= 90:
-                tariff_tier = "pro"
-            else:
-                tariff_tier = "basic"
-        
-        if str(tariff_tier).lower() == str(tier).lower():
-            tier_tariffs.append(tariff)
-    
-    if not tier_tariffs:
-        await query.answer("❌ Тарифы этого типа не найдены")
-        return
-    
+    tier_tariffs = [
+        tariff for tariff in tariffs
+        if isinstance(tariff, dict) and _tariff_tier(tariff) == str(tier).lower()
+    ]
     # Сортируем по длительности
     tier_tariffs.sort(key=lambda x: x.get("duration_days", 0))
     
     # Получаем функции тарифа для этого tier
-    tariff_features = api.get_tariff_features()
     features_list = tariff_features.get(tier, [])
     
     # Получаем названия функций из брендинга
-    branding = api.get_branding()
     features_names = branding.get("tariff_features_names", {})
     
     # Подготавливаем функции для генерации изображения
@@ -3561,31 +3772,139 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
         "icon": tier_icons.get(str(tier), get_emoji("STAR")),
     }
     
-    # Генерируем изображение
+    # Получаем цвет из брендинга (если есть)
+    primary_color_hex = branding.get("primary_color", "#3f69ff")
+    # Конвертируем hex в RGB tuple
     try:
-        from modules.image_generator import generate_tariff_image
-        from io import BytesIO
-        
-        # Получаем цвет из брендинга (если есть)
-        primary_color_hex = branding.get("primary_color", "#3f69ff")
-        # Конвертируем hex в RGB tuple
+        hex_color = primary_color_hex.lstrip('#')
+        if len(hex_color) == 3:
+            hex_color = ''.join([c*2 for c in hex_color])
+        primary_color = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    except:
+        primary_color = (63, 105, 255)  # Синий по умолчанию
+    
+    return {
+        "tariffs": tier_tariffs,
+        "features": processed_features,
+        "features_total": len(features_list),
+        "name": tier_info["name"],
+        "icon": tier_info["icon"],
+        "primary_color": primary_color
+    }
+
+
+def _tariff_image_params(card: dict, currency: str) -> dict:
+    """Аргументы generate_tariff_image для карточки уровня и валюты"""
+    return {
+        "tier_name": card["name"],
+        "tier_icon": card["icon"],
+        "features": card["features"],
+        "tariffs": card["tariffs"],
+        "currency": currency,
+        "currency_symbol": TIER_CURRENCIES.get(currency, TIER_CURRENCIES["uah"])["symbol"],
+        "primary_color": card["primary_color"]
+    }
+
+
+async def render_tariff_image_async(params: dict) -> bytes:
+    """PNG тарифа: из памяти сразу, иначе диск/рендер в пуле потоков"""
+    from modules.image_generator import render_tariff_image, tariff_image_cache, tariff_image_key
+    
+    cached = tariff_image_cache.get(tariff_image_key(**params))
+    if cached is not None:
+        return cached
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_image_executor, functools.partial(render_tariff_image, **params))
+
+
+async def warm_tariff_images(state: dict) -> int:
+    """Отрисовать изображения всех уровней во всех валютах, если тарифы/брендинг изменились"""
+    tariffs, levels, tariff_features, branding, settings = await asyncio.gather(
+        api.get_tariffs(), api.get_tariff_levels(), api.get_tariff_features(),
+        api.get_branding(), api.get_system_settings()
+    )
+    if not tariffs:
+        return 0
+    currencies = [c for c in (settings or {}).get("active_currencies") or list(TIER_CURRENCIES) if c in TIER_CURRENCIES]
+    fingerprint = hashlib.sha256(
+        json.dumps([tariffs, levels, tariff_features, branding, currencies], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    if fingerprint == state.get("fingerprint"):
+        return 0
+    
+    rendered = 0
+    for tier in sorted({_tariff_tier(t) for t in tariffs if isinstance(t, dict)}):
+        card = _tier_card(tier, tariffs, levels, tariff_features, branding)
+        if not card["tariffs"]:
+            continue
+        for currency in currencies:
+            await render_tariff_image_async(_tariff_image_params(card, currency))
+            rendered += 1
+    state["fingerprint"] = fingerprint
+    logger.info(f"Tariff images warmed: {rendered}")
+    return rendered
+
+
+async def _tariff_image_warm_loop():
+    state = {}
+    while True:
         try:
-            hex_color = primary_color_hex.lstrip('#')
-            if len(hex_color) == 3:
-                hex_color = ''.join([c*2 for c in hex_color])
-            primary_color = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        except:
-            primary_color = (63, 105, 255)  # Синий по умолчанию
-        
-        image_bytes = generate_tariff_image(
-            tier_name=tier_info["name"],
-            tier_icon=tier_info["icon"],
-            features=processed_features,
-            tariffs=tier_tariffs,
-            currency=currency,
-            currency_symbol=symbol,
-            primary_color=primary_color
-        )
+            await warm_tariff_images(state)
+        except ImportError:
+            logger.warning("Image generator module not found, tariff images are not warmed")
+            return
+        except Exception as e:
+            logger.warning(f"Failed to warm tariff images: {e}")
+        await asyncio.sleep(TARIFF_IMAGE_WARM_INTERVAL)
+
+
+async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE, tier: str):
+    """Показать тарифы конкретного типа (Basic/Pro/Elite) с выбором длительности"""
+    query = update.callback_query
+    if not query:
+        return
+    
+    user = update.effective_user
+    telegram_id = user.id
+    
+    token = await get_user_token(telegram_id)
+    if not token:
+        await query.answer("❌ Ошибка авторизации")
+        return
+    
+    tariffs = await api.get_tariffs()
+    
+    if not tariffs:
+        await query.answer("❌ Тарифы не найдены")
+        return
+    
+    # Получаем валюту и язык пользователя
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
+    currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
+    
+    currency_config = TIER_CURRENCIES.get(currency, TIER_CURRENCIES["uah"])
+    price_field = currency_config["field"]
+    symbol = currency_config["symbol"]
+    
+    # Данные карточки уровня (общие с фоновым прогревом изображений)
+    levels, tariff_features, branding = await asyncio.gather(
+        api.get_tariff_levels(), api.get_tariff_features(), api.get_branding()
+    )
+    card = _tier_card(tier, tariffs, levels, tariff_features, branding)
+    tier_tariffs = card["tariffs"]
+    
+    if not tier_tariffs:
+        await query.answer("❌ Тарифы этого типа не найдены")
+        return
+    
+    processed_features = card["features"]
+    tier_info = {"name": card["name"], "icon": card["icon"]}
+    
+    # Генерируем изображение
+    try:
+        # Из кэша или рендер в пуле потоков (не блокирует обработку обновлений)
+        image_bytes = await render_tariff_image_async(_tariff_image_params(card, currency))
         
         # Кнопки выбора длительности
         keyboard = []
@@ -3613,10 +3932,6 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # Отправляем изображение
-        photo_file = BytesIO(image_bytes)
-        photo_file.name = f"tariff_{tier}.png"
-        
         # Пытаемся удалить старое сообщение
         try:
             await query.message.delete()
@@ -3624,9 +3939,11 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
             pass
         
         # Отправляем новое сообщение с изображением
-        sent_message = await context.bot.send_photo(
+        # После первой загрузки то же изображение отправляется по file_id
+        sent_message = await send_photo_cached(
+            context.bot.send_photo, image_bytes,
+            filename=f"tariff_{tier}.png",
             chat_id=query.message.chat_id,
-            photo=photo_file,
             caption="Выберите длительность:",
             reply_markup=reply_markup
         )
@@ -3650,8 +3967,8 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
             text += "✨ **Включено в тариф:**\n"  # ✨ не в .env, оставляем как есть
             for feature in processed_features:
                 text += f"{feature['icon']} {feature['name']}\n"
-            if len(features_list) > 5:
-                text += f"... и еще {len(features_list) - 5} функций\n"
+            if card["features_total"] > 5:
+                text += f"... и еще {card['features_total'] - 5} функций\n"
             text += "\n"
         
         text += f"{get_emoji('DATE')} Выберите длительность:\n\n"
@@ -3706,8 +4023,8 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
             text += "✨ **Включено в тариф:**\n"
             for feature in processed_features:
                 text += f"{feature['icon']} {feature['name']}\n"
-            if len(features_list) > 5:
-                text += f"... и еще {len(features_list) - 5} функций\n"
+            if card["features_total"] > 5:
+                text += f"... и еще {card['features_total'] - 5} функций\n"
             text += "\n"
         
         text += f"{get_emoji('DATE')} Выберите длительность:\n\n"
@@ -3750,17 +4067,17 @@ async def show_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать категории дополнительных опций"""
     query = update.callback_query
     telegram_id = query.from_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     currency = (user_data.get("preferred_currency") if user_data else "uah") or "uah"
     symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(str(currency).lower(), "₴")
 
-    options = api.get_purchase_options() or {}
+    options = await api.get_purchase_options() or {}
     traffic = options.get("traffic", []) or []
     devices = options.get("devices", []) or []
     squad = options.get("squad", []) or []
@@ -3790,17 +4107,17 @@ async def show_options_category(update: Update, context: ContextTypes.DEFAULT_TY
     """Показать список опций по типу"""
     query = update.callback_query
     telegram_id = query.from_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     currency = (user_data.get("preferred_currency") if user_data else "uah") or "uah"
     symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(str(currency).lower(), "₴")
 
-    options = api.get_purchase_options() or {}
+    options = await api.get_purchase_options() or {}
     items = options.get(option_type, []) or []
 
     titles = {"traffic": "📊 Трафик", "devices": "📱 Устройства", "squad": "👥 Сквады"}
@@ -3855,13 +4172,13 @@ async def show_option_payment_methods(update: Update, context: ContextTypes.DEFA
     """Показать методы оплаты для опции"""
     query = update.callback_query
     telegram_id = query.from_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Получаем валюту для отображения символа
     currency = user_data.get("preferred_currency", "rub") if user_data else "rub"
@@ -3872,7 +4189,7 @@ async def show_option_payment_methods(update: Update, context: ContextTypes.DEFA
     }
     currency_config = currency_map.get(currency, currency_map["rub"])
 
-    available_methods = api.get_available_payment_methods()
+    available_methods = await api.get_available_payment_methods()
     if not available_methods:
         await query.answer()
         text = "❌ Нет доступных способов оплаты. Настройте платежки в админке."
@@ -3881,7 +4198,7 @@ async def show_option_payment_methods(update: Update, context: ContextTypes.DEFA
         return
 
     # Информация об опции и балансе — только через API (без доступа к БД из бота)
-    options = api.get_purchase_options() or {}
+    options = await api.get_purchase_options() or {}
     option = None
     for key in ("traffic", "devices", "squad"):
         for opt in (options.get(key) or []):
@@ -3958,18 +4275,18 @@ async def show_servers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await update.callback_query.answer("❌ Ошибка авторизации")
         return
     
     # Проверяем активность подписки
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await update.callback_query.answer("❌ Не удалось загрузить данные")
         return
     
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     is_active = user_data.get("activeInternalSquads", [])
     expire_at = user_data.get("expireAt")
     
@@ -3977,7 +4294,7 @@ async def show_servers(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.answer("❌ Подписка не активна. Активируйте триал или выберите тариф")
         return
     
-    nodes = api.get_nodes(token)
+    nodes = await api.get_nodes(token)
     
     back_to = pop_back_callback(context, "main_menu")
 
@@ -4039,23 +4356,23 @@ async def show_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await update.callback_query.answer("❌ Ошибка авторизации")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await update.callback_query.answer("❌ Не удалось загрузить данные")
         return
     
     # Получаем язык пользователя
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Получаем информацию о реферальной программе из API
     try:
-        ref_resp = api.session.get(
-            f"{FLASK_API_URL}/api/client/referrals/info",
+        ref_resp = await api.get(
+            "/api/client/referrals/info",
             headers={"Authorization": f"Bearer {token}"},
             timeout=5
         )
@@ -4094,7 +4411,7 @@ async def show_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Получаем домен сервера из API
         try:
-            domain_resp = api.session.get(f"{FLASK_API_URL}/api/public/server-domain", timeout=5)
+            domain_resp = await api.get("/api/public/server-domain", timeout=5)
             if domain_resp.status_code == 200:
                 domain_data = domain_resp.json()
                 server_domain = domain_data.get("full_url") or domain_data.get("domain") or YOUR_SERVER_IP
@@ -4183,21 +4500,21 @@ async def show_support(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('auth_error', lang)}")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('failed_to_load', lang)}")
         return
 
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
-    tickets = api.get_support_tickets(token)
+    tickets = await api.get_support_tickets(token)
     
     text = f"💬 **{get_text('support_title', user_lang)}**\n"
     text += "━━━━━━━━━━━━━━━\n\n"
@@ -4254,8 +4571,8 @@ async def show_support(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_user_agreement(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать пользовательское соглашение"""
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
     
     # Текст пользовательского соглашения (может быть ссылкой)
     agreement_text = get_user_agreement_text(user_lang)
@@ -4288,8 +4605,8 @@ async def show_user_agreement(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def show_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать публичную оферту"""
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
     
     # Текст публичной оферты (может быть ссылкой)
     offer_text = get_offer_text(user_lang)
@@ -4850,8 +5167,8 @@ def get_refund_policy_text(lang: str = 'ru') -> str:
 async def show_refund_policy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать политику возврата"""
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
     
     # Текст политики возврата
     policy_text = get_refund_policy_text(user_lang)
@@ -4955,13 +5272,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         telegram_id = user.id
         
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if token:
-            token, user_data = get_user_data_safe(telegram_id, token)
+            token, user_data = await get_user_data_safe(telegram_id, token)
             
             if user_data:
                 # Получаем язык пользователя
-                user_lang = get_user_lang(user_data, context, token)
+                user_lang = await get_user_lang(user_data, context, token)
                 
                 welcome_text = f"{get_emoji('HEADER')} **{get_text('stealthnet_bot', user_lang)}**\n"
                 welcome_text += f"{get_text('main_menu_button', user_lang)}\n"
@@ -5091,7 +5408,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
         
         # Fallback если не удалось загрузить данные
-        lang = get_user_lang(None, context, token) if token else 'ru'
+        lang = await get_user_lang(None, context, token) if token else 'ru'
         welcome_text = f"{get_text('main_menu_button', lang)}\n\n"
         welcome_text += f"{get_text('select_action', lang)}:"
         
@@ -5218,7 +5535,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         telegram_id = update.callback_query.from_user.id
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if not token:
             await update.callback_query.answer("❌ Ошибка авторизации")
             return
@@ -5230,10 +5547,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             cfg_id = None
 
-        await update.callback_query.answer(get_text('creating_payment', get_user_lang(None, context, token)))
-        result = api.create_option_payment(token, option_id, provider, config_id=cfg_id)
-        user_data_api = api.get_user_data(token) or {}
-        user_lang = get_user_lang(user_data_api, context, token)
+        await update.callback_query.answer(get_text('creating_payment', await get_user_lang(None, context, token)))
+        result = await api.create_option_payment(token, option_id, provider, config_id=cfg_id)
+        user_data_api = await api.get_user_data(token) or {}
+        user_lang = await get_user_lang(user_data_api, context, token)
 
         # Если оплата с баланса прошла успешно (payment_url == null и success == true)
         if result.get("success") or (result.get("payment_url") is None and provider == "balance"):
@@ -5298,19 +5615,19 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         telegram_id = user.id
         
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if not token:
-            lang = get_user_lang(None, context, token)
+            lang = await get_user_lang(None, context, token)
             await query.answer(f"❌ {get_text('auth_error', lang)}")
             return
         
-        token, user_data_api = get_user_data_safe(telegram_id, token)
+        token, user_data_api = await get_user_data_safe(telegram_id, token)
         if not user_data_api:
-            lang = get_user_lang(None, context, token)
+            lang = await get_user_lang(None, context, token)
             await query.answer(f"❌ {get_text('failed_to_load', lang)}")
             return
         
-        user_lang = get_user_lang(user_data_api, context, token)
+        user_lang = await get_user_lang(user_data_api, context, token)
         preferred_currency = user_data_api.get("preferred_currency", "uah")
         currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
         
@@ -5353,13 +5670,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         user = update.effective_user
         telegram_id = user.id
-        token = get_user_token(telegram_id)
-        token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-        user_lang = get_user_lang(user_data, context, token)
+        token = await get_user_token(telegram_id)
+        token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+        user_lang = await get_user_lang(user_data, context, token)
         
         # Получаем домен сервера из API
         try:
-            domain_resp = api.session.get(f"{FLASK_API_URL}/api/public/server-domain", timeout=5)
+            domain_resp = await api.get("/api/public/server-domain", timeout=5)
             if domain_resp.status_code == 200:
                 domain_data = domain_resp.json()
                 server_domain = domain_data.get("full_url") or domain_data.get("domain") or YOUR_SERVER_IP
@@ -5400,9 +5717,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "create_ticket":
         user = update.effective_user
         telegram_id = user.id
-        token = get_user_token(telegram_id)
-        token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-        user_lang = get_user_lang(user_data, context, token)
+        token = await get_user_token(telegram_id)
+        token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+        user_lang = await get_user_lang(user_data, context, token)
         
         temp_update = Update(update_id=0, callback_query=query)
         await safe_edit_or_send_with_logo(
@@ -5427,9 +5744,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ticket_id = int(data.replace("reply_ticket_", ""))
             user = update.effective_user
             telegram_id = user.id
-            token = get_user_token(telegram_id)
-            token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-            user_lang = get_user_lang(user_data, context, token)
+            token = await get_user_token(telegram_id)
+            token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+            user_lang = await get_user_lang(user_data, context, token)
             
             temp_update = Update(update_id=0, callback_query=query)
             await safe_edit_or_send_with_logo(
@@ -5446,9 +5763,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except (ValueError, IndexError):
             user = update.effective_user
             telegram_id = user.id
-            token = get_user_token(telegram_id)
-            token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-            user_lang = get_user_lang(user_data, context, token)
+            token = await get_user_token(telegram_id)
+            token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+            user_lang = await get_user_lang(user_data, context, token)
             await query.answer(f"❌ {get_text('invalid_ticket_id', user_lang)}")
     
     elif data == "register_user":
@@ -5496,18 +5813,18 @@ async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await query.answer("❌ Не удалось загрузить данные")
         return
     
     # Получаем язык и валюту с правильными ключами
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     current_currency = user_data.get("preferred_currency") or user_data.get("preferredCurrency") or "uah"
     
     logger.debug(f"Settings: lang={user_lang}, currency={current_currency}")
@@ -5528,7 +5845,7 @@ async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text += f"📝 {get_text('select_currency', user_lang)}\n"
     
     # Получаем активные валюты из настроек
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     # Генерируем кнопки валют динамически
@@ -5580,13 +5897,13 @@ async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE, curre
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
     
     # Проверяем, что валюта активна
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     if currency not in active_currencies:
@@ -5594,7 +5911,7 @@ async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE, curre
         return
     
     # Проверяем текущую валюту
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     current_currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     
     if current_currency == currency:
@@ -5602,7 +5919,7 @@ async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE, curre
         return
     
     # Сохраняем валюту
-    result = api.save_settings(token, currency=currency)
+    result = await api.save_settings(token, currency=currency)
     
     logger.info(f"Currency save result: {result}")
     
@@ -5631,24 +5948,24 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE, lang:
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await query.answer("❌ Не удалось загрузить данные")
         return
     
-    current_lang = get_user_lang(user_data, context, token)
+    current_lang = await get_user_lang(user_data, context, token)
     
     # Если язык не указан, показываем меню выбора
     if not lang:
         text = f"🌐 **{get_text('select_language', current_lang)}**\n\n"
         
         # Получаем активные языки из настроек
-        system_settings = api.get_system_settings()
+        system_settings = await api.get_system_settings()
         active_languages = system_settings.get("active_languages", ["ru", "ua", "en", "cn"])
         
         # Генерируем кнопки языков динамически
@@ -5687,7 +6004,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE, lang:
         return
     
     # Проверяем, что язык активен
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_languages = system_settings.get("active_languages", ["ru", "ua", "en", "cn"])
     
     if lang not in active_languages:
@@ -5700,7 +6017,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE, lang:
         return
     
     # Сохраняем язык
-    result = api.save_settings(token, lang=lang)
+    result = await api.save_settings(token, lang=lang)
     
     logger.info(f"Language save result: {result}")
     
@@ -5734,18 +6051,18 @@ async def view_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     await query.answer(f"⏳ {get_text('loading_ticket', user_lang)}...")
     
-    ticket_data = api.get_ticket_messages(token, ticket_id)
+    ticket_data = await api.get_ticket_messages(token, ticket_id)
     
     if not ticket_data or not ticket_data.get("messages"):
         temp_update = Update(update_id=0, callback_query=query)
@@ -5869,9 +6186,9 @@ async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_username = user.username or ""
     
     # Проверяем, не зарегистрирован ли уже
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if token:
-        lang = get_user_lang(None, context, token) if token else 'ru'
+        lang = await get_user_lang(None, context, token) if token else 'ru'
         await query.answer(f"✅ {get_text('already_registered', lang)}", show_alert=True)
         await start(update, context)
         return
@@ -5889,9 +6206,9 @@ async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Авто-регистрация с системными настройками (язык/валюта)
     ref_code = context.user_data.get("ref_code")
-    default_lang, default_currency = get_system_defaults()
+    default_lang, default_currency = await get_system_defaults()
     await query.answer("⏳", show_alert=False)
-    result = api.register_user(
+    result = await api.register_user(
         telegram_id,
         telegram_username,
         ref_code=ref_code,
@@ -5913,7 +6230,7 @@ async def register_select_language(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Проверяем, что язык активен
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_languages = system_settings.get("active_languages", ["ru", "ua", "en", "cn"])
     
     if lang not in active_languages:
@@ -5937,7 +6254,7 @@ async def register_select_language(update: Update, context: ContextTypes.DEFAULT
     text += "💡 Вы сможете изменить её позже в настройках."
     
     # Получаем активные валюты из настроек
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     # Генерируем кнопки валют динамически на основе активных валют
@@ -5982,7 +6299,7 @@ async def register_select_currency(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Проверяем, что валюта активна
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     if currency not in active_currencies:
@@ -6033,7 +6350,7 @@ async def register_select_currency(update: Update, context: ContextTypes.DEFAULT
     ref_code = context.user_data.get("ref_code")
     
     # Регистрируем пользователя с выбранными языком и валютой
-    result = api.register_user(telegram_id, telegram_username, ref_code, preferred_lang=lang, preferred_currency=currency)
+    result = await api.register_user(telegram_id, telegram_username, ref_code, preferred_lang=lang, preferred_currency=currency)
     
     if not result:
         text = "❌ **Ошибка регистрации**\n\n"
@@ -6049,7 +6366,7 @@ async def register_select_currency(update: Update, context: ContextTypes.DEFAULT
     
     if result.get("message") == "User already registered":
         await query.answer("✅ Вы уже зарегистрированы!", show_alert=True)
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if token:
             await show_status(update, context)
         return
@@ -6124,18 +6441,18 @@ async def activate_trial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     await query.answer(f"⏳ {get_text('activating_trial', user_lang)}...")
     
-    result = api.activate_trial(token)
+    result = await api.activate_trial(token)
     
     keyboard = [[InlineKeyboardButton(get_text('main_menu_button', user_lang), callback_data="main_menu")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -6241,22 +6558,22 @@ async def select_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE, tari
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации", show_alert=True)
         return
     
     # Получаем информацию о тарифе
-    tariffs = api.get_tariffs()
+    tariffs = await api.get_tariffs()
     tariff = next((t for t in tariffs if t.get("id") == tariff_id), None)
     
     if not tariff:
         await query.answer("❌ Тариф не найден", show_alert=True)
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     currency_map = {
         "uah": {"field": "price_uah", "symbol": "₴"},
@@ -6284,11 +6601,11 @@ async def select_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE, tari
             tariff_tier = "basic"
     
     # Получаем функции тарифа
-    tariff_features = api.get_tariff_features()
+    tariff_features = await api.get_tariff_features()
     features_list = tariff_features.get(tariff_tier, [])
     
     # Получаем названия функций из брендинга
-    branding = api.get_branding()
+    branding = await api.get_branding()
     features_names = branding.get("tariff_features_names", {})
     
     text = f"💎 **{get_text('tariff_selected', user_lang)}:** {tariff.get('name', get_text('unknown', user_lang))}\n"
@@ -6343,7 +6660,7 @@ async def select_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE, tari
     text += f"**{get_text('payment_methods', user_lang)}**:"
     
     # Получаем доступные способы оплаты из API
-    available_methods = api.get_available_payment_methods()
+    available_methods = await api.get_available_payment_methods()
     
     # Маппинг названий способов оплаты
     payment_names = {
@@ -6437,14 +6754,14 @@ async def handle_payment(
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Если оплата с баланса, используем специальный endpoint
     if provider == 'balance':
@@ -6457,8 +6774,8 @@ async def handle_payment(
             if create_new_config:
                 payload["create_new_config"] = True
 
-            response = api.session.post(
-                f"{FLASK_API_URL}/api/client/purchase-with-balance",
+            response = await api.post(
+                "/api/client/purchase-with-balance",
                 headers={"Authorization": f"Bearer {token}"},
                 json=payload,
                 timeout=30
@@ -6510,7 +6827,7 @@ async def handle_payment(
     
     await query.answer(f"⏳ {get_text('creating_payment', user_lang)}...")
     
-    result = api.create_payment(
+    result = await api.create_payment(
         token,
         tariff_id,
         provider,
@@ -6586,16 +6903,16 @@ async def choose_config_for_payment(update: Update, context: ContextTypes.DEFAUL
     user = update.effective_user
     telegram_id = user.id
 
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
-    cfgs_resp = api.get_configs(token)
+    cfgs_resp = await api.get_configs(token)
     cfgs = (cfgs_resp or {}).get('configs') or []
 
     text = "🧩 **Выберите подписку для оплаты**\n"
@@ -6637,16 +6954,16 @@ async def show_configs(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user = update.effective_user
     telegram_id = user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
-    cfgs_resp = api.get_configs(token, force_refresh=True)
+    cfgs_resp = await api.get_configs(token, force_refresh=True)
     cfgs = (cfgs_resp or {}).get('configs') or []
 
     text = f"{get_emoji('PUZZLE')} **{get_text('configs_button', user_lang)}**\n"
@@ -6703,19 +7020,19 @@ async def handle_share_config(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     user = update.effective_user
     telegram_id = user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     try:
         # Создаем токен через API
-        response = requests.post(
-            f"{FLASK_API_URL}/api/client/configs/{config_id}/share-token",
+        response = await api.post(
+            f"/api/client/configs/{config_id}/share-token",
             headers={"Authorization": f"Bearer {token}"},
             json={"expires_hours": 168, "max_uses": 1},  # 7 дней, 1 использование
             timeout=10
@@ -6733,7 +7050,7 @@ async def handle_share_config(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
         
         # Получаем информацию о конфиге
-        cfgs_resp = api.get_configs(token, force_refresh=True)
+        cfgs_resp = await api.get_configs(token, force_refresh=True)
         cfgs = (cfgs_resp or {}).get('configs') or []
         config = next((c for c in cfgs if c.get('id') == config_id), None)
         
@@ -6803,8 +7120,8 @@ async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Проверяем, является ли запрос токеном
     try:
         # Получаем информацию о подписке по токену
-        response = requests.get(
-            f"{FLASK_API_URL}/api/public/config-share/{query_text}",
+        response = await api.get(
+            f"/api/public/config-share/{query_text}",
             timeout=10
         )
         
@@ -6907,19 +7224,19 @@ async def handle_accept_shared_config(update: Update, context: ContextTypes.DEFA
     
     user = update.effective_user
     telegram_id = user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     try:
         # Принимаем подписку через API
-        response = requests.post(
-            f"{FLASK_API_URL}/api/client/configs/share/{share_token}/accept",
+        response = await api.post(
+            f"/api/client/configs/share/{share_token}/accept",
             headers={"Authorization": f"Bearer {token}"},
             timeout=10
         )
@@ -6955,14 +7272,13 @@ async def handle_accept_shared_config(update: Update, context: ContextTypes.DEFA
                     chat_id = user.id
                     logo_path = _get_logo_path("default")
                     if os.path.exists(logo_path):
-                        with open(logo_path, 'rb') as logo_file:
-                            await context.bot.send_photo(
-                                chat_id=chat_id,
-                                photo=logo_file,
-                                caption=text,
-                                reply_markup=reply_markup,
-                                parse_mode="Markdown"
-                            )
+                        await send_photo_cached(
+                            context.bot.send_photo, logo_path,
+                            chat_id=chat_id,
+                            caption=text,
+                            reply_markup=reply_markup,
+                            parse_mode="Markdown"
+                        )
                     else:
                         await context.bot.send_message(
                             chat_id=chat_id,
@@ -7001,19 +7317,19 @@ async def show_topup_balance(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('failed_to_load', lang)}")
         return
     
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     balance = user_data.get("balance", 0)
     preferred_currency = user_data.get("preferred_currency", "uah")
     currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
@@ -7070,9 +7386,9 @@ async def select_topup_method(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         if query:
             await query.answer(f"❌ {get_text('auth_error', lang)}")
         elif message:
@@ -7080,8 +7396,8 @@ async def select_topup_method(update: Update, context: ContextTypes.DEFAULT_TYPE
             await reply_with_logo(temp_update, f"❌ {get_text('auth_error', lang)}", context=context)
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     preferred_currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
     
@@ -7091,7 +7407,7 @@ async def select_topup_method(update: Update, context: ContextTypes.DEFAULT_TYPE
     text += f"**{get_text('select_topup_method', user_lang)}**:"
     
     # Получаем доступные способы оплаты
-    available_methods = api.get_available_payment_methods()
+    available_methods = await api.get_available_payment_methods()
     
     payment_names = {
         'crystalpay': '💳 CrystalPay',
@@ -7173,22 +7489,22 @@ async def handle_topup_payment(update: Update, context: ContextTypes.DEFAULT_TYP
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     preferred_currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
     
     await query.answer(f"⏳ {get_text('creating_payment', user_lang)}...")
     
     try:
-        response = api.session.post(
-            f"{FLASK_API_URL}/api/client/create-payment",
+        response = await api.post(
+            "/api/client/create-payment",
             headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
             json={
                 "type": "balance_topup",
@@ -7250,10 +7566,201 @@ async def handle_topup_payment(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ОБНОВЛЕНИЙ
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Одновременно выполняемых обработчиков (1 - строго последовательная обработка)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "16"))
+# Лимит ожидающих нажатий кнопок: всего и на один чат (сверх лимита нажатие отбрасывается)
+BOT_UPDATE_QUEUE_LIMIT = int(os.getenv("BOT_UPDATE_QUEUE_LIMIT", "1000"))
+BOT_CHAT_QUEUE_LIMIT = int(os.getenv("BOT_CHAT_QUEUE_LIMIT", "5"))
+# Интервал записи метрик очереди в лог, сек (0 - не писать)
+BOT_METRICS_INTERVAL = float(os.getenv("BOT_METRICS_INTERVAL", "60"))
+
+
+def _update_chat_key(update: object) -> Optional[int]:
+    """Ключ очереди обновления: чат, а без чата (inline, pre-checkout) - пользователь"""
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+    return None
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов выполняются одновременно (не больше workers обработчиков),
+    обновления одного чата - строго по очереди. Нажатие той же кнопки, пока предыдущее ещё
+    ждёт в очереди, сливается с ним; нажатия сверх chat_queue_limit на чат или queue_limit
+    всего отбрасываются. Сообщения, команды и платежи не отбрасываются.
+    """
+
+    # Лимит базового класса только защищает память: параллельность задаёт семафор workers
+    MAX_IN_FLIGHT = 100_000
+
+    def __init__(self, workers: int, queue_limit: int, chat_queue_limit: int, metrics_interval: float = 0):
+        super().__init__(self.MAX_IN_FLIGHT)
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.chat_queue_limit = chat_queue_limit
+        self.metrics_interval = metrics_interval
+        self._worker_slots = asyncio.Semaphore(self.workers)
+        self._chat_locks = {}
+        self._chat_pending = {}
+        self._queued_taps = set()
+        self._queued = 0
+        self._running = 0
+        self._wait_times = deque(maxlen=1000)
+        self._handle_times = deque(maxlen=1000)
+        self._counters = {'processed': 0, 'merged': 0, 'dropped': 0, 'failed': 0}
+        self._metrics_task = None
+
+    async def initialize(self) -> None:
+        if self.metrics_interval > 0 and self._metrics_task is None:
+            self._metrics_task = asyncio.create_task(self._metrics_loop())
+
+    async def shutdown(self) -> None:
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._metrics_task
+            self._metrics_task = None
+
+    def _reject_reason(self, key, tap) -> Optional[str]:
+        if tap in self._queued_taps:
+            return 'merged'
+        if self._queued >= self.queue_limit or self._chat_pending.get(key, 0) >= self.chat_queue_limit:
+            return 'dropped'
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = _update_chat_key(update)
+        tap = None
+        if isinstance(update, Update) and update.callback_query:
+            query = update.callback_query
+            tap = (key, query.message.message_id if query.message else None, query.data)
+            reason = self._reject_reason(key, tap)
+            if reason:
+                coroutine.close()
+                self._counters[reason] += 1
+                # Убираем «часики» на кнопке; слитое нажатие выполнит уже стоящее в очереди
+                with contextlib.suppress(Exception):
+                    await query.answer("⏳" if reason == 'dropped' else None)
+                return
+            self._queued_taps.add(tap)
+
+        admitted = time.perf_counter()
+        self._queued += 1
+        self._chat_pending[key] = self._chat_pending.get(key, 0) + 1
+        lock = self._chat_locks.setdefault(key, asyncio.Lock()) if key is not None else contextlib.nullcontext()
+        waiting = True
+        try:
+            async with lock:
+                async with self._worker_slots:
+                    waiting = False
+                    self._queued -= 1
+                    self._queued_taps.discard(tap)
+                    started = time.perf_counter()
+                    self._wait_times.append(started - admitted)
+                    self._running += 1
+                    try:
+                        await coroutine
+                        self._counters['processed'] += 1
+                    except Exception:
+                        self._counters['failed'] += 1
+                        raise
+                    finally:
+                        self._running -= 1
+                        self._handle_times.append(time.perf_counter() - started)
+        finally:
+            if waiting:
+                # Отмена до начала обработки (остановка бота)
+                self._queued -= 1
+                self._queued_taps.discard(tap)
+                coroutine.close()
+            self._chat_pending[key] -= 1
+            if not self._chat_pending[key]:
+                del self._chat_pending[key]
+                self._chat_locks.pop(key, None)
+
+    def metrics(self) -> dict:
+        """Снимок очереди: глубина, выполняется, задержки (мс), счётчики"""
+        return {
+            'queued': self._queued,
+            'running': self._running,
+            'chats': len(self._chat_pending),
+            'wait_p50_ms': round(_percentile(self._wait_times, 0.5) * 1000, 1),
+            'wait_p95_ms': round(_percentile(self._wait_times, 0.95) * 1000, 1),
+            'handler_p50_ms': round(_percentile(self._handle_times, 0.5) * 1000, 1),
+            'handler_p95_ms': round(_percentile(self._handle_times, 0.95) * 1000, 1),
+            **self._counters
+        }
+
+    async def _metrics_loop(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            stats = self.metrics()
+            active = bool(self._handle_times) or stats['queued'] or stats['running']
+            # Окно задержек - за последний интервал, счётчики - с запуска
+            self._wait_times.clear()
+            self._handle_times.clear()
+            if active:
+                logger.info(
+                    "Update queue: queued=%(queued)s running=%(running)s chats=%(chats)s "
+                    "wait p50/p95=%(wait_p50_ms)s/%(wait_p95_ms)s ms "
+                    "handler p50/p95=%(handler_p50_ms)s/%(handler_p95_ms)s ms "
+                    "processed=%(processed)s merged=%(merged)s dropped=%(dropped)s failed=%(failed)s",
+                    stats
+                )
+
+
+async def _post_init(application: Application):
+    """Реестр file_id и первая загрузка конфигурации бота и настроек триала (дальше кеш обновляется в фоне)"""
+    global _tariff_image_warm_task
+    await asyncio.to_thread(media_registry.load, application.bot.id)
+    await asyncio.gather(refresh_bot_config(), refresh_trial_settings())
+    if TARIFF_IMAGE_WARM_INTERVAL > 0:
+        _tariff_image_warm_task = asyncio.create_task(_tariff_image_warm_loop())
+
+
+async def _post_shutdown(application: Application):
+    """Остановить прогрев изображений и закрыть пул соединений к Flask API"""
+    if _tariff_image_warm_task is not None:
+        _tariff_image_warm_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _tariff_image_warm_task
+    _image_executor.shutdown(wait=False)
+    await api.aclose()
+
+
 def main():
     """Главная функция запуска бота"""
     # Создаем приложение
-    application = Application.builder().token(CLIENT_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(CLIENT_BOT_TOKEN)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        # Обновления разных чатов - параллельно, одного чата - по порядку
+        .concurrent_updates(ChatOrderedUpdateProcessor(
+            workers=BOT_CONCURRENT_UPDATES,
+            queue_limit=BOT_UPDATE_QUEUE_LIMIT,
+            chat_queue_limit=BOT_CHAT_QUEUE_LIMIT,
+            metrics_interval=BOT_METRICS_INTERVAL
+        ))
+        .build()
+    )
     
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -7351,14 +7858,14 @@ def main():
                 message = update.message.text
                 
                 telegram_id = update.effective_user.id
-                token = get_user_token(telegram_id)
+                token = await get_user_token(telegram_id)
                 
                 if token:
-                    result = api.create_support_ticket(token, subject, message)
+                    result = await api.create_support_ticket(token, subject, message)
                     
                     # Получаем язык пользователя для кнопки
-                    token, user_data_api = get_user_data_safe(telegram_id, token) if token else (token, None)
-                    user_lang = get_user_lang(user_data_api, context, token)
+                    token, user_data_api = await get_user_data_safe(telegram_id, token) if token else (token, None)
+                    user_lang = await get_user_lang(user_data_api, context, token)
                     
                     # API возвращает {"message": "Created", "ticket_id": nt.id} со статусом 201
                     # Проверяем оба варианта
@@ -7405,14 +7912,14 @@ def main():
                 message = update.message.text
                 
                 telegram_id = update.effective_user.id
-                token = get_user_token(telegram_id)
+                token = await get_user_token(telegram_id)
                 
                 if token and ticket_id:
                     # Получаем язык пользователя для кнопок
-                    token, user_data_api = get_user_data_safe(telegram_id, token)
-                    user_lang = get_user_lang(user_data_api, context, token)
+                    token, user_data_api = await get_user_data_safe(telegram_id, token)
+                    user_lang = await get_user_lang(user_data_api, context, token)
                     
-                    result = api.reply_to_ticket(token, ticket_id, message)
+                    result = await api.reply_to_ticket(token, ticket_id, message)
                     
                     if result.get("id") or result.get("success"):
                         # Создаем клавиатуру с кнопками "Просмотреть тикет" и "Назад"
@@ -7452,9 +7959,9 @@ def main():
                 user = update.effective_user
                 telegram_id = user.id
                 
-                token = get_user_token(telegram_id)
-                token, user_data_api = get_user_data_safe(telegram_id, token) if token else (token, None)
-                user_lang = get_user_lang(user_data_api, context, token)
+                token = await get_user_token(telegram_id)
+                token, user_data_api = await get_user_data_safe(telegram_id, token) if token else (token, None)
+                user_lang = await get_user_lang(user_data_api, context, token)
                 
                 try:
                     amount_text = update.message.text.strip()
@@ -7508,8 +8015,8 @@ def main():
                 if share_token:
                     try:
                         # Пробуем получить информацию о подписке по токену
-                        response = requests.get(
-                            f"{FLASK_API_URL}/api/public/config-share/{share_token}",
+                        response = await api.get(
+                            f"/api/public/config-share/{share_token}",
                             timeout=5
                         )
                         
@@ -7520,11 +8027,11 @@ def main():
                             owner_username = config_data.get('owner_username', 'пользователя')
                             
                             telegram_id = update.effective_user.id
-                            user_token = get_user_token(telegram_id)
+                            user_token = await get_user_token(telegram_id)
                             
                             if user_token:
-                                token, user_data_api = get_user_data_safe(telegram_id, user_token)
-                                user_lang = get_user_lang(user_data_api, context, user_token)
+                                token, user_data_api = await get_user_data_safe(telegram_id, user_token)
+                                user_lang = await get_user_lang(user_data_api, context, user_token)
                                 
                                 text = f"🧩 **{config_name}**\n"
                                 text += f"От: {owner_username}\n\n"
@@ -7583,16 +8090,12 @@ def main():
         
         # При polling бот получает обновления, вебхук Flask не вызывается — обрабатываем платеж через внутренний API
         try:
-            import asyncio
-            def _process_payment():
-                r = requests.post(
-                    f"{FLASK_API_URL}/api/internal/process-telegram-payment",
-                    headers={"Content-Type": "application/json", "X-Internal-Key": "telegram-stars-internal"},
-                    json={"order_id": order_id, "telegram_id": telegram_id},
-                    timeout=15
-                )
-                return r
-            resp = await asyncio.to_thread(_process_payment)
+            resp = await api.post(
+                "/api/internal/process-telegram-payment",
+                headers={"Content-Type": "application/json", "X-Internal-Key": "telegram-stars-internal"},
+                json={"order_id": order_id, "telegram_id": telegram_id},
+                timeout=15
+            )
             if resp.status_code == 200:
                 logger.info(f"Payment processed via internal API: order_id={order_id}")
             else:
@@ -7600,13 +8103,13 @@ def main():
         except Exception as e:
             logger.exception(f"Failed to process Telegram Stars payment via internal API: {e}")
         
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if not token:
             await message.reply_text("❌ Ошибка авторизации")
             return
         
-        token, user_data = get_user_data_safe(telegram_id, token)
-        user_lang = get_user_lang(user_data, context, token)
+        token, user_data = await get_user_data_safe(telegram_id, token)
+        user_lang = await get_user_lang(user_data, context, token)
         
         text = f"✅ **{get_text('payment_successful', user_lang)}**\n\n"
         text += f"💳 {get_text('payment_processed', user_lang)}\n\n"
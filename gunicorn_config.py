@@ -86,6 +86,29 @@ def post_fork(server, worker):
         import traceback
         traceback.print_exc()
 
+    # Фоновое обновление снимка пользователей RemnaWave (между воркерами координируется блокировкой в кэше)
+    try:
+        import app  # noqa: F401 - инициализирует modules.core
+        from modules.remnawave_snapshot import start_snapshot_refresher
+        start_snapshot_refresher()
+        print(f"✅ [gunicorn] Worker {worker.age}: обновление снимка RemnaWave запущено")
+    except Exception as e:
+        print(f"⚠️ [gunicorn] Worker {worker.age}: не удалось запустить обновление снимка RemnaWave: {e}")
+
+    # Воркеры фоновой очереди (JOB_WORKER_THREADS=0, если задачи выполняет отдельный run_job_worker.py)
+    try:
+        from modules.jobs import start_job_workers
+        start_job_workers()
+    except Exception as e:
+        print(f"⚠️ [gunicorn] Worker {worker.age}: не удалось запустить воркеры очереди: {e}")
+
+    # Фоновая сверка зависших оплат (между воркерами координируется блокировкой в кэше)
+    try:
+        from modules.payment_reconcile import start_payment_reconciler
+        start_payment_reconciler()
+    except Exception as e:
+        print(f"⚠️ [gunicorn] Worker {worker.age}: не удалось запустить сверку оплат: {e}")
+
 def worker_int(worker):
     """Вызывается при получении SIGINT/SIGQUIT worker процессом"""
     print(f"🛑 [gunicorn] Worker {worker.age} получил сигнал остановки")
@@ -2,6 +2,9 @@
 """
 Скрипт автоматической миграции данных из SQLite в PostgreSQL
 Выполняется автоматически при первом запуске с PostgreSQL
+
+Строки читаются из SQLite пачками по MIGRATION_CHUNK_SIZE и вставляются одним
+executemany на пачку; пачка с ошибкой переносится построчно (ошибочные строки пропускаются).
 """
 
 import os
@@ -9,12 +12,15 @@ import sys
 import sqlite3
 from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import create_engine, inspect, text, insert, select
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 
 # Загрузка переменных окружения
 load_dotenv()
 
+MIGRATION_CHUNK_SIZE = int(os.getenv('MIGRATION_CHUNK_SIZE', 1000))
+
 def get_sqlite_db_path():
     """Получить путь к SQLite базе данных"""
     # Проверяем несколько возможных путей
@@ -49,6 +55,46 @@ def get_postgresql_url():
     
     return None
 
+def _row_to_data(row, columns, model_columns):
+    """Словарь значений строки SQLite только с колонками модели"""
+    data = {}
+    for col, value in zip(columns, row):
+        if col not in model_columns:
+            # Пропускаем поля, которых нет в модели (например, если структура изменилась)
+            continue
+        if isinstance(value, str) and value == '':
+            # Пустые строки
+            data[col] = None if 'id' not in col.lower() else value
+        else:
+            # None, бинарные данные (например, зашифрованные ключи) и остальные значения как есть
+            data[col] = value
+    return data
+
+def _insert_chunk(session, table, rows):
+    """
+    Вставка пачки строк одним executemany и commit.
+    При ошибке пачка откатывается и вставляется построчно. Возвращает (вставлено, [ошибки]).
+    """
+    if not rows:
+        return 0, []
+    try:
+        session.execute(insert(table), rows)
+        session.commit()
+        return len(rows), []
+    except SQLAlchemyError:
+        session.rollback()
+
+    inserted, errors = 0, []
+    for row in rows:
+        try:
+            session.execute(insert(table), [row])
+            session.commit()
+            inserted += 1
+        except SQLAlchemyError as e:
+            session.rollback()
+            errors.append(str(e))
+    return inserted, errors
+
 def check_migration_needed():
     """Проверить, нужна ли миграция"""
     sqlite_path = get_sqlite_db_path()
@@ -202,85 +248,61 @@ def migrate_data():
                         print(f"   ⏭️  {table_name}: таблица не существует в SQLite")
                         continue
                     
-                    # Получаем данные из SQLite
-                    cursor.execute(f"SELECT * FROM {table_name}")
-                    rows = cursor.fetchall()
-                    
-                    if not rows:
+                    # Получаем данные из SQLite пачками (таблица не загружается в память целиком)
+                    total_rows = cursor.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+                    if not total_rows:
                         print(f"   ⏭️  {table_name}: нет данных")
                         continue
                     
-                    print(f"   📦 {table_name}: {len(rows)} записей...")
+                    print(f"   📦 {table_name}: {total_rows} записей...")
+                    cursor.execute(f'SELECT * FROM "{table_name}"')
                     
                     # Получаем названия колонок
                     columns = [description[0] for description in cursor.description]
+                    model_columns = {c.name for c in model.__table__.columns}
                     
                     # Вставляем данные в PostgreSQL
                     migrated_count = 0
                     skipped_count = 0
-                    for row in rows:
-                        try:
-                            # Создаем словарь из данных
-                            data = {}
-                            for i, col in enumerate(columns):
-                                value = row[i]
-                                # Обрабатываем None и специальные типы
-                                if value is None:
-                                    data[col] = None
-                                elif isinstance(value, bytes):
-                                    # Бинарные данные (например, зашифрованные ключи)
-                                    data[col] = value
-                                elif isinstance(value, str) and value == '':
-                                    # Пустые строки
-                                    data[col] = None if 'id' not in col.lower() else value
-                                else:
-                                    data[col] = value
+                    while True:
+                        rows = cursor.fetchmany(MIGRATION_CHUNK_SIZE)
+                        if not rows:
+                            break
+                        
+                        batch = []
+                        for row in rows:
+                            data = _row_to_data(row, columns, model_columns)
                             
-                            # Пропускаем поля, которых нет в модели (например, если структура изменилась)
-                            model_columns = {c.name for c in model.__table__.columns}
-                            data = {k: v for k, v in data.items() if k in model_columns}
-                            
-                            # Для платежей проверяем внешние ключи
-                            if table_name == 'payment' and 'user_id' in data:
+                            # Для платежей и тикетов проверяем внешние ключи
+                            if table_name in ('payment', 'ticket') and 'user_id' in data:
                                 if data['user_id'] not in existing_user_ids:
                                     skipped_count += 1
                                     if skipped_count <= 3:
-                                        print(f"      ⚠️  Пропущен платеж ID {data.get('id', '?')}: пользователь ID {data['user_id']} не существует")
+                                        label = 'платеж' if table_name == 'payment' else 'тикет'
+                                        print(f"      ⚠️  Пропущен {label} ID {data.get('id', '?')}: пользователь ID {data['user_id']} не существует")
                                     continue
                             
-                            # Для тикетов проверяем внешние ключи
-                            if table_name == 'ticket' and 'user_id' in data:
-                                if data['user_id'] not in existing_user_ids:
-                                    skipped_count += 1
-                                    if skipped_count <= 3:
-                                        print(f"      ⚠️  Пропущен тикет ID {data.get('id', '?')}: пользователь ID {data['user_id']} не существует")
-                                    continue
-                            
-                            # Для сообщений тикетов проверяем внешние ключи
-                            if table_name == 'ticket_message' and 'ticket_id' in data:
-                                # Проверяем существование тикета (будет проверено после миграции тикетов)
-                                pass
-                            
-                            # Создаем объект модели
-                            instance = model(**data)
-                            pg_db.session.add(instance)
-                            migrated_count += 1
-                        except Exception as e:
+                            batch.append(data)
+                        
+                        inserted, errors = _insert_chunk(pg_db.session, model.__table__, batch)
+                        migrated_count += inserted
+                        for error in errors:
                             skipped_count += 1
                             if skipped_count <= 3:  # Показываем только первые 3 ошибки
-                                print(f"      ⚠️  Ошибка при миграции записи: {str(e)[:100]}")
-                            continue
+                                print(f"      ⚠️  Ошибка при миграции записи: {error[:100]}")
+                        
+                        if total_rows > MIGRATION_CHUNK_SIZE:
+                            print(f"      ⏳ {migrated_count + skipped_count}/{total_rows}", flush=True)
                     
                     if skipped_count > 3:
                         print(f"      ⚠️  ... и еще {skipped_count - 3} ошибок")
                     
-                    pg_db.session.commit()
                     print(f"      ✅ Мигрировано: {migrated_count} записей")
                     total_migrated += migrated_count
                     
                     # После миграции пользователей обновляем список user_id для проверки внешних ключей
                     if table_name == 'user':
-                        existing_user_ids = {u.id for u in User.query.all()}
+                        existing_user_ids = set(pg_db.session.scalars(select(User.id)))
                         print(f"      ℹ️  Обновлен список user_id: {len(existing_user_ids)} пользователей")
                     
                 except Exception as e:
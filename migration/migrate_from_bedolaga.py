@@ -5,11 +5,21 @@
 
 Использование:
     python migration/migrate_from_bedolaga.py /path/to/backup_20260126_000000
+    python migration/migrate_from_bedolaga.py /path/to/backup --stream [--chunk-size 2000]
+    python migration/migrate_from_bedolaga.py /path/to/backup --resume
+
+Режим --stream читает database.json по одной записи (файл не загружается в память целиком)
+и пишет пачками по --chunk-size строк. Контрольная точка хранится в самой базе (таблица
+bedolaga_migration_checkpoint) и коммитится в одной транзакции с пачкой, поэтому обрыв между
+вставкой и сохранением прогресса невозможен; --resume продолжает миграцию с места остановки.
 """
 
 import os
+import re
 import sys
 import json
+import time
+import codecs
 import argparse
 from datetime import datetime, timezone
 from pathlib import Path
@@ -18,11 +28,9 @@ from pathlib import Path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flask import Flask
+from sqlalchemy import event, inspect, insert, select, update, delete, Table, Column, MetaData, String, Text
+from sqlalchemy.exc import SQLAlchemyError
 from modules.core import init_app, get_db
-from modules.models import (
-    User, Payment, Tariff, PromoCode, Ticket, TicketMessage,
-    UserConfig
-)
 
 def parse_args():
     """Парсинг аргументов командной строки"""
@@ -39,10 +47,26 @@ def parse_args():
         action='store_true',
         help='Перезаписать существующую базу данных'
     )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Потоковое чтение бекапа и запись пачками (для больших бекапов)'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=1000,
+        help='Размер пачки в режиме --stream (по умолчанию 1000)'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Продолжить прерванную потоковую миграцию с контрольной точки (включает --stream)'
+    )
     return parser.parse_args()
 
-def load_bedolaga_backup(backup_path):
-    """Загрузка данных из бекапа Бедолага"""
+def find_backup_json(backup_path):
+    """Путь к database.json в папке бекапа"""
     backup_path = Path(backup_path)
     
     # Проверяем, что путь существует
@@ -60,6 +84,12 @@ def load_bedolaga_backup(backup_path):
             f"Убедитесь, что указан правильный путь к папке с бекапом."
         )
     
+    return database_json
+
+def load_bedolaga_backup(backup_path):
+    """Загрузка данных из бекапа Бедолага"""
+    database_json = find_backup_json(backup_path)
+    
     print(f"📂 Загрузка данных из {database_json}...")
     
     try:
@@ -121,8 +151,98 @@ def create_app_for_migration():
     # Инициализируем приложение
     init_app(app)
     
+    # Импортируем модели после инициализации (им нужен инициализированный db)
+    global User, Payment, Tariff, PromoCode, Ticket, TicketMessage, UserConfig
+    from modules.models import (
+        User, Payment, Tariff, PromoCode, Ticket, TicketMessage,
+        UserConfig
+    )
+    
     return app, db_path
 
+def _parse_datetime(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else datetime.now(timezone.utc)
+
+def _user_row(bed_user):
+    return dict(
+        telegram_id=str(bed_user['telegram_id']),
+        telegram_username=bed_user.get('username'),
+        remnawave_uuid=bed_user.get('remnawave_uuid'),
+        referral_code=bed_user.get('referral_code'),
+        balance=bed_user.get('balance_kopeks', 0) / 100.0,  # Конвертируем копейки в рубли
+        preferred_lang=bed_user.get('language', 'ru'),
+        trial_used=bed_user.get('has_had_paid_subscription', False),
+        created_at=_parse_datetime(bed_user.get('created_at'))
+    )
+
+def _config_row(user_id, remnawave_uuid, created_at, is_primary):
+    return dict(
+        user_id=user_id,
+        remnawave_uuid=remnawave_uuid,
+        config_name="Основной конфиг" if is_primary else "Конфиг из миграции",
+        is_primary=is_primary,
+        created_at=_parse_datetime(created_at)
+    )
+
+def _payment_row(trans, user_id):
+    """Строка платежа из транзакции Бедолаги; None - тип транзакции не переносится"""
+    # Определяем статус
+    status = 'COMPLETED' if trans.get('is_completed', False) else 'PENDING'
+    
+    # Определяем провайдера
+    payment_method = trans.get('payment_method')
+    provider = 'platega' if payment_method == 'platega' else 'telegram_stars' if payment_method == 'telegram_stars' else 'manual'
+    
+    # Переносим только оплату подписки и пополнение баланса (Бедолага использует рубли)
+    if trans.get('type', 'deposit') not in ('subscription_payment', 'deposit'):
+        return None
+    amount = trans.get('amount_kopeks', 0) / 100.0
+    currency = 'rub'
+    
+    # Уникальный order_id - только из исходной записи, чтобы повторный перенос находил уже вставленный платёж
+    external_id = trans.get('external_id')
+    if external_id:
+        order_id = f"bedolaga_{trans['id']}_{external_id[:20]}"
+    else:
+        order_id = f"bedolaga_{trans['id']}"
+    
+    return dict(
+        order_id=order_id,
+        user_id=user_id,
+        status=status,
+        amount=amount,
+        currency=currency,
+        payment_provider=provider,
+        payment_system_id=external_id,
+        description=trans.get('description', ''),
+        created_at=_parse_datetime(trans.get('created_at'))
+    )
+
+# Маппинг статусов тикетов
+TICKET_STATUS_MAP = {
+    'open': 'OPEN',
+    'answered': 'IN_PROGRESS',
+    'closed': 'CLOSED',
+    'resolved': 'RESOLVED'
+}
+
+def _ticket_row(bed_ticket, user_id):
+    return dict(
+        user_id=user_id,
+        subject=bed_ticket.get('title', 'Без темы'),
+        status=TICKET_STATUS_MAP.get(bed_ticket.get('status', 'open').lower(), 'OPEN'),
+        created_at=_parse_datetime(bed_ticket.get('created_at'))
+    )
+
+def _message_row(bed_message, ticket_id, user_id):
+    return dict(
+        ticket_id=ticket_id,
+        sender_id=user_id,
+        message=bed_message.get('message_text', ''),
+        is_admin=bed_message.get('is_from_admin', False),
+        created_at=_parse_datetime(bed_message.get('created_at'))
+    )
+
 def migrate_users(bedolaga_data, db):
     """Миграция пользователей"""
     print("\n👥 Миграция пользователей...")
@@ -153,16 +273,7 @@ def migrate_users(bedolaga_data, db):
                 continue
             
             # Создаем нового пользователя
-            user = User(
-                telegram_id=str(bed_user['telegram_id']),
-                telegram_username=bed_user.get('username'),
-                remnawave_uuid=bed_user.get('remnawave_uuid'),
-                referral_code=bed_user.get('referral_code'),
-                balance=bed_user.get('balance_kopeks', 0) / 100.0,  # Конвертируем копейки в рубли
-                preferred_lang=bed_user.get('language', 'ru'),
-                trial_used=bed_user.get('has_had_paid_subscription', False),
-                created_at=datetime.fromisoformat(bed_user['created_at'].replace('Z', '+00:00')) if bed_user.get('created_at') else datetime.now(timezone.utc)
-            )
+            user = User(**_user_row(bed_user))
             
             db.session.add(user)
             db.session.flush()  # Получаем ID
@@ -219,13 +330,7 @@ def migrate_user_configs(bedolaga_data, user_id_mapping, db):
             continue
         
         # Создаем конфиг
-        config = UserConfig(
-            user_id=user_id,
-            remnawave_uuid=remnawave_uuid,
-            config_name=f"Конфиг из миграции",
-            is_primary=False,
-            created_at=datetime.fromisoformat(sub['created_at'].replace('Z', '+00:00')) if sub.get('created_at') else datetime.now(timezone.utc)
-        )
+        config = UserConfig(**_config_row(user_id, remnawave_uuid, sub.get('created_at'), is_primary=False))
         
         db.session.add(config)
         processed_uuids.add(remnawave_uuid)
@@ -246,13 +351,7 @@ def migrate_user_configs(bedolaga_data, user_id_mapping, db):
             continue
         
         # Создаем конфиг
-        config = UserConfig(
-            user_id=user_id,
-            remnawave_uuid=remnawave_uuid,
-            config_name=f"Основной конфиг",
-            is_primary=True,
-            created_at=datetime.fromisoformat(bed_user['created_at'].replace('Z', '+00:00')) if bed_user.get('created_at') else datetime.now(timezone.utc)
-        )
+        config = UserConfig(**_config_row(user_id, remnawave_uuid, bed_user.get('created_at'), is_primary=True))
         
         db.session.add(config)
         processed_uuids.add(remnawave_uuid)
@@ -273,49 +372,16 @@ def migrate_payments(bedolaga_data, user_id_mapping, db):
         if not user_id:
             continue
         
-        # Определяем статус
-        status = 'COMPLETED' if trans.get('is_completed', False) else 'PENDING'
-        
-        # Определяем провайдера
-        payment_method = trans.get('payment_method')
-        provider = 'platega' if payment_method == 'platega' else 'telegram_stars' if payment_method == 'telegram_stars' else 'manual'
-        
-        # Определяем тип транзакции
-        trans_type = trans.get('type', 'deposit')
-        if trans_type == 'subscription_payment':
-            # Это оплата подписки
-            amount = trans.get('amount_kopeks', 0) / 100.0
-            currency = 'rub'  # Бедолага использует рубли
-        elif trans_type == 'deposit':
-            # Это пополнение баланса
-            amount = trans.get('amount_kopeks', 0) / 100.0
-            currency = 'rub'
-        else:
+        row = _payment_row(trans, user_id)
+        if row is None:
             continue
         
-        # Создаем уникальный order_id
-        external_id = trans.get('external_id')
-        if external_id:
-            order_id = f"bedolaga_{trans['id']}_{external_id[:20]}"
-        else:
-            order_id = f"bedolaga_{trans['id']}_{int(datetime.now().timestamp())}"
-        
         # Проверяем, существует ли уже такой платеж
-        existing_payment = Payment.query.filter_by(order_id=order_id).first()
+        existing_payment = Payment.query.filter_by(order_id=row['order_id']).first()
         if existing_payment:
             continue
         
-        payment = Payment(
-            order_id=order_id,
-            user_id=user_id,
-            status=status,
-            amount=amount,
-            currency=currency,
-            payment_provider=provider,
-            payment_system_id=external_id,
-            description=trans.get('description', ''),
-            created_at=datetime.fromisoformat(trans['created_at'].replace('Z', '+00:00')) if trans.get('created_at') else datetime.now(timezone.utc)
-        )
+        payment = Payment(**row)
         
         db.session.add(payment)
         migrated_count += 1
@@ -338,21 +404,7 @@ def migrate_tickets(bedolaga_data, user_id_mapping, db):
         if not user_id:
             continue
         
-        # Маппинг статусов
-        status_map = {
-            'open': 'OPEN',
-            'answered': 'IN_PROGRESS',
-            'closed': 'CLOSED',
-            'resolved': 'RESOLVED'
-        }
-        status = status_map.get(bed_ticket.get('status', 'open').lower(), 'OPEN')
-        
-        ticket = Ticket(
-            user_id=user_id,
-            subject=bed_ticket.get('title', 'Без темы'),
-            status=status,
-            created_at=datetime.fromisoformat(bed_ticket['created_at'].replace('Z', '+00:00')) if bed_ticket.get('created_at') else datetime.now(timezone.utc)
-        )
+        ticket = Ticket(**_ticket_row(bed_ticket, user_id))
         
         db.session.add(ticket)
         db.session.flush()
@@ -368,13 +420,7 @@ def migrate_tickets(bedolaga_data, user_id_mapping, db):
         if not ticket_id or not user_id:
             continue
         
-        message = TicketMessage(
-            ticket_id=ticket_id,
-            sender_id=user_id,
-            message=bed_message.get('message_text', ''),
-            is_admin=bed_message.get('is_from_admin', False),
-            created_at=datetime.fromisoformat(bed_message['created_at'].replace('Z', '+00:00')) if bed_message.get('created_at') else datetime.now(timezone.utc)
-        )
+        message = TicketMessage(**_message_row(bed_message, ticket_id, user_id))
         
         db.session.add(message)
         migrated_messages += 1
@@ -391,6 +437,511 @@ def migrate_system_settings(bedolaga_data, db):
     # SystemSetting в STEALTHNET-Panel имеет фиксированную структуру,
     # а не key-value хранилище, поэтому не мигрируем автоматически
 
+# ============================================================================
+# Потоковая миграция (--stream): чтение бекапа по записям, запись пачками
+# ============================================================================
+
+class BackupStream:
+    """
+    Потоковое чтение массивов data.<секция> из database.json.
+
+    Файл читается блоками по READ_SIZE байт; каждая запись разбирается json-декодером
+    отдельно, а ненужные секции пропускаются без построения объектов.
+    """
+
+    READ_SIZE = 1 << 20
+    _decoder = json.JSONDecoder()
+    _WS_RE = re.compile(r'\s*')
+    _SCAN_RE = re.compile(r'["{}\[\]]')
+    _STRING_END_RE = re.compile(r'["\\]')
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.size = self.path.stat().st_size or 1
+        self._bytes_read = 0
+
+    @property
+    def progress(self):
+        """Доля прочитанного файла в текущем проходе (0..1)"""
+        return min(1.0, self._bytes_read / self.size)
+
+    def iter_section(self, name, start=0):
+        """Записи секции data.<name> по одной; первые start записей пропускаются без разбора"""
+        with open(self.path, 'rb') as f:
+            self._file = f
+            self._bytes_read = 0
+            self._utf8 = codecs.getincrementaldecoder('utf-8')()
+            self._buf = ''
+            self._pos = 0
+            self._eof = False
+            for key in self._iter_object():
+                if key != 'data':
+                    self._skip()
+                    continue
+                for section in self._iter_object():
+                    if section != name or self._peek() != '[':
+                        self._skip()
+                        continue
+                    for index in self._iter_array():
+                        if index < start:
+                            self._skip()
+                        else:
+                            yield self._value()
+                    return
+                return
+            raise ValueError("В файле database.json отсутствует секция 'data'")
+
+    def _fill(self):
+        data = self._file.read(self.READ_SIZE)
+        self._eof = not data
+        self._bytes_read += len(data)
+        self._buf = self._buf[self._pos:] + self._utf8.decode(data, final=self._eof)
+        self._pos = 0
+        return not self._eof
+
+    def _fill_or_fail(self):
+        if not self._fill():
+            raise ValueError("Неожиданный конец файла database.json")
+
+    def _peek(self):
+        while True:
+            self._pos = self._WS_RE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Ошибка при парсинге JSON: ожидался '{char}', найден '{found}'")
+        self._pos += 1
+
+    def _separator(self, closing):
+        """True - дальше следующий элемент, False - контейнер закрыт"""
+        char = self._peek()
+        self._pos += 1
+        if char == closing:
+            return False
+        if char != ',':
+            raise ValueError(f"Ошибка при парсинге JSON: ожидался ',' или '{closing}', найден '{char}'")
+        return True
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                self._fill_or_fail()
+                continue
+            # Число на границе блока могло оборваться - дочитываем
+            if end == len(self._buf) and not self._eof:
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def _skip(self):
+        """Пропустить значение, не строя объект"""
+        if self._peek() not in '{[':
+            self._value()
+            return
+        depth = 0
+        in_string = False
+        while True:
+            pattern = self._STRING_END_RE if in_string else self._SCAN_RE
+            match = pattern.search(self._buf, self._pos)
+            if not match:
+                self._pos = len(self._buf)
+                self._fill_or_fail()
+                continue
+            char = match.group()
+            if char == '\\':
+                if match.end() >= len(self._buf):
+                    self._pos = match.start()
+                    self._fill_or_fail()
+                    continue
+                self._pos = match.end() + 1
+            elif char == '"':
+                self._pos = match.end()
+                in_string = not in_string
+            else:
+                self._pos = match.end()
+                depth += 1 if char in '{[' else -1
+                if depth == 0:
+                    return
+
+    def _iter_object(self):
+        """Ключи объекта; значение после каждого ключа читает или пропускает вызывающий"""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if not self._separator('}'):
+                return
+
+    def _iter_array(self):
+        """Индексы элементов массива; элемент читает или пропускает вызывающий"""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if not self._separator(']'):
+                return
+
+
+_checkpoint_table = Table(
+    'bedolaga_migration_checkpoint', MetaData(),
+    Column('name', String(50), primary_key=True),
+    Column('state', Text, nullable=False),
+)
+
+
+class MigrationCheckpoint:
+    """
+    Контрольная точка потоковой миграции: сколько записей каждого шага уже перенесено
+    и соответствие старых ID тикетов новым.
+
+    Хранится в таблице bedolaga_migration_checkpoint той же базы: advance() пишет состояние
+    в текущую транзакцию и коммитит её вместе со вставленной пачкой.
+    """
+
+    NAME = 'stream'
+
+    @staticmethod
+    def exists(db):
+        """Есть ли незавершённая миграция (таблица удаляется после успешного завершения)"""
+        return inspect(db.engine).has_table(_checkpoint_table.name)
+
+    def __init__(self, db, resume=False):
+        self.db = db
+        self.state = {'offsets': {}, 'done': [], 'ticket_ids': {}}
+        _checkpoint_table.create(db.engine, checkfirst=True)
+        saved = db.session.execute(
+            select(_checkpoint_table.c.state).where(_checkpoint_table.c.name == self.NAME)
+        ).scalar()
+        if saved and resume:
+            self.state.update(json.loads(saved))
+            print("♻️  Продолжение миграции с контрольной точки")
+        elif saved:
+            db.session.execute(delete(_checkpoint_table))
+            db.session.commit()
+
+    def offset(self, step):
+        return self.state['offsets'].get(step, 0)
+
+    def is_done(self, step):
+        return step in self.state['done']
+
+    def advance(self, step, offset, ticket_ids=None):
+        """Сдвинуть шаг и закоммитить вместе с пачкой, вставленной в текущей транзакции"""
+        self.state['offsets'][step] = offset
+        if ticket_ids:
+            # Ключи JSON - строки; храним старые ID тикетов как строки
+            self.state['ticket_ids'].update({str(k): v for k, v in ticket_ids.items()})
+        self._save()
+
+    def finish_step(self, step):
+        if step not in self.state['done']:
+            self.state['done'].append(step)
+        self._save()
+
+    def ticket_ids(self):
+        return {k: v for k, v in self.state['ticket_ids'].items()}
+
+    def remove(self):
+        _checkpoint_table.drop(self.db.engine, checkfirst=True)
+
+    def _save(self):
+        self.db.session.execute(delete(_checkpoint_table).where(_checkpoint_table.c.name == self.NAME))
+        self.db.session.execute(insert(_checkpoint_table).values(name=self.NAME, state=json.dumps(self.state)))
+        self.db.session.commit()
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _enable_sqlite_savepoints(db):
+    """
+    pysqlite сам не открывает транзакцию перед SAVEPOINT, и RELEASE коммитит пачку раньше
+    контрольной точки. Отдаём управление транзакциями SQLAlchemy (рецепт из документации SQLAlchemy).
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _sqlite_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql('BEGIN')
+
+    db.session.remove()
+    engine.dispose()
+
+
+def _bulk_insert(db, model, rows, label):
+    """
+    Вставка пачки одним INSERT ... RETURNING id в текущей транзакции (commit делает вызывающий код -
+    вместе с контрольной точкой). Если пачка не вставилась (например, дубликат уникального поля) -
+    вставляем построчно в savepoint, пропуская ошибочные строки.
+    Возвращает новые ID в порядке rows (None - строка пропущена).
+    """
+    if not rows:
+        return []
+    try:
+        with db.session.begin_nested():
+            return list(db.session.scalars(
+                insert(model).returning(model.id, sort_by_parameter_order=True), rows
+            ))
+    except SQLAlchemyError as e:
+        print(f"  ⚠️  Пачка {label} не вставилась ({str(e)[:100]}), вставляем построчно")
+
+    ids = []
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                ids.append(db.session.execute(insert(model).returning(model.id), row).scalar_one())
+        except SQLAlchemyError as e:
+            print(f"  ❌ Ошибка при миграции {label}: {str(e)[:100]}")
+            ids.append(None)
+    return ids
+
+
+class _Progress:
+    """Строка прогресса шага: записей, % файла, записей в секунду"""
+
+    def __init__(self, label, backup):
+        self.label = label
+        self.backup = backup
+        self.count = 0
+        self.started = time.perf_counter()
+
+    def update(self, count):
+        self.count += count
+        elapsed = time.perf_counter() - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0
+        print(f"  ⏳ {self.label}: {self.count} ({self.backup.progress:.0%} файла, {rate:.0f}/с)", flush=True)
+
+
+def stream_migrate_users(backup, db, chunk_size):
+    """
+    Потоковая миграция пользователей. Шаг идемпотентен (существующие пользователи ищутся
+    по telegram_id), поэтому при --resume выполняется заново и восстанавливает карту ID.
+    """
+    print("\n👥 Миграция пользователей (потоково)...")
+    user_id_mapping = {}  # Старый ID -> Новый ID
+    referrals = []  # (старый ID пользователя, старый ID реферера)
+    migrated_count = 0
+    skipped_count = 0
+    progress = _Progress('пользователи', backup)
+
+    for chunk in _chunks(backup.iter_section('users'), chunk_size):
+        old_ids_by_tg = {}  # telegram_id -> старые ID (дубликаты в бекапе)
+        rows = {}
+        for bed_user in chunk:
+            if not bed_user.get('telegram_id'):
+                skipped_count += 1
+                continue
+            if bed_user.get('referred_by_id'):
+                referrals.append((bed_user.get('id'), bed_user['referred_by_id']))
+            telegram_id = str(bed_user['telegram_id'])
+            old_ids_by_tg.setdefault(telegram_id, []).append(bed_user.get('id'))
+            if telegram_id not in rows:
+                try:
+                    rows[telegram_id] = _user_row(bed_user)
+                except Exception as e:
+                    print(f"  ❌ Ошибка при миграции пользователя {bed_user.get('id')}: {e}")
+
+        existing = dict(db.session.execute(
+            select(User.telegram_id, User.id).where(User.telegram_id.in_(list(old_ids_by_tg)))
+        ).all())
+        new_rows = [row for telegram_id, row in rows.items() if telegram_id not in existing]
+        new_ids = _bulk_insert(db, User, new_rows, 'пользователей')
+        db.session.commit()
+        existing.update((row['telegram_id'], new_id) for row, new_id in zip(new_rows, new_ids) if new_id)
+        migrated_count += sum(1 for new_id in new_ids if new_id)
+
+        for telegram_id, old_ids in old_ids_by_tg.items():
+            new_id = existing.get(telegram_id)
+            if new_id:
+                for old_id in old_ids:
+                    user_id_mapping[old_id] = new_id
+        skipped_count += sum(len(ids) for ids in old_ids_by_tg.values()) - sum(1 for new_id in new_ids if new_id)
+        progress.update(len(chunk))
+
+    # Реферальные связи - по карте ID в памяти, пачками UPDATE по первичному ключу
+    print("\n🔗 Обновление реферальных связей...")
+    links = [
+        {'id': user_id_mapping[old_id], 'referrer_id': user_id_mapping[old_referrer_id]}
+        for old_id, old_referrer_id in referrals
+        if old_id in user_id_mapping and old_referrer_id in user_id_mapping
+    ]
+    for chunk in _chunks(links, chunk_size):
+        db.session.execute(update(User), chunk)
+        db.session.commit()
+    print(f"  ✅ Установлено реферальных связей: {len(links)}")
+
+    print(f"\n✅ Мигрировано пользователей: {migrated_count}")
+    if skipped_count > 0:
+        print(f"⚠️  Пропущено пользователей: {skipped_count}")
+    return user_id_mapping
+
+
+def _stream_configs_step(backup, db, checkpoint, chunk_size, step, section, is_primary,
+                         user_id_mapping, processed_uuids):
+    if checkpoint.is_done(step):
+        return 0
+    offset = checkpoint.offset(step)
+    progress = _Progress(f'конфиги ({section})', backup)
+    migrated_count = 0
+
+    for chunk in _chunks(backup.iter_section(section, start=offset), chunk_size):
+        offset += len(chunk)
+        candidates = {}
+        for item in chunk:
+            user_id = user_id_mapping.get(item.get('user_id') if section == 'subscriptions' else item.get('id'))
+            if section == 'subscriptions':
+                remnawave_uuid = item.get('remnawave_short_uuid') or item.get('remnawave_uuid')
+            else:
+                remnawave_uuid = item.get('remnawave_uuid')
+            if user_id and remnawave_uuid and remnawave_uuid not in processed_uuids and remnawave_uuid not in candidates:
+                candidates[remnawave_uuid] = _config_row(user_id, remnawave_uuid, item.get('created_at'), is_primary)
+
+        existing = set(db.session.scalars(
+            select(UserConfig.remnawave_uuid).where(UserConfig.remnawave_uuid.in_(list(candidates)))
+        ))
+        processed_uuids.update(candidates)
+        new_ids = _bulk_insert(db, UserConfig, [row for uuid_, row in candidates.items() if uuid_ not in existing], 'конфигов')
+        migrated_count += sum(1 for new_id in new_ids if new_id)
+        checkpoint.advance(step, offset)
+        progress.update(len(chunk))
+
+    checkpoint.finish_step(step)
+    return migrated_count
+
+
+def stream_migrate_user_configs(backup, user_id_mapping, db, checkpoint, chunk_size):
+    """Потоковая миграция конфигов: сначала из подписок, затем основные конфиги пользователей"""
+    print("\n⚙️  Миграция конфигов пользователей (потоково)...")
+    processed_uuids = set()
+    migrated_count = _stream_configs_step(backup, db, checkpoint, chunk_size, 'configs_subscriptions',
+                                          'subscriptions', False, user_id_mapping, processed_uuids)
+    migrated_count += _stream_configs_step(backup, db, checkpoint, chunk_size, 'configs_users',
+                                           'users', True, user_id_mapping, processed_uuids)
+    print(f"✅ Мигрировано конфигов: {migrated_count}")
+
+
+def stream_migrate_payments(backup, user_id_mapping, db, checkpoint, chunk_size):
+    """Потоковая миграция транзакций в платежи"""
+    print("\n💳 Миграция платежей (потоково)...")
+    step = 'payments'
+    if checkpoint.is_done(step):
+        print("  ℹ️  Уже перенесены (контрольная точка)")
+        return
+    offset = checkpoint.offset(step)
+    progress = _Progress('платежи', backup)
+    migrated_count = 0
+
+    for chunk in _chunks(backup.iter_section('transactions', start=offset), chunk_size):
+        offset += len(chunk)
+        rows = {}
+        for trans in chunk:
+            user_id = user_id_mapping.get(trans.get('user_id'))
+            row = _payment_row(trans, user_id) if user_id else None
+            if row and row['order_id'] not in rows:
+                rows[row['order_id']] = row
+
+        existing = set(db.session.scalars(
+            select(Payment.order_id).where(Payment.order_id.in_(list(rows)))
+        ))
+        new_ids = _bulk_insert(db, Payment, [row for order_id, row in rows.items() if order_id not in existing], 'платежей')
+        migrated_count += sum(1 for new_id in new_ids if new_id)
+        checkpoint.advance(step, offset)
+        progress.update(len(chunk))
+
+    checkpoint.finish_step(step)
+    print(f"✅ Мигрировано платежей: {migrated_count}")
+
+
+def stream_migrate_tickets(backup, user_id_mapping, db, checkpoint, chunk_size):
+    """Потоковая миграция тикетов и сообщений; карта ID тикетов сохраняется в контрольной точке"""
+    print("\n🎫 Миграция тикетов (потоково)...")
+    ticket_id_mapping = checkpoint.ticket_ids()  # Старый ID (строкой) -> Новый ID
+    migrated_tickets = 0
+    migrated_messages = 0
+
+    step = 'tickets'
+    if not checkpoint.is_done(step):
+        offset = checkpoint.offset(step)
+        progress = _Progress('тикеты', backup)
+        for chunk in _chunks(backup.iter_section('tickets', start=offset), chunk_size):
+            offset += len(chunk)
+            old_ids, rows = [], []
+            for bed_ticket in chunk:
+                user_id = user_id_mapping.get(bed_ticket.get('user_id'))
+                if user_id:
+                    old_ids.append(bed_ticket['id'])
+                    rows.append(_ticket_row(bed_ticket, user_id))
+            new_ids = _bulk_insert(db, Ticket, rows, 'тикетов')
+            chunk_mapping = {old_id: new_id for old_id, new_id in zip(old_ids, new_ids) if new_id}
+            ticket_id_mapping.update({str(k): v for k, v in chunk_mapping.items()})
+            migrated_tickets += len(chunk_mapping)
+            checkpoint.advance(step, offset, ticket_ids=chunk_mapping)
+            progress.update(len(chunk))
+        checkpoint.finish_step(step)
+
+    step = 'ticket_messages'
+    if not checkpoint.is_done(step):
+        offset = checkpoint.offset(step)
+        progress = _Progress('сообщения тикетов', backup)
+        for chunk in _chunks(backup.iter_section('ticket_messages', start=offset), chunk_size):
+            offset += len(chunk)
+            rows = []
+            for bed_message in chunk:
+                ticket_id = ticket_id_mapping.get(str(bed_message.get('ticket_id')))
+                user_id = user_id_mapping.get(bed_message.get('user_id'))
+                if ticket_id and user_id:
+                    rows.append(_message_row(bed_message, ticket_id, user_id))
+            new_ids = _bulk_insert(db, TicketMessage, rows, 'сообщений')
+            migrated_messages += sum(1 for new_id in new_ids if new_id)
+            checkpoint.advance(step, offset)
+            progress.update(len(chunk))
+        checkpoint.finish_step(step)
+
+    print(f"✅ Мигрировано тикетов: {migrated_tickets}, сообщений: {migrated_messages}")
+
+
+def run_stream_migration(backup, db, checkpoint, chunk_size):
+    """Все шаги потоковой миграции (нужен app context)"""
+    user_id_mapping = stream_migrate_users(backup, db, chunk_size)
+    if user_id_mapping:
+        stream_migrate_user_configs(backup, user_id_mapping, db, checkpoint, chunk_size)
+        stream_migrate_payments(backup, user_id_mapping, db, checkpoint, chunk_size)
+        stream_migrate_tickets(backup, user_id_mapping, db, checkpoint, chunk_size)
+    migrate_system_settings({}, db)
+    checkpoint.remove()
+
+
 def main():
     """Основная функция миграции"""
     args = parse_args()
@@ -399,9 +950,15 @@ def main():
     print("🔄 Миграция данных из бекапа Бедолага в STEALTHNET-Panel")
     print("=" * 60)
     
-    # Загружаем данные из бекапа
+    stream = args.stream or args.resume
+    
+    # Загружаем данные из бекапа (в потоковом режиме только проверяем путь)
     try:
-        bedolaga_data = load_bedolaga_backup(args.backup_path)
+        if stream:
+            backup = BackupStream(find_backup_json(args.backup_path))
+            print(f"📂 Потоковое чтение {backup.path} ({backup.size / 1024 / 1024:.1f} МБ), пачки по {args.chunk_size}")
+        else:
+            bedolaga_data = load_bedolaga_backup(args.backup_path)
     except Exception as e:
         print(f"❌ Ошибка при загрузке бекапа: {e}")
         sys.exit(1)
@@ -409,8 +966,8 @@ def main():
     # Создаем Flask приложение
     app, db_path = create_app_for_migration()
     
-    # Проверяем существование базы данных
-    if os.path.exists(db_path) and not args.force:
+    # Проверяем существование базы данных (при --resume продолжаем в существующую)
+    if os.path.exists(db_path) and not args.force and not args.resume:
         response = input(f"\n⚠️  База данных {db_path} уже существует. Перезаписать? (y/N): ")
         if response.lower() != 'y':
             print("❌ Миграция отменена")
@@ -426,12 +983,28 @@ def main():
         print("✅ Таблицы созданы")
         
         # Выполняем миграцию
-        user_id_mapping = migrate_users(bedolaga_data, db)
-        if user_id_mapping:
-            migrate_user_configs(bedolaga_data, user_id_mapping, db)
-            migrate_payments(bedolaga_data, user_id_mapping, db)
-            migrate_tickets(bedolaga_data, user_id_mapping, db)
-        migrate_system_settings(bedolaga_data, db)
+        if stream:
+            if args.resume and not MigrationCheckpoint.exists(db):
+                # Повторный прогон всех шагов продублировал бы тикеты и сообщения
+                print(f"❌ Контрольная точка не найдена в {db_path}: миграция уже завершена или не запускалась")
+                print("   Для новой миграции запустите без --resume")
+                sys.exit(1)
+            _enable_sqlite_savepoints(db)
+            checkpoint = MigrationCheckpoint(db, resume=args.resume)
+            try:
+                run_stream_migration(backup, db, checkpoint, max(1, args.chunk_size))
+            except Exception as e:
+                db.session.rollback()
+                print(f"\n❌ Миграция прервана: {e}")
+                print(f"♻️  Продолжить: python migration/migrate_from_bedolaga.py {args.backup_path} --resume")
+                sys.exit(1)
+        else:
+            user_id_mapping = migrate_users(bedolaga_data, db)
+            if user_id_mapping:
+                migrate_user_configs(bedolaga_data, user_id_mapping, db)
+                migrate_payments(bedolaga_data, user_id_mapping, db)
+                migrate_tickets(bedolaga_data, user_id_mapping, db)
+            migrate_system_settings(bedolaga_data, db)
     
     print("\n" + "=" * 60)
     print("✅ Миграция завершена успешно!")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Миграция: Таблица analytics_daily_rollup (дневные агрегаты для /api/admin/analytics)
+и первичное заполнение её из истории payment/user/user_config.
+"""
+import sys
+import os
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+
+from modules.core import get_db
+from modules.models.analytics import AnalyticsDailyRollup
+
+
+def migrate(app_instance=None):
+    """Создать таблицу analytics_daily_rollup и заполнить её, если она пуста."""
+    if app_instance is None:
+        from app import app as app_instance
+
+    with app_instance.app_context():
+        db = app_instance.extensions.get('sqlalchemy') or get_db()
+        try:
+            from sqlalchemy import inspect
+            inspector = inspect(db.engine)
+            tables = inspector.get_table_names()
+            if 'analytics_daily_rollup' not in tables:
+                AnalyticsDailyRollup.__table__.create(db.engine)
+                print("✅ Таблица analytics_daily_rollup создана")
+            else:
+                print("ℹ️  Таблица analytics_daily_rollup уже существует")
+
+            from modules.analytics import ensure_daily_rollup
+            rows = ensure_daily_rollup()
+            if rows:
+                print(f"✅ Агрегаты аналитики заполнены: {rows} строк")
+        except Exception as e:
+            print(f"❌ Ошибка миграции: {e}")
+            raise
+
+
+if __name__ == '__main__':
+    migrate()
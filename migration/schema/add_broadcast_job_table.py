@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Миграция: Таблица broadcast_job (фоновые рассылки с сохранением прогресса)
+"""
+import sys
+import os
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+
+from modules.core import get_db
+from modules.models.broadcast import BroadcastJob
+
+
+def migrate(app_instance=None):
+    """Создать таблицу broadcast_job, если её нет."""
+    if app_instance is None:
+        from app import app as app_instance
+
+    with app_instance.app_context():
+        db = app_instance.extensions.get('sqlalchemy') or get_db()
+        try:
+            from sqlalchemy import inspect
+            inspector = inspect(db.engine)
+            if BroadcastJob.__tablename__ not in inspector.get_table_names():
+                BroadcastJob.__table__.create(db.engine)
+                print("✅ Таблица broadcast_job создана")
+            else:
+                print("ℹ️  Таблица broadcast_job уже существует")
+        except Exception as e:
+            print(f"❌ Ошибка миграции: {e}")
+            raise
+
+
+if __name__ == '__main__':
+    migrate()
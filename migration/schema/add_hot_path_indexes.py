@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Миграция: Вторичные индексы для частых выборок (payment, user, user_config, ticket, ticket_message, casino_game)
+
+Индексы объявлены в моделях (__table_args__), миграция создаёт недостающие в существующей БД:
+- PostgreSQL: CREATE INDEX CONCURRENTLY IF NOT EXISTS (без блокировки записи в таблицу, вне транзакции);
+  невалидный индекс, оставшийся от прерванного CONCURRENTLY, пересоздаётся
+- SQLite и прочие: CREATE INDEX IF NOT EXISTS
+"""
+import sys
+import os
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from modules.core import get_db
+
+
+def _indexed_tables():
+    from modules.models.payment import Payment
+    from modules.models.user import User
+    from modules.models.user_config import UserConfig
+    from modules.models.ticket import Ticket, TicketMessage
+    from modules.models.casino import CasinoGame
+    return [m.__table__ for m in (Payment, User, UserConfig, Ticket, TicketMessage, CasinoGame)]
+
+
+def _create_postgresql(engine, index):
+    preparer = engine.dialect.identifier_preparer
+    name = preparer.quote(index.name)
+    table = preparer.format_table(index.table)
+    columns = ', '.join(preparer.quote(c.name) for c in index.columns)
+
+    # CONCURRENTLY нельзя выполнять внутри транзакции
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {'name': index.name}).first()
+        if invalid:
+            print(f"   ⚠️  Индекс {index.name} невалиден (прерванное создание) - пересоздаём")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def _create_generic(engine, index):
+    with engine.begin() as conn:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def migrate(app_instance=None):
+    """Создать недостающие индексы"""
+    if app_instance is None:
+        from app import app as app_instance
+
+    with app_instance.app_context():
+        db = app_instance.extensions.get('sqlalchemy') or get_db()
+        try:
+            engine = db.engine
+            is_postgres = engine.dialect.name == 'postgresql'
+            inspector = inspect(engine)
+            tables = set(inspector.get_table_names())
+
+            created = 0
+            for table in _indexed_tables():
+                if table.name not in tables:
+                    print(f"   ⏭️  Таблица {table.name} не найдена, индексы пропущены")
+                    continue
+                existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+                for index in sorted(table.indexes, key=lambda ix: ix.name):
+                    if index.name in existing and not is_postgres:
+                        continue
+                    if is_postgres:
+                        _create_postgresql(engine, index)
+                    else:
+                        _create_generic(engine, index)
+                    if index.name not in existing:
+                        created += 1
+                        print(f"✅ Индекс {index.name} создан")
+
+            if not created:
+                print("ℹ️  Все индексы уже существуют")
+        except Exception as e:
+            print(f"❌ Ошибка миграции: {e}")
+            raise
+
+
+if __name__ == '__main__':
+    migrate()
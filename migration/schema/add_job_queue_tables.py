@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Миграция: Таблицы background_job (фоновая очередь задач) и webhook_event (журнал webhook-событий оплат)
+"""
+import sys
+import os
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+
+from modules.core import get_db
+from modules.models.job import BackgroundJob, WebhookEvent
+
+
+def migrate(app_instance=None):
+    """Создать таблицы background_job и webhook_event, если их нет."""
+    if app_instance is None:
+        from app import app as app_instance
+
+    with app_instance.app_context():
+        db = app_instance.extensions.get('sqlalchemy') or get_db()
+        try:
+            from sqlalchemy import inspect
+            inspector = inspect(db.engine)
+            tables = inspector.get_table_names()
+            # background_job раньше: на неё ссылается webhook_event.job_id
+            for model in (BackgroundJob, WebhookEvent):
+                name = model.__tablename__
+                if name not in tables:
+                    model.__table__.create(db.engine)
+                    print(f"✅ Таблица {name} создана")
+                else:
+                    print(f"ℹ️  Таблица {name} уже существует")
+        except Exception as e:
+            print(f"❌ Ошибка миграции: {e}")
+            raise
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Миграция: Добавление поля remnawave_applied_at в таблицу payment
+
+Отметка того, что подписка по платежу уже продлена в RemnaWave: повтор задачи
+payment.process после сбоя не продлевает подписку второй раз.
+"""
+import sys
+import os
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, root)
+
+from modules.core import get_db
+
+
+def migrate(app_instance=None):
+    """Добавить поле remnawave_applied_at в таблицу payment"""
+    if app_instance is None:
+        from app import app as app_instance
+
+    with app_instance.app_context():
+        db = app_instance.extensions.get('sqlalchemy') or get_db()
+        try:
+            from sqlalchemy import inspect, text
+            inspector = inspect(db.engine)
+            columns = [col['name'] for col in inspector.get_columns('payment')]
+
+            if 'remnawave_applied_at' in columns:
+                print("ℹ️  Поле remnawave_applied_at уже существует")
+                return
+
+            column_type = 'TIMESTAMP' if db.engine.dialect.name == 'postgresql' else 'DATETIME'
+            db.session.execute(text(f"ALTER TABLE payment ADD COLUMN remnawave_applied_at {column_type} NULL"))
+            db.session.commit()
+            print("✅ Поле remnawave_applied_at добавлено в таблицу payment")
+        except Exception as e:
+            db.session.rollback()
+            if 'already exists' in str(e).lower() or 'duplicate' in str(e).lower() or 'существует' in str(e).lower():
+                print("ℹ️  Поле remnawave_applied_at уже существует")
+            else:
+                print(f"❌ Ошибка миграции: {e}")
+                raise
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,259 @@
+"""
+Дневные агрегаты аналитики (таблица analytics_daily_rollup)
+
+Агрегаты обновляются инкрементально через события SQLAlchemy:
+- Payment переходит в статус PAID (process_successful_payment, пополнения, опции) -> +выручка, +платёж
+- Payment уходит из PAID (возврат/ручная правка) -> -выручка, -платёж
+- Создан клиент (регистрация на сайте, в боте, в мини-аппе) -> +регистрация (+telegram)
+- Клиенту привязан Telegram -> +telegram
+- Создан UserConfig -> +конфиг
+
+Полный пересчёт (backfill) - rebuild_daily_rollup() или other/tools/rebuild_analytics_rollup.py.
+"""
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import event, func
+
+from modules.core import get_db
+from modules.models.analytics import AnalyticsDailyRollup
+from modules.models.payment import Payment
+from modules.models.user import User
+from modules.models.user_config import UserConfig
+
+db = get_db()
+
+ROLLUP_METRICS = ('revenue', 'payments_count', 'registrations', 'configs_created', 'telegram_users')
+
+
+def _day_of(value):
+    """Дата (UTC) для агрегата; None -> сегодня"""
+    if value is None:
+        return datetime.utcnow().date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _upsert(connection, day, currency='', provider='', **deltas):
+    """
+    Атомарно прибавляет deltas к строке (day, currency, provider).
+
+    INSERT ... ON CONFLICT DO UPDATE поддерживается и PostgreSQL, и SQLite (3.24+),
+    поэтому конкурирующие воркеры не теряют инкременты и не ловят unique violation.
+    """
+    table = AnalyticsDailyRollup.__table__
+    values = {m: deltas.get(m, 0) for m in ROLLUP_METRICS}
+    keys = {'day': day, 'currency': currency or '', 'provider': provider or ''}
+    now = datetime.utcnow()
+
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(**keys, **values, updated_at=now)
+        set_ = {m: getattr(table.c, m) + getattr(stmt.excluded, m) for m in ROLLUP_METRICS}
+        set_['updated_at'] = now
+        stmt = stmt.on_conflict_do_update(index_elements=['day', 'currency', 'provider'], set_=set_)
+        connection.execute(stmt)
+        return
+
+    # Прочие СУБД: UPDATE, а если строки нет - INSERT
+    where = (table.c.day == day) & (table.c.currency == keys['currency']) & (table.c.provider == keys['provider'])
+    result = connection.execute(
+        table.update().where(where).values(
+            updated_at=now, **{m: getattr(table.c, m) + values[m] for m in ROLLUP_METRICS}
+        )
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**keys, **values, updated_at=now))
+
+
+def _payment_deltas(payment, sign):
+    return {
+        'revenue': sign * float(payment.amount or 0),
+        'payments_count': sign,
+    }
+
+
+# ============================================================================
+# ИНКРЕМЕНТАЛЬНОЕ ОБНОВЛЕНИЕ
+# ============================================================================
+
+@event.listens_for(Payment, 'after_insert')
+def _rollup_payment_insert(mapper, connection, target):
+    if target.status == 'PAID':
+        _upsert(connection, _day_of(target.created_at), target.currency, target.payment_provider,
+                **_payment_deltas(target, 1))
+
+
+@event.listens_for(Payment, 'after_update')
+def _rollup_payment_update(mapper, connection, target):
+    history = db.inspect(target).attrs.status.history
+    if not history.has_changes():
+        return
+    was_paid = 'PAID' in (history.deleted or ())
+    is_paid = target.status == 'PAID'
+    if was_paid == is_paid:
+        return
+    _upsert(connection, _day_of(target.created_at), target.currency, target.payment_provider,
+            **_payment_deltas(target, 1 if is_paid else -1))
+
+
+@event.listens_for(User, 'after_insert')
+def _rollup_user_insert(mapper, connection, target):
+    if (target.role or 'CLIENT') != 'CLIENT':
+        return
+    _upsert(connection, _day_of(target.created_at),
+            registrations=1, telegram_users=1 if target.telegram_id else 0)
+
+
+@event.listens_for(User, 'after_update')
+def _rollup_user_telegram_linked(mapper, connection, target):
+    if (target.role or 'CLIENT') != 'CLIENT':
+        return
+    history = db.inspect(target).attrs.telegram_id.history
+    if not history.has_changes():
+        return
+    had_telegram = any(history.deleted or ())
+    has_telegram = bool(target.telegram_id)
+    if had_telegram == has_telegram:
+        return
+    _upsert(connection, _day_of(target.created_at), telegram_users=1 if has_telegram else -1)
+
+
+@event.listens_for(UserConfig, 'after_insert')
+def _rollup_config_insert(mapper, connection, target):
+    _upsert(connection, _day_of(target.created_at), configs_created=1)
+
+
+# ============================================================================
+# BACKFILL
+# ============================================================================
+
+def rebuild_daily_rollup(start_day=None, end_day=None):
+    """
+    Пересчитать агрегаты из payment/user/user_config за [start_day, end_day] (включительно).
+
+    Без аргументов пересчитывает всю историю. Возвращает количество записанных строк.
+    """
+    table = AnalyticsDailyRollup.__table__
+
+    def _range(column):
+        conditions = []
+        if start_day:
+            conditions.append(column >= datetime.combine(start_day, datetime.min.time()))
+        if end_day:
+            conditions.append(column < datetime.combine(end_day + timedelta(days=1), datetime.min.time()))
+        return conditions
+
+    rows = {}
+
+    def _add(day, currency, provider, **values):
+        if day is None:
+            return
+        if isinstance(day, str):
+            day = date.fromisoformat(day[:10])
+        elif isinstance(day, datetime):
+            day = day.date()
+        key = (day, currency or '', provider or '')
+        row = rows.setdefault(key, {m: 0 for m in ROLLUP_METRICS})
+        for name, value in values.items():
+            row[name] += value or 0
+
+    day_expr = func.date(Payment.created_at)
+    for day, currency, provider, revenue, count in db.session.query(
+        day_expr, Payment.currency, Payment.payment_provider,
+        func.sum(Payment.amount), func.count(Payment.id)
+    ).filter(Payment.status == 'PAID', *_range(Payment.created_at)).group_by(
+        day_expr, Payment.currency, Payment.payment_provider
+    ):
+        _add(day, currency, provider, revenue=float(revenue or 0), payments_count=count)
+
+    day_expr = func.date(User.created_at)
+    for day, registrations, telegram_users in db.session.query(
+        day_expr, func.count(User.id), func.count(User.telegram_id)
+    ).filter(User.role == 'CLIENT', *_range(User.created_at)).group_by(day_expr):
+        _add(day, '', '', registrations=registrations, telegram_users=telegram_users)
+
+    day_expr = func.date(UserConfig.created_at)
+    for day, configs in db.session.query(
+        day_expr, func.count(UserConfig.id)
+    ).filter(*_range(UserConfig.created_at)).group_by(day_expr):
+        _add(day, '', '', configs_created=configs)
+
+    delete = table.delete()
+    if start_day:
+        delete = delete.where(table.c.day >= start_day)
+    if end_day:
+        delete = delete.where(table.c.day <= end_day)
+    db.session.execute(delete)
+
+    now = datetime.utcnow()
+    if rows:
+        db.session.execute(table.insert(), [
+            {'day': day, 'currency': currency, 'provider': provider, 'updated_at': now, **values}
+            for (day, currency, provider), values in rows.items()
+        ])
+    db.session.commit()
+    return len(rows)
+
+
+def ensure_daily_rollup():
+    """Заполнить агрегаты, если таблица пуста, а история уже есть (первый запуск после обновления)"""
+    if AnalyticsDailyRollup.query.first() is not None:
+        return 0
+    # Только по id: полная выборка модели упадёт, если миграции колонок ещё не прогнаны
+    has_history = (db.session.query(Payment.id).limit(1).first() is not None
+                   or db.session.query(User.id).limit(1).first() is not None)
+    if not has_history:
+        return 0
+    return rebuild_daily_rollup()
+
+
+# ============================================================================
+# ЧТЕНИЕ
+# ============================================================================
+
+def _period_key(day, period):
+    if period == 'weeks':
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if period == 'months':
+        return day.replace(day=1).isoformat()
+    return day.isoformat()
+
+
+def get_rollup_series(start, end, period='days', currencies=('USD', 'UAH', 'RUB')):
+    """
+    Ряды для графиков аналитики из дневных агрегатов.
+
+    Returns:
+        (revenue_by_period, user_registrations_by_period, payments_by_period) в формате /api/admin/analytics:
+        периоды с выручкой по возрастанию, регистрации и платежи выровнены по тем же периодам.
+    """
+    rows = AnalyticsDailyRollup.query.filter(
+        AnalyticsDailyRollup.day >= _day_of(start),
+        AnalyticsDailyRollup.day <= _day_of(end)
+    ).all()
+
+    revenue = {}
+    registrations = {}
+    payments = {}
+    for row in rows:
+        key = _period_key(row.day, period)
+        if row.registrations:
+            registrations[key] = registrations.get(key, 0) + row.registrations
+        if row.payments_count:
+            payments[key] = payments.get(key, 0) + row.payments_count
+        if row.currency and row.payments_count:
+            bucket = revenue.setdefault(key, {'date': key, **{c: 0.0 for c in currencies}})
+            if row.currency in bucket:
+                bucket[row.currency] += float(row.revenue)
+
+    keys = sorted(revenue.keys())
+    return (
+        [revenue[k] for k in keys],
+        [{'date': k, 'count': registrations.get(k, 0)} for k in keys],
+        [{'date': k, 'count': payments.get(k, 0)} for k in keys],
+    )
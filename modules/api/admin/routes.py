@@ -14,7 +14,9 @@ API эндпоинты администратора
 - GET/POST /api/admin/trial-settings - Настройки триала
 - GET/POST /api/admin/tariff-features - Функции тарифов
 - GET/POST /api/admin/currency-rates - Курсы валют
-- POST /api/admin/broadcast - Рассылка
+- POST /api/admin/broadcast - Рассылка (фоновая), GET /api/admin/broadcast/<id> - прогресс
+- GET /api/admin/jobs, POST /api/admin/jobs/<id>/retry - Фоновая очередь (dead-letter)
+- GET /api/admin/webhook-events - Журнал webhook-событий оплат
 """
 
 from flask import jsonify, request
@@ -24,7 +26,9 @@ import json
 import os
 
 from modules.core import get_app, get_db, get_cache, get_bcrypt
+from modules.remnawave import remnawave
 from modules.auth import admin_required
+from modules.remnawave_snapshot import get_live_users_maps, invalidate_live_user
 from modules.models.user import User
 from modules.models.payment import Payment, PaymentSetting
 from modules.models.tariff import Tariff
@@ -36,11 +40,16 @@ from modules.models.bot_config import BotConfig
 from modules.models.referral import ReferralSetting
 from modules.models.tariff_feature import TariffFeatureSetting
 from modules.models.currency import CurrencyRate
+from modules.models.job import BackgroundJob, WebhookEvent
+from modules.models.broadcast import BroadcastJob
+from modules.broadcast import get_broadcast_bot_token, recipients_query as broadcast_recipients_query
+from modules.jobs import enqueue, retry_job
 from modules.models.auto_broadcast import AutoBroadcastMessage, AutoBroadcastSettings
 from modules.models.trial import TrialSettings
 from modules.models.tariff_level import TariffLevel
 from modules.models.option import PurchaseOption
 from modules.models.email_setting import EmailSetting
+from modules.api.payments.base import decrypt_key
 
 app = get_app()
 db = get_db()
@@ -57,176 +66,277 @@ def _get_site_name():
         return ""
 
 
-def get_remnawave_headers():
-    """Получить заголовки для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    return headers, cookies
-
-
 # ============================================================================
 # USERS
 # ============================================================================
 
+# Допустимые поля сортировки списка пользователей и значения по умолчанию для NULL
+# (keyset-пагинация требует полного порядка, поэтому NULL заменяем на "минимальное" значение)
+ADMIN_USERS_SORT_FIELDS = ('id', 'email', 'telegram_id', 'balance', 'created_at')
+ADMIN_USERS_DEFAULT_LIMIT = 50
+ADMIN_USERS_MAX_LIMIT = 500
+
+
+def _get_live_users_maps():
+    """
+    Снимок пользователей RemnaWave: (map по UUID, map по email/username).
+    Общий для всех воркеров, обновляется фоном (см. modules/remnawave_snapshot.py).
+    """
+    try:
+        return get_live_users_maps()
+    except Exception as e:
+        print(f"Warning: Could not fetch live users: {e}")
+        return {}, {}
+
+
+def _get_primary_config_uuids(user_ids):
+    """Один запрос: {user_id: remnawave_uuid основного конфига} для набора пользователей"""
+    from modules.models.user_config import UserConfig
+
+    result = {}
+    user_ids = list(user_ids)
+    # Чанки ограничивают размер IN (...) — SQLite не любит тысячи параметров
+    for i in range(0, len(user_ids), 900):
+        rows = db.session.query(UserConfig.user_id, UserConfig.remnawave_uuid).filter(
+            UserConfig.user_id.in_(user_ids[i:i + 900]),
+            UserConfig.is_primary == True
+        ).all()
+        for user_id, remnawave_uuid in rows:
+            if remnawave_uuid and user_id not in result:
+                result[user_id] = remnawave_uuid
+    return result
+
+
+def _serialize_admin_user(u, primary_uuid, live_map, live_map_by_email):
+    """Формирует запись пользователя для админки (с live-данными RemnaWave)"""
+    from modules.currency import convert_from_usd
+
+    balance_usd = float(u.balance) if u.balance else 0.0
+    balance_converted = convert_from_usd(balance_usd, u.preferred_currency or 'uah')
+
+    # Если включены несколько конфигов (UserConfig), то remnawave_uuid у User должен быть равен UUID основного конфига.
+    # Ранее здесь был авто-апдейт UUID по email/username из RemnaWave, но при нескольких конфигурациях это опасно:
+    # - email может совпадать у разных конфигов
+    # - live_map_by_email становится неоднозначным
+    # и в итоге u.remnawave_uuid начинает "прыгать", ломая оплаты/уведомления.
+    if primary_uuid and u.remnawave_uuid != primary_uuid:
+        u.remnawave_uuid = primary_uuid
+
+    # Сначала ищем по UUID
+    live_data = None
+    fetch_error = None
+    uuid_for_lookup = primary_uuid or u.remnawave_uuid
+    if uuid_for_lookup:
+        live_data = live_map.get(uuid_for_lookup)
+
+    # Если не нашли по UUID, пробуем найти по email
+    if not live_data and u.email:
+        # Пробуем разные варианты email для поиска
+        email_variants = [
+            u.email.lower(),
+            u.email.replace('@', '_').lower(),  # admin@stealthnet.app -> admin_stealthnet_app
+            u.email.split('@')[0].lower()  # admin@stealthnet.app -> admin
+        ]
+        for email_var in email_variants:
+            if email_var in live_map_by_email:
+                live_data = live_map_by_email[email_var]
+                break
+
+    if u.remnawave_uuid and not live_data:
+        fetch_error = "User not found in RemnaWave"
+
+    return {
+        "id": u.id,
+        "email": u.email,
+        "role": u.role,
+        "remnawave_uuid": u.remnawave_uuid,
+        "referral_code": u.referral_code,
+        "referrer_id": u.referrer_id,
+        "is_verified": u.is_verified,
+        "balance": balance_converted,
+        "balance_usd": balance_usd,
+        "preferred_currency": u.preferred_currency or 'uah',
+        "telegram_id": u.telegram_id,
+        "telegram_username": u.telegram_username,
+        "created_at": u.created_at.isoformat() if u.created_at else None,
+        "is_blocked": getattr(u, 'is_blocked', False),
+        "block_reason": getattr(u, 'block_reason', None) or "",
+        "blocked_at": u.blocked_at.isoformat() if hasattr(u, 'blocked_at') and u.blocked_at else None,
+        "live_data": {"response": live_data},
+        "fetch_error": fetch_error
+    }
+
+
+def _admin_users_sort_expr(sort_field):
+    """Выражение сортировки без NULL (keyset-пагинации нужен строгий порядок)"""
+    from sqlalchemy import func
+
+    if sort_field == 'email':
+        return func.coalesce(User.email, '')
+    if sort_field == 'telegram_id':
+        return func.coalesce(User.telegram_id, '')
+    if sort_field == 'balance':
+        return func.coalesce(User.balance, 0.0)
+    if sort_field == 'created_at':
+        return func.coalesce(User.created_at, datetime(1970, 1, 1))
+    return User.id
+
+
+def _encode_users_cursor(sort_field, value, user_id):
+    """Курсор = base64(JSON [значение сортировки, id последней строки страницы])"""
+    import base64
+
+    if sort_field == 'created_at' and isinstance(value, datetime):
+        value = value.replace(tzinfo=None).isoformat()
+    raw = json.dumps([sort_field, value, user_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_users_cursor(cursor, sort_field):
+    """Разбирает курсор; возвращает (значение, id) или None если курсор невалиден/от другой сортировки"""
+    import base64
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        field, value, user_id = json.loads(raw.decode('utf-8'))
+        if field != sort_field:
+            return None
+        if sort_field == 'created_at':
+            value = datetime.fromisoformat(str(value).replace(' ', 'T'))
+        elif sort_field == 'balance':
+            value = float(value)
+        elif sort_field == 'id':
+            value = int(value)
+        else:
+            value = str(value)
+        return value, int(user_id)
+    except Exception:
+        return None
+
+
+def _get_admin_users_page(args):
+    """
+    Серверная пагинация /api/admin/users (keyset по паре (поле сортировки, id)).
+
+    Параметры: limit, cursor, search, sort (id|email|telegram_id|balance|created_at), order (asc|desc).
+    """
+    from sqlalchemy import or_, and_
+
+    try:
+        limit = int(args.get('limit') or ADMIN_USERS_DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        limit = ADMIN_USERS_DEFAULT_LIMIT
+    limit = max(1, min(limit, ADMIN_USERS_MAX_LIMIT))
+
+    sort_field = (args.get('sort') or 'id').strip().lower()
+    if sort_field not in ADMIN_USERS_SORT_FIELDS:
+        return None, ({"message": f"Invalid sort field. Allowed: {', '.join(ADMIN_USERS_SORT_FIELDS)}"}, 400)
+    descending = (args.get('order') or 'asc').strip().lower() == 'desc'
+
+    query = User.query
+    search = (args.get('search') or args.get('q') or '').strip()
+    if search:
+        pattern = f"%{search.lower()}%"
+        conditions = [
+            User.email.ilike(pattern),
+            User.telegram_username.ilike(pattern),
+            User.telegram_id.like(f"%{search}%"),
+            User.remnawave_uuid.ilike(pattern),
+        ]
+        if search.isdigit():
+            conditions.append(User.id == int(search))
+        query = query.filter(or_(*conditions))
+
+    total = query.order_by(None).count()
+
+    sort_expr = _admin_users_sort_expr(sort_field)
+    cursor = args.get('cursor')
+    if cursor:
+        decoded = _decode_users_cursor(cursor, sort_field)
+        if decoded is None:
+            return None, ({"message": "Invalid cursor"}, 400)
+        last_value, last_id = decoded
+        if sort_field == 'id':
+            query = query.filter(User.id < last_id if descending else User.id > last_id)
+        elif descending:
+            query = query.filter(or_(sort_expr < last_value, and_(sort_expr == last_value, User.id < last_id)))
+        else:
+            query = query.filter(or_(sort_expr > last_value, and_(sort_expr == last_value, User.id > last_id)))
+
+    if sort_field == 'id':
+        query = query.order_by(User.id.desc() if descending else User.id.asc())
+    elif descending:
+        query = query.order_by(sort_expr.desc(), User.id.desc())
+    else:
+        query = query.order_by(sort_expr.asc(), User.id.asc())
+
+    # +1 строка, чтобы понять, есть ли следующая страница, без отдельного COUNT
+    rows = query.add_columns(sort_expr.label('sort_value')).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more and rows:
+        last_user, last_value = rows[-1]
+        next_cursor = _encode_users_cursor(sort_field, last_value, last_user.id)
+
+    page_users = [u for u, _ in rows]
+    return {
+        "users": page_users,
+        "total": total,
+        "limit": limit,
+        "sort": sort_field,
+        "order": 'desc' if descending else 'asc',
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }, None
+
+
 @app.route('/api/admin/users', methods=['GET'])
 @admin_required
 def get_admin_users(current_admin):
-    """Получение списка пользователей"""
+    """
+    Получение списка пользователей.
+
+    Без параметров возвращает полный список (совместимость со старой админкой).
+    С любым из limit/cursor/search/sort/order — страницу:
+    {"users": [...], "total", "limit", "sort", "order", "next_cursor", "has_more"}.
+    """
     try:
-        local_users = User.query.all()
-        live_map = cache.get('all_live_users_map')
-        
-        if not live_map:
-            headers, cookies = get_remnawave_headers()
-            try:
-                # RemnaWave /api/users поддерживает пагинацию (size/start). Без параметров может вернуться
-                # только первая страница, из-за чего большинство пользователей будет "не найдено".
-                users_list = []
-                start = 0
-                size = 1000
-                total = None
-                while True:
-                    resp = requests.get(
-                        f"{os.getenv('API_URL')}/api/users",
-                        params={"size": size, "start": start},
-                        headers=headers,
-                        cookies=cookies,
-                        timeout=15
-                    )
-                    payload = resp.json() if resp is not None else {}
-                    data = payload.get('response', payload) if isinstance(payload, dict) else payload
-
-                    if isinstance(data, dict):
-                        chunk = data.get('users', []) or []
-                        if total is None:
-                            try:
-                                total = int(data.get('total')) if data.get('total') is not None else None
-                            except Exception:
-                                total = None
-                    elif isinstance(data, list):
-                        chunk = data
-                    else:
-                        chunk = []
-
-                    if not isinstance(chunk, list) or len(chunk) == 0:
-                        break
-
-                    users_list.extend(chunk)
-                    start += size
-
-                    if total is not None and len(users_list) >= total:
-                        break
-                    # Safety to avoid infinite loop if API behaves unexpectedly
-                    if start > 50000:
-                        break
-                # Создаем два индекса: по UUID и по email/username
-                live_map = {u['uuid']: u for u in users_list if isinstance(u, dict) and 'uuid' in u}
-                # Дополнительный индекс по email для поиска, если UUID не совпадает
-                live_map_by_email = {}
-                for u in users_list:
-                    if isinstance(u, dict):
-                        # Пробуем разные поля для email/username
-                        email_key = u.get('email') or u.get('username') or u.get('name')
-                        if email_key:
-                            live_map_by_email[email_key.lower()] = u
-                cache.set('all_live_users_map', live_map, timeout=60)
-                cache.set('all_live_users_map_by_email', live_map_by_email, timeout=60)
-            except Exception as e:
-                print(f"Warning: Could not fetch live users: {e}")
-                live_map = {}
-                live_map_by_email = {}
+        paginated = any(request.args.get(p) for p in ('limit', 'cursor', 'search', 'q', 'sort', 'order'))
+
+        if paginated:
+            page, error = _get_admin_users_page(request.args)
+            if error:
+                return jsonify(error[0]), error[1]
+            local_users = page['users']
         else:
-            live_map_by_email = cache.get('all_live_users_map_by_email') or {}
-        
-        from modules.currency import convert_from_usd
-        
-        combined = []
-        for u in local_users:
-            balance_usd = float(u.balance) if u.balance else 0.0
-            balance_converted = convert_from_usd(balance_usd, u.preferred_currency or 'uah')
-            
-            # Пытаемся найти пользователя в RemnaWave
-            live_data = None
-            fetch_error = None
-            primary_uuid = None
-            
-            # Если включены несколько конфигов (UserConfig), то remnawave_uuid у User должен быть равен UUID основного конфига.
-            # Ранее здесь был авто-апдейт UUID по email/username из RemnaWave, но при нескольких конфигурациях это опасно:
-            # - email может совпадать у разных конфигов
-            # - live_map_by_email становится неоднозначным
-            # и в итоге u.remnawave_uuid начинает "прыгать", ломая оплаты/уведомления.
-            try:
-                from modules.models.user_config import UserConfig
-                primary_cfg = UserConfig.query.filter_by(user_id=u.id, is_primary=True).first()
-                if primary_cfg and primary_cfg.remnawave_uuid:
-                    primary_uuid = primary_cfg.remnawave_uuid
-                    if u.remnawave_uuid != primary_uuid:
-                        u.remnawave_uuid = primary_uuid
-            except Exception:
-                primary_uuid = None
-            
-            # Сначала ищем по UUID
-            uuid_for_lookup = primary_uuid or u.remnawave_uuid
-            if uuid_for_lookup:
-                live_data = live_map.get(uuid_for_lookup)
-            
-            # Если не нашли по UUID, пробуем найти по email
-            if not live_data and u.email:
-                # Пробуем разные варианты email для поиска
-                email_variants = [
-                    u.email.lower(),
-                    u.email.replace('@', '_').lower(),  # admin@stealthnet.app -> admin_stealthnet_app
-                    u.email.split('@')[0].lower()  # admin@stealthnet.app -> admin
-                ]
-                for email_var in email_variants:
-                    if email_var in live_map_by_email:
-                        live_data = live_map_by_email[email_var]
-                        break
-            
-            if u.remnawave_uuid and not live_data:
-                fetch_error = "User not found in RemnaWave"
-            
-            combined.append({
-                "id": u.id, 
-                "email": u.email, 
-                "role": u.role, 
-                "remnawave_uuid": u.remnawave_uuid,
-                "referral_code": u.referral_code, 
-                "referrer_id": u.referrer_id, 
-                "is_verified": u.is_verified,
-                "balance": balance_converted,
-                "balance_usd": balance_usd,
-                "preferred_currency": u.preferred_currency or 'uah',
-                "telegram_id": u.telegram_id,
-                "telegram_username": u.telegram_username,
-                "is_blocked": getattr(u, 'is_blocked', False),
-                "block_reason": getattr(u, 'block_reason', None) or "",
-                "blocked_at": u.blocked_at.isoformat() if hasattr(u, 'blocked_at') and u.blocked_at else None,
-                "live_data": {"response": live_data},
-                "fetch_error": fetch_error
-            })
-        
+            page = None
+            local_users = User.query.order_by(User.id.asc()).all()
+
+        # Основные конфиги — одним запросом на страницу, вместо запроса на каждого пользователя
+        primary_uuids = _get_primary_config_uuids(u.id for u in local_users)
+        live_map, live_map_by_email = _get_live_users_maps()
+
+        combined = [
+            _serialize_admin_user(u, primary_uuids.get(u.id), live_map, live_map_by_email)
+            for u in local_users
+        ]
+
         # Коммитим все обновления UUID одним разом
-        try:
-            db.session.commit()
-        except Exception as e:
-            print(f"Error committing UUID updates: {e}")
-            db.session.rollback()
-        
-        return jsonify(combined), 200
-        
+        if db.session.dirty:
+            try:
+                db.session.commit()
+            except Exception as e:
+                print(f"Error committing UUID updates: {e}")
+                db.session.rollback()
+
+        if page is None:
+            return jsonify(combined), 200
+
+        page['users'] = combined
+        return jsonify(page), 200
+
     except Exception as e:
         print(f"Error in get_admin_users: {e}")
         return jsonify({"message": "Internal Server Error"}), 500
@@ -300,11 +410,8 @@ def delete_user(current_admin, user_id):
         # Удаляем пользователя из RemnaWave перед удалением из локальной БД
         if remnawave_uuid:
             try:
-                headers, cookies = get_remnawave_headers()
-                delete_response = requests.delete(
-                    f"{os.getenv('API_URL')}/api/users/{remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
+                delete_response = remnawave.delete(
+                    f"/api/users/{remnawave_uuid}",
                     timeout=10
                 )
                 if delete_response.status_code in [200, 204]:
@@ -318,7 +425,7 @@ def delete_user(current_admin, user_id):
         # Очищаем кэш
         if remnawave_uuid:
             cache.delete(f'live_data_{remnawave_uuid}')
-        cache.delete('all_live_users_map')
+        invalidate_live_user(remnawave_uuid)
         
         # Удаляем пользователя из локальной БД
         db.session.delete(user)
@@ -392,7 +499,7 @@ def update_user_balance(current_admin, user_id):
         
         # Очищаем кэш пользователя
         cache.delete(f'live_data_{u.remnawave_uuid}')
-        cache.delete('all_live_users_map')
+        invalidate_live_user(u.remnawave_uuid)
         
         # Конвертируем баланс обратно в валюту пользователя для отображения
         balance_display = convert_from_usd(new_balance_usd, u.preferred_currency or 'uah')
@@ -553,7 +660,7 @@ def unblock_user(current_admin, user_id):
         # Очищаем кэш пользователя, чтобы данные обновились
         if user.remnawave_uuid:
             cache.delete(f'live_data_{user.remnawave_uuid}')
-        cache.delete('all_live_users_map')
+        invalidate_live_user(user.remnawave_uuid)
         
         return jsonify({
             "message": "User unblocked successfully",
@@ -592,10 +699,8 @@ def update_user_telegram_id(current_admin, user_id):
         # Обновляем telegramId в RemnaWave, если есть UUID
         if user.remnawave_uuid:
             try:
-                headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-                requests.patch(
-                    f"{os.getenv('API_URL')}/api/users",
-                    headers=headers,
+                remnawave.patch(
+                    "/api/users",
                     json={"uuid": user.remnawave_uuid, "telegramId": telegram_id},
                     timeout=10
                 )
@@ -649,8 +754,6 @@ def admin_update_user(current_admin, user_id):
         if not action:
             return jsonify({"message": "Action is required. Valid actions: grant_tariff, grant_trial, set_device_limit"}), 400
         
-        headers, cookies = get_remnawave_headers()
-
         def _parse_dt(value):
             """Parse ISO datetime string (handles trailing Z). Returns aware dt in UTC or None."""
             if not value or not isinstance(value, str):
@@ -711,10 +814,8 @@ def admin_update_user(current_admin, user_id):
             if days_to_add <= 0:
                 days_to_add = 30
 
-            resp = requests.get(
-                f"{os.getenv('API_URL')}/api/users/{target_uuid}",
-                headers=headers,
-                cookies=cookies,
+            resp = remnawave.get(
+                f"/api/users/{target_uuid}",
                 timeout=10
             )
             if resp.status_code != 200:
@@ -764,10 +865,8 @@ def admin_update_user(current_admin, user_id):
             except Exception:
                 pass
 
-            patch_resp = requests.patch(
-                f"{os.getenv('API_URL')}/api/users",
-                headers=headers,
-                cookies=cookies,
+            patch_resp = remnawave.patch(
+                "/api/users",
                 json=patch_payload,
                 timeout=10
             )
@@ -775,7 +874,7 @@ def admin_update_user(current_admin, user_id):
                 return jsonify({"message": "Failed to update user in RemnaWave"}), 500
 
             cache.delete(f'live_data_{target_uuid}')
-            cache.delete('all_live_users_map')
+            invalidate_live_user(target_uuid)
             return jsonify({
                 "message": "Tariff granted successfully",
                 "user_email": user.email,
@@ -794,10 +893,8 @@ def admin_update_user(current_admin, user_id):
             if days <= 0:
                 days = 3
 
-            resp = requests.get(
-                f"{os.getenv('API_URL')}/api/users/{target_uuid}",
-                headers=headers,
-                cookies=cookies,
+            resp = remnawave.get(
+                f"/api/users/{target_uuid}",
                 timeout=10
             )
             if resp.status_code != 200:
@@ -828,10 +925,8 @@ def admin_update_user(current_admin, user_id):
                 "activeInternalSquads": current_squads if current_squads else ([trial_squad] if trial_squad else [])
             }
 
-            patch_resp = requests.patch(
-                f"{os.getenv('API_URL')}/api/users",
-                headers=headers,
-                cookies=cookies,
+            patch_resp = remnawave.patch(
+                "/api/users",
                 json=patch_payload,
                 timeout=10
             )
@@ -839,7 +934,7 @@ def admin_update_user(current_admin, user_id):
                 return jsonify({"message": "Failed to update user in RemnaWave"}), 500
 
             cache.delete(f'live_data_{target_uuid}')
-            cache.delete('all_live_users_map')
+            invalidate_live_user(target_uuid)
             return jsonify({
                 "message": "Trial granted successfully",
                 "user_email": user.email,
@@ -857,10 +952,8 @@ def admin_update_user(current_admin, user_id):
             if device_limit < 0:
                 device_limit = 0
 
-            patch_resp = requests.patch(
-                f"{os.getenv('API_URL')}/api/users",
-                headers=headers,
-                cookies=cookies,
+            patch_resp = remnawave.patch(
+                "/api/users",
                 json={"uuid": target_uuid, "hwidDeviceLimit": device_limit},
                 timeout=10
             )
@@ -868,7 +961,7 @@ def admin_update_user(current_admin, user_id):
                 return jsonify({"message": "Failed to update user in RemnaWave"}), 500
 
             cache.delete(f'live_data_{target_uuid}')
-            cache.delete('all_live_users_map')
+            invalidate_live_user(target_uuid)
             return jsonify({
                 "message": "Device limit updated successfully",
                 "user_email": user.email,
@@ -898,54 +991,81 @@ def get_users_emails(current_admin):
 # STATISTICS
 # ============================================================================
 
+REVENUE_CURRENCIES = ('USD', 'UAH', 'RUB')
+
+
+def _count_if(condition):
+    """COUNT(*) FILTER (WHERE condition) в переносимом виде (SQLite + PostgreSQL)"""
+    from sqlalchemy import func, case
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _sum_if(condition, column):
+    """SUM(column) только по строкам, где выполняется condition"""
+    from sqlalchemy import func, case
+    return func.coalesce(func.sum(case((condition, column), else_=0)), 0)
+
+
+def _revenue_by_currency(*filters, **named_conditions):
+    """
+    Выручка PAID-платежей по валютам одним GROUP BY currency.
+
+    Без named_conditions возвращает {'USD': .., 'UAH': .., 'RUB': ..}.
+    С named_conditions (имя -> SQL-условие) — {имя: {'USD': ..}} для каждого условия,
+    все суммы считаются за один проход по таблице.
+    """
+    from sqlalchemy import func
+
+    currency_col = func.coalesce(Payment.currency, 'USD')
+    if named_conditions:
+        names = list(named_conditions.keys())
+        columns = [_sum_if(named_conditions[name], Payment.amount) for name in names]
+    else:
+        names = [None]
+        columns = [func.coalesce(func.sum(Payment.amount), 0)]
+
+    rows = db.session.query(currency_col, *columns).filter(
+        Payment.status == 'PAID', *filters
+    ).group_by(currency_col).all()
+
+    result = {name: {c: 0.0 for c in REVENUE_CURRENCIES} for name in names}
+    for row in rows:
+        currency = row[0]
+        if currency not in REVENUE_CURRENCIES:
+            continue
+        for name, total in zip(names, row[1:]):
+            result[name][currency] += float(total or 0)
+    return result[None] if not named_conditions else result
+
+
 @app.route('/api/admin/statistics', methods=['GET'])
 @admin_required
 def get_statistics(current_admin):
     """Получение статистики системы"""
     try:
-        total_users = User.query.count()
-        active_users = User.query.filter(User.is_verified == True).count()
-        total_payments = Payment.query.count()
-        successful_payments = Payment.query.filter(Payment.status == 'PAID').count()
+        from sqlalchemy import func, true
+
+        total_users, active_users = db.session.query(
+            func.count(User.id),
+            _count_if(User.is_verified == True)
+        ).one()
+        total_payments, successful_payments = db.session.query(
+            func.count(Payment.id),
+            _count_if(Payment.status == 'PAID')
+        ).one()
         total_tariffs = Tariff.query.count()
         
         # Подсчет продаж (только успешные платежи)
         total_sales_count = successful_payments
         
-        # Подсчет общей прибыли по валютам
-        paid_payments = Payment.query.filter(Payment.status == 'PAID').all()
-        total_revenue = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        
-        for payment in paid_payments:
-            currency = payment.currency or 'USD'
-            amount = float(payment.amount) if payment.amount else 0.0
-            
-            # Конвертируем в USD для общего подсчета, если нужно
-            if currency == 'USD':
-                total_revenue['USD'] += amount
-            elif currency == 'UAH':
-                total_revenue['UAH'] += amount
-            elif currency == 'RUB':
-                total_revenue['RUB'] += amount
-        
-        # Подсчет прибыли за сегодня
+        # Прибыль по валютам: за всё время и за сегодня — одним агрегатом
         today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        today_payments = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= today_start
-        ).all()
-        
-        today_revenue = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        for payment in today_payments:
-            currency = payment.currency or 'USD'
-            amount = float(payment.amount) if payment.amount else 0.0
-            
-            if currency == 'USD':
-                today_revenue['USD'] += amount
-            elif currency == 'UAH':
-                today_revenue['UAH'] += amount
-            elif currency == 'RUB':
-                today_revenue['RUB'] += amount
+        revenue = _revenue_by_currency(
+            total=true(),
+            today=Payment.created_at >= today_start
+        )
+        total_revenue = revenue['total']
+        today_revenue = revenue['today']
 
         return jsonify({
             'total_users': total_users,
@@ -971,11 +1091,10 @@ def get_statistics(current_admin):
 def get_analytics(current_admin):
     """Получение расширенной аналитики с группировкой по дням, неделям, месяцам"""
     try:
-        from sqlalchemy import func, extract, case, text
+        from sqlalchemy import func
         from modules.models.user_config import UserConfig
+        from modules.analytics import ensure_daily_rollup, get_rollup_series
         
-        # Определяем тип БД
-        is_postgresql = app.config.get('USE_POSTGRESQL', False)
         period = request.args.get('period', 'days')  # days, weeks, months
         
         # Фильтры по датам (опционально)
@@ -1005,402 +1124,64 @@ def get_analytics(current_admin):
                 stats_end_date = datetime.now(timezone.utc)
                 stats_start_date = stats_end_date - timedelta(days=365)
         
-        # Общая статистика с учетом выбранного периода/диапазона
-        total_users = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
-        verified_users = User.query.filter_by(role='CLIENT', is_verified=True).filter(
+        # Общая статистика с учетом выбранного периода/диапазона — один условный агрегат по клиентам
+        (total_users, verified_users, users_with_telegram,
+         trial_users, users_with_referrer) = db.session.query(
+            func.count(User.id),
+            _count_if(User.is_verified == True),
+            _count_if(User.telegram_id.isnot(None)),
+            _count_if(User.trial_used == True),
+            _count_if(User.referrer_id.isnot(None))
+        ).filter(
+            User.role == 'CLIENT',
             User.created_at >= stats_start_date,
             User.created_at <= stats_end_date
-        ).count()
+        ).one()
         
-        # Конфиги созданные в выбранном периоде
-        total_configs = UserConfig.query.filter(
+        # Конфиги созданные в выбранном периоде и число пользователей с такими конфигами
+        total_configs, users_with_configs = db.session.query(
+            func.count(UserConfig.id),
+            func.count(func.distinct(UserConfig.user_id))
+        ).filter(
             UserConfig.created_at >= stats_start_date,
             UserConfig.created_at <= stats_end_date
-        ).count()
+        ).one()
         
-        total_payments = Payment.query.filter(
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).count()
-        successful_payments = Payment.query.filter(
-            Payment.status == 'PAID',
+        total_payments, successful_payments = db.session.query(
+            func.count(Payment.id),
+            _count_if(Payment.status == 'PAID')
+        ).filter(
             Payment.created_at >= stats_start_date,
             Payment.created_at <= stats_end_date
-        ).count()
-        
-        # Статистика по пользователям в боте (с telegram_id) в выбранном периоде
-        users_with_telegram = User.query.filter_by(role='CLIENT').filter(
-            User.telegram_id.isnot(None),
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
-        
-        # Статистика по сайтам (конфигам) - пользователи с конфигами в выбранном периоде
-        configs_by_user = db.session.query(
-            func.count(UserConfig.id).label('config_count')
-        ).filter(
-            UserConfig.created_at >= stats_start_date,
-            UserConfig.created_at <= stats_end_date
-        ).group_by(UserConfig.user_id).all()
-        users_with_configs = len(configs_by_user)
+        ).one()
         
         # Подсчет прибыли по валютам в выбранном периоде
-        paid_payments = Payment.query.filter(
-            Payment.status == 'PAID',
+        total_revenue = _revenue_by_currency(
             Payment.created_at >= stats_start_date,
             Payment.created_at <= stats_end_date
-        ).all()
-        total_revenue = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        
-        for payment in paid_payments:
-            currency = payment.currency or 'USD'
-            amount = float(payment.amount) if payment.amount else 0.0
-            if currency in total_revenue:
-                total_revenue[currency] += amount
-        
-        # Группировка по периодам
-        revenue_by_period = []
-        user_registrations_by_period = []
-        payments_by_period = []
+        )
         
-        if period == 'days':
-            # Используем кастомный диапазон или последние 30 дней
-            if custom_date_range:
-                start_date, end_date = custom_date_range
-            else:
-                end_date = datetime.now(timezone.utc)
-                start_date = end_date - timedelta(days=30)
-            
-            if is_postgresql:
-                # Доходы по дням (PostgreSQL)
-                revenue_query = db.session.query(
-                    func.date(Payment.created_at).label('date'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.date(Payment.created_at),
-                    Payment.currency
-                ).order_by('date').all()
-                
-                # Регистрации по дням
-                registrations_query = db.session.query(
-                    func.date(User.created_at).label('date'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.date(User.created_at)).order_by('date').all()
-                
-                # Платежи по дням
-                payments_count_query = db.session.query(
-                    func.date(Payment.created_at).label('date'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.date(Payment.created_at)).order_by('date').all()
-            else:
-                # SQLite - используем strftime
-                revenue_query = db.session.query(
-                    func.strftime('%Y-%m-%d', Payment.created_at).label('date'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.strftime('%Y-%m-%d', Payment.created_at),
-                    Payment.currency
-                ).order_by('date').all()
-                
-                registrations_query = db.session.query(
-                    func.strftime('%Y-%m-%d', User.created_at).label('date'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.strftime('%Y-%m-%d', User.created_at)).order_by('date').all()
-                
-                payments_count_query = db.session.query(
-                    func.strftime('%Y-%m-%d', Payment.created_at).label('date'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.strftime('%Y-%m-%d', Payment.created_at)).order_by('date').all()
-            
-            # Формируем данные по дням
-            date_dict = {}
-            for item in revenue_query:
-                if len(item) == 3:
-                    date, currency, total = item
-                    date_str = date.isoformat() if hasattr(date, 'isoformat') else str(date)
-                    if date_str not in date_dict:
-                        date_dict[date_str] = {'date': date_str, 'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                    if currency in date_dict[date_str]:
-                        date_dict[date_str][currency] += float(total)
-            
-            revenue_by_period = list(date_dict.values())
-            
-            # Регистрации
-            reg_dict = {str(item[0]): item[1] for item in registrations_query}
-            user_registrations_by_period = [
-                {'date': date, 'count': reg_dict.get(date, 0)}
-                for date in date_dict.keys()
-            ]
-            
-            # Платежи
-            payments_dict = {str(item[0]): item[1] for item in payments_count_query}
-            payments_by_period = [
-                {'date': date, 'count': payments_dict.get(date, 0)}
-                for date in date_dict.keys()
-            ]
-            
-        elif period == 'weeks':
-            # Используем кастомный диапазон или последние 12 недель
-            if custom_date_range:
-                start_date, end_date = custom_date_range
-            else:
-                end_date = datetime.now(timezone.utc)
+        # Группировка по периодам — из дневных агрегатов (analytics_daily_rollup),
+        # а не сканированием payment/user за весь диапазон
+        if custom_date_range:
+            start_date, end_date = custom_date_range
+        else:
+            end_date = datetime.now(timezone.utc)
+            if period == 'weeks':
                 start_date = end_date - timedelta(weeks=12)
-            
-            # Для PostgreSQL используем date_trunc, для SQLite - группируем в Python
-            if is_postgresql:
-                # Доходы по неделям (PostgreSQL)
-                revenue_query = db.session.query(
-                    func.date_trunc('week', Payment.created_at).label('week'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.date_trunc('week', Payment.created_at),
-                    Payment.currency
-                ).order_by('week').all()
-                
-                # Регистрации по неделям
-                registrations_query = db.session.query(
-                    func.date_trunc('week', User.created_at).label('week'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.date_trunc('week', User.created_at)).order_by('week').all()
-                
-                # Платежи по неделям
-                payments_count_query = db.session.query(
-                    func.date_trunc('week', Payment.created_at).label('week'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.date_trunc('week', Payment.created_at)).order_by('week').all()
-            else:
-                # SQLite - получаем все данные и группируем в Python
-                all_payments = Payment.query.filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).all()
-                
-                all_users = User.query.filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).all()
-                
-                # Группируем по неделям в Python
-                week_dict_rev = {}
-                week_dict_reg = {}
-                week_dict_pay = {}
-                
-                for payment in all_payments:
-                    if payment.created_at:
-                        # Находим начало недели (понедельник)
-                        week_start = payment.created_at - timedelta(days=payment.created_at.weekday())
-                        week_key = week_start.date().isoformat()
-                        
-                        if week_key not in week_dict_rev:
-                            week_dict_rev[week_key] = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                        currency = payment.currency or 'USD'
-                        if currency in week_dict_rev[week_key]:
-                            week_dict_rev[week_key][currency] += float(payment.amount or 0)
-                        
-                        if week_key not in week_dict_pay:
-                            week_dict_pay[week_key] = 0
-                        week_dict_pay[week_key] += 1
-                
-                for user in all_users:
-                    if user.created_at:
-                        week_start = user.created_at - timedelta(days=user.created_at.weekday())
-                        week_key = week_start.date().isoformat()
-                        if week_key not in week_dict_reg:
-                            week_dict_reg[week_key] = 0
-                        week_dict_reg[week_key] += 1
-                
-                revenue_query = [
-                    (week_key, currency, amount)
-                    for week_key, currencies in week_dict_rev.items()
-                    for currency, amount in currencies.items()
-                    if amount > 0
-                ]
-                registrations_query = [(week_key, count) for week_key, count in week_dict_reg.items()]
-                payments_count_query = [(week_key, count) for week_key, count in week_dict_pay.items()]
-            
-            # Формируем данные
-            week_dict = {}
-            for item in revenue_query:
-                if len(item) == 3:
-                    week, currency, total = item
-                    week_str = week.isoformat() if hasattr(week, 'isoformat') else str(week)
-                    if week_str not in week_dict:
-                        week_dict[week_str] = {'date': week_str, 'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                    if currency in week_dict[week_str]:
-                        week_dict[week_str][currency] += float(total)
-            
-            revenue_by_period = list(week_dict.values())
-            
-            reg_dict = {str(item[0]): item[1] for item in registrations_query}
-            user_registrations_by_period = [
-                {'date': date, 'count': reg_dict.get(date, 0)}
-                for date in week_dict.keys()
-            ]
-            
-            payments_dict = {str(item[0]): item[1] for item in payments_count_query}
-            payments_by_period = [
-                {'date': date, 'count': payments_dict.get(date, 0)}
-                for date in week_dict.keys()
-            ]
-            
-        elif period == 'months':
-            # Используем кастомный диапазон или последние 12 месяцев
-            if custom_date_range:
-                start_date, end_date = custom_date_range
-            else:
-                end_date = datetime.now(timezone.utc)
+            elif period == 'months':
                 start_date = end_date - timedelta(days=365)
-            
-            if is_postgresql:
-                # Доходы по месяцам (PostgreSQL)
-                revenue_query = db.session.query(
-                    func.date_trunc('month', Payment.created_at).label('month'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.date_trunc('month', Payment.created_at),
-                    Payment.currency
-                ).order_by('month').all()
-                
-                # Регистрации по месяцам
-                registrations_query = db.session.query(
-                    func.date_trunc('month', User.created_at).label('month'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.date_trunc('month', User.created_at)).order_by('month').all()
-                
-                # Платежи по месяцам
-                payments_count_query = db.session.query(
-                    func.date_trunc('month', Payment.created_at).label('month'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.date_trunc('month', Payment.created_at)).order_by('month').all()
             else:
-                # SQLite - группируем в Python
-                all_payments = Payment.query.filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).all()
-                
-                all_users = User.query.filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).all()
-                
-                month_dict_rev = {}
-                month_dict_reg = {}
-                month_dict_pay = {}
-                
-                for payment in all_payments:
-                    if payment.created_at:
-                        month_key = payment.created_at.replace(day=1).date().isoformat()
-                        if month_key not in month_dict_rev:
-                            month_dict_rev[month_key] = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                        currency = payment.currency or 'USD'
-                        if currency in month_dict_rev[month_key]:
-                            month_dict_rev[month_key][currency] += float(payment.amount or 0)
-                        
-                        if month_key not in month_dict_pay:
-                            month_dict_pay[month_key] = 0
-                        month_dict_pay[month_key] += 1
-                
-                for user in all_users:
-                    if user.created_at:
-                        month_key = user.created_at.replace(day=1).date().isoformat()
-                        if month_key not in month_dict_reg:
-                            month_dict_reg[month_key] = 0
-                        month_dict_reg[month_key] += 1
-                
-                revenue_query = [
-                    (month_key, currency, amount)
-                    for month_key, currencies in month_dict_rev.items()
-                    for currency, amount in currencies.items()
-                    if amount > 0
-                ]
-                registrations_query = [(month_key, count) for month_key, count in month_dict_reg.items()]
-                payments_count_query = [(month_key, count) for month_key, count in month_dict_pay.items()]
-            
-            # Формируем данные
-            month_dict = {}
-            for item in revenue_query:
-                if len(item) == 3:
-                    month, currency, total = item
-                    month_str = month.isoformat() if hasattr(month, 'isoformat') else str(month)
-                    if month_str not in month_dict:
-                        month_dict[month_str] = {'date': month_str, 'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                    if currency in month_dict[month_str]:
-                        month_dict[month_str][currency] += float(total)
-            
-            revenue_by_period = list(month_dict.values())
-            
-            reg_dict = {str(item[0]): item[1] for item in registrations_query}
-            user_registrations_by_period = [
-                {'date': date, 'count': reg_dict.get(date, 0)}
-                for date in month_dict.keys()
-            ]
-            
-            payments_dict = {str(item[0]): item[1] for item in payments_count_query}
-            payments_by_period = [
-                {'date': date, 'count': payments_dict.get(date, 0)}
-                for date in month_dict.keys()
-            ]
+                start_date = end_date - timedelta(days=30)
+
+        revenue_by_period = []
+        user_registrations_by_period = []
+        payments_by_period = []
+        if period in ('days', 'weeks', 'months'):
+            ensure_daily_rollup()
+            revenue_by_period, user_registrations_by_period, payments_by_period = get_rollup_series(
+                start_date, end_date, period=period, currencies=REVENUE_CURRENCIES
+            )
         
         # Статистика по провайдерам платежей в выбранном периоде
         provider_stats = db.session.query(
@@ -1509,18 +1290,9 @@ def get_analytics(current_admin):
         )
         
         # Статистика по триалам в выбранном периоде
-        trial_users = User.query.filter_by(role='CLIENT', trial_used=True).filter(
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
         trial_usage_rate = round((trial_users / total_users * 100), 2) if total_users > 0 else 0.0
         
         # Статистика по реферальной программе в выбранном периоде
-        users_with_referrer = User.query.filter_by(role='CLIENT').filter(
-            User.referrer_id.isnot(None),
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
         referral_rate = round((users_with_referrer / total_users * 100), 2) if total_users > 0 else 0.0
         
         # Новые пользователи за последние периоды для сравнения (всегда за последние периоды, независимо от выбранного диапазона)
@@ -1529,63 +1301,39 @@ def get_analytics(current_admin):
         week_ago = today - timedelta(days=7)
         month_ago = today - timedelta(days=30)
         
-        new_users_today = User.query.filter_by(role='CLIENT').filter(User.created_at >= today).count()
-        new_users_yesterday = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= yesterday,
-            User.created_at < today
-        ).count()
-        new_users_this_week = User.query.filter_by(role='CLIENT').filter(User.created_at >= week_ago).count()
-        new_users_last_week = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= (week_ago - timedelta(days=7)),
-            User.created_at < week_ago
-        ).count()
-        new_users_this_month = User.query.filter_by(role='CLIENT').filter(User.created_at >= month_ago).count()
-        new_users_last_month = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= (month_ago - timedelta(days=30)),
-            User.created_at < month_ago
-        ).count()
+        two_months_ago = month_ago - timedelta(days=30)
+        (new_users_today, new_users_yesterday, new_users_this_week,
+         new_users_last_week, new_users_this_month, new_users_last_month) = db.session.query(
+            _count_if(User.created_at >= today),
+            _count_if((User.created_at >= yesterday) & (User.created_at < today)),
+            _count_if(User.created_at >= week_ago),
+            _count_if((User.created_at >= (week_ago - timedelta(days=7))) & (User.created_at < week_ago)),
+            _count_if(User.created_at >= month_ago),
+            _count_if((User.created_at >= two_months_ago) & (User.created_at < month_ago))
+        ).filter(
+            User.role == 'CLIENT',
+            User.created_at >= two_months_ago
+        ).one()
         
         # Платежи за периоды для сравнения
-        payments_today = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= today
-        ).count()
-        payments_yesterday = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= yesterday,
-            Payment.created_at < today
-        ).count()
-        payments_this_week = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= week_ago
-        ).count()
-        payments_last_week = Payment.query.filter(
+        payments_today, payments_yesterday, payments_this_week, payments_last_week = db.session.query(
+            _count_if(Payment.created_at >= today),
+            _count_if((Payment.created_at >= yesterday) & (Payment.created_at < today)),
+            _count_if(Payment.created_at >= week_ago),
+            _count_if((Payment.created_at >= (week_ago - timedelta(days=7))) & (Payment.created_at < week_ago))
+        ).filter(
             Payment.status == 'PAID',
-            Payment.created_at >= (week_ago - timedelta(days=7)),
-            Payment.created_at < week_ago
-        ).count()
+            Payment.created_at >= (week_ago - timedelta(days=7))
+        ).one()
         
         # Доходы за периоды
-        today_payments = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= today
-        ).all()
-        revenue_today = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        for payment in today_payments:
-            currency = payment.currency or 'USD'
-            if currency in revenue_today:
-                revenue_today[currency] += float(payment.amount or 0)
-        
-        yesterday_payments = Payment.query.filter(
-            Payment.status == 'PAID',
+        comparison_revenue = _revenue_by_currency(
             Payment.created_at >= yesterday,
-            Payment.created_at < today
-        ).all()
-        revenue_yesterday = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        for payment in yesterday_payments:
-            currency = payment.currency or 'USD'
-            if currency in revenue_yesterday:
-                revenue_yesterday[currency] += float(payment.amount or 0)
+            today=Payment.created_at >= today,
+            yesterday=Payment.created_at < today
+        )
+        revenue_today = comparison_revenue['today']
+        revenue_yesterday = comparison_revenue['yesterday']
         
         # Расширенная статистика по триалам в выбранном периоде
         trial_stats = {
@@ -1610,17 +1358,8 @@ def get_analytics(current_admin):
         
         # Детальная статистика по реферальной программе в выбранном периоде
         referral_stats = {
-            'total_referrers': User.query.filter_by(role='CLIENT').filter(
-                User.referrer_id.isnot(None),
-                User.created_at >= stats_start_date,
-                User.created_at <= stats_end_date
-            ).count(),
-            'total_referrals': db.session.query(func.count(User.id)).filter(
-                User.role == 'CLIENT',
-                User.referrer_id.isnot(None),
-                User.created_at >= stats_start_date,
-                User.created_at <= stats_end_date
-            ).scalar(),
+            'total_referrers': users_with_referrer,
+            'total_referrals': users_with_referrer,
             'top_referrers': []
         }
         
@@ -1879,8 +1618,7 @@ def get_sales(current_admin):
 def get_squads(current_admin):
     """Получить список сквадов"""
     try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.get(f"{os.getenv('API_URL')}/api/internal-squads", headers=headers, timeout=10)
+        resp = remnawave.get("/api/internal-squads", timeout=10)
         resp.raise_for_status()
         
         data = resp.json()
@@ -1917,8 +1655,7 @@ def get_internal_squads(current_admin):
 def get_nodes(current_admin):
     """Получить список нод"""
     try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.get(f"{os.getenv('API_URL')}/api/nodes", headers=headers, timeout=10)
+        resp = remnawave.get("/api/nodes", timeout=10)
         resp.raise_for_status()
         
         data = resp.json()
@@ -1941,8 +1678,7 @@ def get_nodes(current_admin):
 def restart_node(current_admin, uuid):
     """Перезапустить ноду"""
     try:
-        headers, cookies = get_remnawave_headers()
-        requests.post(f"{os.getenv('API_URL')}/api/nodes/{uuid}/restart", headers=headers, cookies=cookies)
+        remnawave.post(f"/api/nodes/{uuid}/restart")
         return jsonify({"message": "Node restart initiated"}), 200
     except Exception:
         return jsonify({"message": "Failed to restart node"}), 500
@@ -1953,8 +1689,7 @@ def restart_node(current_admin, uuid):
 def restart_all_nodes(current_admin):
     """Перезапустить все ноды"""
     try:
-        headers, cookies = get_remnawave_headers()
-        requests.post(f"{os.getenv('API_URL')}/api/nodes/restart-all", headers=headers, cookies=cookies)
+        remnawave.post("/api/nodes/restart-all")
         return jsonify({"message": "All nodes restart initiated"}), 200
     except Exception:
         return jsonify({"message": "Failed to restart all nodes"}), 500
@@ -1965,10 +1700,8 @@ def restart_all_nodes(current_admin):
 def enable_node(current_admin, uuid):
     """Включить конкретную ноду"""
     try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.post(
-            f"{os.getenv('API_URL')}/api/nodes/{uuid}/actions/enable",
-            headers=headers,
+        resp = remnawave.post(
+            f"/api/nodes/{uuid}/actions/enable",
             timeout=30
         )
         resp.raise_for_status()
@@ -1989,10 +1722,8 @@ def enable_node(current_admin, uuid):
 def disable_node(current_admin, uuid):
     """Отключить конкретную ноду"""
     try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.post(
-            f"{os.getenv('API_URL')}/api/nodes/{uuid}/actions/disable",
-            headers=headers,
+        resp = remnawave.post(
+            f"/api/nodes/{uuid}/actions/disable",
             timeout=30
         )
         resp.raise_for_status()
@@ -3183,8 +2914,9 @@ def admin_trial_settings(current_admin):
 def public_trial_settings():
     """Публичный endpoint для получения настроек триала (для фронтенда)"""
     from modules.models.trial import get_trial_settings
+    from modules.settings_registry import get_settings
     
-    settings = get_trial_settings()
+    settings = get_settings(TrialSettings) or get_trial_settings()
     
     # Форматируем текст, заменяя {days} на актуальное значение
     def format_text(text, days):
@@ -3577,7 +3309,12 @@ def pin_telegram_message(bot_token, chat_id, message_id):
 @app.route('/api/admin/broadcast', methods=['POST'])
 @admin_required
 def send_broadcast(current_admin):
-    """Рассылка email и/или Telegram"""
+    """
+    Рассылка email и/или Telegram.
+
+    Создаёт задачу рассылки и сразу отвечает; отправку выполняет фоновый воркер
+    (modules.broadcast), прогресс - GET /api/admin/broadcast/<id>.
+    """
     try:
         # Проверяем, есть ли файл изображения
         photo_file = None
@@ -3596,7 +3333,6 @@ def send_broadcast(current_admin):
             # Парсим JSON поля если они есть
             if 'custom_emails' in data and isinstance(data['custom_emails'], str):
                 try:
-                    import json
                     data['custom_emails'] = json.loads(data['custom_emails'])
                 except:
                     data['custom_emails'] = []
@@ -3608,7 +3344,6 @@ def send_broadcast(current_admin):
         recipient_type = data.get('recipient_type', 'all')
         custom_emails = data.get('custom_emails', [])
         if isinstance(custom_emails, str):
-            import json
             try:
                 custom_emails = json.loads(custom_emails)
             except:
@@ -3622,160 +3357,101 @@ def send_broadcast(current_admin):
         if broadcast_type == 'email' and not subject:
             return jsonify({"message": "Subject is required for email broadcast"}), 400
         
-        # Получаем токены ботов
-        old_bot_token = os.getenv("CLIENT_BOT_TOKEN")
-        new_bot_token = os.getenv("CLIENT_BOT_V2_TOKEN") or os.getenv("CLIENT_BOT_TOKEN")
-        
-        # Выбираем токен в зависимости от выбранного бота
-        bot_token = new_bot_token if bot_type == 'new' else old_bot_token
-        
-        if broadcast_type in ['telegram', 'both'] and not bot_token:
+        if broadcast_type in ['telegram', 'both'] and not get_broadcast_bot_token(bot_type):
             return jsonify({"message": f"Bot token for {bot_type} bot is not configured"}), 400
         
-        # Определяем получателей
-        recipients = []
-        if recipient_type == 'all':
-            recipients = User.query.filter_by(role='CLIENT').all()
-        elif recipient_type == 'active':
-            from sqlalchemy import and_
-            recipients = User.query.filter(and_(User.role == 'CLIENT', User.remnawave_uuid != None)).all()
-        elif recipient_type == 'inactive':
-            recipients = User.query.filter_by(role='CLIENT').filter(User.remnawave_uuid == None).all()
-        elif recipient_type == 'custom':
+        emails = []
+        if recipient_type == 'custom':
             if not custom_emails or not isinstance(custom_emails, list):
                 return jsonify({"message": "Custom emails list is required"}), 400
             emails = [email.strip() for email in custom_emails if email.strip()]
-            recipients = User.query.filter(User.email.in_(emails)).all()
         
-        if not recipients:
-            return jsonify({"message": "No recipients found"}), 400
+        broadcast = BroadcastJob(
+            broadcast_type=broadcast_type,
+            bot_type=bot_type,
+            recipient_type=recipient_type,
+            custom_emails=json.dumps(emails, ensure_ascii=False) if emails else None,
+            subject=subject or None,
+            message=message,
+            pin_message=bool(pin_message),
+            created_by=current_admin.id,
+        )
+        if photo_file and broadcast_type in ['telegram', 'both']:
+            broadcast.photo_data = photo_file.read()
+            broadcast.photo_filename = photo_file.filename
         
-        # Статистика
-        email_sent = 0
-        email_failed = 0
-        telegram_sent = 0
-        telegram_failed = 0
-        failed_emails = []
-        failed_telegram = []
-        
-        import threading
-        from flask_mail import Message
-        from modules.core import get_mail
-        from modules.email_utils import get_mail_sender, get_broadcast_html
-
-        # HTML письма рассылки из шаблона (настройки почты или файл)
-        email_html_body = get_broadcast_html(subject, message) if broadcast_type in ['email', 'both'] else None
-
-        def send_email_background(email, subj, html_body):
-            """Отправить email в фоновом режиме (имя отправителя из настроек почты)."""
-            with app.app_context():
-                try:
-                    mail_obj = get_mail()
-                    m = Message(subj, recipients=[email])
-                    m.html = html_body
-                    sender = get_mail_sender()
-                    if sender:
-                        m.sender = sender
-                    mail_obj.send(m)
-                    return True
-                except Exception as e:
-                    print(f"Failed to send email to {email}: {e}")
-                    return False
-
-        # Формируем текст для Telegram
-        telegram_text = f"<b>{subject}</b>\n\n{message}" if subject else message
-
-        # Отправляем сообщения
-        for user in recipients:
-            # Email рассылка
-            if broadcast_type in ['email', 'both']:
-                if user.email and not user.email.endswith('@telegram.local'):
-                    def send_email_wrapper(u, subj, html_body):
-                        nonlocal email_sent, email_failed, failed_emails
-                        if send_email_background(u.email, subj, html_body):
-                            email_sent += 1
-                        else:
-                            email_failed += 1
-                            failed_emails.append(u.email)
-
-                    threading.Thread(
-                        target=send_email_wrapper,
-                        args=(user, subject, email_html_body)
-                    ).start()
-            
-            # Telegram рассылка
-            if broadcast_type in ['telegram', 'both']:
-                if user.telegram_id:
-                    def send_telegram_wrapper(u, token, text, photo, pin):
-                        nonlocal telegram_sent, telegram_failed, failed_telegram
-                        # Отправляем сообщение
-                        success, result = send_telegram_message(token, u.telegram_id, text, photo_file=photo)
-                        if success:
-                            telegram_sent += 1
-                            message_id = result
-                            
-                            # Закрепляем сообщение если нужно
-                            if pin and message_id:
-                                pin_success, pin_error = pin_telegram_message(token, u.telegram_id, message_id)
-                                if not pin_success:
-                                    # Логируем ошибку закрепления, но не считаем это критичной ошибкой
-                                    print(f"Failed to pin message for user {u.telegram_id}: {pin_error}")
-                        else:
-                            telegram_failed += 1
-                            failed_telegram.append({
-                                'telegram_id': u.telegram_id,
-                                'email': u.email,
-                                'error': result
-                            })
-                    
-                    # Если есть фото, нужно переоткрыть файл для каждого потока
-                    photo_for_thread = None
-                    if photo_file:
-                        # Сохраняем файл во временное место или используем BytesIO
-                        from io import BytesIO
-                        photo_file.seek(0)  # Возвращаемся в начало файла
-                        photo_data = photo_file.read()
-                        photo_for_thread = BytesIO(photo_data)
-                        photo_file.seek(0)  # Возвращаемся для следующего использования
-                    
-                    threading.Thread(
-                        target=send_telegram_wrapper,
-                        args=(user, bot_token, telegram_text, photo_for_thread, pin_message)
-                    ).start()
+        # Получатели считаются одним COUNT - сами записи воркер читает пачками
+        broadcast.total_recipients = broadcast_recipients_query(broadcast).count()
+        if not broadcast.total_recipients:
+            return jsonify({"message": "No recipients found"}), 400
         
-        # Ждем немного, чтобы потоки начали работу
-        import time
-        time.sleep(0.5)
+        db.session.add(broadcast)
+        db.session.flush()
+        enqueue('broadcast.send', {'broadcast_id': broadcast.id}, dedupe_key=f'broadcast:{broadcast.id}', max_attempts=3)
+        db.session.commit()
         
         result = {
             "message": "Broadcast initiated",
-            "total_recipients": len(recipients),
+            "broadcast_id": broadcast.id,
+            "status": broadcast.status,
+            "total_recipients": broadcast.total_recipients,
             "broadcast_type": broadcast_type,
             "bot_type": bot_type
         }
         
         if broadcast_type in ['email', 'both']:
-            result["email"] = {
-                "sent": email_sent,
-                "failed": email_failed,
-                "failed_emails": failed_emails[:10]
-            }
+            result["email"] = {"sent": 0, "failed": 0, "failed_emails": []}
         
         if broadcast_type in ['telegram', 'both']:
-            result["telegram"] = {
-                "sent": telegram_sent,
-                "failed": telegram_failed,
-                "failed_users": failed_telegram[:10]
-            }
+            result["telegram"] = {"sent": 0, "failed": 0, "failed_users": []}
         
         return jsonify(result), 200
         
     except Exception as e:
+        db.session.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({"message": f"Failed to send broadcast: {str(e)}"}), 500
 
 
+@app.route('/api/admin/broadcast/<int:broadcast_id>', methods=['GET'])
+@admin_required
+def get_broadcast_status(current_admin, broadcast_id):
+    """Прогресс и статистика рассылки"""
+    broadcast = db.session.get(BroadcastJob, broadcast_id)
+    if not broadcast:
+        return jsonify({"message": "Broadcast not found"}), 404
+    return jsonify(broadcast.to_dict()), 200
+
+
+@app.route('/api/admin/broadcasts', methods=['GET'])
+@admin_required
+def get_broadcasts(current_admin):
+    """Последние рассылки (?limit=20)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except (TypeError, ValueError):
+        limit = 20
+    broadcasts = BroadcastJob.query.options(db.defer(BroadcastJob.photo_data)) \
+        .order_by(BroadcastJob.id.desc()).limit(limit).all()
+    return jsonify([b.to_dict() for b in broadcasts]), 200
+
+
+@app.route('/api/admin/broadcast/<int:broadcast_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_broadcast(current_admin, broadcast_id):
+    """Остановить рассылку (уже отправленная пачка дойдёт до конца)"""
+    broadcast = db.session.get(BroadcastJob, broadcast_id)
+    if not broadcast:
+        return jsonify({"message": "Broadcast not found"}), 404
+    if broadcast.status in ('DONE', 'CANCELLED', 'FAILED'):
+        return jsonify({"message": f"Broadcast is already {broadcast.status}"}), 409
+    broadcast.status = 'CANCELLED'
+    broadcast.finished_at = datetime.now(timezone.utc)
+    db.session.commit()
+    return jsonify(broadcast.to_dict()), 200
+
+
 # ============================================================================
 # SYNC BOT USERS
 # ============================================================================
@@ -4369,18 +4045,6 @@ def get_default_translations(current_admin):
 # TELEGRAM WEBHOOK MANAGEMENT
 # ============================================================================
 
-def decrypt_key(key):
-    """Расшифровка ключа"""
-    from modules.core import get_fernet
-    fernet = get_fernet()
-    if not key or not fernet:
-        return ""
-    try:
-        return fernet.decrypt(key).decode('utf-8')
-    except:
-        return ""
-
-
 @app.route('/api/admin/telegram-webhook-status', methods=['GET'])
 @admin_required
 def telegram_webhook_status(current_admin):
@@ -4452,5 +4116,63 @@ def telegram_set_webhook(current_admin):
         return jsonify({"error": str(e)}), 500
 
 
+# ============================================================================
+# JOB QUEUE
+# ============================================================================
+
+@app.route('/api/admin/jobs', methods=['GET'])
+@admin_required
+def get_admin_jobs(current_admin):
+    """Задачи фоновой очереди (?status=DEAD&kind=payment.process&limit=100)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 500)
+    except (TypeError, ValueError):
+        limit = 100
+    query = BackgroundJob.query
+    status = request.args.get('status')
+    if status:
+        query = query.filter(BackgroundJob.status == status.upper())
+    kind = request.args.get('kind')
+    if kind:
+        query = query.filter(BackgroundJob.kind == kind)
+    jobs = query.order_by(BackgroundJob.id.desc()).limit(limit).all()
+
+    counts = dict(db.session.query(BackgroundJob.status, db.func.count(BackgroundJob.id))
+                  .group_by(BackgroundJob.status).all())
+    return jsonify({"jobs": [j.to_dict() for j in jobs], "counts": counts}), 200
+
+
+@app.route('/api/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@admin_required
+def retry_admin_job(current_admin, job_id):
+    """Повторно поставить задачу (обычно из dead-letter) в очередь"""
+    job = BackgroundJob.query.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status == 'RUNNING':
+        return jsonify({"error": "Job is running"}), 409
+    job = retry_job(job_id)
+    return jsonify({"success": True, "job": job.to_dict()}), 200
+
+
+@app.route('/api/admin/webhook-events', methods=['GET'])
+@admin_required
+def get_admin_webhook_events(current_admin):
+    """Журнал принятых webhook-событий (?provider=yookassa&order_id=...&limit=100)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 500)
+    except (TypeError, ValueError):
+        limit = 100
+    query = WebhookEvent.query
+    provider = request.args.get('provider')
+    if provider:
+        query = query.filter(WebhookEvent.provider == provider)
+    order_id = request.args.get('order_id')
+    if order_id:
+        query = query.filter(WebhookEvent.order_id == order_id)
+    events = query.order_by(WebhookEvent.id.desc()).limit(limit).all()
+    return jsonify([e.to_dict() for e in events]), 200
+
+
 # Import side-effect routes (e.g. SSH terminal)
 from modules.api.admin import ssh_terminal  # noqa: F401
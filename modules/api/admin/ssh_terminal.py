@@ -1,22 +1,50 @@
 """
 SSH Terminal API для админ-панели.
 
-Позволяет подключаться к нодам через SSH прямо из браузера
-и передавать/читать данные через короткие HTTP-запросы.
+Позволяет подключаться к нодам через SSH прямо из браузера.
+Вывод канала читает фоновый поток сессии в ограниченный буфер и отдаёт его потоком
+SSE (GET /api/admin/ssh/stream); ввод - короткими POST /api/admin/ssh/send.
+POST /api/admin/ssh/read (опрос) оставлен для старого фронтенда и читает тот же буфер.
+
+EventSource в браузере не передаёт заголовок Authorization, поэтому поток открывается по
+одноразовому токену сессии (?session_id=...&token=...). Токен выдаёт /connect (stream_url) и,
+для переподключения, POST /api/admin/ssh/stream-token. Клиент на fetch может открыть поток
+и с заголовком Authorization без токена.
+
+Сессия живёт в памяти процесса, открывшего соединение: владелец (хост:pid) записывается
+в кэш, и запросы, попавшие в другой воркер, получают 409. Поэтому nginx направляет весь
+/api/admin/ssh/ в отдельный однопроцессный сервис run_ssh_terminal.py (см. nginx.conf).
 """
 
-import threading
+import os
+import json
 import time
+import hmac
 import uuid
+import codecs
+import secrets
+import socket
+import threading
 
 import paramiko
-from flask import request, jsonify
+from flask import request, jsonify, Response
 
-from modules.core import get_app
+from modules.core import get_app, get_cache
 from modules.auth import admin_required
 
 app = get_app()
 
+# Максимум непрочитанного вывода в буфере сессии; при заполнении поток перестаёт читать канал
+# (окно SSH-канала заполняется, и удалённая сторона ждёт) - backpressure для медленного клиента
+SSH_STREAM_BUFFER_LIMIT = int(os.getenv('SSH_STREAM_BUFFER_LIMIT', 256 * 1024))
+# Интервал keep-alive комментариев в SSE-потоке, сек
+SSH_STREAM_KEEPALIVE = float(os.getenv('SSH_STREAM_KEEPALIVE', 15))
+SSH_SESSION_TIMEOUT = 30 * 60
+# Время жизни токена для открытия потока SSE, сек
+SSH_STREAM_TOKEN_TTL = int(os.getenv('SSH_STREAM_TOKEN_TTL', 60))
+
+OWNER_KEY = 'ssh:owner:{}'
+
 # Хранилище активных SSH сессий (на процесс)
 ssh_sessions = {}
 session_lock = threading.Lock()
@@ -26,6 +54,149 @@ def _new_session_id() -> str:
     return str(uuid.uuid4())
 
 
+class _OutputBuffer:
+    """Вывод канала между потоком чтения и клиентом (SSE или опрос)"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.closed = False
+        self.stream_id = 0  # у сессии один активный поток SSE; новый вытесняет старый
+        self.cond = threading.Condition()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def put(self, data):
+        """Добавить вывод; блокирует поток чтения, пока буфер полон"""
+        with self.cond:
+            while self.size >= self.limit and not self.closed:
+                self.cond.wait(1)
+            if self.closed:
+                return
+            self.chunks.append(data)
+            self.size += len(data)
+            self.cond.notify_all()
+
+    def take(self, timeout=0):
+        """Весь накопленный вывод строкой (ждёт до timeout сек, если буфер пуст)"""
+        with self.cond:
+            if not self.chunks and not self.closed and timeout:
+                self.cond.wait(timeout)
+            data = b''.join(self.chunks)
+            self.chunks.clear()
+            self.size = 0
+            self.cond.notify_all()
+            # Инкрементальный декодер не рвёт многобайтовые символы на границе чанков
+            return self.decoder.decode(data, final=self.closed)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+def _reader_loop(session_id, session):
+    """Поток сессии: читает канал, пока он открыт, и складывает вывод в буфер"""
+    channel = session['channel']
+    output = session['output']
+    while not output.closed:
+        try:
+            chunk = channel.recv(4096)
+        except socket.timeout:
+            continue
+        except Exception:
+            break
+        if not chunk:
+            break
+        output.put(chunk)
+    output.close()
+
+
+def _worker_id():
+    # pid берётся при вызове: модуль может быть импортирован до fork воркера
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claim_owner(session_id):
+    try:
+        get_cache().set(OWNER_KEY.format(session_id), _worker_id(), timeout=SSH_SESSION_TIMEOUT)
+    except Exception:
+        pass
+
+
+def _release_owner(session_id):
+    try:
+        get_cache().delete(OWNER_KEY.format(session_id))
+    except Exception:
+        pass
+
+
+def _close_session(session_id):
+    with session_lock:
+        session = ssh_sessions.pop(session_id, None)
+    if not session:
+        return
+    session['output'].close()
+    try:
+        session['channel'].close()
+        session['ssh'].close()
+    except Exception:
+        pass
+    _release_owner(session_id)
+
+
+def _issue_stream_token(session):
+    """Новый одноразовый токен потока SSE для сессии (предыдущий перестаёт действовать)"""
+    token = secrets.token_urlsafe(32)
+    with session_lock:
+        session['stream_token'] = (token, time.time() + SSH_STREAM_TOKEN_TTL)
+    return token
+
+
+def _consume_stream_token(session, token):
+    with session_lock:
+        stored, expires_at = session.pop('stream_token', None) or (None, 0)
+    return bool(stored) and expires_at > time.time() and hmac.compare_digest(stored, token)
+
+
+def _stream_url(session_id, token):
+    return f"/api/admin/ssh/stream?session_id={session_id}&token={token}"
+
+
+def _find_session(session_id):
+    """(session, None) или (None, (response, status)) - без проверки администратора"""
+    if not session_id:
+        return None, (jsonify({"error": "Session ID required"}), 400)
+
+    with session_lock:
+        session = ssh_sessions.get(session_id)
+
+    if not session:
+        try:
+            owner = get_cache().get(OWNER_KEY.format(session_id))
+        except Exception:
+            owner = None
+        if owner and owner != _worker_id():
+            # Сессия жива, но в другом воркере - запрос нужно направить туда (run_ssh_terminal.py)
+            return None, (jsonify({"error": "Session is owned by another worker", "owner": owner}), 409)
+        return None, (jsonify({"error": "Session not found", "disconnected": True}), 404)
+
+    session['last_activity'] = time.time()
+    return session, None
+
+
+def _get_session(session_id, current_admin):
+    """(session, None) или (None, (response, status))"""
+    session, error = _find_session(session_id)
+    if error:
+        return None, error
+
+    if session['admin_id'] != current_admin.id:
+        return None, (jsonify({"error": "Unauthorized"}), 403)
+
+    return session, None
+
+
 @app.route('/api/admin/ssh/connect', methods=['POST'])
 @admin_required
 def ssh_connect(current_admin):
@@ -61,100 +232,156 @@ def ssh_connect(current_admin):
         return jsonify({"error": f"Ошибка подключения: {str(e)}"}), 500
 
     channel = ssh.invoke_shell(term='xterm-256color', width=120, height=40)
-    channel.settimeout(0.1)
+    # Таймаут нужен только потоку чтения, чтобы он замечал закрытие сессии
+    channel.settimeout(1)
 
     session_id = _new_session_id()
     now = time.time()
+    session = {
+        'ssh': ssh,
+        'channel': channel,
+        'output': _OutputBuffer(SSH_STREAM_BUFFER_LIMIT),
+        'host': host,
+        'username': username,
+        'created_at': now,
+        'last_activity': now,
+        'admin_id': current_admin.id
+    }
 
     with session_lock:
-        ssh_sessions[session_id] = {
-            'ssh': ssh,
-            'channel': channel,
-            'host': host,
-            'username': username,
-            'created_at': now,
-            'last_activity': now,
-            'admin_id': current_admin.id
-        }
+        ssh_sessions[session_id] = session
+    _claim_owner(session_id)
+
+    threading.Thread(target=_reader_loop, args=(session_id, session), daemon=True,
+                     name=f'ssh-reader-{session_id[:8]}').start()
 
     return jsonify({
         "session_id": session_id,
+        "worker": _worker_id(),
+        "stream_url": _stream_url(session_id, _issue_stream_token(session)),
+        "stream_token_ttl": SSH_STREAM_TOKEN_TTL,
         "message": "Connected successfully"
     }), 200
 
 
-@app.route('/api/admin/ssh/send', methods=['POST'])
+@app.route('/api/admin/ssh/stream-token', methods=['POST'])
 @admin_required
-def ssh_send(current_admin):
-    """Отправка данных в SSH сессию"""
+def ssh_stream_token(current_admin):
+    """Новый токен потока SSE (для переподключения EventSource)"""
     data = request.get_json(silent=True) or {}
     session_id = data.get('session_id')
-    input_data = data.get('data', '')
 
-    if not session_id:
-        return jsonify({"error": "Session ID required"}), 400
+    session, error = _get_session(session_id, current_admin)
+    if error:
+        return error
 
-    with session_lock:
-        session = ssh_sessions.get(session_id)
+    return jsonify({
+        "stream_url": _stream_url(session_id, _issue_stream_token(session)),
+        "stream_token_ttl": SSH_STREAM_TOKEN_TTL
+    }), 200
 
-    if not session:
-        return jsonify({"error": "Session not found"}), 404
 
-    if session['admin_id'] != current_admin.id:
-        return jsonify({"error": "Unauthorized"}), 403
+@app.route('/api/admin/ssh/stream', methods=['GET'])
+def ssh_stream():
+    """
+    Поток вывода SSH сессии (text/event-stream).
+
+    Доступ: ?token=... (одноразовый, выдан /connect или /stream-token) либо заголовок Authorization.
+    События: data: {"output": "..."} по мере поступления вывода, event: exit при закрытии канала;
+    комментарий ": ping" раз в SSH_STREAM_KEEPALIVE сек. Повторное подключение вытесняет
+    предыдущий поток этой сессии.
+    """
+    token = request.args.get('token')
+    if not token:
+        return _ssh_stream_with_header()
+
+    session_id = request.args.get('session_id')
+    session, error = _find_session(session_id)
+    if error:
+        return error
+    if not _consume_stream_token(session, token):
+        return jsonify({"error": "Invalid or expired stream token"}), 403
+
+    return _stream_response(session_id, session)
+
+
+@admin_required
+def _ssh_stream_with_header(current_admin):
+    session_id = request.args.get('session_id')
+    session, error = _get_session(session_id, current_admin)
+    if error:
+        return error
+
+    return _stream_response(session_id, session)
+
+
+def _stream_response(session_id, session):
+    output = session['output']
+    with output.cond:
+        output.stream_id += 1
+        stream_id = output.stream_id
+        output.cond.notify_all()
+
+    def generate():
+        yield "retry: 2000\n\n"
+        while output.stream_id == stream_id:
+            text = output.take(timeout=SSH_STREAM_KEEPALIVE)
+            session['last_activity'] = time.time()
+            if text:
+                yield f"data: {json.dumps({'output': text})}\n\n"
+            elif output.closed:
+                break
+            elif output.stream_id == stream_id:
+                yield ": ping\n\n"
+        if output.closed:
+            _close_session(session_id)
+            yield 'event: exit\ndata: {"disconnected": true}\n\n'
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx не буферизует поток
+    })
+
+
+@app.route('/api/admin/ssh/send', methods=['POST'])
+@admin_required
+def ssh_send(current_admin):
+    """Отправка данных в SSH сессию"""
+    data = request.get_json(silent=True) or {}
+    input_data = data.get('data', '')
+
+    session, error = _get_session(data.get('session_id'), current_admin)
+    if error:
+        return error
 
     if input_data:
         try:
-            session['channel'].send(input_data)
+            session['channel'].sendall(input_data)
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
-    session['last_activity'] = time.time()
     return jsonify({"success": True}), 200
 
 
 @app.route('/api/admin/ssh/read', methods=['POST'])
 @admin_required
 def ssh_read(current_admin):
-    """Чтение данных из SSH сессии"""
+    """Чтение накопленного вывода SSH сессии (опрос; для потока см. /api/admin/ssh/stream)"""
     data = request.get_json(silent=True) or {}
     session_id = data.get('session_id')
 
-    if not session_id:
-        return jsonify({"error": "Session ID required"}), 400
-
-    with session_lock:
-        session = ssh_sessions.get(session_id)
-
-    if not session:
-        return jsonify({"error": "Session not found", "disconnected": True}), 404
-
-    if session['admin_id'] != current_admin.id:
-        return jsonify({"error": "Unauthorized"}), 403
-
-    channel = session['channel']
-    output = ""
+    session, error = _get_session(session_id, current_admin)
+    if error:
+        return error
 
-    try:
-        while channel.recv_ready():
-            chunk = channel.recv(4096).decode('utf-8', errors='replace')
-            output += chunk
-    except Exception:
-        # ignore read errors (channel may not be ready)
-        pass
-
-    session['last_activity'] = time.time()
+    output = session['output']
+    text = output.take()
 
-    if getattr(channel, 'closed', False):
-        with session_lock:
-            try:
-                session['ssh'].close()
-            except Exception:
-                pass
-            ssh_sessions.pop(session_id, None)
-        return jsonify({"output": output, "disconnected": True}), 200
+    if output.closed:
+        _close_session(session_id)
+        return jsonify({"output": text, "disconnected": True}), 200
 
-    return jsonify({"output": output}), 200
+    return jsonify({"output": text}), 200
 
 
 @app.route('/api/admin/ssh/resize', methods=['POST'])
@@ -162,21 +389,12 @@ def ssh_read(current_admin):
 def ssh_resize(current_admin):
     """Изменение размера терминала"""
     data = request.get_json(silent=True) or {}
-    session_id = data.get('session_id')
     cols = int(data.get('cols') or 120)
     rows = int(data.get('rows') or 40)
 
-    if not session_id:
-        return jsonify({"error": "Session ID required"}), 400
-
-    with session_lock:
-        session = ssh_sessions.get(session_id)
-
-    if not session:
-        return jsonify({"error": "Session not found"}), 404
-
-    if session['admin_id'] != current_admin.id:
-        return jsonify({"error": "Unauthorized"}), 403
+    session, error = _get_session(data.get('session_id'), current_admin)
+    if error:
+        return error
 
     try:
         session['channel'].resize_pty(width=cols, height=rows)
@@ -199,39 +417,26 @@ def ssh_disconnect(current_admin):
     with session_lock:
         session = ssh_sessions.get(session_id)
 
-        if session:
-            if session['admin_id'] != current_admin.id:
-                return jsonify({"error": "Unauthorized"}), 403
-
-            try:
-                session['channel'].close()
-                session['ssh'].close()
-            except Exception:
-                pass
-
-            ssh_sessions.pop(session_id, None)
+    if session:
+        if session['admin_id'] != current_admin.id:
+            return jsonify({"error": "Unauthorized"}), 403
+        _close_session(session_id)
 
     return jsonify({"message": "Disconnected"}), 200
 
 
 def cleanup_old_sessions():
-    """Очистка неактивных сессий (старше 30 минут)"""
+    """Очистка неактивных сессий (старше 30 минут); открытый поток SSE продлевает сессию"""
     current_time = time.time()
-    timeout = 30 * 60
 
     with session_lock:
         to_remove = [
             sid for sid, session in ssh_sessions.items()
-            if current_time - session.get('last_activity', current_time) > timeout
+            if current_time - session.get('last_activity', current_time) > SSH_SESSION_TIMEOUT
         ]
 
-        for sid in to_remove:
-            try:
-                ssh_sessions[sid]['channel'].close()
-                ssh_sessions[sid]['ssh'].close()
-            except Exception:
-                pass
-            ssh_sessions.pop(sid, None)
+    for sid in to_remove:
+        _close_session(sid)
 
 
 def start_cleanup_thread():
@@ -246,4 +451,3 @@ def start_cleanup_thread():
 
 # Запускаем очистку при импорте модуля
 start_cleanup_thread()
-
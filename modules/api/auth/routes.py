@@ -15,16 +15,17 @@ import random
 import string
 import threading
 import requests
-import json
 import os
 
 from modules.core import get_app, get_db, get_bcrypt, get_fernet, get_mail, get_cache, get_limiter
+from modules.remnawave import remnawave
 from modules.auth import create_local_jwt
 from modules.models.user import User
 from modules.models.system import SystemSetting
 from modules.models.referral import ReferralSetting
 from modules.models.branding import BrandingSetting
 from modules.models.bot_config import BotConfig
+from modules.settings_registry import get_settings
 
 app = get_app()
 db = get_db()
@@ -41,29 +42,6 @@ def generate_referral_code(user_id):
     return f"REF-{user_id}-{random_part}"
 
 
-def get_remnawave_headers(additional_headers=None):
-    """Получение заголовков для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    if additional_headers:
-        headers.update(additional_headers)
-    
-    return headers, cookies
-
-
 def send_email_in_background(app_context, recipient, subject, html_body, sender=None):
     """Отправка email в фоновом режиме. sender=(name, email) — из настроек почты, если не передан."""
     with app_context:
@@ -95,7 +73,7 @@ def send_email_in_background(app_context, recipient, subject, html_body, sender=
 
 def get_system_settings():
     """Получить системные настройки"""
-    return SystemSetting.query.first()
+    return get_settings(SystemSetting)
 
 
 def create_system_settings():
@@ -108,7 +86,7 @@ def create_system_settings():
 
 def get_referral_settings():
     """Получить настройки рефералов"""
-    return ReferralSetting.query.first()
+    return get_settings(ReferralSetting)
 
 
 # ============================================================================
@@ -155,19 +133,14 @@ def public_register():
     expire_date = (datetime.now(timezone.utc) + timedelta(days=bonus_days_new)).isoformat()
 
     try:
-        headers, cookies = get_remnawave_headers()
-        API_URL = os.getenv('API_URL')
-        
         # Сначала проверяем, существует ли пользователь в RemnaWave по email
         existing_remnawave_user = None
         try:
             # URL-encode email для безопасной передачи
             import urllib.parse
             encoded_email = urllib.parse.quote(email, safe='')
-            check_resp = requests.get(
-                f"{API_URL}/api/users/by-email/{encoded_email}",
-                headers=headers,
-                cookies=cookies,
+            check_resp = remnawave.get(
+                f"/api/users/by-email/{encoded_email}",
                 timeout=15
             )
             if check_resp.status_code == 200:
@@ -193,7 +166,7 @@ def public_register():
                 "activeInternalSquads": [os.getenv("DEFAULT_SQUAD_ID")] if referrer else []
             }
 
-            resp = requests.post(f"{API_URL}/api/users", headers=headers, cookies=cookies, json=payload_create)
+            resp = remnawave.post("/api/users", json=payload_create)
             resp.raise_for_status()
             remnawave_uuid = resp.json().get('response', {}).get('uuid')
 
@@ -238,8 +211,8 @@ def public_register():
                 your_server_ip = "https://testpanel.stealthnet.app"
 
             url = f"{your_server_ip}/verify?token={verif_token}"
-            branding = BrandingSetting.query.first()
-            bot_config = BotConfig.query.first()
+            branding = get_settings(BrandingSetting)
+            bot_config = get_settings(BotConfig)
             service_name = (bot_config.service_name if bot_config else None) or (branding.site_name if branding else None) or ""
             from modules.email_utils import get_verification_html, get_verification_subject
             html = get_verification_html(url, service_name=service_name)
@@ -253,14 +226,12 @@ def public_register():
         if referrer:
             s = get_referral_settings()
             days = s.referrer_bonus_days if s else 7
-            headers, cookies = get_remnawave_headers()
-            resp = requests.get(f"{os.getenv('API_URL')}/api/users/{referrer.remnawave_uuid}", headers=headers, cookies=cookies)
+            resp = remnawave.get(f"/api/users/{referrer.remnawave_uuid}")
             if resp.ok:
                 live_data = resp.json().get('response', {})
                 curr = datetime.fromisoformat(live_data.get('expireAt'))
                 new_exp = max(datetime.now(timezone.utc), curr) + timedelta(days=days)
-                requests.patch(f"{os.getenv('API_URL')}/api/users",
-                            headers={"Content-Type": "application/json", **headers},
+                remnawave.patch("/api/users",
                             json={"uuid": referrer.remnawave_uuid, "expireAt": new_exp.isoformat()})
                 cache.delete(f'live_data_{referrer.remnawave_uuid}')
 
@@ -450,8 +421,8 @@ def resend_verification():
                 your_server_ip = "https://testpanel.stealthnet.app"
 
             url = f"{your_server_ip}/verify?token={user.verification_token}"
-            branding = BrandingSetting.query.first()
-            bot_config = BotConfig.query.first()
+            branding = get_settings(BrandingSetting)
+            bot_config = get_settings(BotConfig)
             service_name = (bot_config.service_name if bot_config else None) or (branding.site_name if branding else None) or ""
             from modules.email_utils import get_verification_html, get_verification_subject
             html = get_verification_html(url, service_name=service_name)
@@ -7,6 +7,7 @@ API эндпоинты для интеграции с Telegram ботом
 """
 
 from flask import jsonify, request
+from sqlalchemy.exc import IntegrityError
 import random
 import string
 import os
@@ -16,7 +17,11 @@ from modules.auth import create_local_jwt
 from modules.models.user import User
 from modules.models.system import SystemSetting
 from modules.models.bot_config import BotConfig
-from modules.models.referral import ReferralSetting
+from modules.settings_registry import get_settings
+from modules.provisioning import (
+    enqueue_provisioning, get_provisioning_state, retry_failed_provisioning,
+    STATE_READY, STATE_PROVISIONING, STATE_FAILED
+)
 
 app = get_app()
 db = get_db()
@@ -86,9 +91,27 @@ def bot_get_token():
         return jsonify({"message": "Internal Server Error"}), 500
 
 
+def _already_registered(user):
+    """Ответ для уже зарегистрированного пользователя (со статусом создания аккаунта RemnaWave)"""
+    state = get_provisioning_state(user)
+    if state == STATE_FAILED and retry_failed_provisioning(user):
+        state = STATE_PROVISIONING
+    return jsonify({
+        "message": "User already registered",
+        "user_id": user.id,
+        "token": create_local_jwt(user.id),
+        "status": state or STATE_READY
+    }), 200
+
+
 @app.route('/api/bot/register', methods=['POST'])
 def bot_register():
-    """Регистрация пользователя через бота (совместимо со старым API)"""
+    """
+    Регистрация пользователя через бота (совместимо со старым API)
+
+    Пользователь создаётся только в локальной БД, аккаунт RemnaWave создаёт фоновая задача
+    (modules.provisioning): ответ не ждёт RemnaWave, до завершения задачи status = "provisioning".
+    """
     try:
         data = request.json
         telegram_id = data.get('telegram_id')
@@ -104,14 +127,13 @@ def bot_register():
         # Проверяем существующего пользователя
         existing_user = User.query.filter_by(telegram_id=str(telegram_id)).first()
         if existing_user:
-            return jsonify({
-                "message": "User already registered",
-                "user_id": existing_user.id,
-                "token": create_local_jwt(existing_user.id)
-            }), 200
+            return _already_registered(existing_user)
+
+        if not os.getenv('API_URL') or not os.getenv('ADMIN_TOKEN'):
+            return jsonify({"message": "RemnaWave API not configured (API_URL or ADMIN_TOKEN missing)"}), 500
 
         # Получаем системные настройки
-        sys_settings = SystemSetting.query.first()
+        sys_settings = get_settings(SystemSetting)
         if not sys_settings:
             sys_settings = SystemSetting(default_language='ru', default_currency='uah')
             db.session.add(sys_settings)
@@ -130,144 +152,6 @@ def bot_register():
         if referral_code:
             referrer = User.query.filter_by(referral_code=referral_code).first()
 
-        # Создаем пользователя в RemnaWave API (как в старом app.py)
-        remnawave_uuid = None
-        from modules.api.webhooks.routes import get_remnawave_headers
-        from datetime import datetime, timedelta, timezone
-        import requests
-        
-        API_URL = os.getenv('API_URL')
-        ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
-        DEFAULT_SQUAD_ID = os.getenv('DEFAULT_SQUAD_ID')
-        
-        if not API_URL or not ADMIN_TOKEN:
-            return jsonify({"message": "RemnaWave API not configured (API_URL or ADMIN_TOKEN missing)"}), 500
-        
-        try:
-            # Сначала проверяем, существует ли пользователь в RemnaWave по telegramId
-            existing_remnawave_user = None
-            if telegram_id:
-                try:
-                    telegram_id_int = int(telegram_id) if isinstance(telegram_id, (str, int)) else telegram_id
-                    check_resp = requests.get(
-                        f"{API_URL}/api/users/by-telegram-id/{telegram_id_int}",
-                        headers={"Authorization": f"Bearer {ADMIN_TOKEN}"},
-                        timeout=15
-                    )
-                    if check_resp.status_code == 200:
-                        check_data = check_resp.json()
-                        # API может вернуть response с пользователем или массив пользователей
-                        if check_data.get('response'):
-                            existing_remnawave_user = check_data['response']
-                            if isinstance(existing_remnawave_user, list) and len(existing_remnawave_user) > 0:
-                                existing_remnawave_user = existing_remnawave_user[0]
-                        print(f"Found existing user in RemnaWave by telegramId: {existing_remnawave_user.get('uuid') if existing_remnawave_user else 'None'}")
-                except Exception as e:
-                    print(f"Error checking existing user by telegramId: {e}")
-            
-            # Если пользователь уже существует в RemnaWave - используем его UUID
-            if existing_remnawave_user and existing_remnawave_user.get('uuid'):
-                remnawave_uuid = existing_remnawave_user.get('uuid')
-                print(f"Using existing RemnaWave user UUID: {remnawave_uuid}")
-            else:
-                # Пользователь не найден - создаём нового
-                # Бонусные дни для реферала
-                bonus_days = 0
-                if referrer:
-                    ref_settings = ReferralSetting.query.first()
-                    bonus_days = ref_settings.invitee_bonus_days if ref_settings else 7
-                
-                expire_date = (datetime.now(timezone.utc) + timedelta(days=bonus_days)).isoformat()
-                clean_username = email.replace("@", "_").replace(".", "_")
-                
-                payload_create = {
-                    "email": email,
-                    "password": password,
-                    "username": clean_username,
-                    "expireAt": expire_date
-                }
-                
-                # Добавляем activeInternalSquads только если есть реферал и DEFAULT_SQUAD_ID
-                if referrer and DEFAULT_SQUAD_ID:
-                    payload_create["activeInternalSquads"] = [DEFAULT_SQUAD_ID]
-                
-                # Добавляем telegramId только если он есть, и как число (не строку)
-                if telegram_id:
-                    try:
-                        # Пробуем конвертировать в int, если это возможно
-                        telegram_id_int = int(telegram_id) if isinstance(telegram_id, (str, int)) else telegram_id
-                        payload_create["telegramId"] = telegram_id_int
-                    except (ValueError, TypeError):
-                        # Если не получается конвертировать, отправляем как строку
-                        payload_create["telegramId"] = str(telegram_id)
-                
-                print(f"Creating user in RemnaWave with payload: {payload_create}")
-                
-                resp = requests.post(
-                    f"{API_URL}/api/users",
-                    headers={"Authorization": f"Bearer {ADMIN_TOKEN}"},
-                    json=payload_create,
-                    timeout=30
-                )
-                
-                if resp.status_code != 200 and resp.status_code != 201:
-                    error_text = resp.text[:500] if hasattr(resp, 'text') else 'No error details'
-                    print(f"RemnaWave API Error: Status {resp.status_code}, Response: {error_text}")
-                    try:
-                        error_json = resp.json()
-                        error_detail = error_json.get('message') or error_json.get('error') or error_text
-                    except:
-                        error_detail = error_text
-                    raise requests.exceptions.HTTPError(f"{resp.status_code} Client Error: {error_detail} for url: {resp.url}", response=resp)
-                
-                resp.raise_for_status()
-                remnawave_uuid = resp.json().get('response', {}).get('uuid')
-                
-                if not remnawave_uuid:
-                    return jsonify({"message": "Provider Error: Failed to create user in RemnaWave (no UUID returned)"}), 500
-                
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-            # Обработка сетевых ошибок (DNS, таймауты, недоступность сервера)
-            error_msg = str(e)
-            print(f"Error creating user in RemnaWave (Network Error): {error_msg}")
-            print(f"API_URL: {API_URL}")
-            print(f"Payload was: {payload_create}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({
-                "message": "Не удалось подключиться к RemnaWave API. Проверьте настройки API_URL и доступность сервера.",
-                "error": error_msg,
-                "api_url": API_URL
-            }), 500
-        except requests.exceptions.HTTPError as e:
-            error_detail = ""
-            try:
-                if hasattr(e, 'response') and e.response:
-                    error_response = e.response.json() if e.response else {}
-                    error_detail = error_response.get('message') or error_response.get('error') or e.response.text[:200] or str(e)
-                else:
-                    error_detail = str(e)
-            except:
-                error_detail = str(e)
-            print(f"Error creating user in RemnaWave: {error_detail}")
-            print(f"Payload was: {payload_create}")
-            return jsonify({
-                "message": "Failed to create user in RemnaWave",
-                "error": error_detail
-            }), 500
-        except Exception as e:
-            print(f"Error creating user in RemnaWave: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({
-                "message": "Failed to create user in RemnaWave",
-                "error": str(e)
-            }), 500
-
-        # Создаем нового пользователя в локальной БД (только если remnawave_uuid получен)
-        if not remnawave_uuid:
-            return jsonify({"message": "Failed to get UUID from RemnaWave"}), 500
-            
         # Хешируем пароль для возможности входа на сайте
         from modules.core import bcrypt, get_fernet
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
@@ -288,14 +172,22 @@ def bot_register():
             email=email,
             password_hash=hashed_password,  # Сохраняем хеш пароля для входа на сайте
             encrypted_password=encrypted_password_str,  # Сохраняем зашифрованный пароль для старого бота
-            remnawave_uuid=remnawave_uuid,  # Должен быть валидным UUID
+            remnawave_uuid=None,  # Заполнит задача user.provision
             is_verified=True,
             preferred_lang=language_code,
             preferred_currency=currency
         )
 
         db.session.add(new_user)
-        db.session.flush()
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Параллельный /start того же пользователя уже создал запись
+            db.session.rollback()
+            existing_user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+            if existing_user:
+                return _already_registered(existing_user)
+            raise
 
         new_user.referral_code = generate_referral_code(new_user.id)
 
@@ -303,6 +195,8 @@ def bot_register():
         if referrer:
             new_user.referrer_id = referrer.id
 
+        # Аккаунт RemnaWave создаётся в фоне (в той же транзакции, что и пользователь)
+        enqueue_provisioning(new_user)
         db.session.commit()
 
         token = create_local_jwt(new_user.id)
@@ -324,7 +218,8 @@ def bot_register():
             "password": password,  # Возвращаем пароль только при регистрации
             "token": token,
             "user_id": new_user.id,
-            "referral_code": new_user.referral_code
+            "referral_code": new_user.referral_code,
+            "status": STATE_PROVISIONING
         }
 
         return jsonify(response_data), 201
@@ -389,7 +284,7 @@ def bot_get_credentials():
         
         # Добавляем данные для подключения (для совместимости)
         if user.remnawave_uuid:
-            bot_config = BotConfig.query.first()
+            bot_config = get_settings(BotConfig)
             response["remnawave_uuid"] = user.remnawave_uuid
             response["server_domain"] = os.getenv("YOUR_SERVER_IP") or os.getenv("YOUR_SERVER_IP_OR_DOMAIN", "testpanel.stealthnet.app")
             response["bot_config"] = {
@@ -397,6 +292,11 @@ def bot_get_credentials():
                 "support_url": bot_config.support_url if bot_config else "",
                 "support_bot_username": bot_config.support_bot_username if bot_config else ""
             }
+        else:
+            # Аккаунт RemnaWave ещё создаётся (или создание упало)
+            state = get_provisioning_state(user)
+            if state:
+                response["status"] = state
 
         return jsonify(response), 200
 
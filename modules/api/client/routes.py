@@ -13,103 +13,41 @@ API эндпоинты клиента
 from flask import request, jsonify
 from datetime import datetime, timezone, timedelta
 import requests
-import json
 import os
-import time
 
 from modules.core import get_app, get_db, get_cache, get_limiter, get_bcrypt
-from modules.auth import get_user_from_token
+from modules.remnawave import remnawave
+from modules.auth import get_user_from_token, blocked_response
+from modules.remnawave_snapshot import get_live_user, update_live_user, invalidate_live_user
+from modules.live_data import get_cached_live_data, fetch_live_user, store_live_data
 from modules.models.user import User
 from modules.models.promo import PromoCode
 from modules.models.referral import ReferralSetting
 from modules.models.user_config import UserConfig
 from modules.models.config_share import ConfigShareToken
-from modules.currency import convert_from_usd, convert_to_usd, parse_iso_datetime, convert_to_usd, parse_iso_datetime
+from modules.currency import convert_from_usd, convert_to_usd
 from modules.models.tariff import Tariff
-from modules.models.payment import Payment, PaymentSetting
+from modules.models.payment import Payment
 from modules.models.option import PurchaseOption
 from modules.models.branding import BrandingSetting
+from modules.settings_registry import get_settings
+from modules.provisioning import get_provisioning_state, STATE_PROVISIONING, STATE_FAILED
 from modules.core import get_fernet
-from modules.api.payments.base import decrypt_key, get_return_url
+from modules.api.payments.registry import get_provider
 
 app = get_app()
 
 
 def _get_site_name():
     """Название сервиса из брендинга для описаний платежей."""
-    b = BrandingSetting.query.first()
+    b = get_settings(BrandingSetting)
     return (b.site_name or '').strip() if b else ''
 
-# Глобальная сессия для Platega (сохранение cookies для обхода DDoS-Guard)
-_platega_session = None
-_platega_cookies_initialized = False
-
-def _get_platega_session():
-    """Получить или создать сессию для Platega"""
-    global _platega_session, _platega_cookies_initialized
-    if _platega_session is None:
-        _platega_session = requests.Session()
-        _platega_session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-            "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
-            "Connection": "keep-alive",
-            "Upgrade-Insecure-Requests": "1",
-        })
-    
-    # Предварительный запрос для получения cookies от DDoS-Guard (только один раз)
-    if not _platega_cookies_initialized:
-        try:
-            print("Platega: Initializing DDoS-Guard cookies...")
-            _platega_session.get("https://app.platega.io/", timeout=10)
-            _platega_cookies_initialized = True
-            print("Platega: DDoS-Guard cookies initialized")
-        except Exception as e:
-            print(f"Platega: Warning - failed to initialize cookies: {e}")
-    
-    return _platega_session
-
-def _reset_platega_cookies():
-    """Сбросить cookies Platega и получить новые"""
-    global _platega_cookies_initialized
-    session = _get_platega_session()
-    _platega_cookies_initialized = False
-    session.cookies.clear()
-    try:
-        session.get("https://app.platega.io/", timeout=10)
-        _platega_cookies_initialized = True
-        print("Platega: New DDoS-Guard cookies obtained")
-        return True
-    except Exception as e:
-        print(f"Platega: Failed to get new cookies: {e}")
-        return False
 db = get_db()
 cache = get_cache()
 limiter = get_limiter()
 
 
-def get_remnawave_headers(additional_headers=None):
-    """Получение заголовков для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    if additional_headers:
-        headers.update(additional_headers)
-    
-    return headers, cookies
-
-
 def _get_public_base_url_from_request() -> str:
     """
     Определить публичный base URL для callback/redirect.
@@ -128,94 +66,8 @@ def _get_public_base_url_from_request() -> str:
     return base.rstrip("/")
 
 
-def _try_reconcile_payment_if_needed(payment: Payment, user: User) -> bool:
-    """
-    Попытаться обработать платеж без webhook (полезно если callback_url был неверный).
-    Поддержка: platega/platega_mir + crystalpay.
-    Возвращает True если платеж был обработан (стал PAID / подписка обновлена).
-    """
-    try:
-        if not payment or payment.status == 'PAID':
-            return False
-        if not payment.payment_system_id:
-            return False
-
-        s = PaymentSetting.query.first()
-
-        # CrystalPay: invoice/info (state == payed)
-        if payment.payment_provider == 'crystalpay':
-            crystalpay_key = decrypt_key(getattr(s, 'crystalpay_api_key', None)) if s else None
-            crystalpay_secret = decrypt_key(getattr(s, 'crystalpay_api_secret', None)) if s else None
-            if not crystalpay_key or not crystalpay_secret:
-                return False
-            resp = requests.post(
-                "https://api.crystalpay.io/v3/invoice/info/",
-                json={"auth_login": crystalpay_key, "auth_secret": crystalpay_secret, "id": str(payment.payment_system_id)},
-                timeout=10
-            )
-            if not resp.ok:
-                return False
-            data = resp.json() or {}
-            if data.get("error") is True or data.get("errors"):
-                return False
-            state = (data.get("state") or "").lower()
-            if state != "payed":
-                return False
-
-        # Platega / MIR: transaction/{id} (status == CONFIRMED)
-        elif payment.payment_provider in ('platega', 'platega_mir'):
-            platega_key = decrypt_key(getattr(s, 'platega_api_key', None)) if s else None
-            platega_merchant_raw = decrypt_key(getattr(s, 'platega_merchant_id', None)) if s else None
-            if not platega_key or not platega_merchant_raw:
-                return False
-
-            platega_merchant = str(platega_merchant_raw).strip()
-            if platega_merchant.startswith('live_'):
-                platega_merchant = platega_merchant[5:]
-            import re
-            uuid_pattern = r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
-            uuid_match = re.search(uuid_pattern, platega_merchant)
-            if uuid_match:
-                platega_merchant = uuid_match.group(0)
-
-            resp = requests.get(
-                f"https://app.platega.io/transaction/{payment.payment_system_id}",
-                headers={"X-MerchantId": platega_merchant, "X-Secret": platega_key, "Content-Type": "application/json"},
-                timeout=10
-            )
-            if resp.status_code != 200:
-                return False
-            api_data = resp.json() or {}
-            status_upper = (api_data.get('status') or '').upper()
-            if status_upper not in ('CONFIRMED', 'PAID', 'SUCCESS', 'COMPLETED'):
-                return False
-        else:
-            return False
-
-        # Подтверждено: применяем эффект платежа
-        if payment.tariff_id is None:
-            amount_usd = convert_to_usd(payment.amount, payment.currency)
-            user.balance = (float(user.balance) if user.balance else 0.0) + float(amount_usd)
-            payment.status = 'PAID'
-            db.session.commit()
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
-            except Exception:
-                pass
-            return True
-
-        t = db.session.get(Tariff, payment.tariff_id)
-        if not t:
-            return False
-        from modules.api.webhooks.routes import process_successful_payment
-        return bool(process_successful_payment(payment, user, t))
-    except Exception:
-        return False
-
-
 def get_referral_settings():
-    return ReferralSetting.query.first()
+    return get_settings(ReferralSetting)
 
 
 # ============================================================================
@@ -361,16 +213,14 @@ def get_client_me():
     if not user:
         return jsonify({"message": "Ошибка аутентификации"}), 401
 
-    preferred_lang, preferred_currency = _user_prefs(user)
+    # Поля профиля - из кэшированного снимка; строка User загружается только при записи и в редких ветках
+    profile = user.principal
 
     # Проверяем блокировку аккаунта
-    if getattr(user, 'is_blocked', False):
-        return jsonify({
-            "message": "Account blocked",
-            "code": "ACCOUNT_BLOCKED",
-            "block_reason": getattr(user, 'block_reason', '') or "Ваш аккаунт заблокирован",
-            "blocked_at": user.blocked_at.isoformat() if hasattr(user, 'blocked_at') and user.blocked_at else None
-        }), 403
+    if profile.is_blocked:
+        return blocked_response(user)
+
+    preferred_lang, preferred_currency = _user_prefs(user)
 
     # В режиме multi-config у пользователя может быть несколько RemnaWave-аккаунтов.
     # Для бота/сайта по умолчанию работаем СТРОГО с основным конфигом (is_primary=True),
@@ -379,24 +229,28 @@ def get_client_me():
     try:
         from modules.models.user_config import UserConfig
 
-        primary_config = UserConfig.query.filter_by(user_id=user.id, is_primary=True).first()
-        if not primary_config and user.remnawave_uuid and '@' not in user.remnawave_uuid:
-            # Создаем основной конфиг для обратной совместимости
-            primary_config = UserConfig(
-                user_id=user.id,
-                remnawave_uuid=user.remnawave_uuid,
-                config_name='Основной конфиг',
-                is_primary=True
-            )
-            db.session.add(primary_config)
-            db.session.commit()
+        # UUID основного конфига - из кэшированного снимка (без запроса к user_config)
+        primary_uuid = user.primary_uuid
+        if not primary_uuid and user.remnawave_uuid and '@' not in user.remnawave_uuid:
+            primary_config = UserConfig.query.filter_by(user_id=user.id, is_primary=True).first()
+            if not primary_config:
+                # Создаем основной конфиг для обратной совместимости
+                primary_config = UserConfig(
+                    user_id=user.id,
+                    remnawave_uuid=user.remnawave_uuid,
+                    config_name='Основной конфиг',
+                    is_primary=True
+                )
+                db.session.add(primary_config)
+                db.session.commit()
+            primary_uuid = primary_config.remnawave_uuid
 
-        if primary_config and primary_config.remnawave_uuid:
-            current_uuid = primary_config.remnawave_uuid
+        if primary_uuid:
+            current_uuid = primary_uuid
             # Фиксируем user.remnawave_uuid в сторону primary, чтобы старый бот/сайт не "смотрели" на доп. конфиг.
-            if user.remnawave_uuid != primary_config.remnawave_uuid:
+            if user.remnawave_uuid != primary_uuid:
                 old_uuid = user.remnawave_uuid
-                user.remnawave_uuid = primary_config.remnawave_uuid
+                user.remnawave_uuid = primary_uuid
                 db.session.commit()
                 if old_uuid:
                     cache.delete(f'live_data_{old_uuid}')
@@ -412,9 +266,8 @@ def get_client_me():
         # Попытка найти полный UUID
         if os.getenv("API_URL") and os.getenv("ADMIN_TOKEN"):
             try:
-                resp = requests.get(
-                    f"{os.getenv('API_URL')}/api/users/by-short-uuid/{current_uuid}",
-                    headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
+                resp = remnawave.get(
+                    f"/api/users/by-short-uuid/{current_uuid}",
                     timeout=10
                 )
                 if resp.status_code == 200:
@@ -435,43 +288,27 @@ def get_client_me():
     cache_key = f'live_data_{current_uuid}'
     force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
 
-    # Если есть свежий PENDING-платеж — пытаемся обработать его и принудительно обновляем данные,
-    # чтобы бот/сайт не "зависали" на оплате.
-    try:
-        recent_pending = Payment.query.filter_by(user_id=user.id).filter(Payment.status != 'PAID').order_by(Payment.created_at.desc()).first()
-        if recent_pending and recent_pending.created_at:
-            now_utc = datetime.now(timezone.utc)
-            pending_dt = recent_pending.created_at
-            if pending_dt.tzinfo is None:
-                pending_dt = pending_dt.replace(tzinfo=timezone.utc)
-            if pending_dt > (now_utc - timedelta(hours=6)):
-                if _try_reconcile_payment_if_needed(recent_pending, user):
-                    # После успешной обработки — обновим live_data из RemnaWave
-                    force_refresh = True
-                else:
-                    # Даже если не удалось — не отдаём 5-минутный кеш сразу после оплаты
-                    force_refresh = True
-    except Exception:
-        pass
-
+    # Оплата (вебхук или фоновая сверка modules.payment_reconcile) сама сбрасывает live_data_{uuid},
+    # поэтому проверять здесь ожидающие платежи не нужно
     if not force_refresh:
-        cached = cache.get(cache_key)
+        # stale-while-revalidate: устаревшая запись отдаётся сразу, обновление — в фоне
+        cached = get_cached_live_data(current_uuid)
         if cached:
             if isinstance(cached, dict):
                 cached = cached.copy()
-                balance_usd = float(user.balance) if user.balance else 0.0
+                balance_usd = profile.balance
                 balance_converted = convert_from_usd(balance_usd, preferred_currency)
                 # Нормализуем трафик
                 traffic_data = _normalize_traffic_data(cached)
                 cached.update({
-                    'referral_code': user.referral_code,
+                    'referral_code': profile.referral_code,
                     'preferred_lang': preferred_lang,
                     'preferred_currency': preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
+                    'telegram_id': profile.telegram_id,
+                    'telegram_username': profile.telegram_username,
                     'balance_usd': balance_usd,
                     'balance': balance_converted,
-                    'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
+                    'trial_used': profile.trial_used,  # Добавляем информацию об использовании триала
                     **traffic_data  # Добавляем нормализованные данные трафика
                 })
             return jsonify({"response": cached}), 200
@@ -485,22 +322,28 @@ def get_client_me():
 
         # Нет UUID — отдаём только данные из нашей БД, без вызова RemnaWave
         if not current_uuid or not str(current_uuid).strip():
-            balance_usd = float(user.balance) if user.balance else 0.0
+            balance_usd = profile.balance
             basic_data = {
                 'uuid': '',
                 'email': getattr(user, 'email', ''),
-                'referral_code': user.referral_code,
+                'referral_code': profile.referral_code,
                 'preferred_lang': preferred_lang,
                 'preferred_currency': preferred_currency,
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
+                'telegram_id': profile.telegram_id,
+                'telegram_username': profile.telegram_username,
                 'password_hash': user.password_hash if user.password_hash else '',
                 'balance_usd': balance_usd,
                 'balance': convert_from_usd(balance_usd, preferred_currency),
-                'trial_used': getattr(user, 'trial_used', False),
+                'trial_used': profile.trial_used,
                 'subscription': None,
                 'warning': 'UUID не задан. Обратитесь к администратору.'
             }
+            # Аккаунт RemnaWave создаётся фоновой задачей после регистрации через бота
+            state = get_provisioning_state(user)
+            if state == STATE_PROVISIONING:
+                basic_data.update(status=state, provisioning=True, warning='Аккаунт создаётся, обновите через несколько секунд.')
+            elif state == STATE_FAILED:
+                basic_data.update(status=state, provisioning=False)
             return jsonify({"response": basic_data}), 200
 
         api_url = os.getenv('API_URL') or ''
@@ -509,190 +352,196 @@ def get_client_me():
             cached = cache.get(cache_key)
             if cached and isinstance(cached, dict):
                 cached = cached.copy()
-                balance_usd = float(user.balance) if user.balance else 0.0
+                balance_usd = profile.balance
                 traffic_data = _normalize_traffic_data(cached)
                 cached.update({
-                    'referral_code': user.referral_code,
+                    'referral_code': profile.referral_code,
                     'preferred_lang': preferred_lang,
                     'preferred_currency': preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
+                    'telegram_id': profile.telegram_id,
+                    'telegram_username': profile.telegram_username,
                     'balance_usd': balance_usd,
                     'balance': convert_from_usd(balance_usd, preferred_currency),
-                    'trial_used': getattr(user, 'trial_used', False),
+                    'trial_used': profile.trial_used,
                     **traffic_data
                 })
                 return jsonify({"response": cached}), 200
-            balance_usd = float(user.balance) if user.balance else 0.0
+            balance_usd = profile.balance
             basic_data = {
                 'uuid': current_uuid or '',
                 'email': getattr(user, 'email', ''),
-                'referral_code': user.referral_code,
+                'referral_code': profile.referral_code,
                 'preferred_lang': preferred_lang,
                 'preferred_currency': preferred_currency,
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
+                'telegram_id': profile.telegram_id,
+                'telegram_username': profile.telegram_username,
                 'password_hash': user.password_hash if user.password_hash else '',
                 'balance_usd': balance_usd,
                 'balance': convert_from_usd(balance_usd, preferred_currency),
-                'trial_used': getattr(user, 'trial_used', False),
+                'trial_used': profile.trial_used,
                 'subscription': None,
                 'warning': 'RemnaWave API не настроен (API_URL).'
             }
             return jsonify({"response": basic_data}), 200
 
-        resp = requests.get(
-            f"{api_url.rstrip('/')}/api/users/{current_uuid}",
-            headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN') or ''}"},
-            timeout=10
-        )
+        data = None
+        if not force_refresh:
+            # Запись из общего снимка RemnaWave (обновляется фоном) — без отдельного запроса к API
+            snapshot_user = get_live_user(current_uuid, build=False)
+            if snapshot_user:
+                data = dict(snapshot_user)
 
-        if resp.status_code != 200:
-            if resp.status_code == 404:
-                # Если пользователь не найден в RemnaWave, проверяем кэш
+        if data is None:
+            resp = fetch_live_user(current_uuid)
+
+            if resp.status_code != 200:
+                if resp.status_code == 404:
+                    # Если пользователь не найден в RemnaWave, проверяем кэш
+                    cached = cache.get(cache_key)
+                    if cached:
+                        if isinstance(cached, dict):
+                            cached = cached.copy()
+                            balance_usd = profile.balance
+                            # Нормализуем трафик
+                            traffic_data = _normalize_traffic_data(cached)
+                            cached.update({
+                                'referral_code': profile.referral_code,
+                                'preferred_lang': preferred_lang,
+                                'preferred_currency': preferred_currency,
+                                'telegram_id': profile.telegram_id,
+                                'telegram_username': profile.telegram_username,
+                                'balance_usd': balance_usd,
+                                'balance': convert_from_usd(balance_usd, preferred_currency),
+                                'trial_used': profile.trial_used,  # Добавляем информацию об использовании триала
+                                **traffic_data  # Добавляем нормализованные данные трафика
+                            })
+                        return jsonify({"response": cached}), 200
+                
+                    # Если кэша нет, возвращаем базовую информацию из нашей БД
+                    balance_usd = profile.balance
+                    balance_converted = convert_from_usd(balance_usd, preferred_currency)
+                
+                    # Возвращаем минимальную информацию о пользователе
+                    basic_data = {
+                        'uuid': current_uuid,
+                        'email': user.email,
+                        'referral_code': profile.referral_code,
+                        'preferred_lang': preferred_lang,
+                        'preferred_currency': preferred_currency,
+                        'telegram_id': profile.telegram_id,
+                        'telegram_username': profile.telegram_username,
+                        'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
+                        'balance_usd': balance_usd,
+                        'balance': balance_converted,
+                        'trial_used': profile.trial_used,  # Добавляем информацию об использовании триала
+                        'subscription': None,  # Нет подписки, т.к. пользователь не найден в RemnaWave
+                        'warning': 'Пользователь не найден в RemnaWave API. Обратитесь к администратору.'
+                    }
+                
+                    return jsonify({"response": basic_data}), 200
+                # RemnaWave вернул 5xx или другой код — не отдаём 500 клиенту, отдаём кэш или basic_data
+                print(f"[client/me] RemnaWave returned {resp.status_code}, falling back to cache/basic_data")
                 cached = cache.get(cache_key)
-                if cached:
-                    if isinstance(cached, dict):
-                        cached = cached.copy()
-                        balance_usd = float(user.balance) if user.balance else 0.0
-                        # Нормализуем трафик
-                        traffic_data = _normalize_traffic_data(cached)
-                        cached.update({
-                            'referral_code': user.referral_code,
-                            'preferred_lang': preferred_lang,
-                            'preferred_currency': preferred_currency,
-                            'telegram_id': user.telegram_id,
-                            'telegram_username': user.telegram_username,
-                            'balance_usd': balance_usd,
-                            'balance': convert_from_usd(balance_usd, preferred_currency),
-                            'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
-                            **traffic_data  # Добавляем нормализованные данные трафика
-                        })
+                if cached and isinstance(cached, dict):
+                    cached = cached.copy()
+                    balance_usd = profile.balance
+                    traffic_data = _normalize_traffic_data(cached)
+                    cached.update({
+                        'referral_code': profile.referral_code,
+                        'preferred_lang': preferred_lang,
+                        'preferred_currency': preferred_currency,
+                        'telegram_id': profile.telegram_id,
+                        'telegram_username': profile.telegram_username,
+                        'balance_usd': balance_usd,
+                        'balance': convert_from_usd(balance_usd, preferred_currency),
+                        'trial_used': profile.trial_used,
+                        **traffic_data
+                    })
                     return jsonify({"response": cached}), 200
-                
-                # Если кэша нет, возвращаем базовую информацию из нашей БД
-                balance_usd = float(user.balance) if user.balance else 0.0
-                balance_converted = convert_from_usd(balance_usd, preferred_currency)
-                
-                # Возвращаем минимальную информацию о пользователе
+                balance_usd = profile.balance
                 basic_data = {
                     'uuid': current_uuid,
                     'email': user.email,
-                    'referral_code': user.referral_code,
+                    'referral_code': profile.referral_code,
                     'preferred_lang': preferred_lang,
                     'preferred_currency': preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
-                    'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
+                    'telegram_id': profile.telegram_id,
+                    'telegram_username': profile.telegram_username,
+                    'password_hash': user.password_hash if user.password_hash else '',
                     'balance_usd': balance_usd,
-                    'balance': balance_converted,
-                    'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
-                    'subscription': None,  # Нет подписки, т.к. пользователь не найден в RemnaWave
-                    'warning': 'Пользователь не найден в RemnaWave API. Обратитесь к администратору.'
+                    'balance': convert_from_usd(balance_usd, preferred_currency),
+                    'trial_used': profile.trial_used,
+                    'subscription': None,
+                    'warning': f'RemnaWave API вернул {resp.status_code}. Данные из кэша панели.'
                 }
-                
                 return jsonify({"response": basic_data}), 200
-            # RemnaWave вернул 5xx или другой код — не отдаём 500 клиенту, отдаём кэш или basic_data
-            print(f"[client/me] RemnaWave returned {resp.status_code}, falling back to cache/basic_data")
-            cached = cache.get(cache_key)
-            if cached and isinstance(cached, dict):
-                cached = cached.copy()
-                balance_usd = float(user.balance) if user.balance else 0.0
-                traffic_data = _normalize_traffic_data(cached)
-                cached.update({
-                    'referral_code': user.referral_code,
-                    'preferred_lang': preferred_lang,
-                    'preferred_currency': preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
-                    'balance_usd': balance_usd,
-                    'balance': convert_from_usd(balance_usd, preferred_currency),
-                    'trial_used': getattr(user, 'trial_used', False),
-                    **traffic_data
-                })
-                return jsonify({"response": cached}), 200
-            balance_usd = float(user.balance) if user.balance else 0.0
-            basic_data = {
-                'uuid': current_uuid,
-                'email': user.email,
-                'referral_code': user.referral_code,
-                'preferred_lang': preferred_lang,
-                'preferred_currency': preferred_currency,
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
-                'password_hash': user.password_hash if user.password_hash else '',
-                'balance_usd': balance_usd,
-                'balance': convert_from_usd(balance_usd, preferred_currency),
-                'trial_used': getattr(user, 'trial_used', False),
-                'subscription': None,
-                'warning': f'RemnaWave API вернул {resp.status_code}. Данные из кэша панели.'
-            }
-            return jsonify({"response": basic_data}), 200
 
-        try:
-            response_data = resp.json()
-        except (ValueError, requests.RequestException) as e:
-            print(f"[client/me] RemnaWave response not JSON: {e}")
-            cached = cache.get(cache_key)
-            if cached and isinstance(cached, dict):
-                cached = cached.copy()
-                balance_usd = float(user.balance) if user.balance else 0.0
-                traffic_data = _normalize_traffic_data(cached)
-                cached.update({
-                    'referral_code': user.referral_code,
+            try:
+                response_data = resp.json()
+            except (ValueError, requests.RequestException) as e:
+                print(f"[client/me] RemnaWave response not JSON: {e}")
+                cached = cache.get(cache_key)
+                if cached and isinstance(cached, dict):
+                    cached = cached.copy()
+                    balance_usd = profile.balance
+                    traffic_data = _normalize_traffic_data(cached)
+                    cached.update({
+                        'referral_code': profile.referral_code,
+                        'preferred_lang': preferred_lang,
+                        'preferred_currency': preferred_currency,
+                        'telegram_id': profile.telegram_id,
+                        'telegram_username': profile.telegram_username,
+                        'balance_usd': balance_usd,
+                        'balance': convert_from_usd(balance_usd, preferred_currency),
+                        'trial_used': profile.trial_used,
+                        **traffic_data
+                    })
+                    return jsonify({"response": cached}), 200
+                balance_usd = profile.balance
+                basic_data = {
+                    'uuid': current_uuid,
+                    'email': user.email,
+                    'referral_code': profile.referral_code,
                     'preferred_lang': preferred_lang,
                     'preferred_currency': preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
+                    'telegram_id': profile.telegram_id,
+                    'telegram_username': profile.telegram_username,
+                    'password_hash': user.password_hash if user.password_hash else '',
                     'balance_usd': balance_usd,
                     'balance': convert_from_usd(balance_usd, preferred_currency),
-                    'trial_used': getattr(user, 'trial_used', False),
-                    **traffic_data
-                })
-                return jsonify({"response": cached}), 200
-            balance_usd = float(user.balance) if user.balance else 0.0
-            basic_data = {
-                'uuid': current_uuid,
-                'email': user.email,
-                'referral_code': user.referral_code,
-                'preferred_lang': preferred_lang,
-                'preferred_currency': preferred_currency,
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
-                'password_hash': user.password_hash if user.password_hash else '',
-                'balance_usd': balance_usd,
-                'balance': convert_from_usd(balance_usd, preferred_currency),
-                'trial_used': getattr(user, 'trial_used', False),
-                'subscription': None,
-                'warning': 'Не удалось получить данные из RemnaWave.'
-            }
-            return jsonify({"response": basic_data}), 200
+                    'trial_used': profile.trial_used,
+                    'subscription': None,
+                    'warning': 'Не удалось получить данные из RemnaWave.'
+                }
+                return jsonify({"response": basic_data}), 200
 
-        data = response_data.get('response', {}) if isinstance(response_data, dict) else response_data
-        if not isinstance(data, dict):
-            data = {}
+            data = response_data.get('response', {}) if isinstance(response_data, dict) else response_data
+            if not isinstance(data, dict):
+                data = {}
+            # Свежая запись — сразу в общий снимок, чтобы админка/рассылки видели актуальные данные
+            update_live_user(dict(data))
 
         if data is not None:
-            balance_usd = float(user.balance) if user.balance else 0.0
+            balance_usd = profile.balance
             balance_converted = convert_from_usd(balance_usd, preferred_currency)
             
             # Нормализуем трафик
             traffic_data = _normalize_traffic_data(data)
             
             data.update({
-                'referral_code': user.referral_code,
+                'referral_code': profile.referral_code,
                 'preferred_lang': preferred_lang,
                 'preferred_currency': preferred_currency,
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
+                'telegram_id': profile.telegram_id,
+                'telegram_username': profile.telegram_username,
                 'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
                 'balance_usd': balance_usd,
                 'balance': balance_converted,
-                'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
+                'trial_used': profile.trial_used,  # Добавляем информацию об использовании триала
                 **traffic_data  # Добавляем нормализованные данные трафика
             })
 
-        cache.set(cache_key, data, timeout=300)
+        store_live_data(current_uuid, data)
         return jsonify({"response": data}), 200
         
     except requests.RequestException as e:
@@ -700,37 +549,37 @@ def get_client_me():
         if cached:
             if isinstance(cached, dict):
                 cached = cached.copy()
-                balance_usd = float(user.balance) if user.balance else 0.0
+                balance_usd = profile.balance
                 # Нормализуем трафик
                 traffic_data = _normalize_traffic_data(cached)
                 cached.update({
-                    'referral_code': user.referral_code,
+                    'referral_code': profile.referral_code,
                     'preferred_lang': preferred_lang,
                     'preferred_currency': preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
+                    'telegram_id': profile.telegram_id,
+                    'telegram_username': profile.telegram_username,
                     'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
                     'balance_usd': balance_usd,
                     'balance': convert_from_usd(balance_usd, preferred_currency),
-                    'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
+                    'trial_used': profile.trial_used,  # Добавляем информацию об использовании триала
                     **traffic_data  # Добавляем нормализованные данные трафика
                 })
             return jsonify({"response": cached}), 200
         # Нет кэша — отдаём basic_data, не 500
         print(f"[client/me] RequestException (no cache): {e}")
-        balance_usd = float(user.balance) if user.balance else 0.0
+        balance_usd = profile.balance
         basic_data = {
             'uuid': current_uuid or '',
             'email': getattr(user, 'email', ''),
-            'referral_code': user.referral_code,
+            'referral_code': profile.referral_code,
             'preferred_lang': preferred_lang,
             'preferred_currency': preferred_currency,
-            'telegram_id': user.telegram_id,
-            'telegram_username': user.telegram_username,
+            'telegram_id': profile.telegram_id,
+            'telegram_username': profile.telegram_username,
             'password_hash': user.password_hash if user.password_hash else '',
             'balance_usd': balance_usd,
             'balance': convert_from_usd(balance_usd, preferred_currency),
-            'trial_used': getattr(user, 'trial_used', False),
+            'trial_used': profile.trial_used,
             'subscription': None,
             'warning': f'Ошибка подключения к RemnaWave: {str(e)[:80]}. Данные из панели.'
         }
@@ -740,33 +589,33 @@ def get_client_me():
         cached = cache.get(cache_key)
         if cached and isinstance(cached, dict):
             cached = cached.copy()
-            balance_usd = float(user.balance) if user.balance else 0.0
+            balance_usd = profile.balance
             traffic_data = _normalize_traffic_data(cached)
             cached.update({
-                'referral_code': user.referral_code,
+                'referral_code': profile.referral_code,
                 'preferred_lang': preferred_lang,
                 'preferred_currency': preferred_currency,
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
+                'telegram_id': profile.telegram_id,
+                'telegram_username': profile.telegram_username,
                 'balance_usd': balance_usd,
                 'balance': convert_from_usd(balance_usd, preferred_currency),
-                'trial_used': getattr(user, 'trial_used', False),
+                'trial_used': profile.trial_used,
                 **traffic_data
             })
             return jsonify({"response": cached}), 200
-        balance_usd = float(user.balance) if user.balance else 0.0
+        balance_usd = profile.balance
         basic_data = {
             'uuid': current_uuid or '',
             'email': getattr(user, 'email', ''),
-            'referral_code': user.referral_code,
+            'referral_code': profile.referral_code,
             'preferred_lang': preferred_lang,
             'preferred_currency': preferred_currency,
-            'telegram_id': user.telegram_id,
-            'telegram_username': user.telegram_username,
+            'telegram_id': profile.telegram_id,
+            'telegram_username': profile.telegram_username,
             'password_hash': user.password_hash if user.password_hash else '',
             'balance_usd': balance_usd,
             'balance': convert_from_usd(balance_usd, preferred_currency),
-            'trial_used': getattr(user, 'trial_used', False),
+            'trial_used': profile.trial_used,
             'subscription': None,
             'warning': 'Временная ошибка. Настройки языка и валюты сохранены.'
         }
@@ -802,9 +651,6 @@ def get_client_configs():
             UserConfig.created_at.asc()
         ).all()
 
-        API_URL = os.getenv('API_URL')
-        headers, cookies = get_remnawave_headers()
-
         out = []
         for cfg in configs:
             cache_key = f'live_data_{cfg.remnawave_uuid}'
@@ -812,19 +658,17 @@ def get_client_configs():
             if not isinstance(data, dict):
                 data = None
 
-            if not data and API_URL:
+            if not data and remnawave.base_url:
                 try:
-                    resp = requests.get(
-                        f"{API_URL}/api/users/{cfg.remnawave_uuid}",
-                        headers=headers,
-                        cookies=cookies,
+                    resp = remnawave.get(
+                        f"/api/users/{cfg.remnawave_uuid}",
                         timeout=10
                     )
                     if resp.status_code == 200:
                         payload = resp.json() or {}
                         data = payload.get('response', payload) if isinstance(payload, dict) else None
                         if isinstance(data, dict):
-                            cache.set(cache_key, data, timeout=300)
+                            store_live_data(cfg.remnawave_uuid, data)
                 except Exception:
                     data = None
 
@@ -941,7 +785,7 @@ def create_option_payment():
                 payment_db.status = "PAID"
                 db.session.commit()
                 # Обновляем баланс пользователя в ответе
-                db.session.refresh(user)
+                db.session.refresh(user.orm)
                 return jsonify({
                     "payment_url": None,
                     "payment_system_id": None,
@@ -1014,7 +858,7 @@ def create_option_payment():
 @app.route('/api/client/activate-trial', methods=['POST'])
 def activate_trial():
     """Активация триала"""
-    from modules.models.trial import get_trial_settings
+    from modules.models.trial import TrialSettings, get_trial_settings
     
     user = get_user_from_token()
     if not user:
@@ -1023,12 +867,12 @@ def activate_trial():
     try:
         # Проверяем, использовал ли пользователь уже триал
         # Проверяем напрямую в БД, так как hasattr может не работать правильно
-        db.session.refresh(user)
+        db.session.refresh(user.orm)
         if hasattr(user, 'trial_used') and user.trial_used:
             return jsonify({"message": "Trial already used"}), 400
         
         # Получаем настройки триала из БД
-        trial_settings = get_trial_settings()
+        trial_settings = get_settings(TrialSettings) or get_trial_settings()
         
         if not trial_settings.enabled:
             return jsonify({"message": "Trial is currently disabled"}), 400
@@ -1077,9 +921,7 @@ def activate_trial():
         if trial_settings.traffic_limit_bytes > 0:
             patch_payload["trafficLimitBytes"] = trial_settings.traffic_limit_bytes
 
-        headers, cookies = get_remnawave_headers()
-        resp = requests.patch(f"{os.getenv('API_URL')}/api/users", headers=headers, cookies=cookies,
-                    json=patch_payload)
+        resp = remnawave.patch("/api/users", json=patch_payload)
         
         if resp.status_code != 200:
             return jsonify({"message": "Failed to activate trial"}), 500
@@ -1090,7 +932,7 @@ def activate_trial():
         
         # Очищаем кэш для основного конфига
         cache.delete(f'live_data_{remnawave_uuid}')
-        cache.delete('all_live_users_map')
+        invalidate_live_user(remnawave_uuid)
         cache.delete(f'nodes_{remnawave_uuid}')
         
         # Очищаем кэш для основного конфига пользователя (если отличается)
@@ -1143,7 +985,7 @@ def set_settings():
         if updated:
             db.session.commit()
             cache.delete(f'live_data_{user.remnawave_uuid}')
-            cache.delete('all_live_users_map')
+            invalidate_live_user(user.remnawave_uuid)
             print(f"[client/settings] Saved user_id={user.id} preferred_lang={user.preferred_lang} preferred_currency={user.preferred_currency}")
 
         return jsonify({
@@ -1266,11 +1108,8 @@ def get_client_nodes():
             return jsonify(cached), 200
     
     try:
-        headers, cookies = get_remnawave_headers()
-        resp = requests.get(
-            f"{os.getenv('API_URL')}/api/users/{user.remnawave_uuid}/accessible-nodes",
-            headers=headers,
-            cookies=cookies,
+        resp = remnawave.get(
+            f"/api/users/{user.remnawave_uuid}/accessible-nodes",
             timeout=10
         )
         resp.raise_for_status()
@@ -1382,8 +1221,7 @@ def activate_promocode():
             return jsonify({"message": "Promo code is no longer valid"}), 400
 
         if promo.promo_type == 'DAYS':
-            headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-            resp = requests.get(f"{os.getenv('API_URL')}/api/users/{user.remnawave_uuid}", headers=headers)
+            resp = remnawave.get(f"/api/users/{user.remnawave_uuid}")
 
             if resp.status_code == 200:
                 user_data = resp.json().get('response', {})
@@ -1394,9 +1232,8 @@ def activate_promocode():
                 else:
                     new_expire_dt = datetime.now(timezone.utc) + timedelta(days=promo.value)
 
-                update_resp = requests.patch(
-                    f"{os.getenv('API_URL')}/api/users",
-                    headers=headers,
+                update_resp = remnawave.patch(
+                    "/api/users",
                     json={"uuid": user.remnawave_uuid, "expireAt": new_expire_dt.isoformat()}
                 )
 
@@ -1423,18 +1260,6 @@ def activate_promocode():
         return jsonify({"message": "Internal Error"}), 500
 
 
-def decrypt_key(key):
-    """Расшифровка ключа"""
-    from modules.core import get_fernet
-    fernet = get_fernet()
-    if not key or not fernet:
-        return ""
-    try:
-        return fernet.decrypt(key).decode('utf-8')
-    except:
-        return ""
-
-
 # ============================================================================
 # PURCHASE WITH BALANCE
 # ============================================================================
@@ -1457,7 +1282,6 @@ def purchase_with_balance():
         if not tariff_id:
             return jsonify({"message": "tariff_id is required"}), 400
         
-        from modules.models.tariff import Tariff
         from modules.models.payment import Payment
         t = db.session.get(Tariff, tariff_id)
         if not t:
@@ -1551,9 +1375,6 @@ def purchase_with_balance():
         db.session.commit()
         
         # Получаем актуальную дату истечения после активации
-        API_URL = os.getenv('API_URL')
-        h, c = get_remnawave_headers()
-        
         # Определяем remnawave_uuid для получения новой даты
         remnawave_uuid_to_check = user.remnawave_uuid
         if user_config:
@@ -1568,7 +1389,7 @@ def purchase_with_balance():
         # Получаем актуальную дату истечения
         new_expire_date = None
         try:
-            resp = requests.get(f"{API_URL}/api/users/{remnawave_uuid_to_check}", headers=h, cookies=c, timeout=10)
+            resp = remnawave.get(f"/api/users/{remnawave_uuid_to_check}", timeout=10)
             if resp.status_code == 200:
                 live_data = resp.json().get('response', {})
                 new_expire_date = live_data.get('expireAt')
@@ -1578,7 +1399,7 @@ def purchase_with_balance():
         # Очищаем кэш
         cache.delete(f'live_data_{user.remnawave_uuid}')
         cache.delete(f'nodes_{user.remnawave_uuid}')
-        cache.delete('all_live_users_map')
+        invalidate_live_user(user.remnawave_uuid)
         
         # Если создали новый конфиг, очищаем кэш для него тоже
         if create_new_config:
@@ -1608,6 +1429,18 @@ def purchase_with_balance():
 # CREATE PAYMENT
 # ============================================================================
 
+def _provider_unavailable(payment_provider, currency, payment_settings):
+    """Ответ 400, если способ оплаты недоступен для платежа в этой валюте, иначе None"""
+    if get_provider(payment_provider) is None:
+        return jsonify({"message": f"Неподдерживаемый способ оплаты: {payment_provider}"}), 400
+    if payment_provider in ('yookassa', 'yoomoney') and currency != 'RUB':
+        provider_name = 'YooKassa' if payment_provider == 'yookassa' else 'YooMoney'
+        return jsonify({"message": f"{provider_name} поддерживает только валюту RUB. Пожалуйста, выберите другую платежную систему или измените валюту на RUB."}), 400
+    if payment_provider == 'platega_mir' and not getattr(payment_settings, 'platega_mir_enabled', False):
+        return jsonify({"message": "Platega MIR is disabled"}), 400
+    return None
+
+
 @app.route('/api/client/create-payment', methods=['POST'])
 def create_payment():
     """Создание платежа (тариф или пополнение баланса)"""
@@ -1634,7 +1467,7 @@ def create_payment():
                 return jsonify({"message": "Неверная сумма"}), 400
             
             from modules.models.payment import PaymentSetting, Payment
-            s = PaymentSetting.query.first()
+            s = get_settings(PaymentSetting)
             order_id = f"u{user.id}-balance-{int(datetime.now().timestamp())}"
             payment_url = None
             payment_system_id = None
@@ -1652,378 +1485,24 @@ def create_payment():
             currency_code_map = {"uah": "UAH", "rub": "RUB", "usd": "USD"}
             cp_currency = currency_code_map.get(currency.lower(), "UAH")
             
-            if payment_provider == 'crystalpay':
-                crystalpay_key = decrypt_key(s.crystalpay_api_key) if s else None
-                crystalpay_secret = decrypt_key(s.crystalpay_api_secret) if s else None
-                if not crystalpay_key or crystalpay_key == "DECRYPTION_ERROR" or not crystalpay_secret or crystalpay_secret == "DECRYPTION_ERROR":
-                    return jsonify({"message": "CrystalPay не настроен"}), 500
-                
-                payload = {
-                    "auth_login": crystalpay_key,
-                    "auth_secret": crystalpay_secret,
-                    "amount": f"{float(amount):.2f}",
-                    "type": "purchase",
-                    "currency": cp_currency,
-                    "lifetime": 60,
-                    "extra": order_id,
-                    "callback_url": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/crystalpay",
-                    "redirect_url": redirect_url
-                }
-                
-                resp = requests.post("https://api.crystalpay.io/v3/invoice/create/", json=payload, timeout=10)
-                if resp.ok:
-                    data = resp.json()
-                    if not data.get('errors'):
-                        payment_url = data.get('url')
-                        payment_system_id = data.get('id')
-                    else:
-                        print(f"CrystalPay Error for balance topup: {data.get('errors')}")
-                else:
-                    print(f"CrystalPay API Error: {resp.status_code} - {resp.text}")
-            
-            elif payment_provider == 'heleket':
-                heleket_key = decrypt_key(s.heleket_api_key) if s else None
-                if not heleket_key or heleket_key == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Heleket API key not configured"}), 500
-                
-                heleket_currency = cp_currency
-                to_currency = None
-                
-                if cp_currency == 'USD':
-                    heleket_currency = "USD"
-                else:
-                    heleket_currency = "USD"
-                    to_currency = "USDT"
-                
-                payload = {
-                    "amount": f"{float(amount):.2f}",
-                    "currency": heleket_currency,
-                    "order_id": order_id,
-                    "url_return": redirect_url,
-                    "url_callback": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/heleket"
-                }
-                
-                if to_currency:
-                    payload["to_currency"] = to_currency
-                
-                headers = {
-                    "Authorization": f"Bearer {heleket_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                resp = requests.post("https://api.heleket.com/v1/payment", json=payload, headers=headers, timeout=10)
-                if resp.ok:
-                    data = resp.json()
-                    if data.get('state') == 0 and data.get('result'):
-                        result = data.get('result', {})
-                        payment_url = result.get('url')
-                        payment_system_id = result.get('uuid')
-                    else:
-                        print(f"Heleket Error for balance topup: {data.get('message')}")
-                else:
-                    print(f"Heleket API Error: {resp.status_code} - {resp.text}")
-            
-            elif payment_provider == 'yookassa':
-                if cp_currency != 'RUB':
-                    return jsonify({"message": "YooKassa поддерживает только валюту RUB. Пожалуйста, выберите другую платежную систему или измените валюту на RUB."}), 400
-                
-                # Используем универсальную функцию создания платежа
-                from modules.api.payments import create_payment as create_payment_provider
-                
-                payment_url, payment_system_id = create_payment_provider(
-                    provider='yookassa',
-                    amount=float(amount),
-                    currency='RUB',
-                    order_id=order_id,
-                    user_email=user.email,
-                    description=f"Пополнение баланса на сумму {float(amount):.2f} RUB",
-                    source='website'  # Платеж с сайта, возврат на сайт
-                )
-                
-                if not payment_url:
-                    error_msg = payment_system_id or "Failed to create YooKassa payment"
-                    print(f"YooKassa Error: {error_msg}")
-                    return jsonify({"message": error_msg}), 500
-
-            elif payment_provider == 'yoomoney':
-                if cp_currency != 'RUB':
-                    return jsonify({"message": "YooMoney поддерживает только валюту RUB. Пожалуйста, выберите другую платежную систему или измените валюту на RUB."}), 400
-
-                from modules.api.payments import create_payment as create_payment_provider
-                payment_url, payment_system_id = create_payment_provider(
-                    provider='yoomoney',
-                    amount=float(amount),
-                    currency='RUB',
-                    order_id=order_id,
-                    description=f"Пополнение баланса {service_name} #{order_id}",
-                    source='website'
-                )
-
-                if not payment_url:
-                    error_msg = payment_system_id or "Failed to create YooMoney payment"
-                    print(f"YooMoney Error: {error_msg}")
-                    return jsonify({"message": error_msg}), 500
-            
-            elif payment_provider == 'telegram_stars':
-                bot_token = decrypt_key(s.telegram_bot_token) if s else None
-                if not bot_token or bot_token == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Telegram Bot Token not configured"}), 500
-                
-                stars_amount = int(float(amount) * 100)
-                if cp_currency == 'UAH':
-                    stars_amount = int(float(amount) * 2.7)
-                elif cp_currency == 'RUB':
-                    stars_amount = int(float(amount) * 1.1)
-                elif cp_currency == 'USD':
-                    stars_amount = int(float(amount) * 100)
-                
-                if stars_amount < 1:
-                    stars_amount = 1
-                
-                invoice_payload = {
-                    "title": f"Пополнение баланса {service_name}",
-                    "description": f"Пополнение баланса на сумму {float(amount):.2f} {cp_currency}",
-                    "payload": order_id,
-                    "provider_token": "",
-                    "currency": "XTR",
-                    "prices": [
-                        {
-                            "label": f"Пополнение баланса {float(amount):.2f} {cp_currency}",
-                            "amount": stars_amount
-                        }
-                    ]
-                }
-                
-                resp = requests.post(
-                    f"https://api.telegram.org/bot{bot_token}/createInvoiceLink",
-                    json=invoice_payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=10
-                )
-                if resp.ok:
-                    data = resp.json()
-                    if data.get('ok'):
-                        payment_url = data.get('result')
-                        payment_system_id = order_id
-                    else:
-                        print(f"Telegram Stars Error for balance topup: {data.get('description')}")
-                else:
-                    print(f"Telegram Stars API Error: {resp.status_code} - {resp.text}")
-            
-            elif payment_provider == 'freekassa':
-                freekassa_shop_id = decrypt_key(s.freekassa_shop_id) if s else None
-                freekassa_secret = decrypt_key(s.freekassa_secret) if s else None
-                if not freekassa_shop_id or not freekassa_secret or freekassa_shop_id == "DECRYPTION_ERROR" or freekassa_secret == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Freekassa credentials not configured"}), 500
-                
-                import hashlib
-                merchant_id = freekassa_shop_id
-                secret = freekassa_secret
-                freekassa_currency_map = {"RUB": "RUB", "USD": "USD", "EUR": "EUR", "UAH": "UAH", "KZT": "KZT"}
-                freekassa_currency = freekassa_currency_map.get(cp_currency, "RUB")
-                
-                sign_str = f"{merchant_id}:{float(amount)}:{secret}:{order_id}"
-                sign = hashlib.md5(sign_str.encode()).hexdigest()
-                
-                payment_url = f"https://pay.freekassa.ru/?m={merchant_id}&oa={float(amount)}&o={order_id}&s={sign}&currency={freekassa_currency}"
-                payment_system_id = order_id
-
-            elif payment_provider == 'kassa_ai':
-                from modules.api.payments import create_payment as create_payment_provider
-                from modules.api.payments.base import get_callback_url
-                payment_url, payment_system_id = create_payment_provider(
-                    provider='kassa_ai',
-                    amount=float(amount),
-                    currency=cp_currency,
-                    order_id=order_id,
-                    user_email=user.email if user else None,
-                    ip=request.remote_addr,
-                    notification_url=get_callback_url('kassa_ai'),
-                )
-                if not payment_url:
-                    error_msg = payment_system_id or "Kassa AI: не удалось создать платёж"
-                    return jsonify({"message": error_msg}), 500
-            
-            elif payment_provider == 'robokassa':
-                robokassa_login = decrypt_key(getattr(s, 'robokassa_merchant_login', None)) if s else None
-                robokassa_password1 = decrypt_key(getattr(s, 'robokassa_password1', None)) if s else None
-                if not robokassa_login or not robokassa_password1 or robokassa_login == "DECRYPTION_ERROR" or robokassa_password1 == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Robokassa credentials not configured"}), 500
-                
-                import hashlib
-                signature_string = f"{robokassa_login}:{float(amount)}:{order_id}:{robokassa_password1}"
-                signature = hashlib.md5(signature_string.encode('utf-8')).hexdigest()
-                
-                payment_url = f"https://auth.robokassa.ru/Merchant/Index.aspx?MerchantLogin={robokassa_login}&OutSum={float(amount)}&InvId={order_id}&SignatureValue={signature}&Description=Пополнение баланса&Culture=ru&IsTest=0"
-                payment_system_id = order_id
-            
-            elif payment_provider in ('platega', 'platega_mir'):
-                import uuid
-                import re
-                platega_key = decrypt_key(getattr(s, 'platega_api_key', None)) if s else None
-                platega_merchant_raw = decrypt_key(getattr(s, 'platega_merchant_id', None)) if s else None
-                if not platega_key or not platega_merchant_raw or platega_key == "DECRYPTION_ERROR" or platega_merchant_raw == "DECRYPTION_ERROR":
-                    print(f"Platega credentials error: key={bool(platega_key)}, merchant={bool(platega_merchant_raw)}")
-                    return jsonify({"message": "Platega credentials not configured"}), 500
-
-                if payment_provider == 'platega_mir' and not getattr(s, 'platega_mir_enabled', False):
-                    return jsonify({"message": "Platega MIR is disabled"}), 400
-                
-                if (not isinstance(platega_key, str) or not platega_key.strip() or 
-                    not isinstance(platega_merchant_raw, str) or not platega_merchant_raw.strip()):
-                    print("Platega credentials are empty or invalid after decryption")
-                    return jsonify({"message": "Platega credentials are empty or invalid"}), 500
-                
-                # Обработка Merchant ID: согласно документации Platega, X-MerchantId должен быть UUID
-                # Убираем префикс 'live_' если есть, и ищем UUID в строке
-                platega_merchant = platega_merchant_raw.strip()
-                
-                # Если начинается с 'live_', убираем префикс
-                if platega_merchant.startswith('live_'):
-                    platega_merchant = platega_merchant[5:]
-                
-                # Пытаемся найти UUID в строке (формат: xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx)
-                uuid_pattern = r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
-                uuid_match = re.search(uuid_pattern, platega_merchant)
-                
-                if uuid_match:
-                    platega_merchant = uuid_match.group(0)
-                    print(f"Platega: Извлечен UUID из Merchant ID: {platega_merchant}")
-                else:
-                    # Проверяем, является ли вся строка валидным UUID
-                    try:
-                        uuid.UUID(platega_merchant)
-                        print(f"Platega: Merchant ID является валидным UUID: {platega_merchant}")
-                    except ValueError:
-                        print(f"Platega ERROR: Merchant ID не является UUID. Значение: '{platega_merchant_raw}' -> '{platega_merchant}'")
-                        return jsonify({
-                            "message": f"Platega Merchant ID должен быть в формате UUID. Текущее значение: '{platega_merchant_raw}'. Проверьте настройки платежной системы."
-                        }), 500
-                
-                transaction_uuid = str(uuid.uuid4())
-                
-                payment_method = 11 if payment_provider == 'platega_mir' else 2
-                payload = {
-                    "paymentMethod": payment_method,
-                    "paymentDetails": {
-                        "amount": float(amount),
-                        "currency": cp_currency
-                    },
-                    "description": f"Balance topup {order_id}",
-                    "return": redirect_url,
-                    "failedUrl": redirect_url,
-                    "callbackUrl": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/platega"
-                }
-                
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-MerchantId": platega_merchant,
-                    "X-Secret": platega_key,
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Accept": "application/json, text/plain, */*",
-                    "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
-                    "Origin": "https://app.platega.io",
-                    "Referer": "https://app.platega.io/"
-                }
-                
-                print(f"Platega balance topup request: merchant_id={platega_merchant[:10] if platega_merchant else 'N/A'}..., payload={payload}")
-                print(f"Platega callbackUrl: {payload.get('callbackUrl', 'NOT SET')}")
-                
-                try:
-                    session = _get_platega_session()
-                    
-                    # Пробуем сначала API endpoint (без DDoS-Guard), затем web endpoint
-                    api_endpoints = [
-                        "https://api.platega.io/transaction/process",
-                        "https://app.platega.io/transaction/process"
-                    ]
-                    
-                    resp = None
-                    for endpoint in api_endpoints:
-                        try:
-                            print(f"Platega: Trying {endpoint}...")
-                            if resp is not None:
-                                time.sleep(1)
-                            resp = session.post(endpoint, json=payload, headers=headers, timeout=30)
-                            if resp.status_code == 200:
-                                print(f"Platega: Success with {endpoint}")
-                                break
-                            elif resp.status_code != 403:
-                                break
-                        except Exception as e:
-                            print(f"Platega: Error with {endpoint}: {e}")
-                            continue
-                    
-                    if resp is None:
-                        return jsonify({"message": "Platega API Error: Failed to connect"}), 500
-                    
-                    print(f"Platega response: status={resp.status_code}")
-                    
-                    # Если получили 403 от DDoS-Guard, сбрасываем cookies и пробуем снова
-                    if resp.status_code == 403:
-                        response_text = resp.text[:200] if resp.text else ""
-                        if "DDoS-Guard" in response_text or "ddos-guard" in response_text.lower():
-                            print("Platega: DDoS-Guard challenge detected, resetting session and retrying...")
-                            if _reset_platega_cookies():
-                                resp = session.post("https://app.platega.io/transaction/process", json=payload, headers=headers, timeout=30)
-                                print(f"Platega retry response: status={resp.status_code}")
-                    
-                    # Обработка 401 Unauthorized
-                    if resp.status_code == 401:
-                        print(f"Platega 401 Error: Response text: {resp.text[:500] if resp.text else 'No response text'}")
-                        print(f"Platega request headers: X-MerchantId={'present' if headers.get('X-MerchantId') else 'missing'}, X-Secret={'present' if headers.get('X-Secret') else 'missing'}")
-                        print(f"Platega credentials: merchant_id length={len(platega_merchant) if platega_merchant else 0}, api_key length={len(platega_key) if platega_key else 0}")
-                        try:
-                            error_data = resp.json()
-                            error_msg = error_data.get('message') or error_data.get('error') or 'Unauthorized'
-                            print(f"Platega 401 Error: {error_data}")
-                        except:
-                            error_msg = resp.text[:200] if resp.text else 'Unauthorized'
-                        return jsonify({
-                            "message": f"Platega API Error: 401 Unauthorized. {error_msg}. Проверьте правильность API ключа и Merchant ID в настройках платежной системы."
-                        }), 500
-                    
-                    if resp.status_code == 403:
-                        response_text = resp.text[:500] if resp.text else ""
-                        if "DDoS-Guard" in response_text or "ddos-guard" in response_text.lower():
-                            error_msg = (
-                                "Platega заблокировал запрос через DDoS-Guard. "
-                                "Для решения проблемы необходимо добавить IP сервера в whitelist Platega. "
-                                "Свяжитесь с поддержкой Platega и предоставьте IP: 192.3.209.113"
-                            )
-                        else:
-                            try:
-                                error_data = resp.json()
-                                error_msg = error_data.get('message') or error_data.get('error') or 'Forbidden'
-                                print(f"Platega 403 Error: {error_data}")
-                            except:
-                                error_msg = response_text or 'Forbidden'
-                        return jsonify({"message": f"Platega API Error: {error_msg}"}), 500
-                    
-                    resp.raise_for_status()
-                    payment_data = resp.json()
-                    print(f"Platega response data: {payment_data}")
-                    
-                    # Согласно документации Platega: URL в поле "redirect", ID в "transactionId"
-                    payment_url = payment_data.get('redirect') or payment_data.get('url') or payment_data.get('paymentUrl')
-                    payment_system_id = payment_data.get('transactionId') or payment_data.get('id') or transaction_uuid
-                    
-                    if not payment_url:
-                        print(f"Platega: No redirect URL in response: {payment_data}")
-                        return jsonify({"message": "Не удалось получить ссылку на оплату от Platega"}), 500
-                        
-                except requests.exceptions.HTTPError as e:
-                    print(f"Platega HTTP Error: {e}")
-                    return jsonify({"message": f"Platega API Error: {str(e)}"}), 500
-                except Exception as e:
-                    print(f"Platega Error: {e}")
-                    return jsonify({"message": f"Platega Error: {str(e)}"}), 500
+            unavailable = _provider_unavailable(payment_provider, cp_currency, s)
+            if unavailable:
+                return unavailable
             
-            else:
-                return jsonify({"message": f"Неподдерживаемый способ оплаты: {payment_provider}"}), 400
+            payment_url, payment_system_id = get_provider(payment_provider).create_invoice(
+                float(amount), cp_currency, order_id,
+                user_email=user.email,
+                ip=request.remote_addr,
+                return_url=redirect_url,
+                server_url=YOUR_SERVER_IP_OR_DOMAIN,
+                title=f"Пополнение баланса {service_name}",
+                description=f"Пополнение баланса на сумму {float(amount):.2f} {cp_currency}",
+                label=f"Пополнение баланса {float(amount):.2f} {cp_currency}"
+            )
             
             if not payment_url:
-                return jsonify({"message": "Не удалось создать платеж"}), 500
+                print(f"[create-payment] {payment_provider} error for balance topup: {payment_system_id}")
+                return jsonify({"message": payment_system_id or "Не удалось создать платеж"}), 500
             
             # Создаем запись о платеже
             new_p = Payment(
@@ -2088,7 +1567,6 @@ def create_payment():
                 # Если таблицы user_config нет (миграции не прогнаны), продолжаем без привязки
                 print(f"[create-payment] Warning: failed to resolve user_config: {e}")
             
-            from modules.models.tariff import Tariff
             t = db.session.get(Tariff, tid)
             if not t:
                 return jsonify({"message": "Not found"}), 404
@@ -2122,7 +1600,7 @@ def create_payment():
                     return jsonify({"message": "Промокод на бесплатные дни активируется отдельно"}), 400
             
             from modules.models.payment import PaymentSetting, Payment
-            s = PaymentSetting.query.first()
+            s = get_settings(PaymentSetting)
             order_id = f"u{user.id}-t{t.id}-{int(datetime.now().timestamp())}"
             payment_url = None
             payment_system_id = None
@@ -2136,747 +1614,25 @@ def create_payment():
             else:
                 redirect_url = f"{YOUR_SERVER_IP_OR_DOMAIN}/dashboard/subscription" if YOUR_SERVER_IP_OR_DOMAIN else "/dashboard/subscription"
             
-            # CrystalPay
-            if payment_provider == 'crystalpay':
-                crystalpay_key = decrypt_key(s.crystalpay_api_key) if s else None
-                crystalpay_secret = decrypt_key(s.crystalpay_api_secret) if s else None
-                if not crystalpay_key or crystalpay_key == "DECRYPTION_ERROR" or not crystalpay_secret or crystalpay_secret == "DECRYPTION_ERROR":
-                    return jsonify({"message": "CrystalPay не настроен"}), 500
-                
-                payload = {
-                    "auth_login": crystalpay_key,
-                    "auth_secret": crystalpay_secret,
-                    "amount": f"{final_amount:.2f}",
-                    "type": "purchase",
-                    "currency": info['c'],
-                    "lifetime": 60,
-                    "extra": order_id,
-                    "callback_url": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/crystalpay",
-                    "redirect_url": redirect_url
-                }
-                
-                resp = requests.post("https://api.crystalpay.io/v3/invoice/create/", json=payload, timeout=10)
-                if resp.ok:
-                    data = resp.json()
-                    if not data.get('errors'):
-                        payment_url = data.get('url')
-                        payment_system_id = data.get('id')
-                    else:
-                        print(f"CrystalPay Error: {data.get('errors')}")
-                else:
-                    print(f"CrystalPay API Error: {resp.status_code} - {resp.text}")
-            
-            # Heleket
-            elif payment_provider == 'heleket':
-                heleket_key = decrypt_key(s.heleket_api_key) if s else None
-                if not heleket_key or heleket_key == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Heleket API key not configured"}), 500
-                
-                heleket_currency = info['c']
-                to_currency = None
-                
-                if info['c'] == 'USD':
-                    heleket_currency = "USD"
-                else:
-                    heleket_currency = "USD"
-                    to_currency = "USDT"
-                
-                payload = {
-                    "amount": f"{final_amount:.2f}",
-                    "currency": heleket_currency,
-                    "order_id": order_id,
-                    "url_return": redirect_url,
-                    "url_callback": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/heleket"
-                }
-                
-                if to_currency:
-                    payload["to_currency"] = to_currency
-                
-                headers = {
-                    "Authorization": f"Bearer {heleket_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                resp = requests.post("https://api.heleket.com/v1/payment", json=payload, headers=headers, timeout=10)
-                resp_data = resp.json()
-                if resp_data.get('state') != 0 or not resp_data.get('result'):
-                    error_msg = resp_data.get('message', 'Payment Provider Error')
-                    print(f"Heleket Error: {error_msg}")
-                    return jsonify({"message": error_msg}), 500
-                
-                result = resp_data.get('result', {})
-                payment_url = result.get('url')
-                payment_system_id = result.get('uuid')
-            
-            # YooKassa
-            elif payment_provider == 'yookassa':
-                if info['c'] != 'RUB':
-                    return jsonify({"message": "YooKassa supports only RUB currency"}), 400
-                
-                # Используем универсальную функцию создания платежа
-                from modules.api.payments import create_payment as create_payment_provider
-                
-                payment_url, payment_system_id = create_payment_provider(
-                    provider='yookassa',
-                    amount=final_amount,
-                    currency='RUB',
-                    order_id=order_id,
-                    user_email=user.email,
-                    description=f"Подписка {service_name} - {t.name} ({t.duration_days} дней)",
-                    source='website'  # Платеж с сайта, возврат на сайт
-                )
-                
-                if not payment_url:
-                    error_msg = payment_system_id or "Failed to create YooKassa payment"
-                    return jsonify({"message": error_msg}), 500
-
-            # YooMoney
-            elif payment_provider == 'yoomoney':
-                if info['c'] != 'RUB':
-                    return jsonify({"message": "YooMoney supports only RUB currency"}), 400
-
-                from modules.api.payments import create_payment as create_payment_provider
-                payment_url, payment_system_id = create_payment_provider(
-                    provider='yoomoney',
-                    amount=final_amount,
-                    currency='RUB',
-                    order_id=order_id,
-                    description=f"Подписка {service_name} - {t.name} ({t.duration_days} дней)",
-                    source='website'
-                )
-
-                if not payment_url:
-                    error_msg = payment_system_id or "Failed to create YooMoney payment"
-                    return jsonify({"message": error_msg}), 500
-            
-            # Telegram Stars
-            elif payment_provider == 'telegram_stars':
-                bot_token = decrypt_key(s.telegram_bot_token) if s else None
-                if not bot_token or bot_token == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Telegram Bot Token not configured"}), 500
-                
-                stars_amount = int(final_amount * 100)
-                if info['c'] == 'UAH':
-                    stars_amount = int(final_amount * 2.7)
-                elif info['c'] == 'RUB':
-                    stars_amount = int(final_amount * 1.1)
-                elif info['c'] == 'USD':
-                    stars_amount = int(final_amount * 100)
-                
-                if stars_amount < 1:
-                    stars_amount = 1
-                
-                invoice_payload = {
-                    "title": f"Подписка {service_name} - {t.name}",
-                    "description": f"Подписка на {t.duration_days} дней",
-                    "payload": order_id,
-                    "provider_token": "",
-                    "currency": "XTR",
-                    "prices": [
-                        {
-                            "label": f"Подписка {t.duration_days} дней",
-                            "amount": stars_amount
-                        }
-                    ]
-                }
-                
-                resp = requests.post(
-                    f"https://api.telegram.org/bot{bot_token}/createInvoiceLink",
-                    json=invoice_payload,
-                    headers={"Content-Type": "application/json"}
-                ).json()
-                
-                if not resp.get('ok'):
-                    error_msg = resp.get('description', 'Telegram Bot API Error')
-                    print(f"Telegram Stars Error: {error_msg}")
-                    return jsonify({"message": error_msg}), 500
-                
-                payment_url = resp.get('result')
-                payment_system_id = order_id
-            
-            # FreeKassa
-            elif payment_provider == 'freekassa':
-                freekassa_shop_id = decrypt_key(s.freekassa_shop_id) if s else None
-                freekassa_secret = decrypt_key(s.freekassa_secret) if s else None
-                if not freekassa_shop_id or not freekassa_secret or freekassa_shop_id == "DECRYPTION_ERROR" or freekassa_secret == "DECRYPTION_ERROR":
-                    return jsonify({"message": "FreeKassa credentials not configured"}), 500
-                
-                import hashlib
-                merchant_id = freekassa_shop_id
-                secret = freekassa_secret
-                amount = final_amount
-                currency_map = {'RUB': 'RUB', 'UAH': 'UAH', 'USD': 'USD'}
-                currency = currency_map.get(info['c'], 'RUB')
-                
-                # Формируем подпись
-                sign_str = f"{merchant_id}:{amount}:{secret}:{order_id}"
-                sign = hashlib.md5(sign_str.encode()).hexdigest()
-                
-                payment_url = f"https://pay.freekassa.ru/?m={merchant_id}&oa={amount}&o={order_id}&s={sign}&currency={currency}"
-                payment_system_id = order_id
-
-            elif payment_provider == 'kassa_ai':
-                from modules.api.payments import create_payment as create_payment_provider
-                from modules.api.payments.base import get_callback_url
-                payment_url, payment_system_id = create_payment_provider(
-                    provider='kassa_ai',
-                    amount=float(final_amount),
-                    currency=info['c'],
-                    order_id=order_id,
-                    user_email=user.email if user else None,
-                    ip=request.remote_addr,
-                    notification_url=get_callback_url('kassa_ai'),
-                )
-                if not payment_url:
-                    error_msg = payment_system_id or "Kassa AI: не удалось создать платёж"
-                    return jsonify({"message": error_msg}), 500
-            
-            elif payment_provider == 'robokassa':
-                robokassa_login = decrypt_key(getattr(s, 'robokassa_merchant_login', None)) if s else None
-                robokassa_password1 = decrypt_key(getattr(s, 'robokassa_password1', None)) if s else None
-                if not robokassa_login or not robokassa_password1 or robokassa_login == "DECRYPTION_ERROR" or robokassa_password1 == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Robokassa credentials not configured"}), 500
-                
-                import hashlib
-                merchant_login = robokassa_login
-                password1 = robokassa_password1
-                amount = final_amount
-                currency_map = {'RUB': 'RUB', 'UAH': 'UAH', 'USD': 'USD'}
-                currency = currency_map.get(info['c'], 'RUB')
-                
-                # Формируем подпись
-                sign_str = f"{merchant_login}:{amount}:{order_id}:{password1}"
-                sign = hashlib.md5(sign_str.encode()).hexdigest()
-                
-                payment_url = f"https://auth.robokassa.ru/Merchant/Index.aspx?MerchantLogin={merchant_login}&OutSum={amount}&InvId={order_id}&SignatureValue={sign}&Culture=ru&Currency={currency}"
-                payment_system_id = order_id
-            
-            # CryptoBot
-            elif payment_provider == 'cryptobot':
-                cryptobot_key = decrypt_key(s.cryptobot_api_key) if s else None
-                if not cryptobot_key or cryptobot_key == "DECRYPTION_ERROR":
-                    return jsonify({"message": "CryptoBot API key not configured"}), 500
-                
-                payload = {
-                    "amount": final_amount,
-                    "currency_code": info['c'],
-                    "description": f"Подписка {service_name} - {t.name}",
-                    "paid_btn_name": "callback",
-                    "paid_btn_url": f"{YOUR_SERVER_IP_OR_DOMAIN}/dashboard/subscription"
-                }
-                
-                headers = {
-                    "Crypto-Pay-API-Token": cryptobot_key,
-                    "Content-Type": "application/json"
-                }
-                
-                resp = requests.post("https://pay.crypt.bot/api/createInvoice", json=payload, headers=headers, timeout=10)
-                if resp.ok:
-                    data = resp.json()
-                    if data.get('ok'):
-                        result = data.get('result', {})
-                        payment_url = result.get('pay_url')
-                        payment_system_id = str(result.get('invoice_id'))
-                    else:
-                        print(f"CryptoBot Error: {data.get('error')}")
-                else:
-                    print(f"CryptoBot API Error: {resp.status_code} - {resp.text}")
-            
-            # Monobank
-            elif payment_provider == 'monobank':
-                monobank_token = decrypt_key(getattr(s, 'monobank_token', None)) if s else None
-                if not monobank_token or monobank_token == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Monobank token not configured"}), 500
-                
-                amount_in_kopecks = int(final_amount * 100)
-                currency_code = 980  # UAH
-                if info['c'] == 'RUB':
-                    currency_code = 643
-                elif info['c'] == 'USD':
-                    currency_code = 840
-                
-                payload = {
-                    "amount": amount_in_kopecks,
-                    "ccy": currency_code,
-                    "merchantPaymInfo": {
-                        "reference": order_id,
-                        "destination": f"Подписка {service_name} - {t.name}",
-                        "comment": f"Подписка на {t.duration_days} дней"
-                    },
-                    "redirectUrl": redirect_url,
-                    "webHookUrl": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/monobank",
-                    "validity": 3600,
-                    "paymentType": "debit"
-                }
-                
-                headers = {
-                    "X-Token": monobank_token,
-                    "Content-Type": "application/json"
-                }
-                
-                resp = requests.post("https://api.monobank.ua/api/merchant/invoice/create", json=payload, headers=headers, timeout=30)
-                if resp.ok:
-                    data = resp.json()
-                    payment_url = data.get('pageUrl')
-                    payment_system_id = data.get('invoiceId')
-                else:
-                    print(f"Monobank API Error: {resp.status_code} - {resp.text}")
-            
-            # Platega / Platega MIR
-            elif payment_provider in ('platega', 'platega_mir'):
-                import uuid
-                import re
-                platega_key = decrypt_key(getattr(s, 'platega_api_key', None)) if s else None
-                platega_merchant_raw = decrypt_key(getattr(s, 'platega_merchant_id', None)) if s else None
-                if not platega_key or not platega_merchant_raw or platega_key == "DECRYPTION_ERROR" or platega_merchant_raw == "DECRYPTION_ERROR":
-                    print(f"Platega credentials error: key={bool(platega_key)}, merchant={bool(platega_merchant_raw)}")
-                    return jsonify({"message": "Platega credentials not configured"}), 500
-
-                if payment_provider == 'platega_mir' and not getattr(s, 'platega_mir_enabled', False):
-                    return jsonify({"message": "Platega MIR is disabled"}), 400
-                
-                # Проверяем, что ключи не пустые после расшифровки
-                if (not isinstance(platega_key, str) or not platega_key.strip() or 
-                    not isinstance(platega_merchant_raw, str) or not platega_merchant_raw.strip()):
-                    print("Platega credentials are empty or invalid after decryption")
-                    return jsonify({"message": "Platega credentials are empty or invalid"}), 500
-                
-                # Обработка Merchant ID: согласно документации Platega, X-MerchantId должен быть UUID
-                # Убираем префикс 'live_' если есть, и ищем UUID в строке
-                platega_merchant = platega_merchant_raw.strip()
-                
-                # Если начинается с 'live_', убираем префикс
-                if platega_merchant.startswith('live_'):
-                    platega_merchant = platega_merchant[5:]
-                
-                # Пытаемся найти UUID в строке (формат: xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx)
-                uuid_pattern = r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
-                uuid_match = re.search(uuid_pattern, platega_merchant)
-                
-                if uuid_match:
-                    platega_merchant = uuid_match.group(0)
-                    print(f"Platega: Извлечен UUID из Merchant ID: {platega_merchant}")
-                else:
-                    # Проверяем, является ли вся строка валидным UUID
-                    try:
-                        uuid.UUID(platega_merchant)
-                        print(f"Platega: Merchant ID является валидным UUID: {platega_merchant}")
-                    except ValueError:
-                        print(f"Platega ERROR: Merchant ID не является UUID. Значение: '{platega_merchant_raw}' -> '{platega_merchant}'")
-                        return jsonify({
-                            "message": f"Platega Merchant ID должен быть в формате UUID. Текущее значение: '{platega_merchant_raw}'. Проверьте настройки платежной системы."
-                        }), 500
-                
-                transaction_uuid = str(uuid.uuid4())
-                
-                # Согласно документации Platega: ID транзакции генерируется системой автоматически
-                # НЕ передаем поле "id" в запросе
-                payment_method = 11 if payment_provider == 'platega_mir' else 2
-                payload = {
-                    "paymentMethod": payment_method,
-                    "paymentDetails": {
-                        "amount": float(final_amount),  # Должно быть float, не int
-                        "currency": info['c']
-                    },
-                    "description": f"Payment for order {transaction_uuid}",
-                    "return": redirect_url,
-                    "failedUrl": redirect_url,
-                    "callbackUrl": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/platega"
-                }
-                
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-MerchantId": platega_merchant,
-                    "X-Secret": platega_key,
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Accept": "application/json, text/plain, */*",
-                    "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
-                    "Origin": "https://app.platega.io",
-                    "Referer": "https://app.platega.io/"
-                }
-
-                # Логируем для диагностики (без полных ключей)
-                print(f"Platega request: merchant_id={platega_merchant[:10] if platega_merchant else 'N/A'}... (len={len(platega_merchant) if platega_merchant else 0}), key_len={len(platega_key) if platega_key else 0}, payload={payload}")
-                print(f"Platega headers: X-MerchantId present={bool(platega_merchant)}, X-Secret present={bool(platega_key)}")
-                
-                try:
-                    session = _get_platega_session()
-                    
-                    # Пробуем сначала API endpoint (без DDoS-Guard), затем web endpoint
-                    api_endpoints = [
-                        "https://api.platega.io/transaction/process",
-                        "https://app.platega.io/transaction/process"
-                    ]
-                    
-                    resp = None
-                    for endpoint in api_endpoints:
-                        try:
-                            print(f"Platega: Trying {endpoint}...")
-                            if resp is not None:
-                                time.sleep(1)
-                            resp = session.post(endpoint, json=payload, headers=headers, timeout=30)
-                            if resp.status_code == 200:
-                                print(f"Platega: Success with {endpoint}")
-                                break
-                            elif resp.status_code != 403:
-                                break
-                        except Exception as e:
-                            print(f"Platega: Error with {endpoint}: {e}")
-                            continue
-                    
-                    if resp is None:
-                        return jsonify({"message": "Platega API Error: Failed to connect"}), 500
-                    
-                    # Логируем детали ответа для диагностики
-                    print(f"Platega response: status={resp.status_code}, headers={dict(resp.headers)}")
-                    if resp.status_code != 200:
-                        print(f"Platega error response: {resp.text[:500]}")
-                    
-                    # Если получили 401, проверяем заголовки
-                    # Обработка 401 Unauthorized
-                    if resp.status_code == 401:
-                        print(f"Platega 401 Error: Response text: {resp.text[:500] if resp.text else 'No response text'}")
-                        print(f"Platega request headers: X-MerchantId={'present' if headers.get('X-MerchantId') else 'missing'}, X-Secret={'present' if headers.get('X-Secret') else 'missing'}")
-                        print(f"Platega credentials: merchant_id length={len(platega_merchant) if platega_merchant else 0}, api_key length={len(platega_key) if platega_key else 0}")
-                        try:
-                            error_data = resp.json()
-                            error_msg = error_data.get('message') or error_data.get('error') or 'Unauthorized'
-                            print(f"Platega 401 Error: {error_data}")
-                        except:
-                            error_msg = resp.text[:200] if resp.text else 'Unauthorized'
-                        return jsonify({
-                            "message": f"Platega API Error: 401 Unauthorized. {error_msg}. Проверьте правильность API ключа и Merchant ID в настройках платежной системы."
-                        }), 500
-                    
-                    # Если получили 403 от DDoS-Guard, сбрасываем cookies и пробуем снова
-                    if resp.status_code == 403:
-                        response_text = resp.text[:200] if resp.text else ""
-                        if "DDoS-Guard" in response_text or "ddos-guard" in response_text.lower():
-                            print("Platega: DDoS-Guard challenge detected, resetting session and retrying...")
-                            if _reset_platega_cookies():
-                                resp = session.post("https://app.platega.io/transaction/process", json=payload, headers=headers, timeout=30)
-                                print(f"Platega retry response: status={resp.status_code}")
-                        
-                        # Проверяем 401 после retry
-                        if resp.status_code == 401:
-                            print(f"Platega 401 Error after retry: Response text: {resp.text[:500] if resp.text else 'No response text'}")
-                            try:
-                                error_data = resp.json()
-                                error_msg = error_data.get('message') or error_data.get('error') or 'Unauthorized'
-                            except:
-                                error_msg = resp.text[:200] if resp.text else 'Unauthorized'
-                            return jsonify({
-                                "message": f"Platega API Error: 401 Unauthorized. {error_msg}. Проверьте правильность API ключа и Merchant ID в настройках платежной системы."
-                            }), 500
-                        
-                        # Если все еще 403, возвращаем ошибку
-                        if resp.status_code == 403:
-                            response_text_full = resp.text[:500] if resp.text else ""
-                            if "DDoS-Guard" in response_text_full or "ddos-guard" in response_text_full.lower():
-                                error_msg = (
-                                    "Platega заблокировал запрос через DDoS-Guard. "
-                                    "Для решения проблемы необходимо добавить IP сервера в whitelist Platega. "
-                                    "Свяжитесь с поддержкой Platega и предоставьте IP: 192.3.209.113"
-                                )
-                            else:
-                                try:
-                                    error_data = resp.json()
-                                    error_msg = error_data.get('message') or error_data.get('error') or error_data.get('detail') or 'Forbidden'
-                                    print(f"Platega 403 Error details: {error_data}")
-                                except:
-                                    error_msg = response_text_full or 'Forbidden - Invalid credentials or insufficient permissions'
-                                    print(f"Platega 403 Error (non-JSON): {error_msg}")
-                            
-                            return jsonify({
-                                "message": f"Platega API Error: {error_msg}. Проверьте правильность API ключа и Merchant ID в настройках платежей."
-                            }), 500
-                    
-                    resp.raise_for_status()
-                    payment_data = resp.json()
-                    
-                    payment_url = payment_data.get('redirect')
-                    payment_system_id = payment_data.get('transactionId') or transaction_uuid
-                    
-                    if not payment_url:
-                        error_msg = payment_data.get('message', 'Failed to get payment URL from Platega')
-                        print(f"Platega Error: {error_msg}, response: {payment_data}")
-                        return jsonify({"message": error_msg}), 500
-                except requests.exceptions.HTTPError as e:
-                    # Обработка HTTP ошибок (4xx, 5xx)
-                    error_msg = str(e)
-                    error_detail = ""
-                    if hasattr(e, 'response') and e.response is not None:
-                        try:
-                            error_data = e.response.json()
-                            error_detail = error_data.get('message') or error_data.get('error') or error_data.get('detail') or str(e)
-                            print(f"Platega HTTP Error {e.response.status_code}: {error_data}")
-                        except:
-                            error_detail = e.response.text[:500] if e.response.text else str(e)
-                            print(f"Platega HTTP Error {e.response.status_code} (non-JSON): {error_detail}")
-                    else:
-                        error_detail = error_msg
-                    
-                    return jsonify({
-                        "message": f"Platega API Error: {error_detail}"
-                    }), 500
-                except requests.exceptions.RequestException as e:
-                    # Обработка сетевых ошибок
-                    error_msg = str(e)
-                    print(f"Platega Request Error: {error_msg}")
-                    return jsonify({
-                        "message": f"Platega API Error: {error_msg}"
-                    }), 500
-            
-            # Mulenpay
-            elif payment_provider == 'mulenpay':
-                mulenpay_key = decrypt_key(getattr(s, 'mulenpay_api_key', None)) if s else None
-                mulenpay_secret = decrypt_key(getattr(s, 'mulenpay_secret_key', None)) if s else None
-                mulenpay_shop = decrypt_key(getattr(s, 'mulenpay_shop_id', None)) if s else None
-                if not mulenpay_key or not mulenpay_secret or not mulenpay_shop or mulenpay_key == "DECRYPTION_ERROR" or mulenpay_secret == "DECRYPTION_ERROR" or mulenpay_shop == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Mulenpay credentials not configured"}), 500
-                
-                currency_map = {'RUB': 'rub', 'UAH': 'uah', 'USD': 'usd'}
-                mulenpay_currency = currency_map.get(info['c'], info['c'].lower())
-                
-                try:
-                    shop_id_int = int(mulenpay_shop)
-                except (ValueError, TypeError):
-                    shop_id_int = mulenpay_shop
-                
-                payload = {
-                    "currency": mulenpay_currency,
-                    "amount": str(final_amount),
-                    "uuid": order_id,
-                    "shopId": shop_id_int,
-                    "description": f"Подписка {service_name} - {t.name} ({t.duration_days} дней)",
-                    "subscribe": None,
-                    "holdTime": None
-                }
-                
-                import base64
-                auth_string = f"{mulenpay_key}:{mulenpay_secret}"
-                auth_b64 = base64.b64encode(auth_string.encode('ascii')).decode('ascii')
-                
-                headers = {
-                    "Authorization": f"Basic {auth_b64}",
-                    "Content-Type": "application/json"
-                }
-                
-                try:
-                    resp = requests.post("https://api.mulenpay.ru/v2/payments", json=payload, headers=headers, timeout=30)
-                    resp.raise_for_status()
-                    payment_data = resp.json()
-                    
-                    payment_url = payment_data.get('url') or payment_data.get('payment_url') or payment_data.get('redirect')
-                    payment_system_id = payment_data.get('id') or payment_data.get('payment_id') or order_id
-                    
-                    if not payment_url:
-                        error_msg = payment_data.get('message') or payment_data.get('error') or 'Failed to get payment URL from Mulenpay'
-                        print(f"Mulenpay Error: {error_msg}")
-                        return jsonify({"message": error_msg}), 500
-                except requests.exceptions.RequestException as e:
-                    error_msg = str(e)
-                    if hasattr(e, 'response') and e.response is not None:
-                        try:
-                            error_data = e.response.json()
-                            error_msg = error_data.get('message') or error_data.get('error') or str(e)
-                        except:
-                            pass
-                    return jsonify({"message": f"Mulenpay API Error: {error_msg}"}), 500
-            
-            # UrlPay
-            elif payment_provider == 'urlpay':
-                urlpay_key = decrypt_key(getattr(s, 'urlpay_api_key', None)) if s else None
-                urlpay_secret = decrypt_key(getattr(s, 'urlpay_secret_key', None)) if s else None
-                urlpay_shop = decrypt_key(getattr(s, 'urlpay_shop_id', None)) if s else None
-                if not urlpay_key or not urlpay_secret or not urlpay_shop or urlpay_key == "DECRYPTION_ERROR" or urlpay_secret == "DECRYPTION_ERROR" or urlpay_shop == "DECRYPTION_ERROR":
-                    return jsonify({"message": "UrlPay credentials not configured"}), 500
-                
-                currency_map = {'RUB': 'rub', 'UAH': 'uah', 'USD': 'usd'}
-                urlpay_currency = currency_map.get(info['c'], info['c'].lower())
-                
-                try:
-                    shop_id_int = int(urlpay_shop)
-                except (ValueError, TypeError):
-                    shop_id_int = urlpay_shop
-                
-                payload = {
-                    "currency": urlpay_currency,
-                    "amount": str(final_amount),
-                    "uuid": order_id,
-                    "shopId": shop_id_int,
-                    "description": f"Подписка {service_name} - {t.name} ({t.duration_days} дней)",
-                    "subscribe": None,
-                    "holdTime": None
-                }
-                
-                import base64
-                auth_string = f"{urlpay_key}:{urlpay_secret}"
-                auth_b64 = base64.b64encode(auth_string.encode('ascii')).decode('ascii')
-                
-                headers = {
-                    "Authorization": f"Basic {auth_b64}",
-                    "Content-Type": "application/json"
-                }
-                
-                try:
-                    resp = requests.post("https://api.urlpay.io/v2/payments", json=payload, headers=headers, timeout=30)
-                    resp.raise_for_status()
-                    payment_data = resp.json()
-                    
-                    payment_url = payment_data.get('url') or payment_data.get('payment_url') or payment_data.get('redirect')
-                    payment_system_id = payment_data.get('id') or payment_data.get('payment_id') or order_id
-                    
-                    if not payment_url:
-                        error_msg = payment_data.get('message') or payment_data.get('error') or 'Failed to get payment URL from UrlPay'
-                        print(f"UrlPay Error: {error_msg}")
-                        return jsonify({"message": error_msg}), 500
-                except requests.exceptions.RequestException as e:
-                    error_msg = str(e)
-                    if hasattr(e, 'response') and e.response is not None:
-                        try:
-                            error_data = e.response.json()
-                            error_msg = error_data.get('message') or error_data.get('error') or str(e)
-                        except:
-                            pass
-                    return jsonify({"message": f"UrlPay API Error: {error_msg}"}), 500
-            
-            # BTCPayServer
-            elif payment_provider == 'btcpayserver':
-                btcpayserver_url = decrypt_key(getattr(s, 'btcpayserver_url', None)) if s else None
-                btcpayserver_api_key = decrypt_key(getattr(s, 'btcpayserver_api_key', None)) if s else None
-                btcpayserver_store_id = decrypt_key(getattr(s, 'btcpayserver_store_id', None)) if s else None
-                if not btcpayserver_url or not btcpayserver_api_key or not btcpayserver_store_id or btcpayserver_url == "DECRYPTION_ERROR" or btcpayserver_api_key == "DECRYPTION_ERROR" or btcpayserver_store_id == "DECRYPTION_ERROR":
-                    return jsonify({"message": "BTCPayServer credentials not configured"}), 500
-                
-                btcpayserver_url = btcpayserver_url.rstrip('/')
-                
-                metadata = {
-                    "orderId": order_id,
-                    "buyerEmail": user.email if user.email else None,
-                    "itemDesc": f"VPN Subscription - {t.name} ({t.duration_days} days)"
-                }
-                
-                checkout_options = {
-                    "redirectURL": get_return_url(source='website')
-                }
-                
-                payload = {
-                    "amount": f"{final_amount:.2f}",
-                    "currency": info['c'],
-                    "metadata": metadata,
-                    "checkout": checkout_options
-                }
-                
-                invoice_url = f"{btcpayserver_url}/api/v1/stores/{btcpayserver_store_id}/invoices"
-                
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"token {btcpayserver_api_key}"
-                }
-                
-                try:
-                    resp = requests.post(invoice_url, json=payload, headers=headers, timeout=30)
-                    resp.raise_for_status()
-                    invoice_data = resp.json()
-                    
-                    payment_url = invoice_data.get('checkoutLink')
-                    payment_system_id = invoice_data.get('id')
-                    
-                    if not payment_url:
-                        return jsonify({"message": "Failed to create payment"}), 500
-                except requests.exceptions.RequestException as e:
-                    error_msg = str(e)
-                    if hasattr(e, 'response') and e.response is not None:
-                        try:
-                            error_data = e.response.json()
-                            error_msg = error_data.get('message') or error_data.get('error') or str(e)
-                        except:
-                            pass
-                    return jsonify({"message": f"BTCPayServer API Error: {error_msg}"}), 500
-            
-            # Tribute
-            elif payment_provider == 'tribute':
-                tribute_api_key = decrypt_key(getattr(s, 'tribute_api_key', None)) if s else None
-                if not tribute_api_key or tribute_api_key == "DECRYPTION_ERROR":
-                    return jsonify({"message": "Tribute API key not configured"}), 500
-                
-                currency_map = {'RUB': 'rub', 'UAH': 'rub', 'USD': 'eur'}
-                tribute_currency = currency_map.get(info['c'], 'rub')
-                
-                amount_in_cents = int(final_amount * 100)
-                
-                payload = {
-                    "amount": amount_in_cents,
-                    "currency": tribute_currency,
-                    "title": f"VPN Subscription - {t.name}"[:100],
-                    "description": f"VPN subscription for {t.duration_days} days"[:300],
-                    "successUrl": f"{YOUR_SERVER_IP_OR_DOMAIN}/dashboard/subscription",
-                    "failUrl": f"{YOUR_SERVER_IP_OR_DOMAIN}/dashboard/subscription"
-                }
-                
-                if user.email:
-                    payload["email"] = user.email
-                
-                headers = {
-                    "Content-Type": "application/json",
-                    "Api-Key": tribute_api_key
-                }
-                
-                try:
-                    resp = requests.post("https://tribute.tg/api/v1/shop/orders", json=payload, headers=headers, timeout=30)
-                    resp.raise_for_status()
-                    order_data = resp.json()
-                    
-                    payment_url = order_data.get('paymentUrl')
-                    payment_system_id = order_data.get('uuid')
-                    
-                    if not payment_url:
-                        return jsonify({"message": "Failed to create payment"}), 500
-                except requests.exceptions.RequestException as e:
-                    error_msg = str(e)
-                    if hasattr(e, 'response') and e.response is not None:
-                        try:
-                            error_data = e.response.json()
-                            error_msg = error_data.get('message') or error_data.get('error') or str(e)
-                        except:
-                            pass
-                    return jsonify({"message": f"Tribute API Error: {error_msg}"}), 500
+            unavailable = _provider_unavailable(payment_provider, info['c'], s)
+            if unavailable:
+                return unavailable
             
-            # CrystalPay по умолчанию
-            else:
-                crystalpay_key = decrypt_key(s.crystalpay_api_key) if s else None
-                crystalpay_secret = decrypt_key(s.crystalpay_api_secret) if s else None
-                if not crystalpay_key or not crystalpay_secret or crystalpay_key == "DECRYPTION_ERROR" or crystalpay_secret == "DECRYPTION_ERROR":
-                    return jsonify({"message": "CrystalPay credentials not configured"}), 500
-                
-                redirect_url = f"{YOUR_SERVER_IP_OR_DOMAIN}/dashboard/subscription" if YOUR_SERVER_IP_OR_DOMAIN else "/dashboard/subscription"
-                
-                payload = {
-                    "auth_login": crystalpay_key,
-                    "auth_secret": crystalpay_secret,
-                    "amount": f"{final_amount:.2f}",
-                    "type": "purchase",
-                    "currency": info['c'],
-                    "lifetime": 60,
-                    "extra": order_id,
-                    "callback_url": f"{YOUR_SERVER_IP_OR_DOMAIN}/api/webhook/crystalpay",
-                    "redirect_url": redirect_url
-                }
-                
-                resp = requests.post("https://api.crystalpay.io/v3/invoice/create/", json=payload, timeout=10)
-                if resp.ok:
-                    data = resp.json()
-                    if not data.get('errors'):
-                        payment_url = data.get('url')
-                        payment_system_id = data.get('id')
-                    else:
-                        print(f"CrystalPay Error: {data.get('errors')}")
-                else:
-                    print(f"CrystalPay API Error: {resp.status_code} - {resp.text}")
+            payment_url, payment_system_id = get_provider(payment_provider).create_invoice(
+                final_amount, info['c'], order_id,
+                user_email=user.email,
+                ip=request.remote_addr,
+                return_url=redirect_url,
+                server_url=YOUR_SERVER_IP_OR_DOMAIN,
+                title=f"Подписка {service_name} - {t.name}",
+                description=f"Подписка {service_name} - {t.name} ({t.duration_days} дней)",
+                label=f"Подписка {t.duration_days} дней",
+                comment=f"Подписка на {t.duration_days} дней"
+            )
             
             if not payment_url:
-                return jsonify({"message": "Не удалось создать платеж"}), 500
+                print(f"[create-payment] {payment_provider} error: {payment_system_id}")
+                return jsonify({"message": payment_system_id or "Не удалось создать платеж"}), 500
             
             # Создаем запись о платеже
             new_p = Payment(
@@ -2906,21 +1662,29 @@ def create_payment():
 @app.route('/api/client/payments/reconcile', methods=['POST'])
 def reconcile_client_payments():
     """
-    Попытаться обработать "зависшие" оплаты (если webhook не пришёл).
-    Сейчас поддерживается только Platega (и platega_mir), т.к. у него есть API проверки статуса транзакции.
+    Статус последней "зависшей" (PENDING) оплаты (если webhook не пришёл).
+    Сам статус у платёжной системы (CrystalPay, Platega, Platega MIR) проверяет фоновая сверка
+    (modules.payment_reconcile) - запрос не ждёт ответа PSP.
     """
     user = get_user_from_token()
     if not user:
         return jsonify({"success": False, "message": "Auth Error"}), 401
 
     try:
-        # Берем самый свежий "не PAID" платеж пользователя (за тариф или пополнение)
-        p = Payment.query.filter_by(user_id=user.id).filter(Payment.status != 'PAID').order_by(Payment.created_at.desc()).first()
+        # Берем самый свежий PENDING платеж пользователя (за тариф или пополнение):
+        # оплаченные и отменённые не должны заслонять ещё ожидающую оплату
+        p = Payment.query.filter_by(user_id=user.id, status='PENDING').order_by(Payment.created_at.desc()).first()
         if not p:
             return jsonify({"success": True, "message": "No pending payments"}), 200
 
-        ok = _try_reconcile_payment_if_needed(p, user)
-        return jsonify({"success": bool(ok), "message": "Processed" if ok else "Not processed", "provider": p.payment_provider}), 200
+        from modules.api.payments import get_provider
+        provider = get_provider(p.payment_provider)
+        return jsonify({
+            "success": False,
+            "message": "Not processed",
+            "provider": p.payment_provider,
+            "auto_reconcile": bool(provider and provider.supports_status),
+        }), 200
 
     except Exception as e:
         import traceback
@@ -2951,19 +1715,15 @@ def get_subscription_config():
             subscription_url = cached.get('subscriptionUrl')
         else:
             # Получаем из RemnaWave API
-            API_URL = os.getenv('API_URL')
-            headers, cookies = get_remnawave_headers()
             try:
-                resp = requests.get(
-                    f"{API_URL}/api/users/{user.remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
+                resp = remnawave.get(
+                    f"/api/users/{user.remnawave_uuid}",
                     timeout=10
                 )
                 if resp.status_code == 200:
                     data = resp.json().get('response', {})
                     subscription_url = data.get('subscriptionUrl')
-                    cache.set(cache_key, data, timeout=300)
+                    store_live_data(user.remnawave_uuid, data)
             except Exception as e:
                 print(f"Error fetching subscription URL: {e}")
         
@@ -3057,19 +1817,14 @@ def get_config_by_share_token(token):
         owner = share_token.owner
         
         # Получаем данные конфига из RemnaWave
-        API_URL = os.getenv('API_URL')
-        headers, cookies = get_remnawave_headers()
-        
         subscription_url = None
         expire_at = None
         is_active = False
         
-        if API_URL:
+        if remnawave.base_url:
             try:
-                resp = requests.get(
-                    f"{API_URL}/api/users/{config.remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
+                resp = remnawave.get(
+                    f"/api/users/{config.remnawave_uuid}",
                     timeout=10
                 )
                 if resp.status_code == 200:
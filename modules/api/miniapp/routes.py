@@ -12,14 +12,18 @@ API эндпоинты Telegram Mini App
 from flask import request, jsonify
 from datetime import datetime, timezone, timedelta
 import math
-import requests
 import json
 import os
 import urllib.parse
-import re
 import uuid
-
-from modules.core import get_app, get_db, get_cache, get_limiter, get_fernet
+from sqlalchemy import or_, and_
+
+from modules.core import get_app, get_db, get_cache, get_limiter
+from modules.remnawave import remnawave
+from modules.remnawave_snapshot import invalidate_live_user, update_live_user
+from modules.live_data import get_cached_live_data, fetch_live_user, store_live_data
+from modules.tariff_names import get_tariff_display_map, get_tier_names
+from modules.api.payments.base import decrypt_key
 from modules.models.user import User
 from modules.models.tariff import Tariff
 from modules.models.promo import PromoCode
@@ -28,6 +32,8 @@ from modules.models.referral import ReferralSetting
 from modules.models.branding import BrandingSetting
 from modules.models.user_config import UserConfig
 from modules.models.option import PurchaseOption
+from modules.settings_registry import get_settings
+from modules.provisioning import get_provisioning_state, STATE_PROVISIONING
 
 app = get_app()
 db = get_db()
@@ -35,45 +41,6 @@ cache = get_cache()
 limiter = get_limiter()
 
 
-def decrypt_key(key):
-    """
-    Расшифровка ключа из PaymentSetting.
-    Поддерживает TEXT (str) и варианты PostgreSQL (memoryview/bytes).
-    """
-    if not key:
-        return ""
-
-    fernet = get_fernet()
-
-    try:
-        # PostgreSQL может вернуть memoryview
-        if isinstance(key, memoryview):
-            key = bytes(key)
-
-        # Если ключ хранится как строка (PostgreSQL TEXT)
-        if isinstance(key, str):
-            # Если строка уже не зашифрована — возвращаем как есть
-            if not key.startswith('gAAAAAB'):
-                return key
-            # Зашифрована, но нет fernet — не можем расшифровать
-            if not fernet:
-                return ""
-            return fernet.decrypt(key.encode('utf-8')).decode('utf-8')
-
-        # Если bytes — пробуем расшифровать
-        if isinstance(key, (bytes, bytearray)):
-            if not fernet:
-                return ""
-            return fernet.decrypt(bytes(key)).decode('utf-8')
-
-        # Прочие типы — пытаемся привести к bytes
-        if not fernet:
-            return str(key)
-        return fernet.decrypt(bytes(key)).decode('utf-8')
-    except Exception:
-        return ""
-
-
 def parse_telegram_init_data(init_data):
     """Парсит initData из Telegram"""
     if not init_data:
@@ -101,30 +68,11 @@ def parse_telegram_init_data(init_data):
 
 
 def get_referral_settings():
-    return ReferralSetting.query.first()
+    return get_settings(ReferralSetting)
 
 
 def get_branding_settings():
-    return BrandingSetting.query.first()
-
-
-def get_remnawave_headers():
-    """Получить заголовки для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    return headers, cookies
+    return get_settings(BrandingSetting)
 
 
 # ============================================================================
@@ -175,9 +123,20 @@ def miniapp_subscription():
         
         print(f"[MINIAPP] User found: id={user.id}, telegram_id={user.telegram_id}, email={user.email}")
 
+        # Аккаунт RemnaWave ещё создаётся после регистрации в боте - мини-апп показывает ожидание
+        if not user.remnawave_uuid and get_provisioning_state(user) == STATE_PROVISIONING:
+            response = jsonify({
+                "status": STATE_PROVISIONING,
+                "provisioning": True,
+                "detail": {"title": "Provisioning", "message": "Account is being created, please retry in a few seconds"}
+            })
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            response.headers['Retry-After'] = '3'
+            return response, 202
+
         # Получаем данные из кэша
-        cache_key = f'live_data_{user.remnawave_uuid}'
-        cached = cache.get(cache_key)
+        # stale-while-revalidate: устаревшая запись отдаётся сразу, обновление — в фоне
+        cached = get_cached_live_data(user.remnawave_uuid)
 
         def adapt_data(data_dict, user_obj):
             expire_at = data_dict.get('expireAt')
@@ -257,11 +216,7 @@ def miniapp_subscription():
 
         # Запрос к RemnaWave
         try:
-            resp = requests.get(
-                f"{os.getenv('API_URL')}/api/users/{user.remnawave_uuid}",
-                headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
-                timeout=10
-            )
+            resp = fetch_live_user(user.remnawave_uuid)
 
             if resp.status_code != 200:
                 return jsonify({
@@ -269,7 +224,7 @@ def miniapp_subscription():
                 }), 500
 
             data = resp.json().get('response', {})
-            cache.set(cache_key, data, timeout=300)
+            store_live_data(user.remnawave_uuid, data)
 
             response = jsonify(adapt_data(data, user))
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -302,7 +257,7 @@ def miniapp_maintenance_status():
 @limiter.limit("10 per minute")
 def miniapp_activate_trial():
     """Активация триала"""
-    from modules.models.trial import get_trial_settings
+    from modules.models.trial import TrialSettings, get_trial_settings
     
     try:
         data = request.json or {}
@@ -322,7 +277,7 @@ def miniapp_activate_trial():
             return jsonify({"success": False, "message": "Trial already used"}), 400
 
         # Получаем настройки триала из БД
-        trial_settings = get_trial_settings()
+        trial_settings = get_settings(TrialSettings) or get_trial_settings()
         
         if not trial_settings.enabled:
             return jsonify({"success": False, "message": "Trial is currently disabled"}), 400
@@ -371,9 +326,8 @@ def miniapp_activate_trial():
         if trial_settings.traffic_limit_bytes > 0:
             patch_payload["trafficLimitBytes"] = trial_settings.traffic_limit_bytes
 
-        resp = requests.patch(
-            f"{os.getenv('API_URL')}/api/users",
-            headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
+        resp = remnawave.patch(
+            "/api/users",
             json=patch_payload,
             timeout=10
         )
@@ -424,7 +378,7 @@ def miniapp_payment_methods():
         return response
 
     try:
-        s = PaymentSetting.query.first()
+        s = get_settings(PaymentSetting)
         available = []
 
         # Методы из админки (PaymentSetting) — только если запись есть
@@ -722,7 +676,7 @@ def miniapp_app_config():
     # Получаем активные языки из настроек
     active_languages = ["ru", "ua", "en", "cn"]
     try:
-        settings = SystemSetting.query.first()
+        settings = get_settings(SystemSetting)
         if settings and hasattr(settings, 'active_languages') and settings.active_languages:
             try:
                 active_languages = json.loads(settings.active_languages) if isinstance(settings.active_languages, str) else settings.active_languages
@@ -833,59 +787,30 @@ def miniapp_payment_status():
         # Если платеж Platega со статусом PENDING, проверяем статус через API
         if p.payment_provider in ('platega', 'platega_mir') and p.status == 'PENDING' and p.payment_system_id:
             try:
-                from modules.models.payment import PaymentSetting, decrypt_key
-                import requests
-                import re
+                from modules.api.payments import fetch_payment_status
+                from modules.api.payments.registry import STATUS_PAID
+                
+                # Проверяем статус через API Platega
+                if fetch_payment_status(p.payment_provider, p.payment_system_id) == STATUS_PAID and p.status != 'PAID':
+                    from modules.models.user import User
+                    from modules.models.tariff import Tariff
                 
-                settings = PaymentSetting.query.first()
-                if settings:
-                    platega_key = decrypt_key(settings.platega_api_key) if settings.platega_api_key else None
-                    platega_merchant_raw = decrypt_key(settings.platega_merchant_id) if settings.platega_merchant_id else None
+                    user = db.session.get(User, p.user_id)
+                    tariff = db.session.get(Tariff, p.tariff_id) if p.tariff_id else None
+                
+                    if user:
+                        p.status = 'PAID'
+                        # Если это пополнение баланса
+                        if not tariff:
+                            user.balance = (user.balance or 0) + float(p.amount)
+                            print(f"[PLATEGA] Auto-processed balance topup {p.order_id}, new balance: {user.balance}")
+                        else:
+                            # Обрабатываем покупку тарифа
+                            from modules.api.webhooks.routes import process_successful_payment
+                            process_successful_payment(p, user, tariff)
+                            print(f"[PLATEGA] Auto-processed tariff purchase {p.order_id}")
                     
-                    if platega_key and platega_merchant_raw:
-                        # Обработка Merchant ID
-                        platega_merchant = platega_merchant_raw.strip()
-                        if platega_merchant.startswith('live_'):
-                            platega_merchant = platega_merchant[5:]
-                        uuid_pattern = r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
-                        uuid_match = re.search(uuid_pattern, platega_merchant)
-                        if uuid_match:
-                            platega_merchant = uuid_match.group(0)
-                        
-                        # Проверяем статус через API Platega
-                        api_url = f"https://app.platega.io/transaction/{p.payment_system_id}"
-                        headers = {
-                            "X-MerchantId": platega_merchant,
-                            "X-Secret": platega_key,
-                            "Content-Type": "application/json"
-                        }
-                        
-                        resp = requests.get(api_url, headers=headers, timeout=10)
-                        if resp.status_code == 200:
-                            api_data = resp.json()
-                            api_status = api_data.get('status', '').upper()
-                            
-                            # Если статус CONFIRMED, обрабатываем платеж
-                            if api_status == 'CONFIRMED' and p.status != 'PAID':
-                                from modules.models.user import User
-                                from modules.models.tariff import Tariff
-                                
-                                user = db.session.get(User, p.user_id)
-                                tariff = db.session.get(Tariff, p.tariff_id) if p.tariff_id else None
-                                
-                                if user:
-                                    p.status = 'PAID'
-                                    # Если это пополнение баланса
-                                    if not tariff:
-                                        user.balance = (user.balance or 0) + float(p.amount)
-                                        print(f"[PLATEGA] Auto-processed balance topup {p.order_id}, new balance: {user.balance}")
-                                    else:
-                                        # Обрабатываем покупку тарифа
-                                        from modules.api.webhooks.routes import process_successful_payment
-                                        process_successful_payment(p, user, tariff)
-                                        print(f"[PLATEGA] Auto-processed tariff purchase {p.order_id}")
-                                    
-                                    db.session.commit()
+                        db.session.commit()
             except Exception as e:
                 print(f"[PLATEGA] Error checking status via API: {e}")
         
@@ -1017,11 +942,8 @@ def miniapp_activate_promocode():
         
         # Применяем промокод (упрощенная версия - только для DAYS)
         if promo.promo_type == 'DAYS':
-            API_URL = os.getenv('API_URL')
-            headers, cookies = get_remnawave_headers()
-            
             try:
-                live = requests.get(f"{API_URL}/api/users/{user.remnawave_uuid}", headers=headers, cookies=cookies, timeout=10).json().get('response', {})
+                live = remnawave.get(f"/api/users/{user.remnawave_uuid}", timeout=10).json().get('response', {})
                 curr_exp_str = live.get('expireAt')
                 if curr_exp_str:
                     try:
@@ -1048,9 +970,8 @@ def miniapp_activate_promocode():
                     patch_payload["activeInternalSquads"] = [promo.squad_id]
                 # Если у пользователя уже есть сквад - просто добавляем дни (не меняем сквад)
                 
-                patch_resp = requests.patch(
-                    f"{API_URL}/api/users",
-                    headers={"Content-Type": "application/json", **headers},
+                patch_resp = remnawave.patch(
+                    "/api/users",
                     json=patch_payload,
                     timeout=10
                 )
@@ -1070,7 +991,7 @@ def miniapp_activate_promocode():
                 db.session.commit()
                 
                 cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
+                invalidate_live_user(user.remnawave_uuid)
                 
                 response = jsonify({
                     "message": "Промокод активирован",
@@ -1166,9 +1087,7 @@ def miniapp_nodes():
             return response, 404
         
         # Получаем серверы
-        API_URL = os.getenv('API_URL')
-        headers, cookies = get_remnawave_headers()
-        resp = requests.get(f"{API_URL}/api/users/{user.remnawave_uuid}/accessible-nodes", headers=headers, cookies=cookies, timeout=10)
+        resp = remnawave.get(f"/api/users/{user.remnawave_uuid}/accessible-nodes", timeout=10)
         
         if resp.status_code == 200:
             nodes_data = resp.json()
@@ -1520,22 +1439,8 @@ def miniapp_configs():
         # Получаем все конфиги пользователя
         user_configs = UserConfig.query.filter_by(user_id=user.id).order_by(UserConfig.is_primary.desc(), UserConfig.created_at.asc()).all()
         
-        API_URL = os.getenv('API_URL')
-        headers, cookies = get_remnawave_headers()
-        
-        # Получаем названия уровней тарифов (TariffLevel), fallback на branding для базовых
-        from modules.models.branding import BrandingSetting
-        from modules.models.tariff_level import TariffLevel
-
-        branding = BrandingSetting.query.first()
-        basic_name = getattr(branding, 'tariff_tier_basic_name', None) or 'Базовый'
-        pro_name = getattr(branding, 'tariff_tier_pro_name', None) or 'Премиум'
-        elite_name = getattr(branding, 'tariff_tier_elite_name', None) or 'Элитный'
-
-        tier_names = {lvl.code.lower(): (lvl.name or lvl.code) for lvl in TariffLevel.query.filter_by(is_active=True).all()}
-        tier_names.setdefault('basic', basic_name)
-        tier_names.setdefault('pro', pro_name)
-        tier_names.setdefault('elite', elite_name)
+        # Названия уровней тарифов (TariffLevel, fallback на branding для базовых)
+        tier_names = get_tier_names()
         
         configs = []
         
@@ -1546,15 +1451,13 @@ def miniapp_configs():
             
             if not cached:
                 try:
-                    resp = requests.get(
-                        f"{API_URL}/api/users/{user_config.remnawave_uuid}",
-                        headers=headers,
-                        cookies=cookies,
+                    resp = remnawave.get(
+                        f"/api/users/{user_config.remnawave_uuid}",
                         timeout=10
                     )
                     if resp.status_code == 200:
                         cached = resp.json().get('response', {})
-                        cache.set(cache_key, cached, timeout=300)
+                        store_live_data(user_config.remnawave_uuid, cached)
                 except:
                     cached = {}
             
@@ -1796,14 +1699,10 @@ def miniapp_configs_delete():
         # Пытаемся удалить пользователя в RemnaWave (не блокируем удаление в БД при ошибке)
         remote_deleted = False
         remote_status = None
-        API_URL = os.getenv('API_URL')
-        if API_URL and remnawave_uuid:
+        if remnawave.base_url and remnawave_uuid:
             try:
-                headers, cookies = get_remnawave_headers()
-                resp = requests.delete(
-                    f"{API_URL}/api/users/{remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
+                resp = remnawave.delete(
+                    f"/api/users/{remnawave_uuid}",
                     timeout=10
                 )
                 remote_status = resp.status_code
@@ -2032,18 +1931,14 @@ def miniapp_profile():
         cached = cache.get(cache_key)
         
         if not cached:
-            API_URL = os.getenv('API_URL')
-            headers, cookies = get_remnawave_headers()
             try:
-                resp = requests.get(
-                    f"{API_URL}/api/users/{user.remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
+                resp = remnawave.get(
+                    f"/api/users/{user.remnawave_uuid}",
                     timeout=10
                 )
                 if resp.status_code == 200:
                     cached = resp.json().get('response', {})
-                    cache.set(cache_key, cached, timeout=300)
+                    store_live_data(user.remnawave_uuid, cached)
             except:
                 cached = {}
         
@@ -2153,7 +2048,7 @@ def miniapp_settings():
             # Проверяем, что валюта активна
             from modules.models.system import SystemSetting
             import json
-            settings = SystemSetting.query.first()
+            settings = get_settings(SystemSetting)
             active_currencies = ['uah', 'rub', 'usd']
             if settings and hasattr(settings, 'active_currencies') and settings.active_currencies:
                 try:
@@ -2169,7 +2064,7 @@ def miniapp_settings():
                 # Очищаем кэш при изменении валюты, чтобы баланс пересчитался
                 if currency_changed:
                     cache.delete(f'live_data_{user.remnawave_uuid}')
-                    cache.delete('all_live_users_map')
+                    invalidate_live_user(user.remnawave_uuid)
         
         # Обновляем язык
         if 'preferred_lang' in data:
@@ -2177,7 +2072,7 @@ def miniapp_settings():
             # Проверяем, что язык активен
             from modules.models.system import SystemSetting
             import json
-            settings = SystemSetting.query.first()
+            settings = get_settings(SystemSetting)
             active_languages = ['ru', 'ua', 'en', 'cn']
             if settings and hasattr(settings, 'active_languages') and settings.active_languages:
                 try:
@@ -2858,10 +2753,42 @@ def miniapp_support_ticket_reply(ticket_id):
 # PAYMENT HISTORY
 # ============================================================================
 
+def _safe_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _encode_payments_cursor(created_at, payment_id):
+    """Курсор = base64(JSON [created_at, id последнего платежа страницы])"""
+    import base64
+
+    value = created_at.replace(tzinfo=None).isoformat() if created_at else None
+    raw = json.dumps([value, payment_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_payments_cursor(cursor):
+    """Разбирает курсор; возвращает (created_at, id) или None если курсор невалиден"""
+    import base64
+
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(str(cursor)) % 4))
+        created_at, payment_id = json.loads(raw.decode('utf-8'))
+        return datetime.fromisoformat(str(created_at).replace(' ', 'T')), int(payment_id)
+    except Exception:
+        return None
+
+
 @app.route('/miniapp/payments/history', methods=['POST', 'OPTIONS'])
 @limiter.limit("30 per minute")
 def miniapp_payments_history():
-    """Получить историю платежей пользователя"""
+    """
+    Получить историю платежей пользователя
+
+    Постранично: limit (по умолчанию 50, максимум 100) и cursor из next_cursor предыдущего ответа.
+    """
     if request.method == 'OPTIONS':
         response = jsonify({})
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -2887,51 +2814,35 @@ def miniapp_payments_history():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 404
         
-        # Получаем названия уровней тарифов (TariffLevel), fallback на branding для базовых
-        from modules.models.branding import BrandingSetting
-        from modules.models.tariff_level import TariffLevel
+        limit = min(max(_safe_int(data.get('limit'), 50), 1), 100)
+        query = db.session.query(
+            Payment.id, Payment.order_id, Payment.amount, Payment.currency, Payment.status,
+            Payment.payment_provider, Payment.tariff_id, Payment.created_at, Tariff.duration_days
+        ).outerjoin(Tariff, Tariff.id == Payment.tariff_id).filter(Payment.user_id == user.id)
+
+        cursor = data.get('cursor')
+        if cursor:
+            decoded = _decode_payments_cursor(cursor)
+            if decoded is None:
+                response = jsonify({"detail": {"title": "Bad Request", "message": "Invalid cursor"}})
+                response.headers.add('Access-Control-Allow-Origin', '*')
+                return response, 400
+            last_created_at, last_id = decoded
+            query = query.filter(or_(
+                Payment.created_at < last_created_at,
+                and_(Payment.created_at == last_created_at, Payment.id < last_id)
+            ))
 
-        branding = BrandingSetting.query.first()
-        basic_name = getattr(branding, 'tariff_tier_basic_name', None) or 'Базовый'
-        pro_name = getattr(branding, 'tariff_tier_pro_name', None) or 'Премиум'
-        elite_name = getattr(branding, 'tariff_tier_elite_name', None) or 'Элитный'
+        rows = query.order_by(Payment.created_at.desc(), Payment.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # Названия тарифов - из карты, перестраиваемой только при изменении тарифов/уровней/брендинга
+        tariff_names = get_tariff_display_map()
 
-        tier_names = {lvl.code.lower(): (lvl.name or lvl.code) for lvl in TariffLevel.query.filter_by(is_active=True).all()}
-        tier_names.setdefault('basic', basic_name)
-        tier_names.setdefault('pro', pro_name)
-        tier_names.setdefault('elite', elite_name)
-        
-        # Получаем платежи пользователя
-        payments = Payment.query.filter_by(user_id=user.id).order_by(Payment.created_at.desc()).limit(50).all()
-        
         payments_list = []
-        for p in payments:
-            tariff = db.session.get(Tariff, p.tariff_id) if p.tariff_id else None
-            tariff_name = None
-            if tariff:
-                # Используем tier для отображения (Basic, Pro, Elite), если он есть
-                if tariff.tier:
-                    tariff_name = tier_names.get(tariff.tier.lower(), tariff.tier)
-                else:
-                    # Проверяем, содержит ли name период (месяц, дней и т.д.)
-                    period_patterns = [
-                        r'\d+\s*(месяц|месяца|месяцев|Месяц|Месяца|Месяцев)',
-                        r'\d+\s*(день|дня|дней|День|Дня|Дней)',
-                        r'\d+\s*(day|days|Day|Days)',
-                        r'\d+\s*(мес|Мес)'
-                    ]
-                    has_period = any(re.search(pattern, tariff.name or '') for pattern in period_patterns)
-                    if has_period:
-                        # Если name содержит период, определяем tier по duration_days
-                        if tariff.duration_days >= 180:
-                            tariff_name = elite_name
-                        elif tariff.duration_days >= 90:
-                            tariff_name = pro_name
-                        else:
-                            tariff_name = basic_name
-                    else:
-                        tariff_name = tariff.name
-            
+        for p in rows:
+            tariff_name = tariff_names.get(p.tariff_id, (None, None))[0] if p.tariff_id else None
             payments_list.append({
                 "id": p.id,
                 "order_id": p.order_id,
@@ -2940,11 +2851,12 @@ def miniapp_payments_history():
                 "status": p.status.lower(),
                 "payment_provider": p.payment_provider,
                 "tariff_name": tariff_name,
-                "tariff_duration_days": tariff.duration_days if tariff else None,
+                "tariff_duration_days": p.duration_days,
                 "created_at": p.created_at.isoformat() if p.created_at else None
             })
-        
-        response = jsonify({"payments": payments_list})
+
+        next_cursor = _encode_payments_cursor(rows[-1].created_at, rows[-1].id) if has_more and rows else None
+        response = jsonify({"payments": payments_list, "next_cursor": next_cursor, "has_more": has_more})
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 200
         
@@ -2994,84 +2906,67 @@ def spin_wheel(chances):
     return random.choice(sectors)
 
 
-def get_user_days_remaining(user):
-    """Получить количество оставшихся дней подписки (частичный день считаем как 1 день)."""
-    if not user or not user.remnawave_uuid:
-        return 0
+CASINO_COUNTER_TTL = 2 * 86400  # Счётчик игр за день живёт двое суток (ключ содержит дату)
+CASINO_SPIN_LOCK_TTL = 30  # Одна игра пользователя за раз (защита от двойного списания)
 
-    def days_from_expire(expire_at):
-        if not expire_at:
-            return 0
-        try:
-            if isinstance(expire_at, str):
-                expire_at = expire_at.replace('Z', '+00:00')
-            expire_date = datetime.fromisoformat(expire_at) if isinstance(expire_at, str) else expire_at
-            if hasattr(expire_date, 'tzinfo') and expire_date.tzinfo is None:
-                expire_date = expire_date.replace(tzinfo=timezone.utc)
-            now = datetime.now(timezone.utc)
-            delta = expire_date - now
-            if delta.total_seconds() <= 0:
-                return 0
-            return max(0, math.ceil(delta.total_seconds() / 86400))
-        except Exception:
-            return 0
+_casino_stats_id = None
 
-    # Сначала пробуем кэш (те же данные, что видит пользователь в подписке)
-    try:
-        cache_key = f'live_data_{user.remnawave_uuid}'
-        cached = cache.get(cache_key)
-        if cached and isinstance(cached, dict):
-            d = days_from_expire(cached.get('expireAt'))
-            if d > 0:
-                return d
-    except Exception:
-        pass
 
+def _days_from_expire(expire_at):
+    """Оставшиеся дни подписки по expireAt (частичный день считаем как 1 день)."""
+    if not expire_at:
+        return 0
     try:
-        api_url = os.environ.get('API_URL', '')
-        admin_token = os.environ.get('ADMIN_TOKEN', '')
-        if not api_url or not admin_token:
+        if isinstance(expire_at, str):
+            expire_at = expire_at.replace('Z', '+00:00')
+        expire_date = datetime.fromisoformat(expire_at) if isinstance(expire_at, str) else expire_at
+        if hasattr(expire_date, 'tzinfo') and expire_date.tzinfo is None:
+            expire_date = expire_date.replace(tzinfo=timezone.utc)
+        now = datetime.now(timezone.utc)
+        delta = expire_date - now
+        if delta.total_seconds() <= 0:
             return 0
+        return max(0, math.ceil(delta.total_seconds() / 86400))
+    except Exception:
+        return 0
 
-        response = requests.get(
-            f"{api_url}/api/users/{user.remnawave_uuid}",
-            headers={"Authorization": f"Bearer {admin_token}"},
-            timeout=10
-        )
 
+def get_remnawave_user(user):
+    """Свежая запись пользователя из RemnaWave (dict) или None."""
+    if not user or not user.remnawave_uuid:
+        return None
+    if not os.environ.get('API_URL', '') or not os.environ.get('ADMIN_TOKEN', ''):
+        return None
+    try:
+        response = remnawave.get(f"/api/users/{user.remnawave_uuid}", timeout=10)
         if response.status_code == 200:
-            data = response.json().get('response', {})
-            return days_from_expire(data.get('expireAt'))
+            return response.json().get('response', {})
     except Exception:
         pass
+    return None
 
-    return 0
 
+def update_user_subscription(user, days_delta, current=None):
+    """
+    Обновить подписку пользователя (добавить/убавить дни). days_delta может быть float (для x0.5).
 
-def update_user_subscription(user, days_delta):
-    """Обновить подписку пользователя (добавить/убавить дни). days_delta может быть float (для x0.5)."""
+    current - запись пользователя RemnaWave, от expireAt которой считаем (если None - читаем из API).
+    Возвращает запись пользователя после PATCH (dict) или None при ошибке.
+    """
     if not user or not user.remnawave_uuid:
-        return False
+        return None
 
     try:
-        api_url = os.environ.get('API_URL', '')
         admin_token = os.environ.get('ADMIN_TOKEN', '')
-        if not api_url or not admin_token:
-            return False
-
-        # Получаем текущую дату окончания из API (всегда свежие данные)
-        response = requests.get(
-            f"{api_url}/api/users/{user.remnawave_uuid}",
-            headers={"Authorization": f"Bearer {admin_token}"},
-            timeout=10
-        )
-
-        if response.status_code != 200:
-            return False
+        if not os.environ.get('API_URL', '') or not admin_token:
+            return None
 
-        data = response.json().get('response', {})
-        current_expire = data.get('expireAt')
+        if current is None:
+            current = get_remnawave_user(user)
+            if current is None:
+                return None
 
+        current_expire = current.get('expireAt')
         if current_expire:
             if isinstance(current_expire, str):
                 current_expire = current_expire.replace('Z', '+00:00')
@@ -3086,8 +2981,8 @@ def update_user_subscription(user, days_delta):
         days_delta_val = float(days_delta)
         new_expire = expire_date + timedelta(days=days_delta_val)
 
-        update_response = requests.patch(
-            f"{api_url}/api/users",
+        update_response = remnawave.patch(
+            "/api/users",
             headers={
                 "Authorization": f"Bearer {admin_token}",
                 "Content-Type": "application/json"
@@ -3098,17 +2993,119 @@ def update_user_subscription(user, days_delta):
 
         if update_response.status_code != 200:
             print(f"Error updating subscription: Status {update_response.status_code}, Response: {update_response.text[:200]}")
-            return False
+            return None
 
-        # Сбрасываем кэш, чтобы get_user_days_remaining и подписка в мини-аппе видели новый баланс
+        # Новое состояние берём из ответа PATCH (без повторного GET)
+        try:
+            updated = (update_response.json() or {}).get('response') or {}
+        except ValueError:
+            updated = {}
+        if not updated.get('expireAt'):
+            updated = dict(current, uuid=user.remnawave_uuid, expireAt=new_expire.isoformat())
+
+        # Сбрасываем кэш, чтобы подписка в мини-аппе видела новый баланс
         try:
             cache.delete(f'live_data_{user.remnawave_uuid}')
+            update_live_user(updated)
         except Exception:
             pass
-        return True
+        return updated
     except Exception as e:
         print(f"Error updating subscription: {e}")
-        return False
+        return None
+
+
+def _shared_counters_enabled():
+    # Null-кэш не хранит значения - лимит считаем по БД
+    return (app.config.get('CACHE_TYPE') or 'null').lower() not in ('null', 'nullcache')
+
+
+def _casino_day_key(user_id):
+    return f"casino:games:{user_id}:{datetime.utcnow():%Y%m%d}"
+
+
+def _count_games_today(user_id):
+    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return CasinoGame.query.filter(
+        CasinoGame.user_id == user_id,
+        CasinoGame.created_at >= today_start
+    ).count()
+
+
+def _reserve_casino_game(user_id, max_games):
+    """
+    Занять игру из дневного лимита атомарным счётчиком в кэше (INCR в Redis).
+
+    Счётчик создаётся из БД один раз за день (cache.add - только если ключа нет).
+    Returns:
+        tuple: (разрешено, игр сегодня до этой)
+    """
+    if not _shared_counters_enabled():
+        games_today = _count_games_today(user_id)
+        return games_today < max_games, games_today
+
+    key = _casino_day_key(user_id)
+    try:
+        if cache.get(key) is None:
+            cache.add(key, _count_games_today(user_id), timeout=CASINO_COUNTER_TTL)
+        value = cache.cache.inc(key)
+    except Exception:
+        value = None
+    if value is None:
+        games_today = _count_games_today(user_id)
+        return games_today < max_games, games_today
+
+    if value > max_games:
+        _release_casino_game(user_id)
+        return False, value - 1
+    return True, value - 1
+
+
+def _release_casino_game(user_id):
+    """Вернуть игру в дневной лимит (ставка не состоялась)"""
+    if not _shared_counters_enabled():
+        return
+    try:
+        cache.cache.dec(_casino_day_key(user_id))
+    except Exception:
+        pass
+
+
+def _record_casino_stats(bet_days, net_win_days):
+    """
+    Обновить общую статистику казино атомарным UPDATE ... SET x = x + :delta (без чтения строки).
+
+    Блокировка строки держится только до commit игры, а не на время запросов к RemnaWave.
+    """
+    global _casino_stats_id
+    won = max(0, int(round(net_win_days))) if net_win_days > 0 else 0
+    lost = max(0, int(round(abs(net_win_days)))) if net_win_days <= 0 else 0
+    coalesce = db.func.coalesce
+
+    if _casino_stats_id is None:
+        _casino_stats_id = db.session.query(db.func.min(CasinoStats.id)).scalar()
+    if _casino_stats_id is not None:
+        updated = db.session.query(CasinoStats).filter(CasinoStats.id == _casino_stats_id).update({
+            CasinoStats.total_games: coalesce(CasinoStats.total_games, 0) + 1,
+            CasinoStats.total_bet_days: coalesce(CasinoStats.total_bet_days, 0) + bet_days,
+            CasinoStats.total_win_days: coalesce(CasinoStats.total_win_days, 0) + won,
+            CasinoStats.total_lost_days: coalesce(CasinoStats.total_lost_days, 0) + lost,
+            # В SET справа старые значения колонок
+            CasinoStats.house_profit_days: (coalesce(CasinoStats.total_lost_days, 0) + lost)
+                                           - (coalesce(CasinoStats.total_win_days, 0) + won),
+            CasinoStats.updated_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        if updated:
+            return
+        _casino_stats_id = None
+
+    db.session.add(CasinoStats(
+        total_games=1,
+        total_bet_days=bet_days,
+        total_win_days=won,
+        total_lost_days=lost,
+        house_profit_days=lost - won
+    ))
 
 
 @app.route('/miniapp/casino/config', methods=['GET', 'POST', 'OPTIONS'])
@@ -3188,96 +3185,78 @@ def casino_play():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 400
         
-        # Проверяем лимит игр в день
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        games_today = CasinoGame.query.filter(
-            CasinoGame.user_id == user.id,
-            CasinoGame.created_at >= today_start
-        ).count()
-        
-        if games_today >= config['max_games_per_day']:
-            response = jsonify({'error': f'Лимит игр на сегодня исчерпан ({config["max_games_per_day"]} игр)'})
+        # Одна игра пользователя за раз: параллельные запросы не спишут ставку дважды
+        spin_lock_key = f"casino:spin:{user.id}"
+        if not cache.add(spin_lock_key, 1, timeout=CASINO_SPIN_LOCK_TTL):
+            response = jsonify({'error': 'Предыдущая игра ещё не завершена'})
             response.headers.add('Access-Control-Allow-Origin', '*')
-            return response, 400
-        
-        # Проверяем баланс дней
-        balance_before = get_user_days_remaining(user)
-        if balance_before < bet_days:
-            response = jsonify({'error': f'Недостаточно дней для ставки. У вас {balance_before} дней'})
-            response.headers.add('Access-Control-Allow-Origin', '*')
-            return response, 400
+            return response, 429
+        try:
+            # Проверяем лимит игр в день (атомарный счётчик; игра возвращается в лимит, если ставка не состоялась)
+            allowed, games_today = _reserve_casino_game(user.id, config['max_games_per_day'])
+            if not allowed:
+                response = jsonify({'error': f'Лимит игр на сегодня исчерпан ({config["max_games_per_day"]} игр)'})
+                response.headers.add('Access-Control-Allow-Origin', '*')
+                return response, 400
 
-        # Крутим колесо (до списания, чтобы результат не зависел от порядка запросов)
-        multiplier = spin_wheel(config['chances'])
+            spin_committed = False
+            try:
+                # Проверяем баланс дней (свежая запись RemnaWave - от неё же считается новая дата окончания)
+                remnawave_user = get_remnawave_user(user)
+                balance_before = _days_from_expire(remnawave_user.get('expireAt')) if remnawave_user else 0
+                if balance_before < bet_days:
+                    response = jsonify({'error': f'Недостаточно дней для ставки. У вас {balance_before} дней'})
+                    response.headers.add('Access-Control-Allow-Origin', '*')
+                    return response, 400
 
-        # Выигрыш: bet_days * multiplier дней (float для x0.5 — половина обратно)
-        if multiplier == 0:
-            win_days = 0.0
-        else:
-            win_days = float(bet_days) * multiplier
+                # Крутим колесо (до списания, чтобы результат не зависел от порядка запросов)
+                multiplier = spin_wheel(config['chances'])
 
-        # Одно атомарное обновление: списание ставки и начисление выигрыша (нет гонки между двумя PATCH)
-        net_delta = -bet_days + win_days
-        success = update_user_subscription(user, net_delta)
-        if not success:
-            response = jsonify({'error': 'Ошибка обновления подписки (списание/начисление дней)'})
-            response.headers.add('Access-Control-Allow-Origin', '*')
-            return response, 500
+                # Выигрыш: bet_days * multiplier дней (float для x0.5 — половина обратно)
+                if multiplier == 0:
+                    win_days = 0.0
+                else:
+                    win_days = float(bet_days) * multiplier
 
-        # Финальный баланс дней после обновления
-        balance_after = get_user_days_remaining(user)
-        
-        # Чистый выигрыш/проигрыш для статистики
-        net_win_days = win_days - bet_days
-        
-        # Логируем для отладки (списание и выдача дней в одном PATCH: net_delta = -bet_days + win_days)
-        print(f"Casino: bet={bet_days}, multiplier={multiplier}, win_days={win_days}, net_delta={net_delta}, balance_before={balance_before}, balance_after={balance_after}")
-        
-        # Сохраняем игру в историю (в БД — целые числа)
-        net_win_int = int(round(net_win_days))
-        game = CasinoGame(
-            user_id=user.id,
-            bet_days=bet_days,
-            multiplier=multiplier,
-            win_days=net_win_int,
-            balance_before=balance_before,
-            balance_after=balance_after
-        )
-        db.session.add(game)
-        
-        # Обновляем статистику казино
-        stats = CasinoStats.query.first()
-        if not stats:
-            stats = CasinoStats(
-                total_games=0,
-                total_bet_days=0,
-                total_win_days=0,
-                total_lost_days=0,
-                house_profit_days=0
+                # Одно атомарное обновление: списание ставки и начисление выигрыша (нет гонки между двумя PATCH)
+                net_delta = -bet_days + win_days
+                updated_user = update_user_subscription(user, net_delta, current=remnawave_user)
+                if not updated_user:
+                    response = jsonify({'error': 'Ошибка обновления подписки (списание/начисление дней)'})
+                    response.headers.add('Access-Control-Allow-Origin', '*')
+                    return response, 500
+                spin_committed = True
+            finally:
+                if not spin_committed:
+                    _release_casino_game(user.id)
+
+            # Финальный баланс дней - из ответа PATCH
+            balance_after = _days_from_expire(updated_user.get('expireAt'))
+
+            # Чистый выигрыш/проигрыш для статистики
+            net_win_days = win_days - bet_days
+
+            # Логируем для отладки (списание и выдача дней в одном PATCH: net_delta = -bet_days + win_days)
+            print(f"Casino: bet={bet_days}, multiplier={multiplier}, win_days={win_days}, net_delta={net_delta}, balance_before={balance_before}, balance_after={balance_after}")
+
+            # Сохраняем игру в историю (в БД — целые числа)
+            net_win_int = int(round(net_win_days))
+            game = CasinoGame(
+                user_id=user.id,
+                bet_days=bet_days,
+                multiplier=multiplier,
+                win_days=net_win_int,
+                balance_before=balance_before,
+                balance_after=balance_after
             )
-            db.session.add(stats)
-        
-        # Инициализируем None значения
-        if stats.total_games is None:
-            stats.total_games = 0
-        if stats.total_bet_days is None:
-            stats.total_bet_days = 0
-        if stats.total_win_days is None:
-            stats.total_win_days = 0
-        if stats.total_lost_days is None:
-            stats.total_lost_days = 0
-        
-        stats.total_games += 1
-        stats.total_bet_days += bet_days
-        
-        if net_win_days > 0:
-            stats.total_win_days += max(0, int(round(net_win_days)))
-        else:
-            stats.total_lost_days += max(0, int(round(abs(net_win_days))))
-        
-        stats.house_profit_days = stats.total_lost_days - stats.total_win_days
-        
-        db.session.commit()
+            db.session.add(game)
+
+            # Обновляем статистику казино (последним - строка блокируется только до commit)
+            _record_casino_stats(bet_days, net_win_days)
+
+            db.session.commit()
+        finally:
+            cache.delete(spin_lock_key)
         
         # Определяем результат
         if multiplier == 0:
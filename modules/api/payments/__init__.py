@@ -12,37 +12,52 @@
 - monobank.py     - Monobank
 - btcpayserver.py - BTCPayServer
 - platega.py      - Platega
+- mulenpay.py     - Mulenpay
+- urlpay.py       - UrlPay
+- tribute.py      - Tribute
+
+registry.py - реестр провайдеров (общий интерфейс, HTTP-сессии, счётчики)
 """
 
-from modules.api.payments.crystalpay import create_crystalpay_payment
-from modules.api.payments.heleket import create_heleket_payment
+from modules.api.payments.registry import register_provider, get_provider, get_providers
+from modules.api.payments.crystalpay import create_crystalpay_payment, verify_crystalpay_signature, fetch_crystalpay_status
+from modules.api.payments.heleket import create_heleket_payment, verify_heleket_signature
 from modules.api.payments.yookassa import create_yookassa_payment
 from modules.api.payments.yoomoney import create_yoomoney_payment
 from modules.api.payments.telegram_stars import create_telegram_stars_payment
-from modules.api.payments.freekassa import create_freekassa_payment
-from modules.api.payments.kassa_ai import create_kassa_ai_payment
-from modules.api.payments.robokassa import create_robokassa_payment
-from modules.api.payments.cryptobot import create_cryptobot_payment
+from modules.api.payments.freekassa import create_freekassa_payment, verify_freekassa_signature
+from modules.api.payments.kassa_ai import create_kassa_ai_payment, verify_kassa_ai_webhook
+from modules.api.payments.robokassa import create_robokassa_payment, verify_robokassa_signature
+from modules.api.payments.cryptobot import create_cryptobot_payment, verify_cryptobot_signature
 from modules.api.payments.monobank import create_monobank_payment
 from modules.api.payments.btcpayserver import create_btcpayserver_payment
-from modules.api.payments.platega import create_platega_payment, create_platega_mir_payment
+from modules.api.payments.platega import (
+    create_platega_payment, create_platega_mir_payment, verify_platega_signature, fetch_platega_status
+)
+from modules.api.payments.mulenpay import create_mulenpay_payment
+from modules.api.payments.urlpay import create_urlpay_payment
+from modules.api.payments.tribute import create_tribute_payment
+
+# Реестр провайдеров: создание счёта, проверка webhook, запрос статуса
+register_provider('crystalpay', create_crystalpay_payment, verify_crystalpay_signature, fetch_crystalpay_status)
+register_provider('heleket', create_heleket_payment, verify_heleket_signature)
+register_provider('yookassa', create_yookassa_payment)
+register_provider('yoomoney', create_yoomoney_payment)
+register_provider('telegram_stars', create_telegram_stars_payment)
+register_provider('freekassa', create_freekassa_payment, verify_freekassa_signature)
+register_provider('kassa_ai', create_kassa_ai_payment, verify_kassa_ai_webhook)
+register_provider('robokassa', create_robokassa_payment, verify_robokassa_signature)
+register_provider('cryptobot', create_cryptobot_payment, verify_cryptobot_signature)
+register_provider('monobank', create_monobank_payment)
+register_provider('btcpayserver', create_btcpayserver_payment)
+register_provider('platega', create_platega_payment, verify_platega_signature, fetch_platega_status)
+register_provider('platega_mir', create_platega_mir_payment, verify_platega_signature, fetch_platega_status)
+register_provider('mulenpay', create_mulenpay_payment)
+register_provider('urlpay', create_urlpay_payment)
+register_provider('tribute', create_tribute_payment)
 
 # Маппинг провайдеров к функциям создания платежа
-PAYMENT_PROVIDERS = {
-    'crystalpay': create_crystalpay_payment,
-    'heleket': create_heleket_payment,
-    'yookassa': create_yookassa_payment,
-    'yoomoney': create_yoomoney_payment,
-    'telegram_stars': create_telegram_stars_payment,
-    'freekassa': create_freekassa_payment,
-    'kassa_ai': create_kassa_ai_payment,
-    'robokassa': create_robokassa_payment,
-    'cryptobot': create_cryptobot_payment,
-    'monobank': create_monobank_payment,
-    'btcpayserver': create_btcpayserver_payment,
-    'platega': create_platega_payment,
-    'platega_mir': create_platega_mir_payment,
-}
+PAYMENT_PROVIDERS = {name: provider.create_invoice for name, provider in get_providers().items()}
 
 
 def create_payment(provider: str, amount: float, currency: str, order_id: str, **kwargs):
@@ -59,9 +74,21 @@ def create_payment(provider: str, amount: float, currency: str, order_id: str, *
     Returns:
         tuple: (url, payment_id) или (None, error_message)
     """
-    if provider not in PAYMENT_PROVIDERS:
+    payment_provider = get_provider(provider)
+    if payment_provider is None:
         return None, f"Unknown payment provider: {provider}"
     
-    return PAYMENT_PROVIDERS[provider](amount, currency, order_id, **kwargs)
+    return payment_provider.create_invoice(amount, currency, order_id, **kwargs)
 
 
+def fetch_payment_status(provider: str, payment_system_id: str):
+    """
+    Статус платежа у провайдера (для сверки без webhook)
+    
+    Returns:
+        str: PAID / PENDING / FAILED или None (провайдер не поддерживает запрос статуса / ошибка)
+    """
+    payment_provider = get_provider(provider)
+    if payment_provider is None or not payment_system_id:
+        return None
+    return payment_provider.fetch_status(payment_system_id)
@@ -2,20 +2,121 @@
 Базовые функции для платёжных систем
 """
 import os
+import threading
+from types import MappingProxyType
 from modules.core import get_fernet
 from modules.models.payment import PaymentSetting
 from modules.models.bot_config import BotConfig
+from modules.settings_registry import get_settings
 
 fernet = get_fernet()
 
+# Ключи PaymentSetting, без которых провайдер недоступен (порядок = порядок в списке методов оплаты)
+PROVIDER_CREDENTIALS = {
+    'crystalpay': ('crystalpay_api_key', 'crystalpay_api_secret'),
+    'heleket': ('heleket_api_key',),
+    'yookassa': ('yookassa_shop_id', 'yookassa_secret_key'),
+    'yoomoney': ('yoomoney_receiver', 'yoomoney_notification_secret'),
+    'platega': ('platega_api_key', 'platega_merchant_id'),
+    'mulenpay': ('mulenpay_api_key', 'mulenpay_secret_key', 'mulenpay_shop_id'),
+    'urlpay': ('urlpay_api_key', 'urlpay_secret_key', 'urlpay_shop_id'),
+    'telegram_stars': ('telegram_bot_token',),
+    'monobank': ('monobank_token',),
+    'btcpayserver': ('btcpayserver_url', 'btcpayserver_api_key', 'btcpayserver_store_id'),
+    'tribute': ('tribute_api_key',),
+    'robokassa': ('robokassa_merchant_login', 'robokassa_password1'),
+    'freekassa': ('freekassa_shop_id', 'freekassa_secret'),
+    'cryptobot': ('cryptobot_api_key',),
+}
+
+# Все зашифрованные поля PaymentSetting (TEXT-колонки)
+CREDENTIAL_FIELDS = tuple(
+    c.key for c in PaymentSetting.__table__.columns if c.key != 'id' and c.type.python_type is str
+)
+
+# Расшифрованные ключи текущего снимка PaymentSetting; пересобираются, когда реестр настроек
+# отдаёт новый снимок (после сохранения /api/admin/payment-settings в любом воркере)
+_credentials = {'snapshot': None, 'values': MappingProxyType({}), 'by_ciphertext': {}}
+_credentials_lock = threading.Lock()
+
 
 def get_payment_settings():
     """Получить настройки платёжных систем"""
-    return PaymentSetting.query.first()
+    return get_settings(PaymentSetting)
+
+
+def _ciphertext_key(value):
+    if isinstance(value, memoryview):
+        value = bytes(value)
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).decode('utf-8', 'replace')
+    return str(value)
+
+
+def get_payment_credentials():
+    """Расшифрованные ключи платёжных систем {поле PaymentSetting: значение} (каждый ключ расшифровывается один раз)"""
+    settings = get_payment_settings()
+    if settings is None:
+        return MappingProxyType({})
+    state = _credentials
+    if state['snapshot'] is not settings:
+        values, by_ciphertext = {}, {}
+        for field in CREDENTIAL_FIELDS:
+            raw = getattr(settings, field, None)
+            plain = _decrypt(raw) if raw else ""
+            values[field] = plain
+            if raw:
+                by_ciphertext[_ciphertext_key(raw)] = plain
+        with _credentials_lock:
+            state.update(snapshot=settings, values=MappingProxyType(values), by_ciphertext=by_ciphertext)
+    return state['values']
+
+
+def get_provider_credentials(provider):
+    """Ключи провайдера {поле: значение} или None, если какого-то ключа нет или он не расшифровался"""
+    fields = PROVIDER_CREDENTIALS.get(provider)
+    if not fields:
+        return None
+    credentials = get_payment_credentials()
+    values = {field: credentials.get(field, "") for field in fields}
+    if any(not value or value == "DECRYPTION_ERROR" for value in values.values()):
+        return None
+    return values
+
+
+def get_configured_providers():
+    """Провайдеры из PaymentSetting, у которых заполнены все ключи"""
+    providers = []
+    for provider in PROVIDER_CREDENTIALS:
+        if get_provider_credentials(provider) is None:
+            continue
+        providers.append(provider)
+        if provider == 'platega' and getattr(get_payment_settings(), 'platega_mir_enabled', False):
+            providers.append('platega_mir')
+    return providers
+
+
+def invalidate_payment_credentials():
+    """Сбросить расшифрованные ключи процесса (пересоберутся при следующем обращении)"""
+    with _credentials_lock:
+        _credentials.update(snapshot=None, values=MappingProxyType({}), by_ciphertext={})
 
 
 def decrypt_key(encrypted_key):
-    """Расшифровать ключ API"""
+    """Расшифровать ключ API (значения текущих PaymentSetting берутся из кэша расшифрованных ключей)"""
+    if not encrypted_key:
+        return ""
+    try:
+        get_payment_credentials()
+    except Exception:
+        pass
+    cached = _credentials['by_ciphertext'].get(_ciphertext_key(encrypted_key))
+    if cached is not None:
+        return cached
+    return _decrypt(encrypted_key)
+
+
+def _decrypt(encrypted_key):
     if not encrypted_key:
         return ""
     if not fernet:
@@ -50,9 +151,9 @@ def decrypt_key(encrypted_key):
         return ""
 
 
-def get_callback_url(provider: str) -> str:
-    """Получить URL для webhook"""
-    base_url = os.getenv('YOUR_SERVER_IP') or os.getenv('YOUR_SERVER_IP_OR_DOMAIN', '')
+def get_callback_url(provider: str, base_url: str = None) -> str:
+    """Получить URL для webhook (base_url - публичный адрес панели, если известен из запроса)"""
+    base_url = base_url or os.getenv('YOUR_SERVER_IP') or os.getenv('YOUR_SERVER_IP_OR_DOMAIN', '')
     if not base_url.startswith(('http://', 'https://')):
         base_url = f"https://{base_url}" if base_url else ""
     return f"{base_url}/api/webhook/{provider}" if base_url else f"/api/webhook/{provider}"
@@ -62,7 +163,7 @@ def get_service_name_for_payment() -> str:
     """Имя сервиса из брендинга для описаний платежей."""
     try:
         from modules.models.branding import BrandingSetting
-        b = BrandingSetting.query.first()
+        b = get_settings(BrandingSetting)
         return (b.site_name or "").strip() if b else "Панель"
     except Exception:
         return "Панель"
@@ -80,7 +181,7 @@ def get_bot_username() -> str:
     
     # Если нет в переменных окружения, пробуем получить из BotConfig
     try:
-        bot_config = BotConfig.query.first()
+        bot_config = get_settings(BotConfig)
         if bot_config and bot_config.bot_username:
             username = bot_config.bot_username
             # Убираем @ если есть
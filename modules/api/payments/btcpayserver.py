@@ -4,6 +4,7 @@ https://btcpayserver.org/
 """
 import requests
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.registry import provider_session
 
 
 def create_btcpayserver_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -15,6 +16,7 @@ def create_btcpayserver_payment(amount: float, currency: str, order_id: str, **k
         currency: Валюта
         order_id: ID заказа
         user_email: Email пользователя (опционально)
+        description: Описание товара в счёте (опционально)
     
     Returns:
         tuple: (payment_url, invoice_id) или (None, error_message)
@@ -41,7 +43,7 @@ def create_btcpayserver_payment(amount: float, currency: str, order_id: str, **k
                 "orderId": order_id
             },
             "checkout": {
-                "redirectURL": get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2')),
+                "redirectURL": kwargs.get('return_url') or get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2')),
                 "redirectAutomatically": True
             },
             "receipt": {
@@ -49,6 +51,9 @@ def create_btcpayserver_payment(amount: float, currency: str, order_id: str, **k
             }
         }
         
+        if kwargs.get('description'):
+            payload["metadata"]["itemDesc"] = kwargs['description']
+        
         user_email = kwargs.get('user_email')
         if user_email:
             payload["buyer"] = {"email": user_email}
@@ -58,11 +63,10 @@ def create_btcpayserver_payment(amount: float, currency: str, order_id: str, **k
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
+        response = provider_session('btcpayserver').post(
             f"{server_url}/api/v1/stores/{store_id}/invoices",
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
         
         data = response.json()
@@ -4,6 +4,7 @@ https://t.me/CryptoBot
 """
 import requests
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_service_name_for_payment
+from modules.api.payments.registry import provider_session
 
 
 def create_cryptobot_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -14,6 +15,8 @@ def create_cryptobot_payment(amount: float, currency: str, order_id: str, **kwar
         amount: Сумма платежа
         currency: Валюта
         order_id: ID заказа
+        description: Описание счёта
+        return_url: Куда ведёт кнопка после оплаты (опционально)
     
     Returns:
         tuple: (payment_url, invoice_id) или (None, error_message)
@@ -34,23 +37,26 @@ def create_cryptobot_payment(amount: float, currency: str, order_id: str, **kwar
         payload = {
             "asset": crypto_currency,
             "amount": str(amount),
-            "description": f"Подписка {get_service_name_for_payment()} #{order_id}",
+            "description": kwargs.get('description') or f"Подписка {get_service_name_for_payment()} #{order_id}",
             "hidden_message": order_id,
             "payload": order_id,
             "allow_comments": False,
             "allow_anonymous": True
         }
         
+        if kwargs.get('return_url'):
+            payload["paid_btn_name"] = "callback"
+            payload["paid_btn_url"] = kwargs['return_url']
+        
         headers = {
             "Crypto-Pay-API-Token": api_key,
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
+        response = provider_session('cryptobot').post(
             "https://pay.crypt.bot/api/createInvoice",
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
         
         data = response.json()
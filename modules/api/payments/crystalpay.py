@@ -4,6 +4,7 @@ https://crystalpay.io/
 """
 import requests
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.registry import provider_session, STATUS_PAID, STATUS_PENDING, STATUS_FAILED
 
 
 def create_crystalpay_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -38,14 +39,13 @@ def create_crystalpay_payment(amount: float, currency: str, order_id: str, **kwa
             "currency": currency,
             "lifetime": 60,  # 60 минут как в app.py
             "extra": order_id,
-            "callback_url": get_callback_url('crystalpay'),  # callback_url, а не callback
-            "redirect_url": get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2'))
+            "callback_url": get_callback_url('crystalpay', kwargs.get('server_url')),  # callback_url, а не callback
+            "redirect_url": kwargs.get('return_url') or get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2'))
         }
         
-        response = requests.post(
+        response = provider_session('crystalpay').post(
             "https://api.crystalpay.io/v3/invoice/create/",
-            json=payload,
-            timeout=30
+            json=payload
         )
         
         data = response.json()
@@ -80,3 +80,30 @@ def verify_crystalpay_signature(data: dict, signature: str) -> bool:
     
     return calculated_signature == signature
 
+
+
+def fetch_crystalpay_status(invoice_id):
+    """Статус счёта CrystalPay (invoice/info): PAID / PENDING / FAILED или None"""
+    settings = get_payment_settings()
+    api_key = decrypt_key(settings.crystalpay_api_key) if settings else None
+    api_secret = decrypt_key(settings.crystalpay_api_secret) if settings else None
+    if not api_key or not api_secret:
+        return None
+    
+    response = provider_session('crystalpay').post(
+        "https://api.crystalpay.io/v3/invoice/info/",
+        json={"auth_login": api_key, "auth_secret": api_secret, "id": str(invoice_id)},
+        timeout=10
+    )
+    if not response.ok:
+        return None
+    data = response.json() or {}
+    if data.get("error") is True or data.get("errors"):
+        return None
+    
+    state = (data.get("state") or "").lower()
+    if state == "payed":
+        return STATUS_PAID
+    if state in ("failed", "unavailable", "expired"):
+        return STATUS_FAILED
+    return STATUS_PENDING
@@ -5,6 +5,8 @@ https://freekassa.ru/
 import hashlib
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url
 
+FREEKASSA_CURRENCIES = ('RUB', 'USD', 'EUR', 'UAH', 'KZT')
+
 
 def create_freekassa_payment(amount: float, currency: str, order_id: str, **kwargs):
     """
@@ -29,8 +31,10 @@ def create_freekassa_payment(amount: float, currency: str, order_id: str, **kwar
         return None, "FreeKassa credentials not configured"
     
     try:
-        # FreeKassa работает с RUB
-        fk_currency = 'RUB'
+        # Валюта счёта - валюта суммы; неизвестные FreeKassa валюты считаем RUB
+        fk_currency = (currency or '').upper()
+        if fk_currency not in FREEKASSA_CURRENCIES:
+            fk_currency = 'RUB'
         
         # Формируем подпись
         sign_string = f"{shop_id}:{amount:.2f}:{secret}:{fk_currency}:{order_id}"
@@ -4,6 +4,7 @@ https://heleket.com/
 """
 import requests
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.registry import provider_session
 
 
 def create_heleket_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -35,8 +36,8 @@ def create_heleket_payment(amount: float, currency: str, order_id: str, **kwargs
             "amount": f"{amount:.2f}",
             "currency": heleket_currency,
             "order_id": order_id,
-            "url_return": get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2')),
-            "url_callback": get_callback_url('heleket')
+            "url_return": kwargs.get('return_url') or get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2')),
+            "url_callback": get_callback_url('heleket', kwargs.get('server_url'))
         }
         
         if to_currency:
@@ -47,11 +48,10 @@ def create_heleket_payment(amount: float, currency: str, order_id: str, **kwargs
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
+        response = provider_session('heleket').post(
             "https://api.heleket.com/v1/payment",
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
         
         data = response.json()
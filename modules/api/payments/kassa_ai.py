@@ -12,9 +12,8 @@ import os
 import time
 from typing import Optional, Tuple
 
-import requests
-
 from .base import get_callback_url
+from .registry import provider_session
 
 API_BASE = "https://api.fk.life/v1"
 API_URL_ORDERS_CREATE = f"{API_BASE}/orders/create"
@@ -45,7 +44,7 @@ def _get_public_ip() -> str:
         return env_ip
     for url in ("https://api.ipify.org", "https://ifconfig.me/ip", "https://icanhazip.com"):
         try:
-            r = requests.get(url, timeout=3)
+            r = provider_session('kassa_ai').get(url, timeout=3)
             if r.status_code == 200 and r.text:
                 ip = r.text.strip()
                 if ip and len(ip.split(".")) == 4:
@@ -149,7 +148,7 @@ def create_kassa_ai_payment(
     data["signature"] = _signature(data, cfg["sign_key"])
 
     try:
-        r = requests.post(API_URL_ORDERS_CREATE, json=data, headers={"Content-Type": "application/json"}, timeout=15)
+        r = provider_session('kassa_ai').post(API_URL_ORDERS_CREATE, json=data, headers={"Content-Type": "application/json"})
         resp_text = (r.text or "").strip()[:500]
         if r.status_code != 200:
             err_msg = f"Kassa AI API: {r.status_code}"
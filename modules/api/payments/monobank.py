@@ -4,6 +4,10 @@ https://api.monobank.ua/
 """
 import requests
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url, get_service_name_for_payment
+from modules.api.payments.registry import provider_session
+
+# ISO 4217 коды валют счёта
+MONOBANK_CURRENCY_CODES = {'UAH': 980, 'RUB': 643, 'USD': 840}
 
 
 def create_monobank_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -12,8 +16,10 @@ def create_monobank_payment(amount: float, currency: str, order_id: str, **kwarg
     
     Args:
         amount: Сумма платежа
-        currency: Валюта (UAH)
+        currency: Валюта (UAH, RUB, USD)
         order_id: ID заказа
+        description: Назначение платежа
+        comment: Комментарий к платежу (опционально)
     
     Returns:
         tuple: (payment_url, invoice_id) или (None, error_message)
@@ -27,19 +33,24 @@ def create_monobank_payment(amount: float, currency: str, order_id: str, **kwarg
         return None, "Monobank token not configured"
     
     try:
-        # Monobank работает с UAH, сумма в копейках
+        # Сумма в копейках; валюта по умолчанию - UAH
         amount_kopecks = int(amount * 100)
         
+        merchant_info = {
+            "reference": order_id,
+            "destination": kwargs.get('description') or f"Подписка {get_service_name_for_payment()} #{order_id}"
+        }
+        if kwargs.get('comment'):
+            merchant_info["comment"] = kwargs['comment']
+        
         payload = {
             "amount": amount_kopecks,
-            "ccy": 980,  # UAH ISO код
-            "merchantPaymInfo": {
-                "reference": order_id,
-                "destination": f"Подписка {get_service_name_for_payment()} #{order_id}"
-            },
-            "redirectUrl": get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2')),
-            "webHookUrl": get_callback_url('monobank'),
-            "validity": 3600  # 1 час
+            "ccy": MONOBANK_CURRENCY_CODES.get((currency or '').upper(), 980),
+            "merchantPaymInfo": merchant_info,
+            "redirectUrl": kwargs.get('return_url') or get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2')),
+            "webHookUrl": get_callback_url('monobank', kwargs.get('server_url')),
+            "validity": 3600,  # 1 час
+            "paymentType": "debit"
         }
         
         headers = {
@@ -47,11 +58,10 @@ def create_monobank_payment(amount: float, currency: str, order_id: str, **kwarg
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
+        response = provider_session('monobank').post(
             "https://api.monobank.ua/api/merchant/invoice/create",
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
         
         data = response.json()
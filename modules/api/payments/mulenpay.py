@@ -0,0 +1,75 @@
+"""
+Mulenpay - платёжная система
+https://mulenpay.ru/
+"""
+import base64
+import requests
+from modules.api.payments.base import get_provider_credentials, get_service_name_for_payment
+from modules.api.payments.registry import provider_session
+
+
+def create_mulenpay_payment(amount: float, currency: str, order_id: str, **kwargs):
+    """
+    Создать платёж через Mulenpay (v2/payments)
+    
+    Args:
+        amount: Сумма платежа
+        currency: Валюта (UAH, RUB, USD)
+        order_id: ID заказа
+        description: Описание платежа
+    
+    Returns:
+        tuple: (payment_url, payment_id) или (None, error_message)
+    """
+    credentials = get_provider_credentials('mulenpay')
+    if not credentials:
+        return None, "Mulenpay credentials not configured"
+    
+    try:
+        shop_id = int(credentials['mulenpay_shop_id'])
+    except (ValueError, TypeError):
+        shop_id = credentials['mulenpay_shop_id']
+    
+    payload = {
+        "currency": (currency or 'RUB').lower(),
+        "amount": str(amount),
+        "uuid": order_id,
+        "shopId": shop_id,
+        "description": kwargs.get('description') or f"Подписка {get_service_name_for_payment()} #{order_id}",
+        "subscribe": None,
+        "holdTime": None
+    }
+    
+    auth_string = f"{credentials['mulenpay_api_key']}:{credentials['mulenpay_secret_key']}"
+    headers = {
+        "Authorization": f"Basic {base64.b64encode(auth_string.encode('ascii')).decode('ascii')}",
+        "Content-Type": "application/json"
+    }
+    
+    try:
+        response = provider_session('mulenpay').post(
+            "https://api.mulenpay.ru/v2/payments",
+            json=payload,
+            headers=headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        data = response.json()
+        
+        payment_url = data.get('url') or data.get('payment_url') or data.get('redirect')
+        if not payment_url:
+            return None, data.get('message') or data.get('error') or 'Failed to get payment URL from Mulenpay'
+        
+        return payment_url, data.get('id') or data.get('payment_id') or order_id
+        
+    except requests.RequestException as e:
+        error_msg = str(e)
+        if getattr(e, 'response', None) is not None:
+            try:
+                error_data = e.response.json()
+                error_msg = error_data.get('message') or error_data.get('error') or error_msg
+            except Exception:
+                pass
+        return None, f"Mulenpay API Error: {error_msg}"
+    except Exception as e:
+        return None, f"Mulenpay error: {str(e)}"
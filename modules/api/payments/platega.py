@@ -2,52 +2,57 @@
 Platega - платёжная система
 https://docs.platega.io/
 """
+import re
 import requests
 import uuid
 import time
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.registry import provider_session, STATUS_PAID, STATUS_PENDING, STATUS_FAILED
 
-# Глобальная сессия для сохранения cookies между запросами (для обхода DDoS-Guard)
-_platega_session = None
-_platega_cookies_initialized = False
+PLATEGA_BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+# Статусы транзакции Platega (по документации: PENDING, CANCELED, CONFIRMED, CHARGEBACKED).
+# Оплаченной считается только CONFIRMED - как в прежней проверке статуса в miniapp
+PLATEGA_PAID_STATUSES = ('CONFIRMED',)
+PLATEGA_FAILED_STATUSES = ('CANCELED', 'CANCELLED', 'FAILED', 'EXPIRED', 'CHARGEBACKED')
+
+_UUID_RE = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
 
 def _get_platega_session():
-    """Получить или создать сессию для Platega"""
-    global _platega_session, _platega_cookies_initialized
-    if _platega_session is None:
-        _platega_session = requests.Session()
-        _platega_session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-            "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive",
-            "Upgrade-Insecure-Requests": "1",
-        })
+    """Сессия Platega из реестра провайдеров (keep-alive + cookies DDoS-Guard между запросами)"""
+    session = provider_session('platega')
+    if session.headers.get("User-Agent") != PLATEGA_BROWSER_HEADERS["User-Agent"]:
+        session.headers.update(PLATEGA_BROWSER_HEADERS)
     
-    # Предварительный запрос для получения cookies от DDoS-Guard (только один раз)
-    if not _platega_cookies_initialized:
+    # Предварительный запрос для получения cookies от DDoS-Guard (один раз на сессию)
+    if not getattr(session, 'ddos_guard_ready', False):
         try:
             print("Platega: Initializing DDoS-Guard cookies...")
             # Делаем GET запрос к главной странице для получения cookies
-            _platega_session.get("https://app.platega.io/", timeout=10)
-            _platega_cookies_initialized = True
+            session.get("https://app.platega.io/", timeout=10)
+            session.ddos_guard_ready = True
             print("Platega: DDoS-Guard cookies initialized")
         except Exception as e:
             print(f"Platega: Warning - failed to initialize cookies: {e}")
             # Продолжаем работу даже если не удалось получить cookies
     
-    return _platega_session
+    return session
 
 def _reset_platega_cookies():
     """Сбросить cookies Platega и получить новые"""
-    global _platega_cookies_initialized
     session = _get_platega_session()
-    _platega_cookies_initialized = False
+    session.ddos_guard_ready = False
     session.cookies.clear()
     try:
         session.get("https://app.platega.io/", timeout=10)
-        _platega_cookies_initialized = True
+        session.ddos_guard_ready = True
         print("Platega: New DDoS-Guard cookies obtained")
         return True
     except Exception as e:
@@ -63,6 +68,7 @@ def create_platega_payment(amount: float, currency: str, order_id: str, **kwargs
         amount: Сумма платежа
         currency: Валюта (UAH, RUB, USD)
         order_id: ID заказа
+        description: Описание платежа (опционально)
     
     Returns:
         tuple: (payment_url, payment_id) или (None, error_message)
@@ -86,11 +92,18 @@ def create_platega_payment(amount: float, currency: str, order_id: str, **kwargs
     if not isinstance(merchant_id, str) or not merchant_id.strip():
         return None, "Platega Merchant ID is empty"
     
+    # X-MerchantId должен быть UUID (без префикса 'live_')
+    merchant_id = normalize_platega_merchant_id(merchant_id)
+    try:
+        uuid.UUID(merchant_id)
+    except ValueError:
+        return None, "Platega Merchant ID должен быть в формате UUID. Проверьте настройки платежной системы."
+    
     try:
         transaction_uuid = str(uuid.uuid4())
         
         # URL для возврата после оплаты
-        return_url = get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2'))
+        return_url = kwargs.get('return_url') or get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2'))
         
         # Согласно документации Platega:
         # - ID транзакции генерируется автоматически (не передаём)
@@ -107,9 +120,11 @@ def create_platega_payment(amount: float, currency: str, order_id: str, **kwargs
                 "amount": float(amount),
                 "currency": currency
             },
-            "description": f"Payment for order {order_id}",
+            "description": kwargs.get('description') or f"Payment for order {order_id}",
             "return": return_url,
-            "failedUrl": return_url
+            "failedUrl": return_url,
+            # Webhook общий для Platega и Platega MIR
+            "callbackUrl": get_callback_url('platega', kwargs.get('server_url'))
         }
         
         headers = {
@@ -268,3 +283,57 @@ def create_platega_mir_payment(amount: float, currency: str, order_id: str, **kw
     kwargs['payment_method'] = 11
     return create_platega_payment(amount, currency, order_id, **kwargs)
 
+
+
+def normalize_platega_merchant_id(merchant_id) -> str:
+    """Merchant ID без префикса 'live_' (UUID, если он есть в строке)"""
+    merchant = str(merchant_id).strip()
+    if merchant.startswith('live_'):
+        merchant = merchant[5:]
+    uuid_match = _UUID_RE.search(merchant)
+    return uuid_match.group(0) if uuid_match else merchant
+
+
+def get_platega_transaction(transaction_id):
+    """
+    GET /transaction/{id} - данные транзакции Platega
+    
+    Returns:
+        dict ответа API или None (не настроено, 404, ошибка)
+    """
+    settings = get_payment_settings()
+    api_key = decrypt_key(getattr(settings, 'platega_api_key', None)) if settings else None
+    merchant_raw = decrypt_key(getattr(settings, 'platega_merchant_id', None)) if settings else None
+    if not api_key or not merchant_raw:
+        return None
+    
+    resp = provider_session('platega').get(
+        f"https://app.platega.io/transaction/{transaction_id}",
+        headers={
+            "X-MerchantId": normalize_platega_merchant_id(merchant_raw),
+            "X-Secret": api_key,
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        },
+        timeout=10
+    )
+    if resp.status_code == 404:
+        print(f"[PLATEGA] Transaction {transaction_id} not found in Platega API (404)")
+        return None
+    if resp.status_code != 200:
+        print(f"[PLATEGA] Failed to verify status via API: {resp.status_code} - {resp.text[:200]}")
+        return None
+    return resp.json() or {}
+
+
+def fetch_platega_status(transaction_id):
+    """Статус транзакции Platega: PAID / PENDING / FAILED или None"""
+    data = get_platega_transaction(transaction_id)
+    if data is None:
+        return None
+    status = (data.get('status') or '').upper()
+    if status in PLATEGA_PAID_STATUSES:
+        return STATUS_PAID
+    if status in PLATEGA_FAILED_STATUSES:
+        return STATUS_FAILED
+    return STATUS_PENDING
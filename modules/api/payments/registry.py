@@ -0,0 +1,198 @@
+"""
+Реестр платёжных провайдеров
+
+Провайдер = create_invoice / verify_webhook / fetch_status + своя HTTP-сессия:
+keep-alive пул соединений к PSP (без нового TLS-рукопожатия на каждый платёж),
+таймауты (connect, read) по умолчанию и счётчики задержек/ошибок.
+
+Сессии создаются лениво в процессе воркера и пересоздаются после fork.
+"""
+import os
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PAYMENT_HTTP_CONNECT_TIMEOUT = float(os.getenv('PAYMENT_HTTP_CONNECT_TIMEOUT', 5))
+PAYMENT_HTTP_READ_TIMEOUT = float(os.getenv('PAYMENT_HTTP_READ_TIMEOUT', 30))
+PAYMENT_HTTP_POOL_SIZE = int(os.getenv('PAYMENT_HTTP_POOL_SIZE', 10))
+
+# Таймауты (connect, read) для провайдеров, которым не подходят значения по умолчанию
+PROVIDER_TIMEOUTS = {
+    'kassa_ai': (PAYMENT_HTTP_CONNECT_TIMEOUT, 15),
+}
+
+# Статусы, которые возвращает fetch_status
+STATUS_PAID = 'PAID'
+STATUS_PENDING = 'PENDING'
+STATUS_FAILED = 'FAILED'
+
+_providers = {}
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+class _Counter:
+    """Число вызовов, ошибок и время ответа одной операции провайдера"""
+
+    __slots__ = ('calls', 'errors', 'total_ms', 'max_ms', 'last_error', 'last_error_at')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_error = None
+        self.last_error_at = None
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_ms': round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 1),
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at,
+        }
+
+
+def _record(provider, operation, started, error=None):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _lock:
+        counter = _stats.setdefault(provider, {}).get(operation)
+        if counter is None:
+            counter = _stats[provider][operation] = _Counter()
+        counter.calls += 1
+        counter.total_ms += elapsed_ms
+        counter.max_ms = max(counter.max_ms, elapsed_ms)
+        if error:
+            counter.errors += 1
+            counter.last_error = str(error)[:200]
+            counter.last_error_at = time.time()
+
+
+class ProviderSession(requests.Session):
+    """requests.Session с пулом соединений, таймаутом по умолчанию и учётом задержек"""
+
+    def __init__(self, provider, timeout=None):
+        super().__init__()
+        self.provider = provider
+        self.default_timeout = timeout or PROVIDER_TIMEOUTS.get(
+            provider, (PAYMENT_HTTP_CONNECT_TIMEOUT, PAYMENT_HTTP_READ_TIMEOUT))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PAYMENT_HTTP_POOL_SIZE)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.default_timeout)
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except Exception as e:
+            _record(self.provider, 'http', started, error=f"{type(e).__name__}: {e}")
+            raise
+        _record(self.provider, 'http', started,
+                error=f"HTTP {response.status_code}" if response.status_code >= 500 else None)
+        return response
+
+
+def provider_session(name):
+    """Общая (в пределах процесса) HTTP-сессия провайдера"""
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _sessions[name] = ProviderSession(name)
+    return session
+
+
+class PaymentProvider:
+    """Платёжная система: создание счёта, проверка webhook, запрос статуса"""
+
+    def __init__(self, name, create_invoice, verify_webhook=None, fetch_status=None):
+        self.name = name
+        self._create_invoice = create_invoice
+        self._verify_webhook = verify_webhook
+        self._fetch_status = fetch_status
+
+    @property
+    def session(self):
+        return provider_session(self.name)
+
+    @property
+    def supports_status(self):
+        return self._fetch_status is not None
+
+    def create_invoice(self, amount, currency, order_id, **kwargs):
+        """(payment_url, payment_id) или (None, error_message)"""
+        started = time.perf_counter()
+        try:
+            result = self._create_invoice(amount, currency, order_id, **kwargs)
+        except Exception as e:
+            _record(self.name, 'create_invoice', started, error=f"{type(e).__name__}: {e}")
+            raise
+        _record(self.name, 'create_invoice', started, error=result[1] if not result[0] else None)
+        return result
+
+    def verify_webhook(self, *args, **kwargs):
+        """Результат функции проверки подписи провайдера; None - проверка не реализована"""
+        if self._verify_webhook is None:
+            return None
+        return self._verify_webhook(*args, **kwargs)
+
+    def fetch_status(self, payment_system_id):
+        """PAID / PENDING / FAILED по данным PSP; None - статус узнать не удалось"""
+        if self._fetch_status is None:
+            return None
+        started = time.perf_counter()
+        try:
+            status = self._fetch_status(payment_system_id)
+        except Exception as e:
+            _record(self.name, 'fetch_status', started, error=f"{type(e).__name__}: {e}")
+            return None
+        _record(self.name, 'fetch_status', started, error='no status' if status is None else None)
+        return status
+
+
+def register_provider(name, create_invoice, verify_webhook=None, fetch_status=None):
+    provider = PaymentProvider(name, create_invoice, verify_webhook, fetch_status)
+    _providers[name] = provider
+    return provider
+
+
+def get_provider(name):
+    """PaymentProvider по имени или None"""
+    return _providers.get(name)
+
+
+def get_providers():
+    return dict(_providers)
+
+
+def get_provider_stats():
+    """provider -> {операция -> счётчики}; операции: http, create_invoice, fetch_status"""
+    with _lock:
+        return {
+            name: {operation: counter.to_dict() for operation, counter in operations.items()}
+            for name, operations in _stats.items()
+        }
+
+
+def reset_provider_stats():
+    with _lock:
+        _stats.clear()
+
+
+def _reset_after_fork():
+    # Сокеты пула нельзя делить между процессами
+    global _lock
+    _lock = threading.Lock()
+    _sessions.clear()
+    _stats.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -3,6 +3,7 @@ Robokassa - платёжная система
 https://robokassa.com/
 """
 import hashlib
+from urllib.parse import quote
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_service_name_for_payment
 
 
@@ -45,8 +46,9 @@ def create_robokassa_payment(amount: float, currency: str, order_id: str, **kwar
             f"?MerchantLogin={merchant_login}"
             f"&OutSum={out_sum}"
             f"&InvId={order_id}"
-            f"&Description={description}"
+            f"&Description={quote(description)}"
             f"&SignatureValue={signature}"
+            f"&Culture=ru"
             f"&IsTest=0"
         )
         
@@ -4,6 +4,7 @@ https://core.telegram.org/bots/payments
 """
 import requests
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_service_name_for_payment
+from modules.api.payments.registry import provider_session
 
 
 def create_telegram_stars_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -14,6 +15,7 @@ def create_telegram_stars_payment(amount: float, currency: str, order_id: str, *
         amount: Сумма платежа
         currency: Валюта
         order_id: ID заказа
+        title, description, label: Тексты счёта (по умолчанию - подписка)
     
     Returns:
         tuple: (invoice_link, order_id) или (None, error_message)
@@ -42,22 +44,21 @@ def create_telegram_stars_payment(amount: float, currency: str, order_id: str, *
             stars_amount = 1
         
         payload = {
-            "title": f"Подписка {get_service_name_for_payment()}",
-            "description": "Подписка на VPN сервис",
+            "title": kwargs.get('title') or f"Подписка {get_service_name_for_payment()}",
+            "description": kwargs.get('description') or "Подписка на VPN сервис",
             "payload": order_id,
             "provider_token": "",  # Пустой для Stars
             "currency": "XTR",  # Telegram Stars
             "prices": [{
-                "label": "Подписка",
+                "label": kwargs.get('label') or "Подписка",
                 "amount": stars_amount
             }]
         }
         
-        response = requests.post(
+        response = provider_session('telegram_stars').post(
             f"https://api.telegram.org/bot{bot_token}/createInvoiceLink",
             json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=30
+            headers={"Content-Type": "application/json"}
         )
         
         data = response.json()
@@ -0,0 +1,74 @@
+"""
+Tribute - оплата через Telegram
+https://tribute.tg/
+"""
+import requests
+from modules.api.payments.base import get_provider_credentials, get_return_url, get_service_name_for_payment
+from modules.api.payments.registry import provider_session
+
+# Tribute принимает рубли и евро
+TRIBUTE_CURRENCIES = {'RUB': 'rub', 'UAH': 'rub', 'USD': 'eur'}
+
+
+def create_tribute_payment(amount: float, currency: str, order_id: str, **kwargs):
+    """
+    Создать заказ через Tribute (shop/orders)
+    
+    Args:
+        amount: Сумма платежа
+        currency: Валюта (RUB, UAH -> rub, USD -> eur)
+        order_id: ID заказа
+        title: Заголовок заказа
+        description: Описание заказа
+        user_email: Email пользователя (опционально)
+    
+    Returns:
+        tuple: (payment_url, order_uuid) или (None, error_message)
+    """
+    credentials = get_provider_credentials('tribute')
+    if not credentials:
+        return None, "Tribute API key not configured"
+    
+    return_url = kwargs.get('return_url') or get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2'))
+    payload = {
+        "amount": int(amount * 100),  # в центах
+        "currency": TRIBUTE_CURRENCIES.get((currency or '').upper(), 'rub'),
+        "title": (kwargs.get('title') or f"Подписка {get_service_name_for_payment()}")[:100],
+        "description": (kwargs.get('description') or f"Заказ #{order_id}")[:300],
+        "successUrl": return_url,
+        "failUrl": return_url
+    }
+    if kwargs.get('user_email'):
+        payload["email"] = kwargs['user_email']
+    
+    headers = {
+        "Content-Type": "application/json",
+        "Api-Key": credentials['tribute_api_key']
+    }
+    
+    try:
+        response = provider_session('tribute').post(
+            "https://tribute.tg/api/v1/shop/orders",
+            json=payload,
+            headers=headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        data = response.json()
+        
+        if not data.get('paymentUrl'):
+            return None, "Tribute did not return payment URL"
+        
+        return data.get('paymentUrl'), data.get('uuid')
+        
+    except requests.RequestException as e:
+        error_msg = str(e)
+        if getattr(e, 'response', None) is not None:
+            try:
+                error_data = e.response.json()
+                error_msg = error_data.get('message') or error_data.get('error') or error_msg
+            except Exception:
+                pass
+        return None, f"Tribute API Error: {error_msg}"
+    except Exception as e:
+        return None, f"Tribute error: {str(e)}"
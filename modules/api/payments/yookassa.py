@@ -6,6 +6,7 @@ import requests
 import uuid
 import json
 from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url, get_service_name_for_payment
+from modules.api.payments.registry import provider_session
 
 
 def create_yookassa_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -56,7 +57,7 @@ def create_yookassa_payment(amount: float, currency: str, order_id: str, **kwarg
             },
             "confirmation": {
                 "type": "redirect",
-                "return_url": get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2'))
+                "return_url": kwargs.get('return_url') or get_return_url(kwargs.get('source', 'miniapp'), kwargs.get('miniapp_type', 'v2'))
             },
             "capture": True,
             "description": kwargs.get('description', f"Подписка {get_service_name_for_payment()} #{order_id}"),
@@ -110,12 +111,11 @@ def create_yookassa_payment(amount: float, currency: str, order_id: str, **kwarg
             "Idempotence-Key": str(uuid.uuid4())
         }
         
-        response = requests.post(
+        response = provider_session('yookassa').post(
             "https://api.yookassa.ru/v3/payments",
             json=payload,
             headers=headers,
-            auth=(shop_id, secret_key),
-            timeout=30
+            auth=(shop_id, secret_key)
         )
         
         try:
@@ -48,7 +48,7 @@ def create_yoomoney_payment(amount: float, currency: str, order_id: str, **kwarg
     if payment_type not in ("AC", "PC"):
         payment_type = "AC"
 
-    return_url = get_return_url(kwargs.get("source", "miniapp"), kwargs.get("miniapp_type", "v2"))
+    return_url = kwargs.get("return_url") or get_return_url(kwargs.get("source", "miniapp"), kwargs.get("miniapp_type", "v2"))
     targets = kwargs.get("description") or f"{get_service_name_for_payment()} #{order_id}"
 
     params = {
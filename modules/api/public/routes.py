@@ -20,6 +20,7 @@ import json
 import os
 
 from modules.core import get_app, get_db, get_cache
+from modules.remnawave import remnawave
 from modules.models.tariff import Tariff
 from modules.models.tariff_feature import TariffFeatureSetting
 from modules.models.tariff_level import TariffLevel
@@ -28,6 +29,7 @@ from modules.models.branding import BrandingSetting
 from modules.models.bot_config import BotConfig
 from modules.models.currency import CurrencyRate
 from modules.models.option import PurchaseOption
+from modules.settings_registry import get_settings
 
 app = get_app()
 db = get_db()
@@ -241,7 +243,7 @@ def public_system_settings():
     """Публичные системные настройки"""
     try:
         import json
-        settings = SystemSetting.query.first()
+        settings = get_settings(SystemSetting)
         if not settings:
             return jsonify({
                 "default_language": "ru",
@@ -286,7 +288,7 @@ def public_branding():
     """Публичный брендинг"""
     try:
         import json
-        branding = BrandingSetting.query.first()
+        branding = get_settings(BrandingSetting)
         if not branding:
             return jsonify({
                 "site_name": "",
@@ -415,13 +417,7 @@ def public_currency_rates():
 def get_public_nodes():
     """Публичные ноды для лендинга"""
     try:
-        import requests
-        headers, cookies = {}, {}
-        ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-        if ADMIN_TOKEN:
-            headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-        
-        resp = requests.get(f"{os.getenv('API_URL')}/api/nodes/public", headers=headers, timeout=10)
+        resp = remnawave.get("/api/nodes/public", timeout=10)
         resp.raise_for_status()
         return jsonify(resp.json()), 200
     except Exception as e:
@@ -432,9 +428,9 @@ def get_public_nodes():
 def get_system_info():
     """Публичная информация о системе"""
     try:
-        system_settings = SystemSetting.query.first()
-        branding = BrandingSetting.query.first()
-        bot_config = BotConfig.query.first()
+        system_settings = get_settings(SystemSetting)
+        branding = get_settings(BrandingSetting)
+        bot_config = get_settings(BotConfig)
 
         return jsonify({
             "system": {
@@ -478,7 +474,7 @@ def telegram_auth_enabled():
             }), 200
         
         # Fallback: проверяем BotConfig из БД
-        bot_config = BotConfig.query.first()
+        bot_config = get_settings(BotConfig)
         if bot_config and bot_config.bot_username:
             return jsonify({
                 "enabled": True,
@@ -518,7 +514,7 @@ def public_bot_config():
     import json
     import os
     
-    config = BotConfig.query.first()
+    config = get_settings(BotConfig)
     
     # Получаем bot_username: сначала из BotConfig, потом из .env
     bot_username = ""
@@ -534,7 +530,7 @@ def public_bot_config():
         bot_username = bot_username[1:]
     
     if not config:
-        branding = BrandingSetting.query.first()
+        branding = get_settings(BrandingSetting)
         fallback_name = (branding.site_name or "").strip() if branding else "Панель"
         return jsonify({
             "service_name": fallback_name,
@@ -607,7 +603,7 @@ def public_bot_config():
         "cn": getattr(config, 'channel_subscription_text_cn', '') or ""
     }
     
-    branding = BrandingSetting.query.first()
+    branding = get_settings(BrandingSetting)
     fallback_name = (branding.site_name or "").strip() if branding else "Панель"
     return jsonify({
         "service_name": config.service_name or fallback_name,
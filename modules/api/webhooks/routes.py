@@ -9,6 +9,9 @@ API вебхуков платежных систем
 - POST /api/webhook/freekassa - FreeKassa webhook
 - POST /api/webhook/kassa_ai - Kassa AI (Freekassa api.fk.life) webhook
 - POST /api/webhook/robokassa - Robokassa webhook
+
+Вебхуки только проверяют запрос, идемпотентно записывают событие (webhook_event)
+и ставят обработку оплаты в фоновую очередь (background_job, задача 'payment.process').
 """
 
 from flask import request, jsonify
@@ -19,7 +22,9 @@ import os
 import threading
 import hashlib
 
-from modules.core import get_app, get_db, get_cache, get_fernet
+from modules.core import get_app, get_db, get_cache
+from modules.remnawave import remnawave
+from modules.remnawave_snapshot import invalidate_live_user
 from modules.models.payment import Payment, PaymentSetting
 from modules.models.user import User
 from modules.models.tariff import Tariff
@@ -27,6 +32,12 @@ from modules.models.promo import PromoCode
 from modules.models.referral import ReferralSetting
 from modules.currency import convert_to_usd
 from modules.models.option import PurchaseOption
+from modules.settings_registry import get_settings
+from modules.models.job import WebhookEvent
+from modules.jobs import enqueue, job_handler
+from modules.api.payments.base import decrypt_key
+from modules.api.payments.registry import provider_session
+from sqlalchemy.exc import IntegrityError
 
 app = get_app()
 db = get_db()
@@ -47,7 +58,7 @@ def add_referral_commission(user, amount_usd, is_tariff_purchase=True):
     """
     try:
         # Проверяем тип реферальной системы
-        referral_settings = ReferralSetting.query.first()
+        referral_settings = get_settings(ReferralSetting)
         if not referral_settings:
             return
         
@@ -82,33 +93,6 @@ def add_referral_commission(user, amount_usd, is_tariff_purchase=True):
         traceback.print_exc()
 
 
-def get_remnawave_headers(additional_headers=None):
-    headers = {}
-    cookies = {}
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except:
-            pass
-    if additional_headers:
-        headers.update(additional_headers)
-    return headers, cookies
-
-
-def decrypt_key(key):
-    fernet = get_fernet()
-    if not key or not fernet:
-        return ""
-    try:
-        return fernet.decrypt(key).decode('utf-8')
-    except:
-        return ""
-
-
 def sync_subscription_to_bot(app_context, remnawave_uuid):
     """Синхронизация подписки в бота"""
     with app_context:
@@ -169,8 +153,6 @@ def _resolve_target_remnawave_uuid(payment: Payment, user: User) -> str:
 
 def process_option_purchase(payment, user):
     """Обработка успешной покупки опции (трафик, устройства, сквад)"""
-    API_URL = os.getenv("API_URL")
-
     try:
         if not getattr(payment, 'description', None) or not str(payment.description).startswith('OPTION:'):
             print(f"[OPTION] Invalid payment description: {getattr(payment, 'description', None)}")
@@ -193,8 +175,7 @@ def process_option_purchase(payment, user):
             return False
 
         # Получаем текущие данные пользователя из RemnaWave
-        h, c = get_remnawave_headers({"Content-Type": "application/json"})
-        resp = requests.get(f"{API_URL}/api/users/{target_uuid}", headers=h, cookies=c, timeout=15)
+        resp = remnawave.get(f"/api/users/{target_uuid}", timeout=15)
         if resp.status_code != 200:
             print(f"[OPTION] Failed to get user data: {resp.status_code} - {resp.text[:200]}")
             return False
@@ -241,7 +222,7 @@ def process_option_purchase(payment, user):
             print(f"[OPTION] Unknown option type: {option_type}")
             return False
 
-        patch_resp = requests.patch(f"{API_URL}/api/users", headers=h, cookies=c, json=patch_payload, timeout=20)
+        patch_resp = remnawave.patch("/api/users", json=patch_payload, timeout=20)
         if not patch_resp.ok:
             print(f"[OPTION] Failed to update user: {patch_resp.status_code} - {patch_resp.text[:200]}")
             return False
@@ -275,19 +256,91 @@ def process_option_purchase(payment, user):
         return False
 
 
+def _apply_tariff_in_remnawave(payment, user, tariff, remnawave_uuid, default_squad_id):
+    """Продлить подписку и выставить сквады/лимиты тарифа в RemnaWave (GET + PATCH)"""
+    resp = remnawave.get(f"/api/users/{remnawave_uuid}")
+    if resp.status_code != 200:
+        print(
+            f"Failed to get user data: {resp.status_code} (uuid={remnawave_uuid}, payment={getattr(payment,'order_id',None)}, user_id={getattr(user,'id',None)})"
+        )
+        return False
+        
+    user_data = resp.json().get('response', {})
+    current_expire = user_data.get('expireAt')
+    current_squads = user_data.get('activeInternalSquads', [])
+    
+    # Дни по тарифу: базовые + бонусные (чётко начисляются при оплате)
+    days_to_add = tariff.duration_days + (getattr(tariff, 'bonus_days', None) or 0)
+
+    if current_expire:
+        # Обработка формата с 'Z'
+        if isinstance(current_expire, str) and current_expire.endswith('Z'):
+            current_expire = current_expire[:-1] + '+00:00'
+        current_expire_dt = datetime.fromisoformat(current_expire)
+        if current_expire_dt.tzinfo is None:
+            current_expire_dt = current_expire_dt.replace(tzinfo=timezone.utc)
+        new_expire_dt = max(datetime.now(timezone.utc), current_expire_dt) + timedelta(days=days_to_add)
+    else:
+        new_expire_dt = datetime.now(timezone.utc) + timedelta(days=days_to_add)
+    
+    # Получаем список сквадов из тарифа
+    squad_ids = []
+    if hasattr(tariff, 'get_squad_ids'):
+        squad_ids = tariff.get_squad_ids()
+    elif hasattr(tariff, 'squad_ids') and tariff.squad_ids:
+        try:
+            import json
+            squad_ids = json.loads(tariff.squad_ids) if isinstance(tariff.squad_ids, str) else tariff.squad_ids
+        except:
+            squad_ids = []
+    
+    # Если сквады не указаны, используем дефолтный/текущие
+    if not squad_ids:
+        if tariff.squad_id:
+            squad_ids = [tariff.squad_id]
+        else:
+            # Если DEFAULT_SQUAD_ID не задан — сохраняем текущие сквады, чтобы подписка не стала "неактивной"
+            if default_squad_id:
+                squad_ids = [default_squad_id]
+            else:
+                squad_ids = current_squads or []
+    
+    patch_payload = {
+        "uuid": remnawave_uuid,
+        "expireAt": new_expire_dt.isoformat(),
+        "activeInternalSquads": squad_ids
+    }
+    
+    if tariff.traffic_limit_bytes and tariff.traffic_limit_bytes > 0:
+        patch_payload["trafficLimitBytes"] = tariff.traffic_limit_bytes
+        patch_payload["trafficLimitStrategy"] = "NO_RESET"
+    
+    # Устанавливаем лимит устройств, если он указан в тарифе
+    if hasattr(tariff, 'hwid_device_limit') and tariff.hwid_device_limit is not None and tariff.hwid_device_limit > 0:
+        patch_payload["hwidDeviceLimit"] = tariff.hwid_device_limit
+    
+    patch_resp = remnawave.patch("/api/users", json=patch_payload)
+    
+    if not patch_resp.ok:
+        print(f"Failed to update user: {patch_resp.status_code}")
+        return False
+    return True
+
+
 def process_successful_payment(payment, user, tariff):
     """Обработка успешного платежа"""
-    API_URL = os.getenv("API_URL")
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
     DEFAULT_SQUAD_ID = os.getenv("DEFAULT_SQUAD_ID")
     
-    headers = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
-    
     try:
         # Если нужно создать новый конфиг, создаем его перед обработкой платежа
-        if hasattr(payment, 'create_new_config') and payment.create_new_config:
-            from modules.models.user_config import UserConfig
-            
+        from modules.models.user_config import UserConfig
+        created_config = None
+        if getattr(payment, 'create_new_config', False) and payment.user_config_id:
+            # Конфиг уже создан прошлой попыткой задачи - не создаём второй аккаунт
+            created_config = db.session.get(UserConfig, payment.user_config_id)
+        if created_config and created_config.user_id == user.id:
+            remnawave_uuid = created_config.remnawave_uuid
+        elif hasattr(payment, 'create_new_config') and payment.create_new_config:
             # Генерируем уникальный username для нового аккаунта
             base_username = None
             if user.email:
@@ -303,9 +356,8 @@ def process_successful_payment(payment, user, tariff):
             # Пытаемся получить username из Remna для существующих конфигов
             for config in existing_configs:
                 try:
-                    resp = requests.get(
-                        f"{API_URL}/api/users/{config.remnawave_uuid}",
-                        headers=headers,
+                    resp = remnawave.get(
+                        f"/api/users/{config.remnawave_uuid}",
                         timeout=5
                     )
                     if resp.status_code == 200:
@@ -381,9 +433,8 @@ def process_successful_payment(payment, user, tariff):
                 except (ValueError, TypeError):
                     payload_create["telegramId"] = str(user.telegram_id)
             
-            create_resp = requests.post(
-                f"{API_URL}/api/users",
-                headers=headers,
+            create_resp = remnawave.post(
+                "/api/users",
                 json=payload_create,
                 timeout=30
             )
@@ -436,73 +487,12 @@ def process_successful_payment(payment, user, tariff):
                 else:
                     print(f"Warning: user_config_id {payment.user_config_id} not found or doesn't belong to user {user.id}, using primary config")
         
-        resp = requests.get(f"{API_URL}/api/users/{remnawave_uuid}", headers=headers)
-        if resp.status_code != 200:
-            print(
-                f"Failed to get user data: {resp.status_code} (uuid={remnawave_uuid}, payment={getattr(payment,'order_id',None)}, user_id={getattr(user,'id',None)})"
-            )
-            return False
-            
-        user_data = resp.json().get('response', {})
-        current_expire = user_data.get('expireAt')
-        current_squads = user_data.get('activeInternalSquads', [])
-        
-        # Дни по тарифу: базовые + бонусные (чётко начисляются при оплате)
-        days_to_add = tariff.duration_days + (getattr(tariff, 'bonus_days', None) or 0)
-
-        if current_expire:
-            # Обработка формата с 'Z'
-            if isinstance(current_expire, str) and current_expire.endswith('Z'):
-                current_expire = current_expire[:-1] + '+00:00'
-            current_expire_dt = datetime.fromisoformat(current_expire)
-            if current_expire_dt.tzinfo is None:
-                current_expire_dt = current_expire_dt.replace(tzinfo=timezone.utc)
-            new_expire_dt = max(datetime.now(timezone.utc), current_expire_dt) + timedelta(days=days_to_add)
-        else:
-            new_expire_dt = datetime.now(timezone.utc) + timedelta(days=days_to_add)
-        
-        # Получаем список сквадов из тарифа
-        squad_ids = []
-        if hasattr(tariff, 'get_squad_ids'):
-            squad_ids = tariff.get_squad_ids()
-        elif hasattr(tariff, 'squad_ids') and tariff.squad_ids:
-            try:
-                import json
-                squad_ids = json.loads(tariff.squad_ids) if isinstance(tariff.squad_ids, str) else tariff.squad_ids
-            except:
-                squad_ids = []
-        
-        # Если сквады не указаны, используем дефолтный/текущие
-        if not squad_ids:
-            if tariff.squad_id:
-                squad_ids = [tariff.squad_id]
-            else:
-                # Если DEFAULT_SQUAD_ID не задан — сохраняем текущие сквады, чтобы подписка не стала "неактивной"
-                if DEFAULT_SQUAD_ID:
-                    squad_ids = [DEFAULT_SQUAD_ID]
-                else:
-                    squad_ids = current_squads or []
-        
-        patch_payload = {
-            "uuid": remnawave_uuid,
-            "expireAt": new_expire_dt.isoformat(),
-            "activeInternalSquads": squad_ids
-        }
-        
-        if tariff.traffic_limit_bytes and tariff.traffic_limit_bytes > 0:
-            patch_payload["trafficLimitBytes"] = tariff.traffic_limit_bytes
-            patch_payload["trafficLimitStrategy"] = "NO_RESET"
-        
-        # Устанавливаем лимит устройств, если он указан в тарифе
-        if hasattr(tariff, 'hwid_device_limit') and tariff.hwid_device_limit is not None and tariff.hwid_device_limit > 0:
-            patch_payload["hwidDeviceLimit"] = tariff.hwid_device_limit
-        
-        h, c = get_remnawave_headers({"Content-Type": "application/json"})
-        patch_resp = requests.patch(f"{API_URL}/api/users", headers=h, cookies=c, json=patch_payload)
-        
-        if not patch_resp.ok:
-            print(f"Failed to update user: {patch_resp.status_code}")
-            return False
+        # Продление в RemnaWave уже выполнено прошлой попыткой задачи - повторно не продлеваем
+        if payment.remnawave_applied_at is None:
+            if not _apply_tariff_in_remnawave(payment, user, tariff, remnawave_uuid, DEFAULT_SQUAD_ID):
+                return False
+            payment.remnawave_applied_at = datetime.now(timezone.utc)
+            db.session.commit()
         
         # Списываем промокод
         if payment.promo_code_id:
@@ -565,7 +555,7 @@ def process_successful_payment(payment, user, tariff):
         try:
             cache.delete(f'live_data_{remnawave_uuid}')
             cache.delete(f'nodes_{remnawave_uuid}')
-            cache.delete('all_live_users_map')
+            invalidate_live_user(remnawave_uuid)
         except Exception as e:
             print(f"Warning: cache clear failed for uuid {remnawave_uuid}: {e}")
         
@@ -592,6 +582,115 @@ def process_successful_payment(payment, user, tariff):
         return False
 
 
+def _is_option_purchase(payment):
+    return bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
+
+
+def process_balance_topup(payment, user):
+    """Пополнение баланса по оплаченному платежу без тарифа"""
+    current_balance_usd = float(user.balance) if user.balance else 0.0
+    amount_usd = convert_to_usd(payment.amount, payment.currency)
+    user.balance = current_balance_usd + amount_usd
+    payment.status = 'PAID'
+    db.session.commit()
+
+    # Рефералка
+    try:
+        add_referral_commission(user, amount_usd, is_tariff_purchase=False)
+        db.session.commit()
+    except Exception as e:
+        print(f"Warning: referral commission failed for payment {payment.order_id}: {e}")
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+
+    # Уведомления
+    try:
+        from modules.notifications import notify_payment
+        notify_payment(payment, user, is_balance_topup=True)
+    except Exception as e:
+        print(f"Error sending payment notification: {e}")
+
+    try:
+        from modules.notifications import send_user_payment_notification_async
+        send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
+    except Exception as e:
+        print(f"Error sending user payment notification: {e}")
+
+    try:
+        cache.delete(f'live_data_{user.remnawave_uuid}')
+        invalidate_live_user(user.remnawave_uuid)
+    except Exception:
+        pass
+    return True
+
+
+# ============================================================================
+# ОЧЕРЕДЬ ОБРАБОТКИ ОПЛАТ
+# ============================================================================
+
+@job_handler('payment.process')
+def process_paid_payment_job(payment_id):
+    """
+    Обработка оплаченного платежа в фоновом воркере.
+
+    Идемпотентна: уже PAID платёж (повторная доставка, ручная сверка) пропускается;
+    при повторе после сбоя созданный конфиг (payment.user_config_id) переиспользуется,
+    а продление в RemnaWave не повторяется, если отмечено payment.remnawave_applied_at.
+    Исключение = повтор задачи с задержкой, после max_attempts - dead-letter.
+    """
+    p = db.session.get(Payment, payment_id)
+    if not p or p.status == 'PAID':
+        return
+    u = db.session.get(User, p.user_id)
+    if not u:
+        print(f"[payment.process] User not found for payment {p.order_id}")
+        return
+
+    if _is_option_purchase(p):
+        ok = process_option_purchase(p, u)
+    elif p.tariff_id is None:
+        ok = process_balance_topup(p, u)
+    else:
+        t = db.session.get(Tariff, p.tariff_id)
+        if not t:
+            print(f"[payment.process] Tariff not found for payment {p.order_id}, tariff_id={p.tariff_id}")
+            return
+        ok = process_successful_payment(p, u, t)
+
+    if not ok:
+        raise RuntimeError(f"Payment {p.order_id} processing failed")
+
+
+def accept_payment_event(provider, payment, event_type='paid', payload=None):
+    """
+    Идемпотентно зафиксировать webhook-событие и поставить оплату в очередь.
+
+    Returns:
+        bool: True - событие новое и поставлено в очередь, False - повторная доставка
+    """
+    event = WebhookEvent(
+        provider=provider,
+        order_id=str(payment.order_id),
+        event_type=event_type,
+        payment_id=payment.id,
+        payload=json.dumps(payload, ensure_ascii=False, default=str)[:20000] if payload is not None else None,
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(event)
+    except IntegrityError:
+        print(f"[{provider.upper()}] Duplicate event {event_type} for {payment.order_id}, acknowledged")
+        return False
+
+    job = enqueue('payment.process', {'payment_id': payment.id}, dedupe_key=f'payment:{payment.id}:paid')
+    event.job_id = job.id
+    db.session.commit()
+    print(f"[{provider.upper()}] Payment {payment.order_id} queued (job {job.id})")
+    return True
+
+
 # ============================================================================
 # WEBHOOKS
 # ============================================================================
@@ -613,19 +712,14 @@ def heleket_webhook():
         if not payment:
             return jsonify({"status": "error", "message": "Payment not found"}), 404
         
-        payment.status = status.upper()
         payment.payment_system_id = data.get('payment_id')
-        db.session.commit()
-        
         if status.upper() == 'PAID':
-            user = User.query.get(payment.user_id)
-            is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-            if user and is_option_purchase:
-                process_option_purchase(payment, user)
-            else:
-                tariff = Tariff.query.get(payment.tariff_id)
-                if user and tariff:
-                    process_successful_payment(payment, user, tariff)
+            # Статус PAID выставит обработчик очереди после выдачи подписки/баланса
+            if payment.status != 'PAID':
+                accept_payment_event('heleket', payment, payload=data)
+        else:
+            payment.status = status.upper()
+        db.session.commit()
         
         return jsonify({"status": "success"}), 200
         
@@ -695,7 +789,7 @@ def yookassa_webhook():
                 db.session.commit()
                 
                 cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
+                invalidate_live_user(user.remnawave_uuid)
                 
                 print(f"[YOOKASSA] ✅ Balance refund processed: user_id={user.id}, refund={refund_amount_usd} USD, new_balance={new_balance} USD")
             else:
@@ -774,60 +868,8 @@ def yookassa_webhook():
                 print(f"[YOOKASSA] User not found for payment {order_id}")
                 return jsonify({"status": "error", "message": "User not found"}), 404
             
-            print(f"[YOOKASSA] Processing payment: order_id={order_id}, user_id={user.id}, tariff_id={payment.tariff_id}, amount={payment.amount} {payment.currency}")
-            
-            # Если это пополнение баланса (tariff_id == None)
-            if payment.tariff_id is None:
-                is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-                if is_option_purchase:
-                    ok = process_option_purchase(payment, user)
-                    if ok:
-                        print(f"[YOOKASSA] ✅ Option purchase successful: user_id={user.id}, payment_id={payment.id}")
-                    else:
-                        print(f"[YOOKASSA] ❌ Failed to process option purchase: user_id={user.id}, payment_id={payment.id}")
-                    return jsonify({"status": "success"}), 200
-
-                current_balance_usd = float(user.balance) if user.balance else 0.0
-                amount_usd = convert_to_usd(payment.amount, payment.currency)
-                new_balance = current_balance_usd + amount_usd
-                user.balance = new_balance
-                payment.status = 'PAID'
-                db.session.commit()
-                
-                # Начисляем реферальную комиссию
-                add_referral_commission(user, amount_usd, is_tariff_purchase=False)
-                db.session.commit()
-                
-                cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
-                
-                # Отправляем уведомление админам
-                try:
-                    from modules.notifications import notify_payment
-                    notify_payment(payment, user, is_balance_topup=True)
-                except Exception as e:
-                    print(f"Error sending payment notification: {e}")
-                
-                # Отправляем уведомление пользователю в бот
-                try:
-                    from modules.notifications import send_user_payment_notification_async
-                    send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
-                except Exception as e:
-                    print(f"Error sending user payment notification: {e}")
-                
-                print(f"[YOOKASSA] ✅ Balance top-up successful: user_id={user.id}, amount={amount_usd} USD, new_balance={new_balance} USD")
-            else:
-                # Покупка тарифа
-                tariff = Tariff.query.get(payment.tariff_id)
-                if tariff:
-                    # process_successful_payment уже отправляет уведомления админам и пользователю
-                    success = process_successful_payment(payment, user, tariff)
-                    if success:
-                        print(f"[YOOKASSA] ✅ Tariff purchase successful: user_id={user.id}, tariff_id={tariff.id}, tariff_name={tariff.name}")
-                    else:
-                        print(f"[YOOKASSA] ❌ Failed to process tariff purchase: user_id={user.id}, tariff_id={tariff.id}")
-                else:
-                    print(f"[YOOKASSA] ❌ Warning: Tariff not found for payment {payment.order_id}, tariff_id={payment.tariff_id}")
+            print(f"[YOOKASSA] Queueing payment: order_id={order_id}, user_id={user.id}, tariff_id={payment.tariff_id}, amount={payment.amount} {payment.currency}")
+            accept_payment_event('yookassa', payment, payload=data)
         else:
             # Логируем другие статусы для отладки
             print(f"[YOOKASSA] Payment status: {status} (not processing, waiting for 'succeeded')")
@@ -887,12 +929,11 @@ def yoomoney_webhook():
             return jsonify({"status": "error", "message": "Missing label"}), 400
 
         # Проверка подписи
-        s = PaymentSetting.query.first()
+        s = get_settings(PaymentSetting)
         secret = ""
         if s and getattr(s, 'yoomoney_notification_secret', None):
             try:
-                from modules.models.payment import decrypt_key as decrypt_key_model
-                secret = (decrypt_key_model(getattr(s, 'yoomoney_notification_secret', None)) or "").strip()
+                secret = (decrypt_key(getattr(s, 'yoomoney_notification_secret', None)) or "").strip()
             except Exception:
                 secret = ""
 
@@ -933,59 +974,12 @@ def yoomoney_webhook():
         if not user:
             return jsonify({"status": "success", "message": "User not found"}), 200
 
-        # Пополнение баланса
-        if payment.tariff_id is None:
-            is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-            if is_option_purchase:
-                ok = process_option_purchase(payment, user)
-                return jsonify({"status": "success", "processed": bool(ok)}), 200
-
-            current_balance_usd = float(user.balance) if user.balance else 0.0
-            amount_usd = convert_to_usd(payment.amount, payment.currency)
-            user.balance = current_balance_usd + amount_usd
-            payment.status = 'PAID'
-            db.session.commit()
-
-            # Рефералка
-            try:
-                add_referral_commission(user, amount_usd, is_tariff_purchase=False)
-                db.session.commit()
-            except Exception as e:
-                print(f"[YOOMONEY] Warning: referral commission failed: {e}")
-                try:
-                    db.session.rollback()
-                except Exception:
-                    pass
-
-            # Уведомления
-            try:
-                from modules.notifications import notify_payment
-                notify_payment(payment, user, is_balance_topup=True)
-            except Exception as e:
-                print(f"[YOOMONEY] Error sending payment notification: {e}")
-
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
-            except Exception as e:
-                print(f"[YOOMONEY] Error sending user payment notification: {e}")
-
-            try:
-                cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
-            except Exception:
-                pass
-
-            return jsonify({"status": "success"}), 200
-
-        # Покупка тарифа
-        tariff = Tariff.query.get(payment.tariff_id)
-        if not tariff:
+        if payment.tariff_id is not None and not Tariff.query.get(payment.tariff_id):
             return jsonify({"status": "success", "message": "Tariff not found"}), 200
 
-        # process_successful_payment сам выставит статус и уведомления
-        ok = process_successful_payment(payment, user, tariff)
-        return jsonify({"status": "success", "processed": bool(ok)}), 200
+        # Пополнение баланса / опция / тариф — обработает очередь
+        queued = accept_payment_event('yoomoney', payment, payload=data)
+        return jsonify({"status": "success", "queued": queued}), 200
 
     except Exception as e:
         print(f"[YOOMONEY] Error: {e}")
@@ -1009,7 +1003,7 @@ def telegram_webhook():
             order_id = pre_checkout.get('invoice_payload')
             query_id = pre_checkout.get('id')
             
-            s = PaymentSetting.query.first()
+            s = get_settings(PaymentSetting)
             bot_token = decrypt_key(s.telegram_bot_token) if s else None
             
             if not bot_token:
@@ -1017,13 +1011,13 @@ def telegram_webhook():
             
             p = Payment.query.filter_by(order_id=order_id).first()
             if p and p.status == 'PENDING':
-                requests.post(
+                provider_session('telegram_stars').post(
                     f"https://api.telegram.org/bot{bot_token}/answerPreCheckoutQuery",
                     json={"pre_checkout_query_id": query_id, "ok": True},
                     timeout=5
                 )
             else:
-                requests.post(
+                provider_session('telegram_stars').post(
                     f"https://api.telegram.org/bot{bot_token}/answerPreCheckoutQuery",
                     json={"pre_checkout_query_id": query_id, "ok": False, "error_message": "Payment not found"},
                     timeout=5
@@ -1046,48 +1040,9 @@ def telegram_webhook():
             u = db.session.get(User, p.user_id)
             if not u:
                 return jsonify({"ok": True}), 200
-            
-        # Пополнение баланса
-        if p.tariff_id is None:
-            is_option_purchase = bool(getattr(p, 'description', None)) and str(p.description).startswith('OPTION:')
-            if is_option_purchase:
-                process_option_purchase(p, u)
-                return jsonify({"ok": True}), 200
 
-            current_balance = float(u.balance) if u.balance else 0.0
-            amount_usd = convert_to_usd(p.amount, p.currency)
-            u.balance = current_balance + amount_usd
-            p.status = 'PAID'
-            db.session.commit()
-            
-            # Начисляем реферальную комиссию
-            add_referral_commission(u, amount_usd, is_tariff_purchase=False)
-            db.session.commit()
-            
-            # Отправляем уведомление админам
-            try:
-                from modules.notifications import notify_payment
-                notify_payment(p, u, is_balance_topup=True)
-            except Exception as e:
-                print(f"Error sending payment notification: {e}")
-            
-            # Отправляем уведомление пользователю в бот
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(u, is_successful=True, is_balance_topup=True, payment=p)
-            except Exception as e:
-                print(f"Error sending user payment notification: {e}")
-            
-            cache.delete(f'live_data_{u.remnawave_uuid}')
-            return jsonify({"ok": True}), 200
-        
-        # Покупка тарифа
-        t = db.session.get(Tariff, p.tariff_id)
-        if not t:
-            return jsonify({"ok": True}), 200
-        
-        # process_successful_payment уже отправляет уведомление пользователю
-        process_successful_payment(p, u, t)
+            # Пополнение баланса / опция / тариф — обработает очередь
+            accept_payment_event('telegram_stars', p, payload=successful_payment)
         
         return jsonify({"ok": True}), 200
         
@@ -1204,15 +1159,8 @@ def freekassa_webhook():
             return "NO", 404
         
         if payment.status != 'PAID':
-            payment.status = 'PAID'
             payment.payment_system_id = data.get('intid')
-            db.session.commit()
-            
-            user = User.query.get(payment.user_id)
-            tariff = Tariff.query.get(payment.tariff_id)
-            
-            if user and tariff:
-                process_successful_payment(payment, user, tariff)
+            accept_payment_event('freekassa', payment, payload=data)
         
         return "YES", 200
         
@@ -1236,16 +1184,8 @@ def kassa_ai_webhook():
         if not payment:
             return "NO", 404
         if payment.status != 'PAID':
-            payment.status = 'PAID'
             payment.payment_system_id = data.get("intid") or data.get("MERCHANT_ORDER_ID") or order_id
-            db.session.commit()
-            user = User.query.get(payment.user_id)
-            tariff = Tariff.query.get(payment.tariff_id)
-            is_option = bool(getattr(payment, 'description', None)) and str(payment.description).startswith("OPTION:")
-            if user and is_option:
-                process_option_purchase(payment, user)
-            elif user and tariff:
-                process_successful_payment(payment, user, tariff)
+            accept_payment_event('kassa_ai', payment, payload=data)
         return "YES", 200
     except Exception as e:
         print(f"[KASSA_AI] Error: {e}")
@@ -1270,17 +1210,7 @@ def robokassa_webhook():
             return "NO", 404
         
         if payment.status != 'PAID':
-            payment.status = 'PAID'
-            db.session.commit()
-            
-            user = User.query.get(payment.user_id)
-            is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-            if user and is_option_purchase:
-                process_option_purchase(payment, user)
-            else:
-                tariff = Tariff.query.get(payment.tariff_id)
-                if user and tariff:
-                    process_successful_payment(payment, user, tariff)
+            accept_payment_event('robokassa', payment, payload=data)
         
         return f"OK{order_id}", 200
         
@@ -1321,49 +1251,8 @@ def crystalpay_webhook():
         if not u:
             return jsonify({"error": False}), 200
         
-        # Если это пополнение баланса (tariff_id == None)
-        if p.tariff_id is None:
-            is_option_purchase = bool(getattr(p, 'description', None)) and str(p.description).startswith('OPTION:')
-            if is_option_purchase:
-                process_option_purchase(p, u)
-                return jsonify({"error": False}), 200
-
-            current_balance_usd = float(u.balance) if u.balance else 0.0
-            amount_usd = convert_to_usd(p.amount, p.currency)
-            u.balance = current_balance_usd + amount_usd
-            p.status = 'PAID'
-            db.session.commit()
-            
-            # Начисляем реферальную комиссию
-            add_referral_commission(u, amount_usd, is_tariff_purchase=False)
-            db.session.commit()
-            
-            # Отправляем уведомление админам
-            try:
-                from modules.notifications import notify_payment
-                notify_payment(p, u, is_balance_topup=True)
-            except Exception as e:
-                print(f"Error sending payment notification: {e}")
-            
-            # Отправляем уведомление пользователю в бот
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(u, is_successful=True, is_balance_topup=True, payment=p)
-            except Exception as e:
-                print(f"Error sending user payment notification: {e}")
-            
-            cache.delete(f'live_data_{u.remnawave_uuid}')
-            cache.delete('all_live_users_map')
-            
-            return jsonify({"error": False}), 200
-        
-        # Обычная покупка тарифа
-        t = db.session.get(Tariff, p.tariff_id)
-        if not t:
-            return jsonify({"error": False}), 200
-        
-        # process_successful_payment уже отправляет уведомление пользователю
-        process_successful_payment(p, u, t)
+        # Пополнение баланса / опция / тариф — обработает очередь
+        accept_payment_event('crystalpay', p, payload=d)
         
         return jsonify({"error": False}), 200
         
@@ -1451,43 +1340,12 @@ def platega_webhook():
         verified_status = None
         if transaction_id:
             try:
-                from modules.models.payment import PaymentSetting, decrypt_key
-                import requests
+                from modules.api.payments.platega import get_platega_transaction
                 
-                settings = PaymentSetting.query.first()
-                if settings:
-                    platega_key = decrypt_key(getattr(settings, 'platega_api_key', None)) if settings else None
-                    platega_merchant_raw = decrypt_key(getattr(settings, 'platega_merchant_id', None)) if settings else None
-                    
-                    if platega_key and platega_merchant_raw:
-                        # Обработка Merchant ID (убираем префикс 'live_' если есть)
-                        import re
-                        import uuid as uuid_lib
-                        platega_merchant = platega_merchant_raw.strip()
-                        if platega_merchant.startswith('live_'):
-                            platega_merchant = platega_merchant[5:]
-                        uuid_pattern = r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
-                        uuid_match = re.search(uuid_pattern, platega_merchant)
-                        if uuid_match:
-                            platega_merchant = uuid_match.group(0)
-                        
-                        # Проверяем статус через API Platega
-                        api_url = f"https://app.platega.io/transaction/{transaction_id}"
-                        headers = {
-                            "X-MerchantId": platega_merchant,
-                            "X-Secret": platega_key,
-                            "Content-Type": "application/json"
-                        }
-                        
-                        resp = requests.get(api_url, headers=headers, timeout=10)
-                        if resp.status_code == 200:
-                            api_data = resp.json()
-                            verified_status = api_data.get('status', '').upper()
-                            print(f"[PLATEGA] Verified status from API: {verified_status}, full response: {json.dumps(api_data, indent=2)}")
-                        elif resp.status_code == 404:
-                            print(f"[PLATEGA] Transaction {transaction_id} not found in Platega API (404)")
-                        else:
-                            print(f"[PLATEGA] Failed to verify status via API: {resp.status_code} - {resp.text[:200]}")
+                api_data = get_platega_transaction(transaction_id)
+                if api_data is not None:
+                    verified_status = (api_data.get('status') or '').upper()
+                    print(f"[PLATEGA] Verified status from API: {verified_status}, full response: {json.dumps(api_data, indent=2)}")
             except Exception as api_error:
                 print(f"[PLATEGA] Error verifying status via API: {api_error}")
         
@@ -1520,31 +1378,18 @@ def platega_webhook():
             print(f"[PLATEGA] Payment {p.order_id} already processed")
             return jsonify({"status": "ok"}), 200
         
-        # Получаем пользователя и тариф
         u = db.session.get(User, p.user_id)
-        t = db.session.get(Tariff, p.tariff_id) if p.tariff_id else None
-        
         if not u:
             print(f"[PLATEGA] User not found for payment {p.order_id}")
             return jsonify({"status": "ok"}), 200
         
-        # Если это пополнение баланса (нет тарифа), обрабатываем отдельно
-        if not t:
-            # Для пополнения баланса обновляем статус и пополняем баланс
-            p.status = 'PAID'
-            # Пополняем баланс пользователя
-            u.balance = (u.balance or 0) + float(p.amount)
-            db.session.commit()
-            print(f"[PLATEGA] Balance topup payment {p.order_id} marked as PAID, balance updated: {u.balance}")
+        if status_upper not in ['CONFIRMED', 'PAID', 'SUCCESS', 'COMPLETED']:
+            print(f"[PLATEGA] Verified status {status_upper} is not successful, skipping {p.order_id}")
             return jsonify({"status": "ok"}), 200
         
-        # Обрабатываем успешный платеж за тариф
-        if process_successful_payment(p, u, t):
-            print(f"[PLATEGA] Successfully processed payment {p.order_id}")
-            return jsonify({"status": "ok"}), 200
-        else:
-            print(f"[PLATEGA] Failed to process payment {p.order_id}")
-            return jsonify({"status": "ok"}), 200
+        # Пополнение баланса / тариф — обработает очередь
+        accept_payment_event('platega', p, payload=webhook_data)
+        return jsonify({"status": "ok"}), 200
         
     except Exception as e:
         print(f"[PLATEGA] Error: {e}")
@@ -1584,10 +1429,8 @@ def mulenpay_webhook():
         if not u or not t:
             return jsonify({}), 200
         
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        accept_payment_event('mulenpay', p, payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[MULENPAY] Error: {e}")
@@ -1625,10 +1468,8 @@ def urlpay_webhook():
         if not u or not t:
             return jsonify({}), 200
         
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        accept_payment_event('urlpay', p, payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[URLPAY] Error: {e}")
@@ -1670,10 +1511,8 @@ def btcpayserver_webhook():
         if not u or not t:
             return jsonify({}), 200
         
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        accept_payment_event('btcpayserver', p, payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[BTCPAYSERVER] Error: {e}")
@@ -1711,10 +1550,8 @@ def tribute_webhook():
         if not u or not t:
             return jsonify({}), 200
         
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        accept_payment_event('tribute', p, payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[TRIBUTE] Error: {e}")
@@ -1749,10 +1586,8 @@ def monobank_webhook():
         if not u or not t:
             return jsonify({}), 200
         
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        accept_payment_event('monobank', p, payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[MONOBANK] Error: {e}")
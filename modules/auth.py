@@ -1,6 +1,10 @@
-from flask import request, jsonify
+from flask import request, jsonify, g, has_request_context
 from functools import wraps
+from collections import namedtuple
 import jwt
+import time
+import uuid
+import threading
 from datetime import datetime, timedelta, timezone
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
@@ -20,6 +24,209 @@ bcrypt = get_bcrypt()
 
 # Импорт модели User из modules.user
 from modules.user import User
+from modules.models.user_config import UserConfig
+from sqlalchemy import event, and_
+from sqlalchemy.orm import Session, object_session
+
+# ============================================================================
+# PRINCIPAL CACHE
+# ============================================================================
+# Компактный снимок пользователя для проверок на каждом запросе (роль, блокировка, UUID основного конфига)
+# и полей профиля, которые отдаёт /api/client/me (баланс, реферальный код, Telegram, триал).
+# Уровни: flask.g (в пределах запроса) -> словарь процесса на PRINCIPAL_CACHE_TTL секунд.
+# Изменения User/UserConfig после commit сбрасывают локальную запись и меняют версию в общем кэше,
+# поэтому остальные воркеры перечитывают снимок на следующем запросе.
+# Без общего кэша (CACHE_TYPE=null) версия между воркерами не видна - снимок кэшируется только в пределах запроса.
+
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', 30))
+PRINCIPAL_FIELDS = ('role', 'is_blocked', 'remnawave_uuid', 'preferred_lang', 'preferred_currency',
+                    'balance', 'referral_code', 'telegram_id', 'telegram_username', 'trial_used')
+SHARED_CACHE_TYPES = ('RedisCache', 'FileSystemCache')
+
+Principal = namedtuple('Principal', 'id role is_blocked remnawave_uuid preferred_lang preferred_currency '
+                                    'balance referral_code telegram_id telegram_username trial_used primary_uuid version')
+# Поля, которые CurrentUser отдаёт из снимка; остальные (в т.ч. баланс для расчётов) - из строки User
+IDENTITY_FIELDS = ('id', 'role', 'is_blocked', 'remnawave_uuid', 'preferred_lang', 'preferred_currency', 'primary_uuid', 'version')
+
+_principals = {}  # user_id -> (expires_at, version, Principal)
+_principals_lock = threading.Lock()
+
+
+def _principal_version(user_id):
+    try:
+        from modules.core import get_cache
+        return get_cache().get(f'principal_ver_{user_id}')
+    except Exception:
+        return None
+
+
+def _load_principal(user_id):
+    """Один запрос: поля User + UUID основного конфига"""
+    columns = (User.id, User.role, User.is_blocked, User.remnawave_uuid,
+               User.preferred_lang, User.preferred_currency, User.balance, User.referral_code,
+               User.telegram_id, User.telegram_username, User.trial_used)
+    try:
+        row = db.session.query(*columns, UserConfig.remnawave_uuid).outerjoin(
+            UserConfig, and_(UserConfig.user_id == User.id, UserConfig.is_primary == True)
+        ).filter(User.id == user_id).first()
+    except Exception:
+        # Таблица user_config ещё не создана (миграции не прогнаны)
+        db.session.rollback()
+        row = db.session.query(*columns).filter(User.id == user_id).first()
+        row = tuple(row) + (None,) if row else None
+    if not row:
+        return None
+    return Principal(row[0], row[1], bool(row[2]), row[3], row[4] or 'ru', row[5] or 'uah',
+                     float(row[6]) if row[6] else 0.0, row[7], row[8], row[9], bool(row[10]), row[11], None)
+
+
+def _process_cache_enabled():
+    return app.config.get('CACHE_TYPE') in SHARED_CACHE_TYPES
+
+
+def get_principal(user_id):
+    """Снимок пользователя user_id (Principal) или None, если пользователя нет"""
+    request_cache = g.setdefault('_principals', {}) if has_request_context() else {}
+    if user_id in request_cache:
+        return request_cache[user_id]
+
+    if not _process_cache_enabled():
+        principal = _load_principal(user_id)
+        request_cache[user_id] = principal
+        return principal
+
+    version = _principal_version(user_id)
+    entry = _principals.get(user_id)
+    if entry and entry[0] > time.monotonic() and entry[1] == version:
+        principal = entry[2]
+    else:
+        principal = _load_principal(user_id)
+        with _principals_lock:
+            if principal:
+                principal = principal._replace(version=version)
+                _principals[user_id] = (time.monotonic() + PRINCIPAL_CACHE_TTL, version, principal)
+            else:
+                _principals.pop(user_id, None)
+    request_cache[user_id] = principal
+    return principal
+
+
+def invalidate_principal(*user_ids):
+    """Сбросить снимки пользователей (в этом процессе и, через версию в общем кэше, в остальных)"""
+    try:
+        from modules.core import get_cache
+        cache = get_cache()
+    except Exception:
+        cache = None
+    for user_id in user_ids:
+        if not user_id:
+            continue
+        with _principals_lock:
+            _principals.pop(user_id, None)
+        if has_request_context():
+            g.get('_principals', {}).pop(user_id, None)
+        if cache is not None:
+            try:
+                cache.set(f'principal_ver_{user_id}', uuid.uuid4().hex, timeout=max(60, int(PRINCIPAL_CACHE_TTL * 4)))
+            except Exception:
+                pass
+
+
+def _mark_principal_dirty(target, user_id):
+    session = object_session(target)
+    if session is not None and user_id:
+        session.info.setdefault('principal_dirty', set()).add(user_id)
+
+
+@event.listens_for(User, 'after_update')
+def _principal_user_updated(mapper, connection, target):
+    state = db.inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in PRINCIPAL_FIELDS):
+        _mark_principal_dirty(target, target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _principal_user_deleted(mapper, connection, target):
+    _mark_principal_dirty(target, target.id)
+
+
+@event.listens_for(UserConfig, 'after_insert')
+@event.listens_for(UserConfig, 'after_update')
+@event.listens_for(UserConfig, 'after_delete')
+def _principal_config_changed(mapper, connection, target):
+    _mark_principal_dirty(target, target.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _principal_flush_invalidations(session):
+    # Сбрасываем только после commit: иначе параллельный запрос успеет закэшировать старые данные
+    dirty = session.info.pop('principal_dirty', None)
+    if dirty:
+        invalidate_principal(*dirty)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _principal_discard_invalidations(session):
+    session.info.pop('principal_dirty', None)
+
+
+def _token_user_id():
+    """ID пользователя из заголовка Authorization (None - нет токена; исключение - токен невалиден)"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
+    local_token = auth_header.split(" ")[1]
+    payload = jwt.decode(local_token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
+    return int(payload['sub'])
+
+
+class CurrentUser:
+    """Пользователь запроса: поля IDENTITY_FIELDS без обращения к БД, строка User загружается при первом доступе к остальным атрибутам"""
+
+    __slots__ = ('principal', '_row')
+
+    def __init__(self, principal):
+        object.__setattr__(self, 'principal', principal)
+        object.__setattr__(self, '_row', None)
+
+    @property
+    def orm(self):
+        """Строка User (для db.session.refresh и т.п.)"""
+        if self._row is None:
+            object.__setattr__(self, '_row', db.session.get(User, self.principal.id))
+        return self._row
+
+    def __getattr__(self, name):
+        # После загрузки строки отдаём её значения - обработчик мог их изменить
+        if name in ('primary_uuid', 'version') or (self._row is None and name in IDENTITY_FIELDS):
+            return getattr(self.principal, name)
+        return getattr(self.orm, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.orm, name, value)
+
+    def __repr__(self):
+        return f'<CurrentUser {self.principal.id}>'
+
+
+def blocked_response(user):
+    """Ответ 403 для заблокированного аккаунта"""
+    return jsonify({
+        "message": "Account blocked",
+        "code": "ACCOUNT_BLOCKED",
+        "block_reason": getattr(user, 'block_reason', '') or "Ваш аккаунт заблокирован",
+        "blocked_at": user.blocked_at.isoformat() if getattr(user, 'blocked_at', None) else None
+    }), 403
+
+
+def get_current_principal():
+    """Principal текущего запроса по JWT или None"""
+    try:
+        user_id = _token_user_id()
+    except Exception:
+        return None
+    return get_principal(user_id) if user_id else None
+
 
 # Функции аутентификации
 def create_local_jwt(user_id):
@@ -34,25 +241,18 @@ def admin_required(f):
         if not auth_header or not auth_header.startswith("Bearer "):
             return jsonify({"message": "Auth required"}), 401
         try:
-            local_token = auth_header.split(" ")[1]
-            payload = jwt.decode(local_token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-            user = db.session.get(User, int(payload['sub']))
-            if not user or user.role != 'ADMIN':
+            user_id = _token_user_id()
+            # Роль проверяется по кэшированному снимку - не-админ получает 403 без запроса к БД
+            principal = get_principal(user_id)
+            if not principal or principal.role != 'ADMIN':
                 return jsonify({"message": "Forbidden"}), 403
-            kwargs['current_admin'] = user
         except Exception:
             return jsonify({"message": "Invalid token"}), 401
+        kwargs['current_admin'] = CurrentUser(principal)
         return f(*args, **kwargs)
     return decorated_function
 
 def get_user_from_token():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return None
-    try:
-        local_token = auth_header.split(" ")[1]
-        payload = jwt.decode(local_token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-        user = db.session.get(User, int(payload['sub']))
-        return user
-    except Exception:
-        return None
\ No newline at end of file
+    """CurrentUser по JWT или None (блокировку проверяют обработчики, которым она нужна)"""
+    principal = get_current_principal()
+    return CurrentUser(principal) if principal else None
\ No newline at end of file
@@ -0,0 +1,384 @@
+"""
+Движок ручных рассылок (/api/admin/broadcast)
+
+- рассылка хранится в broadcast_job и выполняется задачей 'broadcast.send' фоновой очереди (modules.jobs)
+- получатели читаются из БД пачками по BROADCAST_CHUNK_SIZE (keyset по User.id), а не одним .all()
+- Telegram: общий token bucket на бота (BROADCAST_RATE сообщений/сек, по умолчанию 25 при лимите ~30),
+  не больше BROADCAST_CONCURRENCY одновременных запросов; 429 с retry_after приостанавливает все
+  отправки на указанное время, после чего сообщение отправляется повторно
+- фото загружается в Telegram один раз, дальше отправляется по file_id
+- прогресс сохраняется после каждой пачки: при падении воркера рассылка продолжится с last_user_id
+  (повторно могут уйти только сообщения из прерванной пачки)
+"""
+import os
+import json
+import time
+import asyncio
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from modules.core import get_db
+from modules.jobs import job_handler, heartbeat
+from modules.models.broadcast import BroadcastJob
+from modules.models.user import User
+
+db = get_db()
+
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 500))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 10))
+BROADCAST_EMAIL_CONCURRENCY = int(os.getenv('BROADCAST_EMAIL_CONCURRENCY', 4))
+RETRY_AFTER_ATTEMPTS = 5
+FAILED_SAMPLE_LIMIT = 50
+
+TELEGRAM_API = 'https://api.telegram.org'
+
+# Кнопка "В главное меню" под сообщениями рассылки (как в send_telegram_message)
+MAIN_MENU_MARKUP = {
+    "inline_keyboard": [[{
+        "text": "🏠 В главное меню",
+        "callback_data": "clear_and_main_menu"
+    }]]
+}
+
+
+def get_broadcast_bot_token(bot_type):
+    """Токен бота для рассылки: 'new' - CLIENT_BOT_V2_TOKEN (или основной), иначе CLIENT_BOT_TOKEN"""
+    if bot_type == 'new':
+        return os.getenv("CLIENT_BOT_V2_TOKEN") or os.getenv("CLIENT_BOT_TOKEN")
+    return os.getenv("CLIENT_BOT_TOKEN")
+
+
+def recipients_query(broadcast):
+    """Запрос (User.id, User.email, User.telegram_id) получателей рассылки"""
+    query = db.session.query(User.id, User.email, User.telegram_id)
+    if broadcast.recipient_type == 'active':
+        query = query.filter(User.role == 'CLIENT', User.remnawave_uuid != None)
+    elif broadcast.recipient_type == 'inactive':
+        query = query.filter(User.role == 'CLIENT', User.remnawave_uuid == None)
+    elif broadcast.recipient_type == 'custom':
+        query = query.filter(User.email.in_(broadcast.get_custom_emails()))
+    else:
+        query = query.filter(User.role == 'CLIENT')
+
+    # Отсекаем тех, кому по выбранному каналу отправлять нечего
+    if broadcast.broadcast_type == 'telegram':
+        query = query.filter(User.telegram_id != None)
+    elif broadcast.broadcast_type == 'email':
+        query = query.filter(User.email != None, ~User.email.like('%@telegram.local'))
+    return query
+
+
+class TokenBucket:
+    """Ограничение частоты для asyncio: rate токенов в секунду, запас capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Остановить выдачу токенов (429 retry_after - ограничение общее для всего бота)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TelegramSender:
+    """Отправка сообщений рассылки через Bot API с учётом лимитов Telegram"""
+
+    def __init__(self, bot_token, photo_file_id=None, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY):
+        self.base_url = f"{TELEGRAM_API}/bot{bot_token}"
+        self.photo_file_id = photo_file_id
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.rate_limited = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self._semaphore = None
+
+    def _post(self, method, data, files=None):
+        url = f"{self.base_url}/{method}"
+        if files:
+            resp = self.session.post(url, data=data, files=files, timeout=60)
+        else:
+            resp = self.session.post(url, json=data, timeout=15)
+        try:
+            body = resp.json()
+        except ValueError:
+            body = {}
+        return resp.status_code, body
+
+    async def call(self, method, data, files=None):
+        """
+        Вызов метода Bot API.
+
+        Returns: (ok, result или описание ошибки, error_code)
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        connection_retries = 0
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            async with self._semaphore:
+                try:
+                    status, body = await asyncio.to_thread(self._post, method, data, files)
+                except requests.ConnectionError as e:
+                    # Ошибка соединения - короткий повтор
+                    connection_retries += 1
+                    if connection_retries > 2:
+                        return False, str(e), None
+                    await asyncio.sleep(connection_retries)
+                    continue
+                except requests.RequestException as e:
+                    return False, str(e), None
+
+            if body.get('ok'):
+                return True, body.get('result'), None
+
+            error_code = body.get('error_code', status)
+            retry_after = (body.get('parameters') or {}).get('retry_after')
+            if error_code == 429 and retry_after and attempt < RETRY_AFTER_ATTEMPTS:
+                attempt += 1
+                self.rate_limited += 1
+                self.bucket.pause(float(retry_after))
+                continue
+            return False, body.get('description', f'HTTP {status}'), error_code
+
+    async def send(self, chat_id, text, photo=None, pin=False, reply_markup=None):
+        """
+        Отправить сообщение рассылки (фото с подписью, если задано) и при необходимости закрепить.
+
+        photo - (filename, bytes) для первой загрузки; после неё используется self.photo_file_id.
+        reply_markup - клавиатура (по умолчанию кнопка "В главное меню").
+        Returns: (ok, описание ошибки, error_code)
+        """
+        reply_markup = reply_markup or MAIN_MENU_MARKUP
+        if self.photo_file_id or photo:
+            data = {
+                "chat_id": chat_id,
+                "caption": text[:1024],  # Лимит подписи Telegram
+                "parse_mode": "HTML",
+            }
+            if self.photo_file_id:
+                data["photo"] = self.photo_file_id
+                data["reply_markup"] = reply_markup
+                ok, result, error_code = await self.call('sendPhoto', data)
+            else:
+                data["reply_markup"] = json.dumps(reply_markup)
+                ok, result, error_code = await self.call('sendPhoto', data, files={'photo': photo})
+                if ok and not self.photo_file_id:
+                    sizes = (result or {}).get('photo') or []
+                    if sizes:
+                        self.photo_file_id = sizes[-1].get('file_id')
+        else:
+            ok, result, error_code = await self.call('sendMessage', {
+                "chat_id": chat_id,
+                "text": text,
+                "parse_mode": "HTML",
+                "reply_markup": reply_markup,
+            })
+
+        if not ok:
+            return False, result, error_code
+
+        message_id = (result or {}).get('message_id')
+        if pin and message_id:
+            pinned, error, _ = await self.call('pinChatMessage', {
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "disable_notification": False,
+            })
+            if not pinned:
+                # Ошибка закрепления не считается ошибкой рассылки
+                print(f"[broadcast] Failed to pin message for {chat_id}: {error}")
+        return True, None, None
+
+
+def _send_email(email, subject, html_body, sender):
+    """Отправить одно письмо рассылки (нужен app context)"""
+    from flask_mail import Message
+    from modules.core import get_mail
+    try:
+        m = Message(subject, recipients=[email])
+        m.html = html_body
+        if sender:
+            m.sender = sender
+        get_mail().send(m)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+
+async def _send_chunk(rows, broadcast, telegram, email, stats):
+    """Разослать одну пачку получателей, результаты - в stats"""
+    use_email = broadcast.broadcast_type in ('email', 'both')
+    use_telegram = broadcast.broadcast_type in ('telegram', 'both') and telegram is not None
+    email_semaphore = asyncio.Semaphore(BROADCAST_EMAIL_CONCURRENCY)
+
+    async def email_one(row):
+        async with email_semaphore:
+            ok, error = await asyncio.to_thread(_send_email, row.email, email['subject'], email['html'], email['sender'])
+        if ok:
+            stats['email_sent'] += 1
+        else:
+            stats['email_failed'] += 1
+            stats['failed_email'].append(row.email)
+
+    async def telegram_one(row, photo=None):
+        ok, error, error_code = await telegram.send(row.telegram_id, telegram_text, photo=photo, pin=broadcast.pin_message)
+        if ok:
+            stats['telegram_sent'] += 1
+        else:
+            stats['telegram_failed'] += 1
+            if error_code == 403:
+                stats['telegram_blocked'] += 1
+            stats['failed_telegram'].append({'telegram_id': row.telegram_id, 'email': row.email, 'error': error})
+        return ok
+
+    telegram_text = f"<b>{broadcast.subject}</b>\n\n{broadcast.message}" if broadcast.subject else broadcast.message
+
+    tasks = []
+    if use_email:
+        tasks += [email_one(row) for row in rows if row.email and not row.email.endswith('@telegram.local')]
+
+    telegram_rows = [row for row in rows if row.telegram_id] if use_telegram else []
+    if telegram_rows and broadcast.photo_data and not telegram.photo_file_id:
+        # Фото ещё не загружено: отправляем по одному, пока Telegram не вернёт file_id
+        photo = (broadcast.photo_filename or 'photo.jpg', broadcast.photo_data)
+        while telegram_rows and not telegram.photo_file_id:
+            await telegram_one(telegram_rows.pop(0), photo=photo)
+    tasks += [telegram_one(row) for row in telegram_rows]
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+def _new_stats():
+    return {
+        'email_sent': 0, 'email_failed': 0,
+        'telegram_sent': 0, 'telegram_failed': 0, 'telegram_blocked': 0,
+        'failed_email': [], 'failed_telegram': [],
+    }
+
+
+async def _broadcast_loop(b, telegram, email):
+    """
+    Пачки получателей одна за другой в одном event loop (общий token bucket на всю рассылку).
+    Между пачками - сохранение прогресса. Returns: False, если рассылку отменили.
+    """
+    sample = b.get_failed_sample()
+    while True:
+        db.session.refresh(b)
+        if b.status == 'CANCELLED':
+            print(f"[broadcast] #{b.id} cancelled at {b.processed}/{b.total_recipients}")
+            return False
+
+        rows = recipients_query(b).filter(User.id > b.last_user_id).order_by(User.id).limit(BROADCAST_CHUNK_SIZE).all()
+        if not rows:
+            break
+
+        stats = _new_stats()
+        rate_limited_before = telegram.rate_limited if telegram else 0
+        await _send_chunk(rows, b, telegram, email, stats)
+
+        b.last_user_id = rows[-1].id
+        b.processed += len(rows)
+        b.email_sent += stats['email_sent']
+        b.email_failed += stats['email_failed']
+        b.telegram_sent += stats['telegram_sent']
+        b.telegram_failed += stats['telegram_failed']
+        b.telegram_blocked += stats['telegram_blocked']
+        if telegram:
+            b.rate_limited += telegram.rate_limited - rate_limited_before
+            if telegram.photo_file_id and not b.photo_file_id:
+                b.photo_file_id = telegram.photo_file_id
+                b.photo_data = None
+        sample['email'] = (sample.get('email', []) + stats['failed_email'])[:FAILED_SAMPLE_LIMIT]
+        sample['telegram'] = (sample.get('telegram', []) + stats['failed_telegram'])[:FAILED_SAMPLE_LIMIT]
+        b.failed_sample = json.dumps(sample, ensure_ascii=False)
+        db.session.commit()
+        heartbeat()
+
+    return True
+
+
+def _broadcast_dead(broadcast_id, error):
+    """Задача рассылки ушла в dead-letter: рассылка больше не RUNNING, а FAILED"""
+    b = db.session.get(BroadcastJob, broadcast_id)
+    if not b or b.status not in ('PENDING', 'RUNNING'):
+        return
+    b.status = 'FAILED'
+    b.last_error = error[:1000]
+    b.finished_at = datetime.now(timezone.utc)
+    db.session.commit()
+    print(f"[broadcast] #{b.id} failed at {b.processed}/{b.total_recipients}: {error}")
+
+
+@job_handler('broadcast.send', on_dead=_broadcast_dead)
+def run_broadcast(broadcast_id):
+    """
+    Выполнить (или продолжить) рассылку broadcast_job.id = broadcast_id.
+
+    FAILED не считается окончательным: повтор задачи из dead-letter продолжает рассылку с курсора.
+    """
+    b = db.session.get(BroadcastJob, broadcast_id)
+    if not b or b.status in ('DONE', 'CANCELLED'):
+        return
+
+    telegram = None
+    if b.broadcast_type in ('telegram', 'both'):
+        bot_token = get_broadcast_bot_token(b.bot_type)
+        if not bot_token:
+            b.status = 'FAILED'
+            b.last_error = f"Bot token for {b.bot_type} bot is not configured"
+            b.finished_at = datetime.now(timezone.utc)
+            db.session.commit()
+            return
+        telegram = TelegramSender(bot_token, photo_file_id=b.photo_file_id)
+
+    email = None
+    if b.broadcast_type in ('email', 'both'):
+        from modules.email_utils import get_mail_sender, get_broadcast_html
+        email = {
+            'subject': b.subject,
+            'html': get_broadcast_html(b.subject, b.message),
+            'sender': get_mail_sender(),
+        }
+
+    if b.status != 'RUNNING':
+        b.status = 'RUNNING'
+        b.started_at = b.started_at or datetime.now(timezone.utc)
+        b.finished_at = None
+        b.last_error = None
+    db.session.commit()
+    print(f"[broadcast] #{b.id} started/resumed from user_id>{b.last_user_id} ({b.processed}/{b.total_recipients})")
+
+    if not asyncio.run(_broadcast_loop(b, telegram, email)):
+        return
+
+    b.status = 'DONE'
+    b.finished_at = datetime.now(timezone.utc)
+    db.session.commit()
+    print(f"[broadcast] #{b.id} done: telegram {b.telegram_sent}/{b.telegram_failed}, email {b.email_sent}/{b.email_failed}")
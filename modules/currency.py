@@ -4,6 +4,7 @@
 DEPRECATED: Используйте modules.models.currency напрямую
 """
 from modules.models.currency import CurrencyRate
+from modules.settings_registry import get_currency_rates
 from datetime import datetime
 
 
@@ -19,9 +20,9 @@ DEFAULT_RATES = {
 
 def get_currency_rate(currency):
     """Получить курс валюты к USD (сколько единиц валюты за 1 USD)"""
-    rate = CurrencyRate.query.filter_by(currency=currency.upper()).first()
-    if rate:
-        return rate.rate_to_usd
+    rates = get_currency_rates()
+    if currency.upper() in rates:
+        return rates[currency.upper()]
     return DEFAULT_RATES.get(currency.upper(), 1.0)
 
 
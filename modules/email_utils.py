@@ -6,6 +6,7 @@ from flask import render_template, render_template_string
 
 from modules.models.email_setting import EmailSetting
 from modules.models.branding import BrandingSetting
+from modules.settings_registry import get_settings
 
 
 def get_mail_sender():
@@ -27,7 +28,7 @@ def get_mail_sender():
         es = EmailSetting.query.first()
         if es and es.mail_sender_name and (es.mail_sender_name or "").strip():
             return ((es.mail_sender_name or "").strip(), default_email)
-        b = BrandingSetting.query.first()
+        b = get_settings(BrandingSetting)
         if b and b.site_name and (b.site_name or "").strip():
             return ((b.site_name or "").strip(), default_email)
         return (default_name or "Panel", default_email)
@@ -51,7 +52,7 @@ def get_verification_html(verification_url, service_name=None):
     return render_template(
         'email_verification.html',
         verification_url=verification_url,
-        branding=BrandingSetting.query.first(),
+        branding=get_settings(BrandingSetting),
         service_name=service_name or ""
     )
 
@@ -2,5 +2,6 @@
 Модуль для генерации изображений для бота
 """
 from .tariff_image import generate_tariff_image
+from .render_cache import render_tariff_image, tariff_image_cache, tariff_image_key
 
-__all__ = ['generate_tariff_image']
+__all__ = ['generate_tariff_image', 'render_tariff_image', 'tariff_image_cache', 'tariff_image_key']
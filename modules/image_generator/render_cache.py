@@ -0,0 +1,189 @@
+"""
+Кэш готовых изображений тарифов
+
+Ключ - sha256 от всех данных, которые попадают в изображение (уровень, тарифы, функции,
+валюта, цвет), и версии рендера: одинаковые данные дают тот же PNG, поэтому изображение
+рисуется один раз. Хранится в памяти (LRU, TARIFF_IMAGE_CACHE_MEMORY_MB) и на диске
+(TARIFF_IMAGE_CACHE_DIR, не больше TARIFF_IMAGE_CACHE_DISK_FILES файлов) - переживает
+перезапуск бота. Рендер синхронный (CPU): из асинхронного кода его вызывают в пуле потоков.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .tariff_image import generate_tariff_image, TARIFF_IMAGE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменении внешнего вида: старые файлы кэша перестают совпадать по ключу
+RENDER_VERSION = 2
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TARIFF_IMAGE_CACHE_DIR = os.getenv(
+    'TARIFF_IMAGE_CACHE_DIR', os.path.join(_ROOT, 'instance', 'cache', 'tariff_images')
+)  # пусто - только память
+TARIFF_IMAGE_CACHE_MEMORY_MB = float(os.getenv('TARIFF_IMAGE_CACHE_MEMORY_MB', 32))
+TARIFF_IMAGE_CACHE_DISK_FILES = int(os.getenv('TARIFF_IMAGE_CACHE_DISK_FILES', 500))
+
+PRICE_FIELDS = {"uah": "price_uah", "rub": "price_rub", "usd": "price_usd"}
+
+
+def tariff_image_key(tier_name, tier_icon, features, tariffs, currency, currency_symbol,
+                     primary_color=(63, 105, 255)) -> str:
+    """Ключ кэша для параметров generate_tariff_image"""
+    price_field = PRICE_FIELDS.get(currency, "price_uah")
+    payload = {
+        "v": RENDER_VERSION,
+        "backend": TARIFF_IMAGE_BACKEND,
+        "tier": [tier_name, tier_icon],
+        "features": features or [],
+        # Из тарифа в изображение попадают только название, длительность и цена в валюте
+        "tariffs": [
+            [t.get("name"), t.get("duration_days"), t.get(price_field)]
+            for t in (tariffs or [])
+        ],
+        "currency": [currency, currency_symbol],
+        "color": list(primary_color),
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TariffImageCache:
+    """LRU в памяти + файлы на диске; одновременные запросы одного ключа рисуют изображение один раз"""
+
+    def __init__(self, directory=None, memory_limit=32 * 1024 * 1024, disk_files=500):
+        self.directory = directory or None
+        self.memory_limit = memory_limit
+        self.disk_files = disk_files
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._render_locks = {}
+        self._disk_writes = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'renders': 0}
+
+    # ---------- память ----------
+
+    def get(self, key) -> Optional[bytes]:
+        """Изображение из памяти (без диска и рендера) - можно вызывать из event loop"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+            return data
+
+    def _remember(self, key, data):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_limit and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    # ---------- диск ----------
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _read_disk(self, key) -> Optional[bytes]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # mtime = последнее использование (для вытеснения)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Tariff image cache: disk write failed ({self.directory}): {e}, using memory only")
+            self.directory = None
+            return
+        self._disk_writes += 1
+        if self._disk_writes % 20 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Удалить давно не использованные файлы сверх disk_files"""
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith('.png')]
+        except OSError:
+            return
+        if len(entries) <= self.disk_files:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.disk_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    # ---------- рендер ----------
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._render_locks.get(key)
+            if lock is None:
+                lock = self._render_locks[key] = threading.Lock()
+            return lock
+
+    def get_or_render(self, **params) -> bytes:
+        """PNG для параметров generate_tariff_image: память -> диск -> рендер"""
+        key = tariff_image_key(**params)
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        lock = self._key_lock(key)
+        with lock:
+            data = self.get(key)
+            if data is None:
+                data = self._read_disk(key)
+                if data is not None:
+                    self.stats['disk_hits'] += 1
+                else:
+                    data = generate_tariff_image(**params)
+                    self.stats['renders'] += 1
+                    self._write_disk(key, data)
+                self._remember(key, data)
+        with self._lock:
+            if self._render_locks.get(key) is lock and not lock.locked():
+                del self._render_locks[key]
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+
+
+tariff_image_cache = TariffImageCache(
+    directory=TARIFF_IMAGE_CACHE_DIR,
+    memory_limit=int(TARIFF_IMAGE_CACHE_MEMORY_MB * 1024 * 1024),
+    disk_files=TARIFF_IMAGE_CACHE_DISK_FILES,
+)
+
+
+def render_tariff_image(**params) -> bytes:
+    """generate_tariff_image через общий кэш (синхронно; из asyncio - в пуле потоков)"""
+    return tariff_image_cache.get_or_render(**params)
@@ -1,10 +1,20 @@
 """
 Модуль для генерации изображений тарифов
+
+Два бэкенда рендера (TARIFF_IMAGE_BACKEND):
+- fast (по умолчанию): градиент фона из полосы шириной 1 px, растянутой на всю ширину;
+  тени размываются GaussianBlur только в пределах своей карточки; размеры строк текста
+  кешируются по шрифту; PNG без optimize (zlib по умолчанию).
+- legacy: исходный рендер - для сравнения (бенчмарк в other/tests) и отката.
 """
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
 from io import BytesIO
+from functools import lru_cache
+import os
 import re
 
+TARIFF_IMAGE_BACKEND = os.getenv('TARIFF_IMAGE_BACKEND', 'fast')
+
 
 def remove_emoji(text):
     """Удаляет emoji из текста, так как PIL их не поддерживает"""
@@ -142,30 +152,8 @@ def draw_shadow(img, draw, xy, radius, shadow_color=(0, 0, 0), shadow_opacity=20
     return draw
 
 
-def generate_tariff_image(
-    tier_name: str,
-    tier_icon: str,
-    features: list,
-    tariffs: list,
-    currency: str,
-    currency_symbol: str,
-    primary_color: tuple = (63, 105, 255)  # Синий цвет по умолчанию #3f69ff
-) -> bytes:
-    """
-    Генерирует красивое изображение тарифа
-    
-    Args:
-        tier_name: Название тарифа (например, "Базовый")
-        tier_icon: Иконка тарифа (например, "📦")
-        features: Список функций тарифа
-        tariffs: Список тарифов с ценами
-        currency: Код валюты (uah, rub, usd)
-        currency_symbol: Символ валюты (₴, ₽, $)
-        primary_color: Основной цвет (RGB tuple)
-    
-    Returns:
-        bytes: PNG изображение в виде bytes
-    """
+def _render_legacy(tier_name, tier_icon, features, tariffs, currency, currency_symbol, primary_color):
+    """Исходный рендер: построчный градиент, тени из стопки прямоугольников, PNG с optimize"""
     # Размеры изображения
     width = 1400
     padding = 60
@@ -559,3 +547,229 @@ def generate_tariff_image(
     img.save(output, format='PNG', optimize=True, quality=95)
     output.seek(0)
     return output.getvalue()
+
+
+# ========== БЫСТРЫЙ РЕНДЕР ==========
+
+@lru_cache(maxsize=4096)
+def _text_bbox(font, text):
+    """textbbox строки в координатах (0, 0); шрифты - объекты уровня модуля, по одному на размер"""
+    return font.getbbox(text)
+
+
+def _text_size(font, text):
+    bbox = _text_bbox(font, text)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+
+def _gradient_strip(colors, width):
+    """Изображение из вертикального списка цветов: полоса 1 px растягивается на ширину"""
+    strip = Image.frombytes('RGB', (1, len(colors)), bytes(c for color in colors for c in color))
+    return strip.resize((width, len(colors)), Image.NEAREST)
+
+
+def _paste_shadow(img, xy, radius, offset, blur, opacity, color=(0, 0, 0)):
+    """Мягкая тень карточки: маска и размытие только в прямоугольнике вокруг карточки"""
+    x1, y1, x2, y2 = xy
+    margin = blur * 2
+    mask = Image.new('L', (x2 - x1 + margin * 2, y2 - y1 + margin * 2), 0)
+    ImageDraw.Draw(mask).rounded_rectangle(
+        (margin, margin, margin + x2 - x1, margin + y2 - y1), radius=radius, fill=opacity
+    )
+    mask = mask.filter(ImageFilter.GaussianBlur(blur / 2))
+    img.paste(color, (x1 + offset - margin, y1 + offset - margin), mask)
+
+
+def _render_fast(tier_name, tier_icon, features, tariffs, currency, currency_symbol, primary_color):
+    """Та же раскладка, что в _render_legacy, на быстрых примитивах Pillow"""
+    width = 1400
+    padding = 60
+    card_padding = 40
+    card_spacing = 25
+    corner_radius = 24
+    
+    bg_color = (248, 250, 252)
+    card_bg = (255, 255, 255)
+    text_primary = (15, 23, 42)
+    text_secondary = (100, 116, 139)
+    border_color = (226, 232, 240)
+    
+    header_height = 160
+    features_section_height = (len(features) * 60 + 120) if features else 0
+    tariffs_table_height = 60 + len(tariffs) * 75 + 80
+    total_height = header_height + features_section_height + tariffs_table_height + padding * 2 + card_spacing * 3
+    
+    # Фон: цвета строк считаются один раз, изображение - растяжением полосы
+    colors = []
+    for i in range(total_height):
+        progress = i / total_height
+        alpha = min(0.12, progress * 0.12) + min(0.08, (1 - progress) * 0.08)
+        colors.append(tuple(int(bg_color[j] * (1 - alpha) + primary_color[j] * alpha) for j in range(3)))
+    img = _gradient_strip(colors, width)
+    draw = ImageDraw.Draw(img)
+    
+    def card(top, height, shadow_offset, shadow_blur, shadow_opacity):
+        box = (padding, top, width - padding, top + height)
+        _paste_shadow(img, box, corner_radius, shadow_offset, shadow_blur, shadow_opacity)
+        draw.rounded_rectangle(box, radius=corner_radius, fill=card_bg, outline=border_color, width=1)
+    
+    y = padding
+    
+    # ========== ЗАГОЛОВОК ==========
+    header_card_height = 120
+    card(y, header_card_height, 6, 12, 40)
+    header_text = clean_text_for_image(tier_name)
+    text_width, text_height = _text_size(FONT_BOLD, header_text)
+    x = (width - text_width) // 2
+    y_text = y + (header_card_height - text_height) // 2
+    draw.text((x + 2, y_text + 2), header_text, fill=tuple(c // 3 for c in primary_color), font=FONT_BOLD)
+    draw.text((x, y_text), header_text, fill=primary_color, font=FONT_BOLD)
+    y += header_card_height + card_spacing
+    
+    # ========== ФУНКЦИИ ТАРИФА ==========
+    if features:
+        features_card_height = len(features) * 60 + 100
+        features_y = y
+        card(features_y, features_card_height, 4, 10, 32)
+        draw.text((padding + card_padding, features_y + card_padding), "Включено в тариф:",
+                  fill=text_primary, font=FONT_MEDIUM)
+        
+        feature_y = features_y + card_padding + 55
+        icon_size = 36
+        icon_text = "✓"
+        icon_text_width, icon_text_height = _text_size(FONT_SMALL, icon_text)
+        icon_bg = tuple(int(c * 0.12) for c in primary_color)
+        icon_outline = tuple(int(c * 0.25) for c in primary_color)
+        icon_shadow = tuple(c // 2 for c in primary_color)
+        for feature in features[:5]:
+            if isinstance(feature, dict):
+                feature_name = feature.get("name") or feature.get("title") or feature.get("key", "")
+            elif isinstance(feature, str):
+                feature_name = feature
+            else:
+                continue
+            if not feature_name:
+                continue
+            
+            icon_x = padding + card_padding
+            icon_y = feature_y
+            draw.ellipse([icon_x, icon_y, icon_x + icon_size, icon_y + icon_size],
+                         fill=icon_bg, outline=icon_outline, width=1)
+            text_x = icon_x + (icon_size - icon_text_width) // 2
+            text_y = icon_y + (icon_size - icon_text_height) // 2
+            draw.text((text_x + 1, text_y + 1), icon_text, fill=icon_shadow, font=FONT_SMALL)
+            draw.text((text_x, text_y), icon_text, fill=primary_color, font=FONT_SMALL)
+            draw.text((icon_x + icon_size + 18, feature_y + 8), clean_text_for_image(feature_name),
+                      fill=text_primary, font=FONT_SMALL)
+            feature_y += 60
+        
+        if len(features) > 5:
+            draw.text((padding + card_padding + 45, feature_y), f"... и еще {len(features) - 5} функций",
+                      fill=text_secondary, font=FONT_TINY)
+        
+        y += features_card_height + card_spacing
+    
+    # ========== ТАБЛИЦА ТАРИФОВ ==========
+    draw.text((padding, y), "Выберите длительность:", fill=text_primary, font=FONT_MEDIUM)
+    y += 65
+    
+    # Заголовок таблицы: вертикальный градиент под скруглённой маской
+    table_header_y = y
+    table_header_height = 55
+    header_color_dark = tuple(max(0, int(c * 0.85)) for c in primary_color)
+    header_color_light = tuple(min(255, int(c * 1.1)) for c in primary_color)
+    header_colors = [
+        tuple(int(header_color_dark[j] + (header_color_light[j] - header_color_dark[j]) * i / (table_header_height - 1))
+              for j in range(3))
+        for i in range(table_header_height)
+    ]
+    header_box = (padding, table_header_y, width - padding, table_header_y + table_header_height)
+    header_mask = Image.new('L', (header_box[2] - header_box[0], table_header_height), 0)
+    ImageDraw.Draw(header_mask).rounded_rectangle(
+        (0, 0, header_mask.width - 1, table_header_height - 1), radius=corner_radius, fill=255
+    )
+    img.paste(_gradient_strip(header_colors, header_mask.width), header_box[:2], header_mask)
+    draw.line([(padding, table_header_y + table_header_height), (width - padding, table_header_y + table_header_height)],
+              fill=tuple(int(c * 0.7) for c in primary_color), width=1)
+    
+    col_widths = [300, 200, 220, 200, 200]
+    col_labels = ["Тариф", "Цена", "Цена/день", "Длительность", ""]
+    col_x = padding + card_padding
+    for label, col_w in zip(col_labels, col_widths):
+        if label:
+            label_height = _text_size(FONT_MEDIUM, label)[1]
+            draw.text((col_x, table_header_y + (table_header_height - label_height) // 2), label,
+                      fill=(255, 255, 255), font=FONT_MEDIUM)
+        col_x += col_w
+    
+    y += table_header_height + 12
+    
+    total_rows = len(tariffs)
+    row_height = 75
+    draw.rounded_rectangle((padding, y, width - padding, y + total_rows * row_height),
+                           radius=corner_radius, fill=card_bg, outline=border_color, width=1)
+    
+    price_field = {"uah": "price_uah", "rub": "price_rub", "usd": "price_usd"}.get(currency, "price_uah")
+    for idx, tariff in enumerate(tariffs):
+        name = clean_text_for_image(tariff.get("name", f"{tariff.get('duration_days', 0)} дней"))
+        price = tariff.get(price_field, 0)
+        duration = tariff.get("duration_days", 0)
+        per_day = price / duration if duration > 0 else price
+        row_y = y
+        
+        if idx % 2 == 1:
+            draw.rectangle([padding + 1, row_y, width - padding - 1, row_y + row_height], fill=(250, 252, 255))
+        if idx < total_rows - 1:
+            draw.line([(padding + card_padding, row_y + row_height), (width - padding - card_padding, row_y + row_height)],
+                      fill=border_color, width=1)
+        
+        col_x = padding + card_padding
+        for text, font, fill, col_w in (
+            (name, FONT_SMALL, text_primary, col_widths[0]),
+            (f"{price:.0f} {currency_symbol}", FONT_SMALL, primary_color, col_widths[1]),
+            (f"{per_day:.2f} {currency_symbol}/день", FONT_TINY, text_secondary, col_widths[2]),
+            (f"{duration} дней", FONT_TINY, text_secondary, col_widths[3]),
+        ):
+            text_height = _text_size(font, text)[1]
+            draw.text((col_x, row_y + (row_height - text_height) // 2), text, fill=fill, font=font)
+            col_x += col_w
+        
+        y += row_height
+    
+    # optimize=True втрое замедляет кодирование ради ~2% размера
+    output = BytesIO()
+    img.save(output, format='PNG')
+    return output.getvalue()
+
+
+_BACKENDS = {'fast': _render_fast, 'legacy': _render_legacy}
+
+
+def generate_tariff_image(
+    tier_name: str,
+    tier_icon: str,
+    features: list,
+    tariffs: list,
+    currency: str,
+    currency_symbol: str,
+    primary_color: tuple = (63, 105, 255),  # Синий цвет по умолчанию #3f69ff
+    backend: str = None
+) -> bytes:
+    """
+    Генерирует красивое изображение тарифа
+    
+    Args:
+        tier_name: Название тарифа (например, "Базовый")
+        tier_icon: Иконка тарифа (например, "📦")
+        features: Список функций тарифа
+        tariffs: Список тарифов с ценами
+        currency: Код валюты (uah, rub, usd)
+        currency_symbol: Символ валюты (₴, ₽, $)
+        primary_color: Основной цвет (RGB tuple)
+        backend: fast или legacy (по умолчанию TARIFF_IMAGE_BACKEND)
+    
+    Returns:
+        bytes: PNG изображение в виде bytes
+    """
+    render = _BACKENDS.get(backend or TARIFF_IMAGE_BACKEND, _render_fast)
+    return render(tier_name, tier_icon, features or [], tariffs or [], currency, currency_symbol, tuple(primary_color))
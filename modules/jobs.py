@@ -0,0 +1,253 @@
+"""
+Фоновая очередь задач в БД (таблица background_job)
+
+- enqueue(kind, payload, dedupe_key=...) - поставить задачу (в текущей транзакции, commit делает вызывающий код)
+- @job_handler('kind') - зарегистрировать обработчик; исключение в обработчике = повтор с задержкой,
+  после max_attempts задача уходит в dead-letter (status='DEAD') и вызывается on_dead(error=..., **payload)
+- run_pending_jobs() / start_job_workers() - выполнение задач (потоки в веб-процессе или run_job_worker.py)
+- heartbeat() - продлить захват из долгого обработчика (рассылки и т.п.)
+
+Захват задачи - условный UPDATE ... WHERE status='PENDING' (работает одинаково в PostgreSQL и SQLite),
+поэтому одну задачу не выполнят два воркера, даже в разных процессах.
+"""
+import os
+import json
+import time
+import socket
+import threading
+import traceback
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from modules.core import get_db
+from modules.models.job import BackgroundJob
+
+db = get_db()
+
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+JOB_BACKOFF_BASE = int(os.getenv('JOB_BACKOFF_BASE', 30))  # сек, растёт как base * 2^(attempt-1)
+JOB_BACKOFF_MAX = int(os.getenv('JOB_BACKOFF_MAX', 3600))
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 600))  # RUNNING дольше - воркер считается упавшим
+
+_handlers = {}
+_dead_handlers = {}
+_workers_started = False
+_current = threading.local()  # Задача, выполняемая текущим потоком (для heartbeat)
+
+
+def _utcnow():
+    # Колонки DateTime без таймзоны: храним naive UTC, как и остальные модели
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def job_handler(kind, on_dead=None):
+    """
+    Декоратор: обработчик задач типа kind, вызывается как handler(**payload).
+
+    on_dead(error=..., **payload) - вызывается, когда задача исчерпала попытки (например, чтобы
+    пометить связанную запись как FAILED).
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        if on_dead:
+            _dead_handlers[kind] = on_dead
+        return func
+    return decorator
+
+
+def _notify_dead(job, error):
+    on_dead = _dead_handlers.get(job.kind)
+    if not on_dead:
+        return
+    try:
+        on_dead(error=error, **job.get_payload())
+    except Exception as e:
+        db.session.rollback()
+        print(f"[jobs] ⚠️ Dead-letter handler for job {job.id} ({job.kind}) failed: {e}")
+
+
+def enqueue(kind, payload=None, dedupe_key=None, max_attempts=5, delay=0):
+    """
+    Добавить задачу в сессию (без commit).
+
+    Если задача с таким dedupe_key уже есть - возвращает существующую.
+    """
+    if dedupe_key:
+        existing = BackgroundJob.query.filter_by(dedupe_key=dedupe_key).first()
+        if existing:
+            return existing
+    job = BackgroundJob(
+        kind=kind,
+        payload=json.dumps(payload or {}, ensure_ascii=False, default=str),
+        dedupe_key=dedupe_key,
+        max_attempts=max_attempts,
+        run_after=_utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(job)
+    try:
+        # flush внутри savepoint: гонка двух запросов с одинаковым dedupe_key не ломает транзакцию
+        with db.session.begin_nested():
+            db.session.flush()
+    except IntegrityError:
+        existing = BackgroundJob.query.filter_by(dedupe_key=dedupe_key).first()
+        if existing:
+            return existing
+        raise
+    return job
+
+
+def _backoff(attempts):
+    return min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+
+
+def _release_stale_jobs():
+    """Вернуть в очередь задачи, захваченные упавшими воркерами"""
+    cutoff = _utcnow() - timedelta(seconds=JOB_STALE_AFTER)
+    db.session.query(BackgroundJob).filter(
+        BackgroundJob.status == 'RUNNING',
+        BackgroundJob.locked_at < cutoff
+    ).update({'status': 'PENDING', 'locked_by': None, 'locked_at': None}, synchronize_session=False)
+    db.session.commit()
+
+
+def _claim_next(worker_id, kinds=None):
+    """Захватить одну готовую задачу. Возвращает BackgroundJob или None."""
+    query = db.session.query(BackgroundJob.id).filter(
+        BackgroundJob.status == 'PENDING',
+        BackgroundJob.run_after <= _utcnow()
+    )
+    if kinds:
+        query = query.filter(BackgroundJob.kind.in_(kinds))
+    candidates = [row[0] for row in query.order_by(BackgroundJob.run_after, BackgroundJob.id).limit(10)]
+
+    for job_id in candidates:
+        claimed = db.session.query(BackgroundJob).filter(
+            BackgroundJob.id == job_id,
+            BackgroundJob.status == 'PENDING'
+        ).update({
+            'status': 'RUNNING',
+            'locked_by': worker_id,
+            'locked_at': _utcnow(),
+            'attempts': BackgroundJob.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(BackgroundJob, job_id)
+    return None
+
+
+def heartbeat():
+    """
+    Продлить захват текущей задачи.
+
+    Долгий обработчик должен вызывать это хотя бы раз в JOB_STALE_AFTER секунд,
+    иначе задачу посчитают брошенной и её заберёт другой воркер. Делает commit.
+    """
+    job_id = getattr(_current, 'job_id', None)
+    if not job_id:
+        return
+    db.session.query(BackgroundJob).filter(
+        BackgroundJob.id == job_id,
+        BackgroundJob.status == 'RUNNING'
+    ).update({'locked_at': _utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+
+def _execute(job):
+    handler = _handlers.get(job.kind)
+    _current.job_id = job.id
+    try:
+        if handler is None:
+            raise RuntimeError(f"No handler registered for job kind '{job.kind}'")
+        handler(**job.get_payload())
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(BackgroundJob, job.id)
+        job.last_error = f"{type(e).__name__}: {e}\n{traceback.format_exc()[-2000:]}"
+        job.locked_by = None
+        job.locked_at = None
+        dead = job.attempts >= job.max_attempts
+        if dead:
+            job.status = 'DEAD'
+            print(f"[jobs] ❌ Job {job.id} ({job.kind}) moved to dead-letter after {job.attempts} attempts: {e}")
+        else:
+            job.status = 'PENDING'
+            job.run_after = _utcnow() + timedelta(seconds=_backoff(job.attempts))
+            print(f"[jobs] ⚠️ Job {job.id} ({job.kind}) failed (attempt {job.attempts}/{job.max_attempts}): {e}")
+        db.session.commit()
+        if dead:
+            _notify_dead(job, f"{type(e).__name__}: {e}")
+        return False
+    finally:
+        _current.job_id = None
+
+    job = db.session.get(BackgroundJob, job.id)
+    job.status = 'DONE'
+    job.last_error = None
+    job.locked_by = None
+    job.locked_at = None
+    db.session.commit()
+    return True
+
+
+def run_pending_jobs(worker_id=None, limit=None, kinds=None):
+    """Выполнить готовые задачи (нужен app context). Возвращает количество выполненных."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    done = 0
+    while limit is None or done < limit:
+        job = _claim_next(worker_id, kinds)
+        if job is None:
+            break
+        _execute(job)
+        done += 1
+    return done
+
+
+def retry_job(job_id):
+    """Вернуть задачу (обычно DEAD) в очередь для немедленного выполнения"""
+    job = db.session.get(BackgroundJob, job_id)
+    if not job:
+        return None
+    job.status = 'PENDING'
+    job.attempts = 0
+    job.run_after = _utcnow()
+    job.locked_by = None
+    job.locked_at = None
+    db.session.commit()
+    return job
+
+
+def worker_loop(app, stop_event=None, kinds=None):
+    """Бесконечный цикл воркера (для потоков и run_job_worker.py)"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    last_stale_check = 0.0
+    while not (stop_event and stop_event.is_set()):
+        processed = 0
+        try:
+            with app.app_context():
+                if time.time() - last_stale_check > 60:
+                    _release_stale_jobs()
+                    last_stale_check = time.time()
+                processed = run_pending_jobs(worker_id, limit=50, kinds=kinds)
+        except Exception as e:
+            print(f"[jobs] Worker error: {e}")
+        if not processed:
+            time.sleep(JOB_POLL_INTERVAL)
+
+
+def start_job_workers(threads=None):
+    """Запустить потоки-воркеры в текущем процессе (JOB_WORKER_THREADS, 0 - не запускать)"""
+    global _workers_started
+    if _workers_started:
+        return
+    threads = int(os.getenv('JOB_WORKER_THREADS', 2)) if threads is None else threads
+    if threads <= 0:
+        return
+    _workers_started = True
+
+    from modules.core import get_app
+    app = get_app()
+    for i in range(threads):
+        thread = threading.Thread(target=worker_loop, args=(app,), daemon=True, name=f'job-worker-{i}')
+        thread.start()
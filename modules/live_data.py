@@ -0,0 +1,121 @@
+"""
+Кэш live_data_{uuid} (данные пользователя RemnaWave) в режиме stale-while-revalidate
+
+- live_data_{uuid}        - сама запись, живёт LIVE_DATA_STALE_TTL (по умолчанию час)
+- live_data_fresh_{uuid}  - маркер свежести, живёт LIVE_DATA_TTL (как раньше, 5 минут)
+- live_data_refresh_{uuid} - блокировка фонового обновления (одно обновление на UUID на все воркеры)
+
+Пока маркер жив - запись отдаётся как есть. Когда маркер истёк, запись всё равно отдаётся сразу,
+а обновление уходит в фоновый пул. cache.delete('live_data_{uuid}') (после оплаты/правки)
+по-прежнему означает "данных нет" - следующий запрос получит их синхронно.
+
+Синхронные запросы к RemnaWave за одним и тем же UUID внутри процесса объединяются (single-flight).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from flask import current_app, has_app_context
+
+from modules.core import get_cache
+from modules.remnawave import remnawave
+from modules.remnawave_snapshot import update_live_user
+
+LIVE_DATA_TTL = int(os.getenv('LIVE_DATA_TTL', 300))
+LIVE_DATA_STALE_TTL = int(os.getenv('LIVE_DATA_STALE_TTL', 3600))
+REFRESH_LOCK_TTL = 30
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('LIVE_DATA_REFRESH_WORKERS', 4)),
+                               thread_name_prefix='live-data')
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _key(uuid):
+    return f'live_data_{uuid}'
+
+
+def store_live_data(uuid, data):
+    """Сохранить запись пользователя и отметить её свежей"""
+    cache = get_cache()
+    cache.set(_key(uuid), data, timeout=LIVE_DATA_STALE_TTL)
+    cache.set(f'live_data_fresh_{uuid}', 1, timeout=LIVE_DATA_TTL)
+
+
+def fetch_live_user(uuid):
+    """
+    GET /api/users/{uuid} с объединением одновременных запросов за один UUID.
+    Возвращает requests.Response (общий для всех ожидающих) или пробрасывает исключение.
+    """
+    with _inflight_lock:
+        future = _inflight.get(uuid)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[uuid] = future
+
+    if not owner:
+        return future.result()
+
+    try:
+        resp = remnawave.get(f"/api/users/{uuid}", timeout=10)
+        future.set_result(resp)
+        return resp
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(uuid, None)
+
+
+def _refresh(app, uuid):
+    with app.app_context():
+        cache = get_cache()
+        try:
+            resp = fetch_live_user(uuid)
+            if resp.status_code == 200:
+                payload = resp.json()
+                data = payload.get('response', payload) if isinstance(payload, dict) else None
+                if isinstance(data, dict):
+                    store_live_data(uuid, data)
+                    update_live_user(dict(data))
+        except Exception as e:
+            print(f"[live_data] Background refresh failed for {uuid}: {e}")
+        finally:
+            cache.delete(f'live_data_refresh_{uuid}')
+
+
+def schedule_refresh(uuid):
+    """Обновить запись в фоне (если её уже не обновляет другой запрос/воркер)"""
+    if not uuid or not has_app_context() or not remnawave.base_url:
+        return False
+    cache = get_cache()
+    try:
+        if not cache.add(f'live_data_refresh_{uuid}', 1, timeout=REFRESH_LOCK_TTL):
+            return False
+    except Exception:
+        pass
+    with _inflight_lock:
+        if uuid in _inflight:
+            return False
+    _executor.submit(_refresh, current_app._get_current_object(), uuid)
+    return True
+
+
+def get_cached_live_data(uuid, revalidate=False):
+    """
+    Запись из кэша без ожидания RemnaWave.
+
+    Если запись устарела (или revalidate=True) - запускает фоновое обновление и всё равно возвращает её.
+    Returns: dict или None (данных нет - нужен синхронный запрос).
+    """
+    if not uuid:
+        return None
+    cache = get_cache()
+    data = cache.get(_key(uuid))
+    if not data:
+        return None
+    if revalidate or not cache.get(f'live_data_fresh_{uuid}'):
+        schedule_refresh(uuid)
+    return data
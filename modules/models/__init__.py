@@ -22,6 +22,9 @@ from modules.models.trial import TrialSettings
 from modules.models.user_config import UserConfig
 from modules.models.config_share import ConfigShareToken
 from modules.models.email_setting import EmailSetting
+from modules.models.analytics import AnalyticsDailyRollup
+from modules.models.job import BackgroundJob, WebhookEvent
+from modules.models.broadcast import BroadcastJob
 
 __all__ = [
     'User',
@@ -40,5 +43,8 @@ __all__ = [
     'TrialSettings',
     'UserConfig',
     'ConfigShareToken',
-    'EmailSetting'
+    'EmailSetting',
+    'AnalyticsDailyRollup',
+    'BackgroundJob', 'WebhookEvent',
+    'BroadcastJob'
 ]
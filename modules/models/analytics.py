@@ -0,0 +1,33 @@
+"""
+Модель дневных агрегатов для аналитики админки
+"""
+from datetime import datetime, timezone
+from modules.core import get_db
+
+db = get_db()
+
+
+class AnalyticsDailyRollup(db.Model):
+    """
+    Дневной агрегат по (дата, валюта, провайдер).
+
+    Строки с currency='' и provider='' хранят метрики, не привязанные к платежам:
+    регистрации, созданные конфиги, пользователи с Telegram.
+    """
+    __tablename__ = 'analytics_daily_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'currency', 'provider', name='uq_analytics_rollup_day_currency_provider'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    currency = db.Column(db.String(5), nullable=False, default='')
+    provider = db.Column(db.String(20), nullable=False, default='')
+
+    revenue = db.Column(db.Float, nullable=False, default=0.0)  # Сумма PAID-платежей в валюте currency
+    payments_count = db.Column(db.Integer, nullable=False, default=0)  # Количество PAID-платежей
+    registrations = db.Column(db.Integer, nullable=False, default=0)  # Новые клиенты (role=CLIENT)
+    configs_created = db.Column(db.Integer, nullable=False, default=0)  # Созданные UserConfig
+    telegram_users = db.Column(db.Integer, nullable=False, default=0)  # Новые клиенты с привязанным Telegram
+
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
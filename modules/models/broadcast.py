@@ -0,0 +1,95 @@
+"""
+Модель ручной рассылки (/api/admin/broadcast), выполняемой фоновым воркером
+"""
+import json
+from datetime import datetime, timezone
+from modules.core import get_db
+
+db = get_db()
+
+
+class BroadcastJob(db.Model):
+    """
+    Рассылка email/Telegram.
+
+    Прогресс (last_user_id и счётчики) сохраняется после каждой пачки получателей,
+    поэтому прерванная рассылка продолжается с места остановки без повторных отправок.
+    Статусы: PENDING -> RUNNING -> DONE / CANCELLED / FAILED.
+    """
+    __tablename__ = 'broadcast_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='PENDING')
+    broadcast_type = db.Column(db.String(10), nullable=False, default='email')  # 'email', 'telegram', 'both'
+    bot_type = db.Column(db.String(10), nullable=False, default='old')  # 'old', 'new'
+    recipient_type = db.Column(db.String(20), nullable=False, default='all')  # 'all', 'active', 'inactive', 'custom'
+    custom_emails = db.Column(db.Text, nullable=True)  # JSON массив для recipient_type='custom'
+    subject = db.Column(db.String(255), nullable=True)
+    message = db.Column(db.Text, nullable=False)
+    pin_message = db.Column(db.Boolean, default=False, nullable=False)
+    photo_data = db.Column(db.LargeBinary, nullable=True)  # Загруженное фото (до первой успешной отправки)
+    photo_filename = db.Column(db.String(255), nullable=True)
+    photo_file_id = db.Column(db.String(255), nullable=True)  # file_id Telegram - фото загружается один раз
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+
+    # Прогресс
+    total_recipients = db.Column(db.Integer, default=0, nullable=False)
+    processed = db.Column(db.Integer, default=0, nullable=False)
+    last_user_id = db.Column(db.Integer, default=0, nullable=False)  # Курсор: обработаны все User.id <= last_user_id
+    email_sent = db.Column(db.Integer, default=0, nullable=False)
+    email_failed = db.Column(db.Integer, default=0, nullable=False)
+    telegram_sent = db.Column(db.Integer, default=0, nullable=False)
+    telegram_failed = db.Column(db.Integer, default=0, nullable=False)
+    telegram_blocked = db.Column(db.Integer, default=0, nullable=False)  # 403: бот заблокирован / чат удалён
+    rate_limited = db.Column(db.Integer, default=0, nullable=False)  # Сколько раз получили 429 (retry_after)
+    failed_sample = db.Column(db.Text, nullable=True)  # JSON: первые ошибки для отображения в админке
+    last_error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def get_custom_emails(self):
+        try:
+            return json.loads(self.custom_emails) if self.custom_emails else []
+        except Exception:
+            return []
+
+    def get_failed_sample(self):
+        try:
+            return json.loads(self.failed_sample) if self.failed_sample else {'email': [], 'telegram': []}
+        except Exception:
+            return {'email': [], 'telegram': []}
+
+    def to_dict(self):
+        sample = self.get_failed_sample()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'broadcast_type': self.broadcast_type,
+            'bot_type': self.bot_type,
+            'recipient_type': self.recipient_type,
+            'subject': self.subject,
+            'has_photo': bool(self.photo_data or self.photo_file_id),
+            'pin_message': self.pin_message,
+            'total_recipients': self.total_recipients,
+            'processed': self.processed,
+            'progress': round(self.processed / self.total_recipients * 100, 1) if self.total_recipients else 0,
+            'email': {
+                'sent': self.email_sent,
+                'failed': self.email_failed,
+                'failed_emails': sample.get('email', [])[:10],
+            },
+            'telegram': {
+                'sent': self.telegram_sent,
+                'failed': self.telegram_failed,
+                'blocked': self.telegram_blocked,
+                'rate_limited': self.rate_limited,
+                'failed_users': sample.get('telegram', [])[:10],
+            },
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
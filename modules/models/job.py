@@ -0,0 +1,90 @@
+"""
+Модели фоновой очереди задач и журнала входящих webhook-событий
+"""
+import json
+from datetime import datetime, timezone
+from modules.core import get_db
+
+db = get_db()
+
+
+class BackgroundJob(db.Model):
+    """
+    Задача фоновой очереди (хранится в БД, переживает перезапуск).
+
+    Статусы: PENDING -> RUNNING -> DONE, при ошибке снова PENDING (с задержкой run_after),
+    после max_attempts неудачных попыток - DEAD (dead-letter, видно в /api/admin/jobs).
+    """
+    __tablename__ = 'background_job'
+    __table_args__ = (
+        db.Index('ix_background_job_status_run_after', 'status', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # Тип задачи (имя обработчика), напр. 'payment.process'
+    payload = db.Column(db.Text, nullable=True)  # JSON с аргументами
+    dedupe_key = db.Column(db.String(150), unique=True, nullable=True)  # Не ставить одну и ту же задачу дважды
+    status = db.Column(db.String(20), nullable=False, default='PENDING')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def get_payload(self):
+        try:
+            return json.loads(self.payload) if self.payload else {}
+        except Exception:
+            return {}
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'payload': self.get_payload(),
+            'dedupe_key': self.dedupe_key,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': self.run_after.isoformat() if self.run_after else None,
+            'locked_by': self.locked_by,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class WebhookEvent(db.Model):
+    """
+    Журнал webhook-событий платёжных систем.
+
+    Уникальность (provider, order_id, event_type) делает приём идемпотентным:
+    повторная доставка того же события только подтверждается, повторно не обрабатывается.
+    """
+    __tablename__ = 'webhook_event'
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'order_id', 'event_type', name='uq_webhook_event_provider_order_type'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(30), nullable=False)
+    order_id = db.Column(db.String(100), nullable=False)
+    event_type = db.Column(db.String(30), nullable=False, default='paid')
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), nullable=True, index=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('background_job.id'), nullable=True)
+    payload = db.Column(db.Text, nullable=True)  # Тело запроса (для разбора инцидентов)
+    received_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'provider': self.provider,
+            'order_id': self.order_id,
+            'event_type': self.event_type,
+            'payment_id': self.payment_id,
+            'job_id': self.job_id,
+            'received_at': self.received_at.isoformat() if self.received_at else None,
+        }
@@ -74,6 +74,11 @@ class PaymentSetting(db.Model):
 
 class Payment(db.Model):
     """Платёж"""
+    __table_args__ = (
+        db.Index('ix_payment_user_id_created_at', 'user_id', 'created_at'),  # История и последний PENDING пользователя
+        db.Index('ix_payment_status_created_at', 'status', 'created_at'),  # Статистика/аналитика по PAID за период
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(100), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -89,6 +94,7 @@ class Payment(db.Model):
     user_config_id = db.Column(db.Integer, db.ForeignKey('user_config.id'), nullable=True)  # Конфиг, для которого создан платеж
     create_new_config = db.Column(db.Boolean, default=False, nullable=False)  # Флаг создания нового конфига после оплаты
     description = db.Column(db.Text, nullable=True)  # Служебное описание (например OPTION:{option_id})
+    remnawave_applied_at = db.Column(db.DateTime, nullable=True)  # Подписка продлена в RemnaWave (повтор задачи оплаты не продлевает второй раз)
 
 
 def decrypt_key(key):
@@ -8,6 +8,10 @@ db = get_db()
 
 class Ticket(db.Model):
     """Тикет поддержки"""
+    __table_args__ = (
+        db.Index('ix_ticket_user_id', 'user_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user = db.relationship('User', backref=db.backref('tickets', lazy=True))
@@ -18,6 +22,10 @@ class Ticket(db.Model):
 
 class TicketMessage(db.Model):
     """Сообщение в тикете"""
+    __table_args__ = (
+        db.Index('ix_ticket_message_ticket_id', 'ticket_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
     ticket = db.relationship('Ticket', backref=db.backref('messages', lazy=True))
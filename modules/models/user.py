@@ -3,13 +3,17 @@
 """
 from datetime import datetime, timezone
 from modules.core import get_db
+from modules.remnawave import remnawave
 from sqlalchemy import event
-import os
-import requests
 
 db = get_db()
 
 class User(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_referrer_id', 'referrer_id'),  # Рефералы пользователя
+        db.Index('ix_user_role_created_at', 'role', 'created_at'),  # Списки/статистика клиентов по дате регистрации
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=True)
     password_hash = db.Column(db.String(128), nullable=True)
@@ -41,10 +45,6 @@ class User(db.Model):
 
 
 # Автоматическая синхронизация telegramId в RemnaWave при изменении telegram_id
-from sqlalchemy import event
-import os
-import requests
-
 @event.listens_for(User, 'after_update')
 def sync_telegram_id_to_remnawave(mapper, connection, target):
     """Автоматически синхронизирует telegramId в RemnaWave при изменении telegram_id"""
@@ -57,14 +57,9 @@ def sync_telegram_id_to_remnawave(mapper, connection, target):
         # Если значение изменилось, обновляем в RemnaWave
         if old_value != new_value:
             try:
-                API_URL = os.getenv('API_URL')
-                ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
-                
-                if API_URL and ADMIN_TOKEN:
-                    headers = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
-                    requests.patch(
-                        f"{API_URL}/api/users",
-                        headers=headers,
+                if remnawave.configured:
+                    remnawave.patch(
+                        "/api/users",
                         json={"uuid": target.remnawave_uuid, "telegramId": str(new_value) if new_value else None},
                         timeout=10
                     )
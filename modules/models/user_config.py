@@ -10,6 +10,9 @@ db = get_db()
 class UserConfig(db.Model):
     """Конфиг пользователя - связь с аккаунтом в Remna"""
     __tablename__ = 'user_config'
+    __table_args__ = (
+        db.Index('ix_user_config_user_id_is_primary', 'user_id', 'is_primary'),  # Основной конфиг пользователя
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -0,0 +1,244 @@
+"""
+Фоновая сверка зависших оплат (если webhook не пришёл)
+
+Поток раз в PAYMENT_RECONCILE_INTERVAL секунд обходит PENDING-платежи за последние
+PAYMENT_RECONCILE_WINDOW_HOURS часов пачками по PAYMENT_RECONCILE_BATCH_SIZE и параллельно
+запрашивает их статус у платёжных систем (fetch_status реестра провайдеров), не более
+PAYMENT_RECONCILE_PROVIDER_CONCURRENCY запросов к одному провайдеру одновременно.
+Подтверждённые оплаты проводятся тем же путём, что и webhook: accept_payment_event -> очередь payment.process.
+
+Свежие платежи проверяются на каждом проходе, старые - реже. Между процессами проход
+координируется блокировкой в кэше (как обновление снимка RemnaWave).
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+from modules.core import get_db, get_cache
+from modules.models.payment import Payment
+from modules.api.payments import get_providers, fetch_payment_status
+from modules.api.payments.registry import STATUS_PAID, STATUS_FAILED
+
+db = get_db()
+
+PAYMENT_RECONCILE_INTERVAL = float(os.getenv('PAYMENT_RECONCILE_INTERVAL', 20))  # 0 - не запускать
+PAYMENT_RECONCILE_WINDOW_HOURS = float(os.getenv('PAYMENT_RECONCILE_WINDOW_HOURS', 6))
+PAYMENT_RECONCILE_BATCH_SIZE = int(os.getenv('PAYMENT_RECONCILE_BATCH_SIZE', 100))
+PAYMENT_RECONCILE_WORKERS = int(os.getenv('PAYMENT_RECONCILE_WORKERS', 8))
+PAYMENT_RECONCILE_PROVIDER_CONCURRENCY = int(os.getenv('PAYMENT_RECONCILE_PROVIDER_CONCURRENCY', 4))
+
+LOCK_KEY = 'payment_reconcile:lock'
+
+# Интервал повторной проверки в зависимости от возраста платежа: (возраст до, сек) -> пауза, сек
+RECHECK_SCHEDULE = (
+    (15 * 60, 0),  # первые 15 минут - на каждом проходе
+    (2 * 3600, 120),
+    (None, 600),
+)
+
+# Пауза перед повторной проверкой платежа, уже поставленного в очередь payment.process, сек
+QUEUED_RECHECK_DELAY = 300
+
+# Провайдеры с общим API (и общим лимитом одновременных запросов)
+_LIMIT_GROUPS = {'platega_mir': 'platega'}
+
+_next_check = {}  # payment_id -> time.monotonic(), раньше которого платёж не проверяем
+_semaphores = {}
+_executor = None
+_last_run = {}
+_lock = threading.Lock()
+_reconciler_started = False
+
+
+def _utcnow():
+    # Колонки DateTime без таймзоны: храним naive UTC, как и остальные модели
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _recheck_delay(created_at, now):
+    age = (now - created_at).total_seconds() if created_at else 0
+    for max_age, delay in RECHECK_SCHEDULE:
+        if max_age is None or age < max_age:
+            return delay
+    return RECHECK_SCHEDULE[-1][1]
+
+
+def _semaphore(provider):
+    group = _LIMIT_GROUPS.get(provider, provider)
+    semaphore = _semaphores.get(group)
+    if semaphore is None:
+        with _lock:
+            semaphore = _semaphores.setdefault(group, threading.BoundedSemaphore(PAYMENT_RECONCILE_PROVIDER_CONCURRENCY))
+    return semaphore
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PAYMENT_RECONCILE_WORKERS,
+                                               thread_name_prefix='payment-reconcile')
+    return _executor
+
+
+def _fetch_status(app, provider, payment_system_id):
+    """Запрос статуса в потоке пула (свой app context -> своя сессия БД для чтения настроек)"""
+    with _semaphore(provider):
+        with app.app_context():
+            return fetch_payment_status(provider, payment_system_id)
+
+
+def _supported_providers():
+    return [name for name, provider in get_providers().items() if provider.supports_status]
+
+
+def _due_batches(providers, now_utc):
+    """Пачки (id, provider, payment_system_id, created_at) PENDING-платежей, которые пора проверить"""
+    cutoff = now_utc - timedelta(hours=PAYMENT_RECONCILE_WINDOW_HOURS)
+    now = time.monotonic()
+    seen = set()
+    last_id = None
+    while True:
+        query = db.session.query(
+            Payment.id, Payment.payment_provider, Payment.payment_system_id, Payment.created_at
+        ).filter(
+            Payment.status == 'PENDING',
+            Payment.created_at >= cutoff,
+            Payment.payment_provider.in_(providers),
+            Payment.payment_system_id.isnot(None),
+        )
+        if last_id is not None:
+            query = query.filter(Payment.id < last_id)
+        rows = query.order_by(Payment.id.desc()).limit(PAYMENT_RECONCILE_BATCH_SIZE).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        seen.update(row[0] for row in rows)
+        batch = [row for row in rows if _next_check.get(row[0], 0) <= now]
+        if batch:
+            yield batch
+        if len(rows) < PAYMENT_RECONCILE_BATCH_SIZE:
+            break
+
+    # Забываем платежи, которые вышли из окна или уже не PENDING
+    for payment_id in list(_next_check):
+        if payment_id not in seen:
+            _next_check.pop(payment_id, None)
+
+
+def _finalize(payment_id, provider, status):
+    """Провести подтверждённую оплату через очередь (как webhook)"""
+    from modules.api.webhooks.routes import accept_payment_event
+
+    payment = db.session.get(Payment, payment_id)
+    if not payment or payment.status != 'PENDING':
+        return False
+    return accept_payment_event(provider, payment, event_type='paid',
+                                payload={'source': 'reconcile', 'status': status})
+
+
+def reconcile_pending_payments(app=None):
+    """
+    Один проход сверки (нужен app context). Возвращает счётчики прохода.
+    """
+    if app is None:
+        from modules.core import get_app
+        app = get_app()
+
+    started = time.perf_counter()
+    stats = {'checked': 0, 'paid': 0, 'failed': 0, 'unknown': 0}
+    providers = _supported_providers()
+    if not providers:
+        return stats
+
+    now_utc = _utcnow()
+    executor = _get_executor()
+    for batch in _due_batches(providers, now_utc):
+        futures = [
+            (row, executor.submit(_fetch_status, app, row[1], row[2]))
+            for row in batch
+        ]
+        for (payment_id, provider, _system_id, created_at), future in futures:
+            try:
+                status = future.result()
+            except Exception as e:
+                print(f"[reconcile] Status check failed for payment {payment_id} ({provider}): {e}")
+                status = None
+            stats['checked'] += 1
+            now = time.monotonic()
+
+            if status == STATUS_PAID:
+                try:
+                    if _finalize(payment_id, provider, status):
+                        stats['paid'] += 1
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[reconcile] Failed to queue payment {payment_id}: {e}")
+                    continue
+                # До проведения очередью платёж остаётся PENDING - не ставим его повторно
+                _next_check[payment_id] = now + QUEUED_RECHECK_DELAY
+            elif status == STATUS_FAILED:
+                # Отменённый/просроченный счёт больше не опрашиваем (статус в БД не меняем)
+                stats['failed'] += 1
+                _next_check[payment_id] = float('inf')
+            else:
+                if status is None:
+                    stats['unknown'] += 1
+                _next_check[payment_id] = now + _recheck_delay(created_at, now_utc)
+
+    stats['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    _last_run.clear()
+    _last_run.update(stats, finished_at=time.time())
+    if stats['paid']:
+        print(f"[reconcile] Queued {stats['paid']} confirmed payment(s), checked {stats['checked']}")
+    return stats
+
+
+def get_reconcile_stats():
+    """Счётчики последнего прохода сверки в этом процессе"""
+    return dict(_last_run)
+
+
+def _acquire_lock(timeout):
+    """Межпроцессная блокировка прохода через cache.add (SET NX в Redis)"""
+    try:
+        return bool(get_cache().add(LOCK_KEY, os.getpid(), timeout=timeout))
+    except Exception:
+        return True
+
+
+def _release_lock():
+    try:
+        get_cache().delete(LOCK_KEY)
+    except Exception:
+        pass
+
+
+def start_payment_reconciler():
+    """Запустить фоновый поток сверки (один на процесс; PAYMENT_RECONCILE_INTERVAL=0 - не запускать)"""
+    global _reconciler_started
+    if _reconciler_started or PAYMENT_RECONCILE_INTERVAL <= 0:
+        return
+    _reconciler_started = True
+
+    from modules.core import get_app
+    app = get_app()
+
+    def reconcile_loop():
+        while True:
+            try:
+                if _acquire_lock(timeout=int(max(60, PAYMENT_RECONCILE_INTERVAL * 6))):
+                    try:
+                        with app.app_context():
+                            reconcile_pending_payments(app)
+                    finally:
+                        _release_lock()
+            except Exception as e:
+                print(f"Warning: payment reconciliation failed: {e}")
+            time.sleep(PAYMENT_RECONCILE_INTERVAL)
+
+    thread = threading.Thread(target=reconcile_loop, daemon=True, name='payment-reconcile')
+    thread.start()
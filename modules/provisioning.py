@@ -0,0 +1,166 @@
+"""
+Асинхронное создание аккаунта RemnaWave для пользователей, зарегистрированных через бота
+
+/api/bot/register только создаёт пользователя в локальной БД и ставит задачу 'user.provision'
+фоновой очереди (modules.jobs). Обработчик находит пользователя RemnaWave по telegramId или
+создаёт нового и записывает remnawave_uuid; ошибка RemnaWave = повтор задачи с задержкой.
+Пока задача не выполнена, /api/client/me, бот и мини-апп видят состояние provisioning.
+
+Одновременных запросов к RemnaWave из одного процесса - не больше REMNAWAVE_PROVISION_CONCURRENCY.
+Отдельный пул под волну регистраций: python3 run_job_worker.py --kind user.provision --threads N
+"""
+import os
+import secrets
+import threading
+from datetime import datetime, timezone, timedelta
+
+from modules.core import get_db, get_fernet
+from modules.jobs import enqueue, job_handler, retry_job
+from modules.models.job import BackgroundJob
+from modules.models.user import User
+from modules.models.referral import ReferralSetting
+from modules.remnawave import remnawave
+from modules.remnawave_snapshot import update_live_user
+from modules.settings_registry import get_settings
+
+db = get_db()
+
+PROVISION_JOB = 'user.provision'
+REMNAWAVE_PROVISION_CONCURRENCY = int(os.getenv('REMNAWAVE_PROVISION_CONCURRENCY', 4))
+PROVISION_MAX_ATTEMPTS = int(os.getenv('REMNAWAVE_PROVISION_MAX_ATTEMPTS', 8))
+
+STATE_READY = 'ready'
+STATE_PROVISIONING = 'provisioning'
+STATE_FAILED = 'failed'
+
+_semaphore = threading.BoundedSemaphore(REMNAWAVE_PROVISION_CONCURRENCY)
+
+
+class ProvisioningError(Exception):
+    """RemnaWave не создал/не вернул пользователя - задача будет повторена"""
+
+
+def provision_dedupe_key(user_id):
+    return f"user:{user_id}:provision"
+
+
+def enqueue_provisioning(user):
+    """Поставить создание аккаунта RemnaWave для user (в текущей транзакции, commit делает вызывающий код)"""
+    return enqueue(PROVISION_JOB, {'user_id': user.id},
+                   dedupe_key=provision_dedupe_key(user.id), max_attempts=PROVISION_MAX_ATTEMPTS)
+
+
+def get_provisioning_state(user):
+    """
+    ready / provisioning / failed; None - у пользователя нет UUID, но и задачи создания нет
+    (старые пользователи, UUID снят вручную).
+    """
+    if user.remnawave_uuid:
+        return STATE_READY
+    status = db.session.query(BackgroundJob.status).filter_by(
+        dedupe_key=provision_dedupe_key(user.id)).scalar()
+    if status in ('PENDING', 'RUNNING'):
+        return STATE_PROVISIONING
+    if status == 'DEAD':
+        return STATE_FAILED
+    return None
+
+
+def retry_failed_provisioning(user):
+    """Повторно поставить упавшее создание аккаунта (например, при повторном /start). True - поставлено."""
+    job = BackgroundJob.query.filter_by(dedupe_key=provision_dedupe_key(user.id), status='DEAD').first()
+    if not job:
+        return False
+    retry_job(job.id)
+    return True
+
+
+def _telegram_id_value(telegram_id):
+    # RemnaWave ожидает telegramId числом
+    try:
+        return int(telegram_id)
+    except (ValueError, TypeError):
+        return str(telegram_id)
+
+
+def _find_by_telegram_id(telegram_id):
+    """Пользователь RemnaWave с этим telegramId (dict) или None; ошибка API - исключение"""
+    resp = remnawave.get(f"/api/users/by-telegram-id/{_telegram_id_value(telegram_id)}")
+    if resp.status_code == 404:
+        return None
+    if resp.status_code != 200:
+        raise ProvisioningError(f"RemnaWave lookup by telegramId failed: {resp.status_code} {resp.text[:200]}")
+    found = resp.json().get('response')
+    # API может вернуть пользователя или массив пользователей
+    if isinstance(found, list):
+        found = found[0] if found else None
+    return found if isinstance(found, dict) and found.get('uuid') else None
+
+
+def _create_remnawave_user(user):
+    referrer = db.session.get(User, user.referrer_id) if user.referrer_id else None
+
+    # Бонусные дни для реферала
+    bonus_days = 0
+    if referrer:
+        ref_settings = get_settings(ReferralSetting)
+        bonus_days = ref_settings.invitee_bonus_days if ref_settings else 7
+
+    # Пароль RemnaWave - тот же, что выдан пользователю при регистрации (если его можно расшифровать)
+    password = None
+    fernet = get_fernet()
+    if fernet and user.encrypted_password:
+        try:
+            password = fernet.decrypt(user.encrypted_password.encode()).decode()
+        except Exception:
+            password = None
+
+    payload = {
+        "email": user.email,
+        "password": password or secrets.token_urlsafe(12),
+        "username": user.email.replace("@", "_").replace(".", "_"),
+        "expireAt": (datetime.now(timezone.utc) + timedelta(days=bonus_days)).isoformat(),
+        "telegramId": _telegram_id_value(user.telegram_id),
+    }
+    # activeInternalSquads только если есть реферал и DEFAULT_SQUAD_ID
+    default_squad_id = os.getenv('DEFAULT_SQUAD_ID')
+    if referrer and default_squad_id:
+        payload["activeInternalSquads"] = [default_squad_id]
+
+    resp = remnawave.post("/api/users", json=payload)
+    if resp.status_code not in (200, 201):
+        try:
+            error_json = resp.json()
+            detail = error_json.get('message') or error_json.get('error') or resp.text[:500]
+        except Exception:
+            detail = resp.text[:500]
+        raise ProvisioningError(f"RemnaWave create user failed: {resp.status_code} {detail}")
+    created = resp.json().get('response') or {}
+    if not created.get('uuid'):
+        raise ProvisioningError("RemnaWave create user returned no UUID")
+    return created
+
+
+@job_handler(PROVISION_JOB)
+def provision_user(user_id):
+    """Создать или привязать аккаунт RemnaWave пользователя user_id (повторный запуск безопасен)"""
+    user = db.session.get(User, user_id)
+    if not user or user.remnawave_uuid:
+        return
+
+    with _semaphore:
+        # Сначала ищем по telegramId: аккаунт мог остаться от прошлой установки
+        # или от предыдущей попытки, упавшей после создания
+        remnawave_user = _find_by_telegram_id(user.telegram_id) if user.telegram_id else None
+        if remnawave_user:
+            print(f"[provision] Linked existing RemnaWave user {remnawave_user['uuid']} to user {user.id}")
+        else:
+            remnawave_user = _create_remnawave_user(user)
+            print(f"[provision] Created RemnaWave user {remnawave_user['uuid']} for user {user.id}")
+
+    user = db.session.get(User, user_id)
+    if not user or user.remnawave_uuid:
+        return
+    user.remnawave_uuid = remnawave_user['uuid']
+    db.session.commit()
+    update_live_user(remnawave_user)
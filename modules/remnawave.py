@@ -0,0 +1,239 @@
+"""
+Клиент RemnaWave API
+
+Единая точка для всех запросов к панели RemnaWave:
+- общий requests.Session на процесс (keep-alive, пул соединений)
+- заголовки авторизации (ADMIN_TOKEN) и куки (REMNAWAVE_COOKIES) подставляются автоматически
+- таймауты по эндпоинтам (если вызывающий код не передал свой timeout)
+- повторы с экспоненциальной задержкой: ошибки соединения - для любых методов,
+  502/503/504 и ошибки чтения - только для идемпотентных (GET/PUT/DELETE)
+- circuit breaker: после серии отказов запросы сразу завершаются RemnaWaveUnavailable
+  (наследник requests.ConnectionError, поэтому существующие except requests.RequestException работают)
+- асинхронный интерфейс (aget/apost/...) для asyncio-кода поверх того же пула
+
+Использование:
+    from modules.remnawave import remnawave
+    resp = remnawave.get(f"/api/users/{uuid}")
+    resp = remnawave.patch("/api/users", json={"uuid": uuid, "expireAt": ...})
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = float(os.getenv('REMNAWAVE_TIMEOUT', 10))
+CONNECT_TIMEOUT = float(os.getenv('REMNAWAVE_CONNECT_TIMEOUT', 5))
+POOL_SIZE = int(os.getenv('REMNAWAVE_POOL_SIZE', 20))
+MAX_RETRIES = int(os.getenv('REMNAWAVE_RETRIES', 2))
+RETRY_BACKOFF = float(os.getenv('REMNAWAVE_RETRY_BACKOFF', 0.3))
+BREAKER_THRESHOLD = int(os.getenv('REMNAWAVE_BREAKER_THRESHOLD', 5))
+BREAKER_RESET = float(os.getenv('REMNAWAVE_BREAKER_RESET', 30))
+
+# Таймауты чтения по эндпоинтам: (метод, префикс пути, таймаут). Первое совпадение побеждает.
+ENDPOINT_TIMEOUTS = (
+    ('GET', '/api/users/', 10),
+    ('GET', '/api/users', 20),        # постраничный обход всех пользователей
+    ('POST', '/api/users', 30),       # создание пользователя
+    ('POST', '/api/nodes/', 30),      # действия с нодами
+    (None, '/api/nodes', 15),
+)
+
+
+class RemnaWaveUnavailable(requests.ConnectionError):
+    """RemnaWave временно недоступен (circuit breaker открыт)"""
+
+
+def get_remnawave_headers(additional_headers=None):
+    """Заголовки и куки для RemnaWave API: (headers, cookies)"""
+    headers = {}
+    cookies = {}
+
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+    if ADMIN_TOKEN:
+        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
+
+    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
+    if REMNAWAVE_COOKIES_STR:
+        try:
+            cookies = json.loads(REMNAWAVE_COOKIES_STR)
+        except json.JSONDecodeError:
+            pass
+
+    if additional_headers:
+        headers.update(additional_headers)
+
+    return headers, cookies
+
+
+class _CircuitBreaker:
+    """
+    Простой circuit breaker: closed -> open (после threshold отказов подряд) -> half-open
+    (через reset секунд пропускаем один пробный запрос) -> closed/open.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+
+class RemnaWaveClient:
+    """Пул соединений + повторы + circuit breaker для RemnaWave API"""
+
+    def __init__(self, base_url=None):
+        self._base_url = base_url
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        self.breaker = _CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+
+    @property
+    def base_url(self):
+        return (self._base_url or os.getenv('API_URL') or '').rstrip('/')
+
+    @property
+    def configured(self):
+        return bool(self.base_url and os.getenv('ADMIN_TOKEN'))
+
+    def _get_session(self):
+        # После fork (gunicorn) сокеты родителя не переиспользуем - создаём свой пул
+        pid = os.getpid()
+        if self._session is not None and self._session_pid == pid:
+            return self._session
+        with self._session_lock:
+            if self._session is None or self._session_pid != pid:
+                retry = Retry(
+                    total=MAX_RETRIES,
+                    connect=MAX_RETRIES,
+                    read=MAX_RETRIES,
+                    status=MAX_RETRIES,
+                    backoff_factor=RETRY_BACKOFF,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}),
+                    raise_on_status=False,
+                    respect_retry_after_header=True,
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                self._session_pid = pid
+        return self._session
+
+    def _timeout_for(self, method, path):
+        for m, prefix, timeout in ENDPOINT_TIMEOUTS:
+            if (m is None or m == method) and path.startswith(prefix):
+                return (CONNECT_TIMEOUT, timeout)
+        return (CONNECT_TIMEOUT, DEFAULT_TIMEOUT)
+
+    def request(self, method, path, *, headers=None, cookies=None, timeout=None, **kwargs):
+        """
+        Запрос к RemnaWave. path - путь от API_URL ('/api/users/...').
+
+        Возвращает requests.Response (статус не проверяется - как и раньше, это делает вызывающий код).
+        Ошибки сети/таймауты пробрасываются как requests.RequestException.
+        """
+        method = method.upper()
+        if not self.breaker.allow():
+            raise RemnaWaveUnavailable(f"RemnaWave API unavailable (circuit open), {method} {path}")
+
+        default_headers, default_cookies = get_remnawave_headers()
+        if headers:
+            default_headers.update(headers)
+        if cookies:
+            default_cookies.update(cookies)
+
+        try:
+            resp = self._get_session().request(
+                method,
+                f"{self.base_url}{path}",
+                headers=default_headers,
+                cookies=default_cookies,
+                timeout=timeout if timeout is not None else self._timeout_for(method, path),
+                **kwargs
+            )
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    # ------------------------------------------------------------------
+    # asyncio: тот же пул/повторы/breaker, блокирующий вызов уходит в поток
+    # ------------------------------------------------------------------
+
+    async def arequest(self, method, path, **kwargs):
+        return await asyncio.to_thread(self.request, method, path, **kwargs)
+
+    async def aget(self, path, **kwargs):
+        return await self.arequest('GET', path, **kwargs)
+
+    async def apost(self, path, **kwargs):
+        return await self.arequest('POST', path, **kwargs)
+
+    async def apatch(self, path, **kwargs):
+        return await self.arequest('PATCH', path, **kwargs)
+
+    async def adelete(self, path, **kwargs):
+        return await self.arequest('DELETE', path, **kwargs)
+
+
+remnawave = RemnaWaveClient()
@@ -0,0 +1,570 @@
+"""
+Общий снимок пользователей RemnaWave (live users)
+
+Вместо того чтобы каждый запрос админки/авторассылки проходил весь /api/users
+(по 1000 на страницу), один фоновый поток держит снимок в общем кэше (Redis/FileSystem):
+
+- remnawave_snapshot:meta            - {'version', 'delta_seq', 'built_at', 'full_at', 'count'}
+- remnawave_snapshot:v{N}:by_uuid    - {uuid: user}
+- remnawave_snapshot:v{N}:by_email   - {email/username (lower): user}
+- remnawave_snapshot:v{N}:delta      - {uuid: user | None} - точечные изменения с последнего полного обхода
+- remnawave_snapshot:dirty           - UUID, которые нужно перечитать точечно (множество Redis)
+
+Читатели сравнивают version/delta_seq из meta со своей локальной копией и загружают индексы
+только когда версия сменилась (при новой delta_seq - только delta). Изменения конкретных
+пользователей (оплата, триал, правка в админке) помечаются через invalidate_live_user() и
+подтягиваются точечным GET /api/users/{uuid}; полный обход выполняется раз в
+REMNAWAVE_SNAPSHOT_FULL_INTERVAL.
+
+Снимок работает только с общим для воркеров кэшем (CACHE_TYPE=redis/filesystem). С null-кэшем
+у каждого воркера был бы свой полный обход и своя устаревшая копия, поэтому чтение идёт
+напрямую в RemnaWave, как без снимка.
+"""
+import os
+import time
+import uuid as uuid_lib
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # не POSIX - FileSystemCache без межпроцессной блокировки
+    fcntl = None
+
+from modules.core import get_app, get_cache
+from modules.remnawave import remnawave
+
+META_KEY = 'remnawave_snapshot:meta'
+DIRTY_KEY = 'remnawave_snapshot:dirty'
+LOCK_KEY = 'remnawave_snapshot:lock'
+SHARED_CACHE_TYPES = ('RedisCache', 'FileSystemCache')
+
+# Как часто фоновый поток проверяет снимок и "грязные" UUID (сек)
+REFRESH_INTERVAL = int(os.getenv('REMNAWAVE_SNAPSHOT_INTERVAL', 15))
+# Как часто делать полный обход /api/users (сек)
+FULL_REFRESH_INTERVAL = int(os.getenv('REMNAWAVE_SNAPSHOT_FULL_INTERVAL', 300))
+PAGE_SIZE = 1000
+MAX_USERS = 200000
+# Сколько "грязных" UUID перечитывать за один шаг (остальные - на следующем)
+DIRTY_BATCH = 500
+
+# Снять блокировку, только если она всё ещё наша
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_local = {'version': 0, 'delta_seq': 0, 'by_uuid': {}, 'by_email': {}, 'built_at': 0.0}
+_local_lock = threading.Lock()
+_refresher_started = False
+
+
+def snapshot_enabled():
+    """Снимок включён, только если кэш общий для всех воркеров (Redis/FileSystem)"""
+    try:
+        return get_app().config.get('CACHE_TYPE') in SHARED_CACHE_TYPES
+    except RuntimeError:
+        return False
+
+
+def _redis():
+    """(клиент Redis, префикс ключей) общего кэша или (None, None), если кэш не Redis"""
+    try:
+        backend = get_cache().cache
+    except Exception:
+        return None, None
+    client = getattr(backend, '_write_client', None)
+    if client is None:
+        return None, None
+    prefix = getattr(backend, 'key_prefix', '') or ''
+    return client, (prefix if isinstance(prefix, str) else '')
+
+
+@contextlib.contextmanager
+def _fs_lock():
+    """Межпроцессная блокировка get/set для FileSystemCache (flock на файле в каталоге кэша)"""
+    cache_dir = get_app().config.get('CACHE_DIR')
+    if fcntl is None or not cache_dir:
+        yield
+        return
+    with open(os.path.join(cache_dir, 'remnawave_snapshot.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _email_key(user):
+    key = user.get('email') or user.get('username') or user.get('name')
+    return str(key).lower() if key else None
+
+
+def _same_user(record, uuid):
+    # Индексы из общего кэша распаковываются по отдельности - сравниваем по UUID, а не по объекту
+    return bool(record) and str(record.get('uuid')) == uuid
+
+
+def _build_indexes(users):
+    by_uuid = {}
+    by_email = {}
+    for u in users:
+        if not isinstance(u, dict) or not u.get('uuid'):
+            continue
+        by_uuid[str(u['uuid'])] = u
+        email_key = _email_key(u)
+        if email_key:
+            by_email[email_key] = u
+    return by_uuid, by_email
+
+
+def fetch_all_users():
+    """Полный обход RemnaWave /api/users с пагинацией. Возвращает список или None при ошибке."""
+    if not remnawave.base_url:
+        return None
+
+    users_list = []
+    start = 0
+    total = None
+    while True:
+        resp = remnawave.get(
+            "/api/users",
+            params={"size": PAGE_SIZE, "start": start}
+        )
+        payload = resp.json() if resp is not None else {}
+        data = payload.get('response', payload) if isinstance(payload, dict) else payload
+
+        if isinstance(data, dict):
+            chunk = data.get('users', []) or []
+            if total is None:
+                try:
+                    total = int(data.get('total')) if data.get('total') is not None else None
+                except Exception:
+                    total = None
+        elif isinstance(data, list):
+            chunk = data
+        else:
+            chunk = []
+
+        if not isinstance(chunk, list) or len(chunk) == 0:
+            break
+
+        users_list.extend(chunk)
+        start += PAGE_SIZE
+
+        if total is not None and len(users_list) >= total:
+            break
+        # Защита от бесконечного цикла, если API ведёт себя неожиданно
+        if start > MAX_USERS:
+            break
+    return users_list
+
+
+def fetch_user(uuid):
+    """Точечное чтение пользователя RemnaWave. None - не найден, исключение - ошибка сети."""
+    resp = remnawave.get(f"/api/users/{uuid}")
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    data = resp.json()
+    user = data.get('response', data) if isinstance(data, dict) else None
+    return user if isinstance(user, dict) else None
+
+
+# ============================================================================
+# ХРАНЕНИЕ
+# ============================================================================
+
+def _data_keys(version):
+    return f'remnawave_snapshot:v{version}:by_uuid', f'remnawave_snapshot:v{version}:by_email'
+
+
+def _delta_key(version):
+    return f'remnawave_snapshot:v{version}:delta'
+
+
+def _apply_delta(by_uuid, by_email, delta):
+    """Новые индексы с применёнными точечными изменениями {uuid: user | None}"""
+    by_uuid = dict(by_uuid)
+    by_email = dict(by_email)
+    for uuid, user in delta.items():
+        old = by_uuid.pop(uuid, None)
+        if old:
+            old_email = _email_key(old)
+            if old_email and _same_user(by_email.get(old_email), uuid):
+                by_email.pop(old_email, None)
+        if user:
+            by_uuid[uuid] = user
+            email_key = _email_key(user)
+            if email_key:
+                by_email[email_key] = user
+    return by_uuid, by_email
+
+
+def _publish(by_uuid, by_email):
+    """Записать новую версию снимка (после полного обхода) в общий кэш и в локальную копию процесса"""
+    cache = get_cache()
+    now = time.time()
+    meta = cache.get(META_KEY) or {}
+    version = max(int(meta.get('version') or 0), _local['version']) + 1
+    ttl = FULL_REFRESH_INTERVAL * 3
+
+    uuid_key, email_key = _data_keys(version)
+    try:
+        cache.set(uuid_key, by_uuid, timeout=ttl)
+        cache.set(email_key, by_email, timeout=ttl)
+        cache.set(META_KEY, {
+            'version': version,
+            'delta_seq': 0,
+            'built_at': now,
+            'full_at': now,
+            'count': len(by_uuid),
+        }, timeout=ttl)
+    except Exception as e:
+        print(f"Warning: failed to publish RemnaWave snapshot: {e}")
+
+    with _local_lock:
+        _local.update({'version': version, 'delta_seq': 0, 'by_uuid': by_uuid, 'by_email': by_email, 'built_at': now})
+    return version
+
+
+def _publish_delta(changes):
+    """
+    Записать точечные изменения: в общий кэш уходит только delta текущей версии
+    (изменения с последнего полного обхода), индексы целиком не перезаписываются.
+    """
+    cache = get_cache()
+    now = time.time()
+    meta = cache.get(META_KEY) or {}
+    version = int(meta.get('version') or 0)
+    if not version:
+        return
+    ttl = FULL_REFRESH_INTERVAL * 3
+    delta_seq = int(meta.get('delta_seq') or 0) + 1
+    try:
+        delta = cache.get(_delta_key(version)) or {}
+        delta.update(changes)
+        cache.set(_delta_key(version), delta, timeout=ttl)
+        cache.set(META_KEY, dict(meta, delta_seq=delta_seq, built_at=now), timeout=ttl)
+    except Exception as e:
+        print(f"Warning: failed to publish RemnaWave snapshot delta: {e}")
+        return
+
+    with _local_lock:
+        if _local['version'] == version:
+            by_uuid, by_email = _apply_delta(_local['by_uuid'], _local['by_email'], changes)
+            _local.update({'delta_seq': delta_seq, 'by_uuid': by_uuid, 'by_email': by_email, 'built_at': now})
+
+
+def _load_current():
+    """Синхронизировать локальную копию с версией в общем кэше. Возвращает meta или None."""
+    cache = get_cache()
+    meta = cache.get(META_KEY)
+    if not meta:
+        return None
+    version = int(meta.get('version') or 0)
+    delta_seq = int(meta.get('delta_seq') or 0)
+    if version == _local['version'] and delta_seq == _local['delta_seq']:
+        return meta
+
+    if version != _local['version']:
+        uuid_key, email_key = _data_keys(version)
+        by_uuid = cache.get(uuid_key)
+        by_email = cache.get(email_key)
+        if by_uuid is None:
+            return None
+        by_email = by_email or {}
+    else:
+        by_uuid, by_email = _local['by_uuid'], _local['by_email']
+    if delta_seq:
+        # delta накопительная - повторное применение к уже обновлённой копии ничего не ломает
+        by_uuid, by_email = _apply_delta(by_uuid, by_email, cache.get(_delta_key(version)) or {})
+    with _local_lock:
+        _local.update({
+            'version': version,
+            'delta_seq': delta_seq,
+            'by_uuid': by_uuid,
+            'by_email': by_email,
+            'built_at': meta.get('built_at', time.time()),
+        })
+    return meta
+
+
+def _acquire_lock(timeout):
+    """Межпроцессная блокировка обновления. Возвращает токен владельца или None, если занято."""
+    token = uuid_lib.uuid4().hex
+    try:
+        client, prefix = _redis()
+        if client is not None:
+            return token if client.set(prefix + LOCK_KEY, token, nx=True, ex=int(timeout)) else None
+        cache = get_cache()
+        with _fs_lock():
+            if cache.get(LOCK_KEY) is not None:
+                return None
+            cache.set(LOCK_KEY, token, timeout=timeout)
+        return token
+    except Exception:
+        return token
+
+
+def _release_lock(token):
+    """Снять блокировку, если её держит этот владелец (после таймаута её мог взять другой процесс)"""
+    try:
+        client, prefix = _redis()
+        if client is not None:
+            client.eval(_RELEASE_LOCK_SCRIPT, 1, prefix + LOCK_KEY, token)
+            return
+        cache = get_cache()
+        with _fs_lock():
+            if cache.get(LOCK_KEY) == token:
+                cache.delete(LOCK_KEY)
+    except Exception:
+        pass
+
+
+def _mark_dirty(uuids):
+    """Добавить UUID в множество "грязных" (атомарно: SADD в Redis, под flock для FileSystemCache)"""
+    ttl = FULL_REFRESH_INTERVAL * 3
+    client, prefix = _redis()
+    if client is not None:
+        pipe = client.pipeline()
+        pipe.sadd(prefix + DIRTY_KEY, *uuids)
+        pipe.expire(prefix + DIRTY_KEY, ttl)
+        pipe.execute()
+        return
+    cache = get_cache()
+    with _fs_lock():
+        dirty = cache.get(DIRTY_KEY) or []
+        dirty.extend(u for u in uuids if u not in dirty)
+        cache.set(DIRTY_KEY, dirty, timeout=ttl)
+
+
+def _pop_dirty(limit):
+    """Забрать до limit "грязных" UUID (SPOP в Redis)"""
+    client, prefix = _redis()
+    if client is not None:
+        popped = client.spop(prefix + DIRTY_KEY, limit) or []
+        return [u.decode() if isinstance(u, bytes) else str(u) for u in popped]
+    cache = get_cache()
+    with _fs_lock():
+        dirty = cache.get(DIRTY_KEY) or []
+        if not dirty:
+            return []
+        if len(dirty) > limit:
+            cache.set(DIRTY_KEY, dirty[limit:], timeout=FULL_REFRESH_INTERVAL * 3)
+        else:
+            cache.delete(DIRTY_KEY)
+    return dirty[:limit]
+
+
+def is_live_user_dirty(uuid):
+    """UUID помечен изменённым и ещё не перечитан фоновым потоком"""
+    try:
+        client, prefix = _redis()
+        if client is not None:
+            return bool(client.sismember(prefix + DIRTY_KEY, str(uuid)))
+        return str(uuid) in (get_cache().get(DIRTY_KEY) or [])
+    except Exception:
+        return True
+
+
+# ============================================================================
+# ОБНОВЛЕНИЕ
+# ============================================================================
+
+def refresh_full():
+    """Полный обход RemnaWave и публикация новой версии. Возвращает True при успехе."""
+    try:
+        users = fetch_all_users()
+    except Exception as e:
+        print(f"Warning: Could not fetch live users: {e}")
+        return False
+    if users is None:
+        return False
+    by_uuid, by_email = _build_indexes(users)
+    _publish(by_uuid, by_email)
+    return True
+
+
+def refresh_dirty():
+    """Перечитать точечно UUID, помеченные через invalidate_live_user()"""
+    dirty = _pop_dirty(DIRTY_BATCH)
+    if not dirty:
+        return 0
+
+    changes = {}
+    failed = []
+    for uuid in dict.fromkeys(dirty):
+        try:
+            changes[uuid] = fetch_user(uuid)
+        except Exception as e:
+            print(f"Warning: failed to refresh RemnaWave user {uuid}: {e}")
+            failed.append(uuid)
+    if failed:
+        # Не теряем UUID при сбое сети - перечитаем на следующем шаге
+        _mark_dirty(failed)
+
+    if changes:
+        _publish_delta(changes)
+    return len(changes)
+
+
+def refresh_once():
+    """Один шаг фонового обновления (под межпроцессной блокировкой)"""
+    if not remnawave.base_url or not snapshot_enabled():
+        return
+    token = _acquire_lock(timeout=max(60, REFRESH_INTERVAL * 4))
+    if not token:
+        # Обновляет другой процесс - просто подхватываем его версию
+        _load_current()
+        return
+    try:
+        meta = _load_current()
+        if not meta or time.time() - float(meta.get('full_at') or 0) >= FULL_REFRESH_INTERVAL:
+            refresh_full()
+        else:
+            refresh_dirty()
+    finally:
+        _release_lock(token)
+
+
+def start_snapshot_refresher():
+    """Запустить фоновый поток обновления снимка (один на процесс)"""
+    global _refresher_started
+    if _refresher_started:
+        return
+    _refresher_started = True
+
+    app = get_app()
+    if not snapshot_enabled():
+        print("ℹ️  Снимок RemnaWave выключен: нужен общий кэш (CACHE_TYPE=redis или filesystem)")
+        return
+
+    def refresh_loop():
+        while True:
+            try:
+                with app.app_context():
+                    refresh_once()
+            except Exception as e:
+                print(f"Warning: RemnaWave snapshot refresh failed: {e}")
+            time.sleep(REFRESH_INTERVAL)
+
+    thread = threading.Thread(target=refresh_loop, daemon=True, name='remnawave-snapshot')
+    thread.start()
+
+
+# ============================================================================
+# ЧТЕНИЕ
+# ============================================================================
+
+def get_live_users_maps():
+    """
+    (by_uuid, by_email) - текущий снимок пользователей RemnaWave.
+
+    Если снимка ещё нет ни в кэше, ни в процессе - строит его синхронно один раз.
+    Без общего кэша - полный обход RemnaWave на каждый вызов (как до снимка).
+    """
+    if not snapshot_enabled():
+        try:
+            users = fetch_all_users()
+        except Exception as e:
+            print(f"Warning: Could not fetch live users: {e}")
+            users = None
+        return _build_indexes(users or [])
+
+    _load_current()
+    if _local['version'] or _local['by_uuid']:
+        return _local['by_uuid'], _local['by_email']
+
+    token = _acquire_lock(timeout=120)
+    if token:
+        try:
+            # Пока ждали блокировку, снимок мог опубликовать другой процесс
+            if not _load_current():
+                refresh_full()
+        finally:
+            _release_lock(token)
+    else:
+        _load_current()
+    return _local['by_uuid'], _local['by_email']
+
+
+def get_live_user(uuid, build=True):
+    """
+    Запись пользователя из снимка (или None).
+
+    build=False - только читать готовый снимок, не запуская полный обход (для горячих эндпоинтов):
+    изменённые и ещё не перечитанные UUID, как и всё при выключенном снимке, не отдаются -
+    вызывающий идёт за свежими данными в RemnaWave.
+    """
+    if not uuid:
+        return None
+    if not snapshot_enabled():
+        if not build:
+            return None
+        try:
+            return fetch_user(uuid)
+        except Exception as e:
+            print(f"Warning: failed to fetch RemnaWave user {uuid}: {e}")
+            return None
+    if build:
+        by_uuid, _ = get_live_users_maps()
+    else:
+        if is_live_user_dirty(uuid):
+            return None
+        _load_current()
+        by_uuid = _local['by_uuid']
+    return by_uuid.get(str(uuid))
+
+
+def get_snapshot_info():
+    """Версия/возраст/размер снимка (для диагностики)"""
+    meta = _load_current() or {}
+    return {
+        'enabled': snapshot_enabled(),
+        'version': _local['version'],
+        'delta_seq': _local['delta_seq'],
+        'count': len(_local['by_uuid']),
+        'built_at': meta.get('built_at', _local['built_at']),
+        'full_at': meta.get('full_at'),
+    }
+
+
+def invalidate_live_user(*uuids):
+    """Пометить пользователей RemnaWave как изменённые - фоновый поток перечитает их точечно"""
+    uuids = [str(u) for u in uuids if u]
+    if not uuids or not snapshot_enabled():
+        return
+    try:
+        _mark_dirty(uuids)
+    except Exception as e:
+        print(f"Warning: failed to mark RemnaWave users dirty: {e}")
+
+
+def update_live_user(user):
+    """
+    Свежая запись пользователя (например, из ответа GET/PATCH) сразу попадает в локальную копию
+    процесса; остальные процессы получат её со следующим полным обходом. UUID не помечается
+    "грязным": запись уже свежая, повторный GET в RemnaWave не нужен.
+
+    Существующая запись заменяется на месте (O(1), размер словарей не меняется, поэтому
+    параллельный обход снимка не ломается); новый UUID или сменившийся email - копией индекса.
+    """
+    if not isinstance(user, dict) or not user.get('uuid') or not snapshot_enabled():
+        return
+    uuid = str(user['uuid'])
+    email_key = _email_key(user)
+    with _local_lock:
+        if not _local['version']:
+            return
+        by_uuid, by_email = _local['by_uuid'], _local['by_email']
+        old = by_uuid.get(uuid)
+        old_email = _email_key(old) if old else None
+        if old is None or old_email != email_key:
+            _local['by_uuid'], _local['by_email'] = _apply_delta(by_uuid, by_email, {uuid: user})
+            return
+        by_uuid[uuid] = user
+        if email_key and _same_user(by_email.get(email_key), uuid):
+            by_email[email_key] = user
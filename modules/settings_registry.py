@@ -0,0 +1,155 @@
+"""
+Реестр настроек - неизменяемые снимки строк-синглтонов (SystemSetting, BrandingSetting, BotConfig, ...)
+и курсов валют (CurrencyRate)
+
+Каждый воркер загружает строку один раз и отдаёт её копию (SettingsSnapshot) без SQL.
+Изменения этих моделей после commit сбрасывают снимки процесса и меняют версию в общем кэше;
+версия читается не чаще одного раза за запрос, поэтому остальные воркеры перечитывают настройки
+на следующем запросе (при null-кэше - по истечении SETTINGS_CACHE_TTL).
+
+Снимки только для чтения - изменения по-прежнему делаются через модель (Model.query.first()).
+"""
+import os
+import time
+import uuid
+import threading
+
+from flask import g, has_app_context, has_request_context
+from sqlalchemy import event, select, inspect as sa_inspect
+from sqlalchemy.orm import Session, object_session
+
+from modules.core import get_db, get_cache
+from modules.models.system import SystemSetting
+from modules.models.referral import ReferralSetting
+from modules.models.branding import BrandingSetting
+from modules.models.bot_config import BotConfig
+from modules.models.payment import PaymentSetting
+from modules.models.trial import TrialSettings
+from modules.models.currency import CurrencyRate
+
+db = get_db()
+
+SETTINGS_CACHE_TTL = float(os.getenv('SETTINGS_CACHE_TTL', 60))
+VERSION_KEY = 'settings_ver'
+
+SETTINGS_MODELS = (SystemSetting, ReferralSetting, BrandingSetting, BotConfig, PaymentSetting, TrialSettings)
+
+_MISSING = object()
+_snapshots = {}  # модель -> SettingsSnapshot или None (строки нет)
+_state = {'version': None, 'expires_at': 0.0}
+_lock = threading.Lock()
+
+
+class SettingsSnapshot:
+    """Копия строки настроек: атрибуты = колонки модели, запись запрещена"""
+
+    __slots__ = ('_model', '_values')
+
+    def __init__(self, model, values):
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_values', values)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(f"{self._model.__name__} snapshot has no attribute '{name}'") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self._model.__name__} snapshot is read-only; update the model instead")
+
+    def __repr__(self):
+        return f"<{self._model.__name__} snapshot id={self._values.get('id')}>"
+
+    def as_dict(self):
+        return dict(self._values)
+
+
+def _shared_version():
+    """Версия настроек из общего кэша; в пределах запроса читается один раз"""
+    if has_request_context() and '_settings_ver' in g:
+        return g._settings_ver
+    try:
+        version = get_cache().get(VERSION_KEY)
+    except Exception:
+        version = None
+    if has_request_context():
+        g._settings_ver = version
+    return version
+
+
+def _load(model):
+    """Значения колонок первой строки (без ORM-объекта в сессии)"""
+    attrs = sa_inspect(model).column_attrs
+    row = db.session.execute(
+        select(*(getattr(model, attr.key) for attr in attrs)).order_by(model.id).limit(1)
+    ).first()
+    if row is None:
+        return None
+    return SettingsSnapshot(model, {attr.key: value for attr, value in zip(attrs, row)})
+
+
+def _cached(model, loader):
+    version = _shared_version()
+    now = time.monotonic()
+    if _state['version'] != version or _state['expires_at'] <= now:
+        with _lock:
+            _snapshots.clear()
+            _state.update(version=version, expires_at=now + SETTINGS_CACHE_TTL)
+
+    snapshot = _snapshots.get(model, _MISSING)
+    if snapshot is _MISSING:
+        snapshot = loader(model)
+        with _lock:
+            _snapshots[model] = snapshot
+    return snapshot
+
+
+def get_settings(model):
+    """Снимок единственной строки model (SettingsSnapshot) или None, если строки нет"""
+    return _cached(model, _load)
+
+
+def _load_currency_rates(model):
+    rows = db.session.execute(select(model.currency, model.rate_to_usd))
+    return {currency.upper(): rate for currency, rate in rows if currency}
+
+
+def get_currency_rates():
+    """Курсы валют {код: единиц за 1 USD} из таблицы CurrencyRate (без SQL, пока снимок актуален)"""
+    return _cached(CurrencyRate, _load_currency_rates)
+
+
+def invalidate_settings():
+    """Сбросить снимки (в этом процессе и, через версию в общем кэше, в остальных)"""
+    with _lock:
+        _snapshots.clear()
+        _state['expires_at'] = 0.0
+    if has_app_context():
+        g.pop('_settings_ver', None)
+    try:
+        get_cache().set(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+    except Exception:
+        pass
+
+
+def _settings_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['settings_dirty'] = True
+
+
+for _model in SETTINGS_MODELS + (CurrencyRate,):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _settings_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _settings_flush_invalidation(session):
+    if session.info.pop('settings_dirty', False):
+        invalidate_settings()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _settings_discard_invalidation(session):
+    session.info.pop('settings_dirty', None)
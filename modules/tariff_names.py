@@ -0,0 +1,128 @@
+"""
+Отображаемые названия тарифов (уровни Basic/Pro/Elite и пр.)
+
+Карта tariff_id -> (название, duration_days) и названия уровней строятся один раз и хранятся в процессе.
+Изменения Tariff/TariffLevel/BrandingSetting после commit сбрасывают карту и меняют версию в общем кэше,
+поэтому остальные воркеры перестраивают её на следующем запросе (при null-кэше - по истечении TARIFF_NAMES_TTL).
+"""
+import os
+import re
+import time
+import uuid
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from modules.core import get_db, get_cache
+from modules.models.tariff import Tariff
+from modules.models.tariff_level import TariffLevel
+from modules.models.branding import BrandingSetting
+from modules.settings_registry import get_settings
+
+db = get_db()
+
+TARIFF_NAMES_TTL = float(os.getenv('TARIFF_NAMES_TTL', 300))
+VERSION_KEY = 'tariff_names_ver'
+
+# Название тарифа содержит период ("1 месяц", "30 дней", "3 мес", "7 days")
+PERIOD_RE = re.compile(r'\d+\s*(месяц|месяца|месяцев|день|дня|дней|days?|мес)', re.IGNORECASE)
+
+_state = {'expires_at': 0.0, 'version': None, 'tiers': None, 'tariffs': None}
+_lock = threading.Lock()
+
+
+def _version():
+    try:
+        return get_cache().get(VERSION_KEY)
+    except Exception:
+        return None
+
+
+def _build():
+    """Уровни (code -> название) и карта тарифов; три запроса на всё"""
+    branding = get_settings(BrandingSetting)
+    basic_name = getattr(branding, 'tariff_tier_basic_name', None) or 'Базовый'
+    pro_name = getattr(branding, 'tariff_tier_pro_name', None) or 'Премиум'
+    elite_name = getattr(branding, 'tariff_tier_elite_name', None) or 'Элитный'
+
+    tiers = {lvl.code.lower(): (lvl.name or lvl.code) for lvl in TariffLevel.query.filter_by(is_active=True).all()}
+    tiers.setdefault('basic', basic_name)
+    tiers.setdefault('pro', pro_name)
+    tiers.setdefault('elite', elite_name)
+
+    tariffs = {}
+    for tariff_id, name, tier, duration_days in db.session.query(
+            Tariff.id, Tariff.name, Tariff.tier, Tariff.duration_days).all():
+        if tier:
+            # Используем tier для отображения (Basic, Pro, Elite), если он есть
+            display = tiers.get(tier.lower(), tier)
+        elif PERIOD_RE.search(name or ''):
+            # Если name содержит период, определяем tier по duration_days
+            if (duration_days or 0) >= 180:
+                display = elite_name
+            elif (duration_days or 0) >= 90:
+                display = pro_name
+            else:
+                display = basic_name
+        else:
+            display = name
+        tariffs[tariff_id] = (display, duration_days)
+    return tiers, tariffs
+
+
+def _current():
+    version = _version()
+    state = _state
+    if state['tariffs'] is None or state['expires_at'] <= time.monotonic() or state['version'] != version:
+        tiers, tariffs = _build()
+        with _lock:
+            _state.update(expires_at=time.monotonic() + TARIFF_NAMES_TTL, version=version,
+                          tiers=tiers, tariffs=tariffs)
+        return tiers, tariffs
+    return state['tiers'], state['tariffs']
+
+
+def get_tier_names():
+    """code уровня (в нижнем регистре) -> отображаемое название"""
+    return _current()[0]
+
+
+def get_tariff_display_map():
+    """tariff_id -> (отображаемое название, duration_days)"""
+    return _current()[1]
+
+
+def invalidate_tariff_names():
+    """Сбросить карту (в этом процессе и, через версию в общем кэше, в остальных)"""
+    with _lock:
+        _state.update(expires_at=0.0, tariffs=None, tiers=None)
+    try:
+        get_cache().set(VERSION_KEY, uuid.uuid4().hex, timeout=max(60, int(TARIFF_NAMES_TTL * 4)))
+    except Exception:
+        pass
+
+
+@event.listens_for(Tariff, 'after_insert')
+@event.listens_for(Tariff, 'after_update')
+@event.listens_for(Tariff, 'after_delete')
+@event.listens_for(TariffLevel, 'after_insert')
+@event.listens_for(TariffLevel, 'after_update')
+@event.listens_for(TariffLevel, 'after_delete')
+@event.listens_for(BrandingSetting, 'after_insert')
+@event.listens_for(BrandingSetting, 'after_update')
+def _tariff_names_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['tariff_names_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _tariff_names_flush_invalidation(session):
+    if session.info.pop('tariff_names_dirty', False):
+        invalidate_tariff_names()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _tariff_names_discard_invalidation(session):
+    session.info.pop('tariff_names_dirty', None)
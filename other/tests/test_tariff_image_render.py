@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рендера изображений тарифов: бэкенд fast против legacy
+(время и пиковая память для 1, 5 и 12 тарифов)
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from modules.image_generator.tariff_image import generate_tariff_image
+
+TARIFF_COUNTS = (1, 5, 12)
+RUNS = 3
+
+# Пиковая память меряется в отдельном процессе (один рендер после импорта): буферы Pillow
+# не видны tracemalloc. VmHWM сбрасывается при exec, а ru_maxrss в Linux наследует пик родителя
+_MEMORY_SCRIPT = """
+import sys, json, resource
+
+def peak_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+sys.path.insert(0, sys.argv[1])
+from modules.image_generator.tariff_image import generate_tariff_image
+params = json.loads(sys.argv[2])
+before = peak_kb()
+generate_tariff_image(**params)
+print(peak_kb() - before)
+"""
+
+
+def make_params(count, backend):
+    return {
+        "tier_name": "Премиум",
+        "tier_icon": "⭐",
+        "features": [{"name": f"Функция {i}"} for i in range(7)],
+        "tariffs": [
+            {"name": f"{30 * (i + 1)} дней", "duration_days": 30 * (i + 1), "price_uah": 100 * (i + 1)}
+            for i in range(count)
+        ],
+        "currency": "uah",
+        "currency_symbol": "₴",
+        "backend": backend,
+    }
+
+
+def render_time(params):
+    """Лучшее время из RUNS рендеров (после прогрева)"""
+    generate_tariff_image(**params)
+    best = None
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        generate_tariff_image(**params)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def render_peak_memory_kb(params):
+    """Прирост пикового RSS процесса за один рендер, КБ"""
+    result = subprocess.run(
+        [sys.executable, "-c", _MEMORY_SCRIPT, ROOT, json.dumps(params)],
+        capture_output=True, text=True, check=True
+    )
+    return int(result.stdout.strip().splitlines()[-1])
+
+
+def test_tariff_image_render():
+    """Сравнить бэкенды fast и legacy"""
+    print("=" * 80)
+    print("🖼  БЕНЧМАРК РЕНДЕРА ИЗОБРАЖЕНИЙ ТАРИФОВ")
+    print("=" * 80)
+    print(f"{'Тарифов':>8} | {'legacy, мс':>10} | {'fast, мс':>9} | {'legacy, КБ':>10} | {'fast, КБ':>9}")
+
+    for count in TARIFF_COUNTS:
+        results = {}
+        for backend in ("legacy", "fast"):
+            params = make_params(count, backend)
+            results[backend] = (render_time(params), render_peak_memory_kb(params))
+        (legacy_time, legacy_memory), (fast_time, fast_memory) = results["legacy"], results["fast"]
+        print(f"{count:>8} | {legacy_time * 1000:>10.1f} | {fast_time * 1000:>9.1f} | {legacy_memory:>10} | {fast_memory:>9}")
+
+        assert fast_time < legacy_time, f"{count} тарифов: fast {fast_time:.3f}s не быстрее legacy {legacy_time:.3f}s"
+        # Тени рисуются только в пределах карточек - пик памяти не должен заметно вырасти
+        assert fast_memory <= legacy_memory + 4096, f"{count} тарифов: fast {fast_memory} КБ, legacy {legacy_memory} КБ"
+
+    print("=" * 80)
+
+
+if __name__ == '__main__':
+    test_tariff_image_render()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест /miniapp/casino/play (спинов в секунду)
+
+Поднимает заглушку RemnaWave API (GET /api/users/<uuid>, PATCH /api/users) с задержкой ответа,
+отдельную SQLite-БД с пользователями и крутит колесо из нескольких потоков, по одному пользователю
+на поток. Печатает спины/с, задержки и число запросов к RemnaWave на спин.
+
+Использование:
+    python other/tools/benchmark_casino.py                        # 8 потоков по 50 спинов, задержка RemnaWave 20 мс
+    python other/tools/benchmark_casino.py --threads 16 --spins 100 --latency 50
+    CACHE_TYPE=redis python other/tools/benchmark_casino.py      # счётчик лимита игр в Redis
+"""
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+
+class _RemnaWaveStub(BaseHTTPRequestHandler):
+    """Заглушка RemnaWave: хранит expireAt пользователей в памяти"""
+    protocol_version = 'HTTP/1.1'
+    latency = 0.02
+    users = {}
+    calls = {'GET': 0, 'PATCH': 0}
+    lock = threading.Lock()
+
+    def _reply(self, payload):
+        body = json.dumps({'response': payload}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls['GET'] += 1
+        uuid = self.path.rsplit('/', 1)[-1]
+        self._reply({'uuid': uuid, 'expireAt': self.users.get(uuid)})
+
+    def do_PATCH(self):
+        time.sleep(self.latency)
+        data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with self.lock:
+            self.calls['PATCH'] += 1
+            self.users[data['uuid']] = data['expireAt']
+        self._reply({'uuid': data['uuid'], 'expireAt': data['expireAt']})
+
+    def log_message(self, *args):
+        pass
+
+
+def run(threads, spins, latency):
+    workdir = tempfile.mkdtemp(prefix='bench_casino_')
+    _RemnaWaveStub.latency = latency / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RemnaWaveStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ['API_URL'] = f'http://127.0.0.1:{server.server_port}'
+    os.environ.setdefault('ADMIN_TOKEN', 'bench')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench')
+    os.environ['CASINO_ENABLED'] = 'true'
+    os.environ['CASINO_MAX_GAMES_PER_DAY'] = str(spins + 1)
+    if not os.environ.get('FERNET_KEY'):
+        from cryptography.fernet import Fernet
+        os.environ['FERNET_KEY'] = Fernet.generate_key().decode()
+
+    from sqlalchemy import create_engine
+    from app import app, db
+    from modules.models.user import User
+
+    expire = (datetime.now(timezone.utc) + timedelta(days=10000)).isoformat()
+    with app.app_context():
+        # Своя БД вместо БД приложения (движок создаётся лениво - к рабочей БД не подключаемся)
+        db.engines[None] = create_engine('sqlite:///' + os.path.join(workdir, 'bench.db'),
+                                         connect_args={'timeout': 30})
+        db.create_all()
+        for i in range(threads):
+            uuid = f'00000000-0000-0000-0000-{i:012d}'
+            db.session.add(User(email=f'casino{i}@bench.local', telegram_id=str(500000 + i),
+                                remnawave_uuid=uuid, referral_code=f'C{i}'))
+            _RemnaWaveStub.users[uuid] = expire
+        db.session.commit()
+
+    latencies, errors = [], []
+
+    def player(i):
+        client = app.test_client()
+        init_data = 'user=' + quote(json.dumps({'id': 500000 + i}))
+        for _ in range(spins):
+            started = time.perf_counter()
+            r = client.post('/miniapp/casino/play', json={'initData': init_data, 'bet': 1})
+            elapsed = time.perf_counter() - started
+            if r.status_code == 200:
+                latencies.append(elapsed)
+            else:
+                errors.append(r.status_code)
+
+    workers = [threading.Thread(target=player, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    total = time.perf_counter() - started
+    server.shutdown()
+    with app.app_context():
+        db.engines[None].dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    done = len(latencies)
+    latencies.sort()
+    remnawave_calls = sum(_RemnaWaveStub.calls.values())
+    print(f"Потоков: {threads}, спинов: {done} (ошибок {len(errors)}), задержка RemnaWave {latency} мс")
+    print(f"Спинов в секунду:        {done / total:>8.1f}")
+    if latencies:
+        print(f"Задержка p50 / p95, мс:  {latencies[done // 2] * 1000:>8.1f} / {latencies[int(done * 0.95) - 1] * 1000:.1f}")
+        print(f"Запросов к RemnaWave/спин: {remnawave_calls / done:>6.2f} (GET {_RemnaWaveStub.calls['GET']}, PATCH {_RemnaWaveStub.calls['PATCH']})")
+    return done / total if total else 0.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест казино')
+    parser.add_argument('--threads', type=int, default=8, help='Параллельных игроков (по умолчанию 8)')
+    parser.add_argument('--spins', type=int, default=50, help='Спинов на игрока')
+    parser.add_argument('--latency', type=float, default=20, help='Задержка ответа RemnaWave, мс')
+    args = parser.parse_args()
+    run(args.threads, args.spins, args.latency)
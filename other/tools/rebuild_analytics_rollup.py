@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Пересчёт дневных агрегатов аналитики (analytics_daily_rollup)
+
+Использование:
+    python other/tools/rebuild_analytics_rollup.py                      # вся история
+    python other/tools/rebuild_analytics_rollup.py 2025-01-01           # с даты до сегодня
+    python other/tools/rebuild_analytics_rollup.py 2025-01-01 2025-01-31
+"""
+
+import sys
+import os
+from datetime import date
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+load_dotenv()
+
+
+def rebuild(start_day=None, end_day=None):
+    """Пересчитать агрегаты за диапазон дат"""
+    from flask import Flask
+    from modules.core import init_app, get_db
+
+    app = Flask(__name__)
+    init_app(app)
+
+    with app.app_context():
+        from modules.models.analytics import AnalyticsDailyRollup
+        from modules.analytics import rebuild_daily_rollup
+
+        db = get_db()
+        AnalyticsDailyRollup.__table__.create(db.engine, checkfirst=True)
+
+        rows = rebuild_daily_rollup(start_day, end_day)
+        period = f"{start_day or 'начало'} — {end_day or 'сегодня'}"
+        print(f"✅ Агрегаты пересчитаны ({period}): {rows} строк")
+        return True
+
+
+if __name__ == '__main__':
+    try:
+        start = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+        end = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    except ValueError:
+        print("Использование: python other/tools/rebuild_analytics_rollup.py [YYYY-MM-DD] [YYYY-MM-DD]")
+        sys.exit(1)
+
+    success = rebuild(start, end)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Отдельный процесс-воркер фоновой очереди (background_job).
+
+Запуск: python3 run_job_worker.py [--threads N] [--kind payment.process ...] [--reconcile]
+Если воркеры запущены так, в процессах API можно выставить JOB_WORKER_THREADS=0.
+Пул под волну регистраций в боте: python3 run_job_worker.py --kind user.provision --threads 4
+"""
+import sys
+import signal
+import argparse
+import threading
+
+from app import app
+from modules.jobs import worker_loop
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воркер фоновой очереди задач')
+    parser.add_argument('--threads', type=int, default=1, help='Количество потоков')
+    parser.add_argument('--kind', action='append', help='Выполнять только задачи этого типа (можно несколько)')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='Также запускать фоновую сверку зависших оплат (PAYMENT_RECONCILE_INTERVAL)')
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+
+    def _stop(signum, frame):
+        print("🛑 Остановка воркера...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    threads = []
+    for i in range(max(1, args.threads)):
+        thread = threading.Thread(target=worker_loop, args=(app, stop_event, args.kind),
+                                  daemon=True, name=f'job-worker-{i}')
+        thread.start()
+        threads.append(thread)
+    if args.reconcile:
+        from modules.payment_reconcile import start_payment_reconciler
+        start_payment_reconciler()
+
+    print(f"✅ Воркер очереди запущен: потоков {len(threads)}, типы: {args.kind or 'все'}")
+
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(timeout=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
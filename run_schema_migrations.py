@@ -57,6 +57,11 @@ def run_all_schema_migrations(app=None):
         ('migration/schema/add_purchase_options_table.py', 'add_purchase_options_table'),
         ('migration/schema/add_config_share_token.py', 'migrate'),  # Таблица для обмена конфигами через inline режим
         ('migration/schema/add_email_setting_table.py', 'migrate'),  # Таблица настроек почты (шаблоны писем, имя отправителя)
+        ('migration/schema/add_remnawave_applied_at_to_payment.py', 'migrate'),  # Отметка продления в RemnaWave для повторов задачи оплаты (до rollup: он читает Payment)
+        ('migration/schema/add_analytics_rollup_table.py', 'migrate'),  # Дневные агрегаты аналитики (+ первичное заполнение)
+        ('migration/schema/add_job_queue_tables.py', 'migrate'),  # Фоновая очередь задач и журнал webhook-событий
+        ('migration/schema/add_broadcast_job_table.py', 'migrate'),  # Фоновые рассылки с прогрессом
+        ('migration/schema/add_hot_path_indexes.py', 'migrate'),  # Индексы частых выборок (CONCURRENTLY на PostgreSQL)
     ]
     
     success_count = 0
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Отдельный процесс SSH-терминала админ-панели (/api/admin/ssh/*).
+
+SSH-сессии хранятся в памяти процесса, поэтому при нескольких воркерах gunicorn все запросы
+терминала должны попадать в один процесс. Этот скрипт запускает то же приложение под gunicorn
+с одним воркером и пулом потоков (gthread); nginx направляет в него location /api/admin/ssh/
+(см. nginx/nginx.conf). Открытый поток SSE занимает поток воркера, а не весь воркер.
+
+Рассылки по расписанию и воркеры очереди задач в этом процессе не запускаются - их выполняет api.
+
+Запуск: python3 run_ssh_terminal.py [--host 0.0.0.0] [--port 5001] [--threads 16]
+"""
+import os
+import sys
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Процесс SSH-терминала админ-панели')
+    parser.add_argument('--host', default=os.getenv('SSH_TERMINAL_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('SSH_TERMINAL_PORT', 5001)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('SSH_TERMINAL_THREADS', 16)))
+    args = parser.parse_args()
+
+    os.environ['AUTO_BROADCAST_ENABLED'] = 'false'
+    os.environ['JOB_WORKER_THREADS'] = '0'
+
+    print(f"✅ SSH-терминал запускается на {args.host}:{args.port} (gunicorn, 1 воркер, {args.threads} потоков)")
+    os.chdir(BASE_DIR)
+    os.execvp('gunicorn', [
+        'gunicorn', '-w', '1', '--threads', str(args.threads),
+        '-c', 'gunicorn_config.py', '-b', f'{args.host}:{args.port}', 'app:app',
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())